@@ -5,8 +5,9 @@ Main application entry point with API routes for chat and paper assistance.
 
 import os
 import json
+import hashlib
 import uuid
-from flask import Flask, request, jsonify, Response
+from flask import Flask, request, jsonify, Response, redirect, send_file
 from flask_cors import CORS
 from dotenv import load_dotenv
 
@@ -14,7 +15,11 @@ from models import db, ChatSession, ChatMessage, GeneratedImage, PaperRecord
 from services.ai import AIService
 from services.llm import LLMService
 from services.storage import StorageService
-from services.paper import PaperService, SessionManager, PaperStatus
+from services.cleanup import CleanupQueue
+from services.paper import (
+    PaperService, SessionManager, PaperStatus, JobRunner, JobConflictError, checkpoint_key, get_session_store,
+    has_checkpoint, compile_stats, timing_stats,
+)
 
 load_dotenv()
 
@@ -30,18 +35,31 @@ CORS(app, origins=[
 # Database configuration
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///lockai.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+# PDF 分发方式：proxy = 经后端转发；redirect = 302 到 S3 预签名 URL，后端不经手数据
+app.config['PAPER_PDF_DELIVERY'] = os.environ.get('PAPER_PDF_DELIVERY', 'proxy')
+app.config['PAPER_PDF_URL_EXPIRES'] = int(os.environ.get('PAPER_PDF_URL_EXPIRES', 300))
 db.init_app(app)
 
 # Create tables
 with app.app_context():
     db.create_all()
 
-ai_service = AIService()
+storage_service = StorageService()
+ai_service = AIService(storage_service)
+cleanup_queue = CleanupQueue(storage_service)
 
 # Paper generation service
 llm_service = LLMService()
-storage_service = StorageService()
 paper_service = PaperService(llm_service, storage_service)
+# 多 worker 部署时用共享会话存储（PAPER_SESSION_STORE=sqlite），任意 worker 都能查询生成状态
+SessionManager.configure(get_session_store())
+# 论文 pipeline 在后台线程池运行，SSE 只负责 attach / 回放事件
+job_runner = JobRunner(
+    app,
+    max_workers=int(os.environ.get('PAPER_JOB_WORKERS', 2)),
+    retention=float(os.environ.get('PAPER_JOB_RETENTION', 7 * 86400)),
+)
 
 
 # ============ Session APIs ============
@@ -130,30 +148,20 @@ def delete_session(session_id):
     if not session:
         return jsonify({"error": "会话不存在"}), 404
     
-    # 获取该会话的所有图片记录
-    images = GeneratedImage.query.filter_by(session_id=session_id).all()
-    
-    # 删除 S3 上的图片
-    if images:
-        try:
-            s3_client = ai_service._s3_client
-            bucket = os.environ.get("S3_BUCKET")
-            if s3_client and bucket:
-                for img in images:
-                    try:
-                        s3_client.delete_object(Bucket=bucket, Key=img.s3_key)
-                        print(f"[S3] 删除图片: {img.s3_key}")
-                    except Exception as e:
-                        print(f"[S3] 删除图片失败: {e}")
-        except Exception as e:
-            print(f"[S3] 清理图片失败: {e}")
-    
+    # 获取该会话的所有图片 key，DB 提交后交给后台队列批量删除
+    image_keys = [
+        img.s3_key
+        for img in GeneratedImage.query.filter_by(session_id=session_id).all()
+    ]
+
     # 删除图片记录
     GeneratedImage.query.filter_by(session_id=session_id).delete()
     
     # 删除会话
     db.session.delete(session)
     db.session.commit()
+
+    cleanup_queue.enqueue(image_keys)
     return jsonify({"success": True})
 
 
@@ -326,11 +334,34 @@ def paper_generate():
 
     user_id = data.get("user_id", "anonymous")
 
+    topic = topic.strip()
+    # 同一用户重复提交同一主题（双击 / 重试）时不再开第二个生成任务
+    dedupe_key = f"{user_id}:{hashlib.sha1(topic.encode('utf-8')).hexdigest()}"
+    try:
+        job_id = job_runner.submit(
+            "generate", paper_service.generate(user_id, topic), user_id=user_id, dedupe_key=dedupe_key,
+        )
+    except JobConflictError as e:
+        return jsonify({"error": "论文正在生成中", "job_id": e.job_id}), 409
+    return _job_sse_response(job_id)
+
+
+def _job_sse_response(job_id: str, after: int = 0) -> Response:
+    """
+    把后台任务的事件流转成 SSE：第一条 job 事件告知 job_id，之后每条事件带 id（seq），
+    客户端断线后可通过 /api/paper/jobs/<job_id>/events + Last-Event-ID 续上。
+    客户端断开只是 detach，任务继续在后台运行。
+    """
     def generate():
         with app.app_context():
-            for event in paper_service.generate(user_id, topic.strip()):
+            yield f"event: job\ndata: {json.dumps({'type': 'job', 'job_id': job_id})}\n\n"
+            for event in job_runner.attach(job_id, after=after):
+                if event is None:
+                    yield ": keepalive\n\n"
+                    continue
+                seq = event.pop("seq")
                 event_type = event.get("type", "progress")
-                yield f"event: {event_type}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+                yield f"id: {seq}\nevent: {event_type}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
 
     return Response(
         generate(),
@@ -339,23 +370,53 @@ def paper_generate():
             "Cache-Control": "no-cache",
             "Connection": "keep-alive",
             "X-Accel-Buffering": "no",
+            "X-Paper-Job-Id": job_id,
         },
     )
 
 
+@app.route("/api/paper/jobs/<job_id>", methods=["GET"])
+def paper_job_status(job_id):
+    """GET /api/paper/jobs/<job_id> — 查询后台任务状态"""
+    job = job_runner.get(job_id)
+    if not job:
+        return jsonify({"error": "任务不存在"}), 404
+    return jsonify(job)
+
+
+@app.route("/api/paper/jobs/<job_id>/events", methods=["GET"])
+def paper_job_events(job_id):
+    """GET /api/paper/jobs/<job_id>/events — attach 到任务事件流（SSE，先回放再跟随）"""
+    if not job_runner.get(job_id):
+        return jsonify({"error": "任务不存在"}), 404
+    after = request.headers.get("Last-Event-ID") or request.args.get("after") or 0
+    try:
+        after = int(after)
+    except ValueError:
+        return jsonify({"error": "after 必须是整数"}), 400
+    return _job_sse_response(job_id, after=after)
+
+
+@app.route("/api/paper/jobs/<job_id>/cancel", methods=["POST"])
+def paper_job_cancel(job_id):
+    """POST /api/paper/jobs/<job_id>/cancel — 取消排队中 / 运行中的任务（已写完的章节保留在检查点）"""
+    job = job_runner.get(job_id)
+    if not job:
+        return jsonify({"error": "任务不存在"}), 404
+    if not job_runner.cancel(job_id):
+        return jsonify({"error": "任务已结束", "status": job["status"]}), 409
+    return jsonify({"job_id": job_id, "status": "cancelling"})
+
+
 @app.route("/api/paper/<paper_id>/status", methods=["GET"])
 def paper_status(paper_id):
     """GET /api/paper/<paper_id>/status — 查询论文生成状态"""
-    # 先查内存中的活跃 session
-    session = SessionManager.get(paper_id)
-    if session:
+    # 先查活跃 session（本 worker 内存或共享会话存储中的其他 worker）
+    snapshot = SessionManager.get_status(paper_id)
+    if snapshot:
         return jsonify({
-            "id": session.id,
-            "topic": session.topic,
-            "status": session.status.value,
-            "progress_detail": session.progress_detail,
-            "pdf_url": session.pdf_url,
-            "error": session.error,
+            key: snapshot.get(key)
+            for key in ("id", "topic", "status", "progress_detail", "chapters", "format_stats", "pdf_url", "error")
         })
 
     # 再查数据库
@@ -363,15 +424,43 @@ def paper_status(paper_id):
     if not record:
         return jsonify({"error": "论文不存在"}), 404
 
-    # 兜底：DB 里是进行中状态，但内存 session 不存在，说明任务已中断。
+    # 兜底：DB 里是进行中状态，但没有任何 worker 持有该 session（或心跳已过期），说明任务已中断。
     terminal_statuses = {PaperStatus.COMPLETED.value, PaperStatus.FAILED.value}
     if record.status not in terminal_statuses:
         record.status = PaperStatus.FAILED.value
         if not record.error:
-            record.error = "任务已中断（服务重启或连接断开），请重新生成"
+            record.error = "任务已中断（服务重启或连接断开），可继续生成或重新生成"
         db.session.commit()
 
-    return jsonify(record.to_dict())
+    data = record.to_dict()
+    if record.status == PaperStatus.FAILED.value:
+        data["resumable"] = has_checkpoint(paper_id, storage_service)
+    return jsonify(data)
+
+
+@app.route("/api/paper/<paper_id>/timings", methods=["GET"])
+def paper_timings(paper_id):
+    """GET /api/paper/<paper_id>/timings — 最近一次生成 / 修订的各阶段耗时 span"""
+    snapshot = SessionManager.get_status(paper_id)
+    if not snapshot or not snapshot.get("timings"):
+        return jsonify({"error": "没有该论文的耗时记录"}), 404
+    return jsonify(snapshot["timings"])
+
+
+@app.route("/api/paper/timings", methods=["GET"])
+def paper_timing_percentiles():
+    """GET /api/paper/timings — 本 worker 最近完成论文的各阶段耗时分位数"""
+    return jsonify(timing_stats.percentiles())
+
+
+@app.route("/api/paper/<paper_id>/resume", methods=["POST"])
+def paper_resume(paper_id):
+    """POST /api/paper/<paper_id>/resume — 从最近的检查点继续生成（SSE 流）"""
+    try:
+        job_id = job_runner.submit("resume", paper_service.resume(paper_id), paper_id=paper_id)
+    except JobConflictError as e:
+        return jsonify({"error": "论文正在生成中", "job_id": e.job_id}), 409
+    return _job_sse_response(job_id)
 
 
 @app.route("/api/paper/<paper_id>/download", methods=["GET"])
@@ -383,52 +472,162 @@ def paper_download(paper_id):
     if not record.pdf_url:
         return jsonify({"error": "PDF 尚未生成"}), 404
 
-    return jsonify({"pdf_url": record.pdf_url})
+    # 优先返回短时效的预签名链接（本地文件系统后端的未签名链接不能直接下载）
+    url = storage_service.presigned_url(
+        record.pdf_s3_key,
+        expires_in=app.config['PAPER_PDF_URL_EXPIRES'],
+        content_type="application/pdf",
+        disposition="attachment",
+    ) if record.pdf_s3_key else None
+    return jsonify({"pdf_url": url or record.pdf_url})
 
 
 @app.route("/api/paper/<paper_id>/pdf", methods=["GET"])
 def paper_pdf_proxy(paper_id):
-    """GET /api/paper/<paper_id>/pdf — 代理 PDF 内容（解决 S3 不支持 inline 预览）"""
+    """
+    GET /api/paper/<paper_id>/pdf — 代理 PDF 内容（解决 S3 不支持 inline 预览）
+
+    分块流式转发 S3 对象，支持 Range（PDF.js 增量加载）、强 ETag 和 If-None-Match → 304。
+    启用本地磁盘缓存时直接 send_file，由 wsgi.file_wrapper 走零拷贝 sendfile。
+    PAPER_PDF_DELIVERY=redirect 时直接 302 到预签名 URL。
+    """
     record = PaperRecord.query.get(paper_id)
     if not record:
         return jsonify({"error": "论文不存在"}), 404
     if not record.pdf_s3_key:
         return jsonify({"error": "PDF 尚未生成"}), 404
 
-    pdf_bytes = storage_service.download_bytes(record.pdf_s3_key)
-    if not pdf_bytes:
+    if app.config['PAPER_PDF_DELIVERY'] == 'redirect':
+        url = storage_service.presigned_url(
+            record.pdf_s3_key,
+            expires_in=app.config['PAPER_PDF_URL_EXPIRES'],
+            content_type="application/pdf",
+            disposition="inline",
+        )
+        if url:
+            response = redirect(url, code=302)
+            # 预签名 URL 会过期，302 本身不能被缓存
+            response.headers["Cache-Control"] = "no-store"
+            return response
+
+    cached = storage_service.fetch_cached(record.pdf_s3_key)
+    if cached:
+        try:
+            response = send_file(
+                cached["path"],
+                mimetype="application/pdf",
+                conditional=True,
+                etag=cached["etag"] or True,
+            )
+        except FileNotFoundError:
+            pass  # 刚好被淘汰，回退到 S3 流式代理
+        else:
+            response.headers["Content-Disposition"] = "inline"
+            response.headers["Cache-Control"] = "public, no-cache"
+            return response
+
+    meta = storage_service.head_object(record.pdf_s3_key)
+    if not meta:
         return jsonify({"error": "PDF 下载失败"}), 502
 
+    size = meta["size"]
+    etag = meta["etag"]
+    headers = {
+        "Content-Disposition": "inline",
+        # 修订后会覆盖同一个 key，必须每次协商；命中 ETag 时只回 304
+        "Cache-Control": "public, no-cache",
+        "Accept-Ranges": "bytes",
+    }
+    if etag:
+        headers["ETag"] = f'"{etag}"'
+
+    if etag and request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+
+    # Range 请求（If-Range 与当前 ETag 不一致时退回完整响应；
+    # 多段 Range 不支持 multipart/byteranges，同样退回完整 200，只有单段越界才回 416）
+    start, stop = 0, size
+    status = 200
+    byte_range = request.range
+    if_range = request.if_range
+    range_valid = (if_range.etag is None and if_range.date is None) or if_range.etag == etag
+    if byte_range and range_valid and len(byte_range.ranges) == 1:
+        span = byte_range.range_for_length(size)
+        if span is None:
+            headers["Content-Range"] = f"bytes */{size}"
+            return Response(status=416, headers=headers)
+        start, stop = span
+        status = 206
+        headers["Content-Range"] = f"bytes {start}-{stop - 1}/{size}"
+
+    headers["Content-Length"] = str(stop - start)
+    if status == 206:
+        body = storage_service.iter_object(record.pdf_s3_key, start, stop - 1)
+    else:
+        body = storage_service.iter_object(record.pdf_s3_key)
+
     return Response(
-        pdf_bytes,
+        body,
+        status=status,
         mimetype="application/pdf",
-        headers={
-            "Content-Disposition": "inline",
-            "Cache-Control": "public, max-age=3600",
-        },
+        headers=headers,
+        direct_passthrough=True,
     )
 
 
+@app.route("/storage/<path:key>", methods=["GET"])
+def storage_file(key):
+    """GET /storage/<key> — 本地文件系统存储后端的对象下载（S3 后端下不启用）"""
+    backend = storage_service.backend
+    if backend.name != "fs":
+        return jsonify({"error": "文件不存在"}), 404
+
+    path = backend.local_path(key)
+    if not path:
+        return jsonify({"error": "文件不存在"}), 404
+
+    meta = backend.head(key) or {}
+    mimetype = meta.get("content_type") or "application/octet-stream"
+    disposition = None
+
+    # 预签名 URL：签名通过才允许访问并覆盖响应头，缺少签名、过期或被篡改则拒绝；
+    # 只有公开读的对象（聊天图片）可以不带签名
+    if "signature" in request.args:
+        if not backend.verify_signature(key, request.args):
+            return jsonify({"error": "链接已过期或无效"}), 403
+        mimetype = request.args.get("content_type") or mimetype
+        disposition = request.args.get("disposition") or None
+    elif not backend.is_public(key):
+        return jsonify({"error": "链接已过期或无效"}), 403
+
+    response = send_file(
+        path,
+        mimetype=mimetype,
+        conditional=True,
+        etag=meta.get("etag") or True,
+    )
+    if disposition:
+        response.headers["Content-Disposition"] = disposition
+    return response
+
+
 @app.route("/api/paper/<paper_id>", methods=["DELETE"])
 def paper_delete(paper_id):
-    """DELETE /api/paper/<paper_id> — 删除论文（DB 记录 + S3 文件）"""
+    """DELETE /api/paper/<paper_id> — 删除论文（DB 记录 + S3 文件 + 生成检查点）"""
     record = PaperRecord.query.get(paper_id)
     if not record:
         return jsonify({"error": "论文不存在"}), 404
 
-    # 删除 S3 上的 PDF 和 VFS 快照
-    deleted_keys = []
-    for key in [record.pdf_s3_key, record.vfs_s3_key]:
-        if key:
-            if storage_service.delete_object(key):
-                deleted_keys.append(key)
+    s3_keys = [record.pdf_s3_key, record.vfs_s3_key, checkpoint_key(paper_id)]
 
     # 删除数据库记录
     db.session.delete(record)
     db.session.commit()
 
-    print(f"[Paper] 已删除论文 {paper_id}，清理 S3: {deleted_keys}")
-    return jsonify({"success": True, "deleted_s3_keys": deleted_keys})
+    # S3 上的 PDF 和 VFS 快照交给后台队列批量删除
+    queued_keys = cleanup_queue.enqueue(s3_keys)
+    print(f"[Paper] 已删除论文 {paper_id}，待清理 S3: {queued_keys}")
+    return jsonify({"success": True, "queued_s3_keys": queued_keys})
 
 
 @app.route("/api/paper/<paper_id>/files", methods=["GET"])
@@ -472,21 +671,11 @@ def paper_revise(paper_id):
     if not instruction or not isinstance(instruction, str) or not instruction.strip():
         return jsonify({"error": "修改指令不能为空"}), 400
 
-    def generate():
-        with app.app_context():
-            for event in paper_service.revise(paper_id, instruction.strip()):
-                event_type = event.get("type", "progress")
-                yield f"event: {event_type}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
-
-    return Response(
-        generate(),
-        mimetype="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "X-Accel-Buffering": "no",
-        },
-    )
+    try:
+        job_id = job_runner.submit("revise", paper_service.revise(paper_id, instruction.strip()), paper_id=paper_id)
+    except JobConflictError as e:
+        return jsonify({"error": "论文正在生成中", "job_id": e.job_id}), 409
+    return _job_sse_response(job_id)
 
 
 @app.route("/api/papers", methods=["GET"])
@@ -507,8 +696,13 @@ def list_papers():
 
 @app.route("/health", methods=["GET"])
 def health():
-    """Health check endpoint"""
-    return jsonify({"status": "ok"})
+    """Health check endpoint（附带论文会话内存占用 / 淘汰统计、首次编译成功率、文献缓存命中率）"""
+    return jsonify({
+        "status": "ok",
+        "paper_sessions": SessionManager.stats(),
+        "paper_compile": compile_stats.stats(),
+        "paper_research_cache": paper_service.research_cache.stats() if paper_service.research_cache else None,
+    })
 
 
 if __name__ == "__main__":
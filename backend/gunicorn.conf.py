@@ -9,7 +9,7 @@ import os
 bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:5003")
 
 # Worker 配置
-workers = int(os.environ.get("GUNICORN_WORKERS", 1))  # 小内存机器用 1 个 worker
+workers = int(os.environ.get("GUNICORN_WORKERS", 1))  # 小内存机器用 1 个 worker；多 worker 需设置 PAPER_SESSION_STORE=sqlite
 worker_class = "gevent"  # 协程模式，支持高并发长连接
 worker_connections = int(os.environ.get("GUNICORN_CONNECTIONS", 50))  # 每个 worker 50 并发
 
@@ -97,3 +97,45 @@ class PaperRecord(db.Model):
             'created_at': self.created_at.isoformat(),
             'completed_at': self.completed_at.isoformat() if self.completed_at else None,
         }
+
+
+class PaperJob(db.Model):
+    """论文后台任务（generate / resume / revise），与 SSE 连接解耦"""
+    __tablename__ = 'paper_jobs'
+
+    id = db.Column(db.String(32), primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)
+    user_id = db.Column(db.String(36), nullable=True, index=True)
+    paper_id = db.Column(db.String(36), nullable=True, index=True)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued / running / cancelling / completed / failed / interrupted / cancelled
+    # 排队中 / 运行中时为去重键（同一篇论文 / 同一用户的同一主题），结束后置空；唯一约束保证跨进程不会重复提交
+    active_key = db.Column(db.String(128), unique=True, nullable=True)
+    error = db.Column(db.Text)
+    last_seq = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    heartbeat_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'paper_id': self.paper_id,
+            'status': self.status,
+            'error': self.error,
+            'last_seq': self.last_seq,
+            'created_at': self.created_at.isoformat(),
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+
+class PaperJobEvent(db.Model):
+    """论文任务事件日志，SSE 重连时按 seq 回放"""
+    __tablename__ = 'paper_job_events'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    job_id = db.Column(db.String(32), db.ForeignKey('paper_jobs.id'), nullable=False, index=True)
+    seq = db.Column(db.Integer, nullable=False)
+    type = db.Column(db.String(30), nullable=False)
+    data = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -5,6 +5,8 @@ Services 模块
 from .ai import AIService
 from .llm import LLMService
 from .storage import StorageService
+from .storage_backends import StorageBackend, S3Backend, FilesystemBackend, MemoryBackend, get_backend
+from .cleanup import CleanupQueue
 from .search import SearchService
 from .image import ImageService
 from .title import TitleService
@@ -14,6 +16,12 @@ __all__ = [
     'AIService',
     'LLMService', 
     'StorageService',
+    'StorageBackend',
+    'S3Backend',
+    'FilesystemBackend',
+    'MemoryBackend',
+    'get_backend',
+    'CleanupQueue',
     'SearchService',
     'ImageService',
     'TitleService',
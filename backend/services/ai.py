@@ -16,9 +16,10 @@ from .title import TitleService
 class AIService:
     """AI 服务主入口"""
     
-    def __init__(self):
+    def __init__(self, storage: StorageService = None):
         self.llm = LLMService()
-        self.storage = StorageService()
+        # 允许与 PaperService 共用同一个 StorageService
+        self.storage = storage or StorageService()
         self.search = SearchService(self.llm)
         self.image = ImageService(self.llm, self.storage)
         self.title = TitleService(self.llm)
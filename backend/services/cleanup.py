@@ -0,0 +1,91 @@
+"""
+后台清理队列 — 异步批量删除 S3 对象
+DELETE 接口提交 DB 后把 key 丢进队列立即返回，S3 往返不再阻塞请求
+"""
+
+import queue
+import threading
+from typing import Iterable
+
+
+class CleanupQueue:
+    """
+    后台线程消费的 S3 删除队列，失败的 key 按指数退避重试。
+    重试由定时器到点后重新入队，退避期间 worker 继续处理其他批次。
+    """
+
+    def __init__(self, storage_service, max_attempts: int = 5, base_delay: float = 1.0):
+        self.storage = storage_service
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self._queue: queue.Queue = queue.Queue()
+        self._worker: threading.Thread | None = None
+        self._lock = threading.Lock()
+        # 已安排、尚未重新入队的重试数
+        self._retrying = 0
+        self._retried = threading.Condition(self._lock)
+
+    def enqueue(self, keys: Iterable[str]) -> list[str]:
+        """提交待删除的 key（自动去重、忽略空值），返回实际入队的 key"""
+        batch = list(dict.fromkeys(k for k in keys if k))
+        if batch:
+            self._ensure_worker()
+            self._queue.put((batch, 1))
+        return batch
+
+    def join(self) -> None:
+        """阻塞直到队列中的任务（包括等待中的重试）全部处理完（测试 / 优雅退出用）"""
+        while True:
+            self._queue.join()
+            with self._retried:
+                if self._retrying:
+                    self._retried.wait()
+                    continue
+                if not self._queue.unfinished_tasks:
+                    return
+
+    def _ensure_worker(self) -> None:
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(
+                    target=self._run, name="s3-cleanup", daemon=True
+                )
+                self._worker.start()
+
+    def _run(self) -> None:
+        while True:
+            keys, attempt = self._queue.get()
+            try:
+                self._process(keys, attempt)
+            except Exception as e:
+                print(f"[Cleanup] 处理异常: {type(e).__name__}: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _process(self, keys: list[str], attempt: int) -> None:
+        result = self.storage.delete_many(keys)
+        failed = result.get("failed", [])
+        if not failed:
+            return
+
+        if attempt >= self.max_attempts:
+            print(f"[Cleanup] 放弃删除 {len(failed)} 个对象（已重试 {attempt} 次）: {failed[:5]}")
+            return
+
+        delay = self.base_delay * (2 ** (attempt - 1))
+        print(f"[Cleanup] {len(failed)} 个对象删除失败，{delay:.1f}s 后第 {attempt + 1} 次重试")
+        self._schedule_retry(failed, attempt + 1, delay)
+
+    def _schedule_retry(self, keys: list[str], attempt: int, delay: float) -> None:
+        """delay 秒后把 keys 重新放回队列（不占用 worker 线程等待）"""
+        def requeue() -> None:
+            with self._retried:
+                self._queue.put((keys, attempt))
+                self._retrying -= 1
+                self._retried.notify_all()
+
+        with self._lock:
+            self._retrying += 1
+        timer = threading.Timer(delay, requeue)
+        timer.daemon = True
+        timer.start()
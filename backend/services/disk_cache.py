@@ -0,0 +1,179 @@
+"""
+本地磁盘缓存 — S3 对象的 read-through 缓存
+按 LRU + 总字节预算淘汰，写入走临时文件 + os.replace 保证原子性，
+多个 gunicorn worker 共用同一个目录也不会读到半截文件。
+字节预算针对整个目录：每个进程的索引只记得自己见过的文件，写入时按 scan_interval
+重新扫描目录（LRU 顺序取数据文件 mtime，get 命中时会刷新），把其他 worker 写入的文件也算进预算。
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import BinaryIO, Callable
+
+
+class DiskCache:
+    """S3 对象的本地磁盘 LRU 缓存（key = S3 key）"""
+
+    def __init__(self, root: str, max_bytes: int, scan_interval: float = 30.0):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        # 写入时距上次目录扫描超过该秒数（或本进程索引已超预算）就重新扫描
+        self.scan_interval = scan_interval
+        self.root.mkdir(parents=True, exist_ok=True)
+        # key → {"name", "size", "etag", "content_type"}，按最近访问排序
+        self._index: OrderedDict[str, dict] = OrderedDict()
+        self._total_bytes = 0
+        self._last_scan = 0.0
+        self._lock = threading.Lock()
+        with self._lock:
+            self._scan()
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def _paths(self, name: str) -> tuple[Path, Path]:
+        base = self.root / name[:2] / name
+        return base, base.with_suffix(".json")
+
+    @staticmethod
+    def _name_for(key: str) -> str:
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def _scan(self) -> None:
+        """扫描目录重建索引（按数据文件 mtime 恢复 LRU 顺序）并按预算淘汰（调用方持锁）"""
+        entries = []
+        for meta_path in self.root.glob("*/*.json"):
+            if meta_path.name.startswith(".tmp-"):
+                continue
+            data_path = meta_path.with_suffix("")
+            try:
+                entry = json.loads(meta_path.read_text(encoding="utf-8"))
+                mtime = data_path.stat().st_mtime
+            except (OSError, ValueError):
+                continue
+            entries.append((mtime, entry))
+        self._index.clear()
+        self._total_bytes = 0
+        for _, entry in sorted(entries, key=lambda item: item[0]):
+            self._index[entry["key"]] = entry
+            self._total_bytes += entry["size"]
+        self._last_scan = time.monotonic()
+        self._evict()
+
+    def get(self, key: str) -> dict | None:
+        """
+        命中时返回 {"path", "size", "etag", "content_type"}，并刷新 LRU 位置。
+        元信息每次从 sidecar 重新读取：其他 worker 写入、覆盖或淘汰了文件时，
+        这里能看到最新版本或视为未命中。
+        """
+        data_path, meta_path = self._paths(self._name_for(key))
+        with self._lock:
+            try:
+                entry = json.loads(meta_path.read_text(encoding="utf-8"))
+                os.utime(data_path)
+            except (OSError, ValueError):
+                self._drop(key)
+                return None
+            previous = self._index.pop(key, None)
+            if previous:
+                self._total_bytes -= previous["size"]
+            self._index[key] = entry
+            self._total_bytes += entry["size"]
+            self._evict()
+        return {**entry, "path": str(data_path)}
+
+    def put_bytes(self, key: str, data: bytes, etag: str = "", content_type: str | None = None) -> dict | None:
+        """写入字节内容（write-through）"""
+        def write(f: BinaryIO) -> dict | None:
+            if len(data) > self.max_bytes:
+                return None
+            f.write(data)
+            return {"etag": etag, "content_type": content_type}
+
+        return self.put_stream(key, write)
+
+    def put_stream(self, key: str, writer: Callable[[BinaryIO], dict | None]) -> dict | None:
+        """
+        writer(fileobj) 把内容写进临时文件并返回 {"etag", "content_type"}，
+        写完后原子替换到缓存位置。writer 抛异常时不会留下残缺文件。
+        单个对象超过整个预算时不缓存，返回 None；writer 事先知道大小时应直接返回 None，
+        不写入任何内容（超大对象不必先完整下载一遍再丢弃）。
+        """
+        name = self._name_for(key)
+        data_path, meta_path = self._paths(name)
+        data_path.parent.mkdir(parents=True, exist_ok=True)
+
+        fd, tmp_name = tempfile.mkstemp(dir=data_path.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                info = writer(f)
+            size = os.path.getsize(tmp_name)
+            if info is None or size > self.max_bytes:
+                os.unlink(tmp_name)
+                return None
+            entry = {
+                "key": key,
+                "name": name,
+                "size": size,
+                "etag": info.get("etag") or "",
+                "content_type": info.get("content_type"),
+            }
+            meta_tmp = f"{tmp_name}.json"
+            Path(meta_tmp).write_text(json.dumps(entry), encoding="utf-8")
+            os.replace(tmp_name, data_path)
+            os.replace(meta_tmp, meta_path)
+        except BaseException:
+            for leftover in (tmp_name, f"{tmp_name}.json"):
+                try:
+                    os.unlink(leftover)
+                except OSError:
+                    pass
+            raise
+
+        with self._lock:
+            if key in self._index:
+                self._total_bytes -= self._index[key]["size"]
+            self._index[key] = entry
+            self._index.move_to_end(key)
+            self._total_bytes += size
+            if self._total_bytes > self.max_bytes or time.monotonic() - self._last_scan >= self.scan_interval:
+                # 其他 worker 的写入只有扫描目录才看得到
+                self._scan()
+            else:
+                self._evict()
+        return {**entry, "path": str(data_path)}
+
+    def invalidate(self, key: str) -> None:
+        """上传覆盖 / 删除时调用"""
+        with self._lock:
+            self._drop(key)
+        # 其他 worker 写入但本进程索引里没有的同名文件也一并清掉
+        for path in self._paths(self._name_for(key)):
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+    def _drop(self, key: str) -> None:
+        entry = self._index.pop(key, None)
+        if entry is None:
+            return
+        self._total_bytes -= entry["size"]
+        for path in self._paths(entry["name"]):
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+    def _evict(self) -> None:
+        """超出字节预算时从最久未访问的开始淘汰（调用方持锁）"""
+        while self._total_bytes > self.max_bytes and self._index:
+            oldest = next(iter(self._index))
+            self._drop(oldest)
@@ -4,8 +4,29 @@ LLM API 调用服务
 
 import os
 import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Generator, Optional
+
 import httpx
-from typing import Generator, Optional
+
+from .tool_context import ToolContext
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：中文约 1 字 1 token，其他字符约 4 个 1 token"""
+    cjk = sum(1 for ch in text if "\u4e00" <= ch <= "\u9fff")
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _add_usage(usage: dict | None, reported: dict | None) -> None:
+    """把一次请求的 usage 累加到调用方传入的 dict"""
+    if usage is None:
+        return
+    reported = reported or {}
+    usage["calls"] = usage.get("calls", 0) + 1
+    usage["prompt_tokens"] = usage.get("prompt_tokens", 0) + (reported.get("prompt_tokens") or 0)
+    usage["completion_tokens"] = usage.get("completion_tokens", 0) + (reported.get("completion_tokens") or 0)
 
 
 class LLMService:
@@ -22,6 +43,10 @@ class LLMService:
         
         self._api_keys = self._load_api_keys()
         self._key_index = 0
+        # 以 400/422 拒绝 stream_options 的端点，之后的请求不再携带（流式 usage 改为按字符数估算）
+        self._no_stream_options: set[str] = set()
+        # 以 400/422 拒绝 response_format 的端点，之后的请求不再携带（由调用方自行解析 JSON）
+        self._no_response_format: set[str] = set()
         
         # Qwen 配置（用于 keyword 提取和标题生成）
         self.qwen_base_url = os.environ.get("QWEN_API_BASE_URL", "https://dashscope.aliyuncs.com/compatible-mode/v1")
@@ -185,17 +210,31 @@ class LLMService:
         max_tokens: int = None,
         api_key: str = None,
         max_rounds: int = 10,
+        usage: dict | None = None,
+        max_parallel_tools: int = 4,
+        on_progress: Callable[[str], None] | None = None,
+        cancel: threading.Event | None = None,
+        context_budget: int | None = None,
     ) -> str | None:
         """
         带 function calling 的多轮对话。
 
         LLM 可以调用 tools 中定义的函数，由 tool_handler 执行后把结果
         喂回 LLM，循环直到 LLM 输出纯文本或达到 max_rounds。
+        每轮以 stream 方式接收（长轮次也能及时报告进度 / 响应取消），
+        所有轮次复用同一个 HTTP 连接；同一轮里互不相关的 tool_call 并发执行。
 
         参数:
             tools: OpenAI 格式的 tool 定义列表
-            tool_handler: callable(name, arguments) -> str，执行工具并返回结果字符串
+            tool_handler: callable(name, arguments) -> str，执行工具并返回结果字符串；
+                会被多个线程同时调用，参数 path 相同的调用按原顺序串行执行
             max_rounds: 最大工具调用轮数，防止死循环
+            usage: 可选，传入 dict 时累计写入 calls / prompt_tokens / completion_tokens
+            max_parallel_tools: 同一轮内并发执行的工具调用数上限
+            on_progress: 可选，callable(detail)，每轮开始 / 每次工具调用时回调
+            cancel: 可选，threading.Event，置位后在下一个数据块 / 下一轮之前中止并返回 None
+            context_budget: 历史消息的估算 token 上限，默认 LLM_TOOL_CONTEXT_TOKENS；
+                每轮请求前用 ToolContext 裁剪旧的工具结果
         返回:
             最终的纯文本回复，或 None
         """
@@ -218,79 +257,208 @@ class LLMService:
             "Content-Type": "application/json",
         }
 
-        msgs = list(messages)  # 不修改原始列表
+        # 不修改原始列表；旧工具结果按轮裁剪，避免请求体随轮数平方增长
+        context = ToolContext(
+            messages, token_budget=context_budget or int(os.environ.get("LLM_TOOL_CONTEXT_TOKENS", "48000")),
+        )
 
-        for round_idx in range(max_rounds):
-            payload = {
-                "model": model,
-                "messages": msgs,
-                "tools": tools,
-                "temperature": temperature if temperature is not None else self.temperature,
-                "max_tokens": max_tokens or self.max_tokens,
-            }
+        def report(detail: str) -> None:
+            if on_progress:
+                try:
+                    on_progress(detail)
+                except Exception as e:
+                    print(f"[LLM] tool_call 进度回调异常: {e}")
 
-            print(f"\n[LLM] tool_call round {round_idx + 1}: model={model}")
+        try:
+            # 流式接收时 read 超时是两个数据块之间的间隔，不再需要 600s
+            with httpx.Client(timeout=httpx.Timeout(connect=30.0, read=120.0, write=30.0, pool=30.0)) as client:
+                for round_idx in range(max_rounds):
+                    if cancel is not None and cancel.is_set():
+                        print("[LLM] tool_call 已取消")
+                        return None
 
-            try:
-                with httpx.Client(
-                    timeout=httpx.Timeout(connect=30.0, read=600.0, write=30.0, pool=30.0)
-                ) as client:
-                    resp = client.post(
-                        endpoint,
-                        headers=headers,
-                        json=payload,
-                    )
-
-                if resp.status_code != 200:
-                    print(f"[LLM] tool_call 错误: HTTP {resp.status_code} - {resp.text[:500]}")
-                    return None
+                    stubbed, dropped = context.stubbed_chars, context.dropped_rounds
+                    msgs = context.prune()
+                    if context.stubbed_chars > stubbed or context.dropped_rounds > dropped:
+                        print(
+                            f"[LLM] tool_call 上下文裁剪：累计省略 {context.stubbed_chars} 字符、"
+                            f"丢弃 {context.dropped_rounds} 轮，当前约 {context.tokens()} tokens"
+                        )
+                    payload = {
+                        "model": model,
+                        "messages": msgs,
+                        "tools": tools,
+                        "temperature": temperature if temperature is not None else self.temperature,
+                        "max_tokens": max_tokens or self.max_tokens,
+                        "stream": True,
+                    }
+                    if endpoint not in self._no_stream_options:
+                        payload["stream_options"] = {"include_usage": True}
 
-                data = resp.json()
-                choice = data.get("choices", [{}])[0]
-                message = choice.get("message", {})
-                finish_reason = choice.get("finish_reason", "")
-
-                # 如果没有 tool_calls → 返回纯文本
-                tool_calls = message.get("tool_calls")
-                if not tool_calls:
-                    return message.get("content") or None
-
-                # 把 assistant 的 tool_calls 消息加入历史
-                msgs.append(message)
-
-                # 逐个执行 tool_call，把结果加入历史
-                for tc in tool_calls:
-                    fn = tc.get("function", {})
-                    name = fn.get("name", "")
-                    try:
-                        arguments = json.loads(fn.get("arguments", "{}"))
-                    except json.JSONDecodeError:
-                        arguments = {}
-
-                    print(f"[LLM] tool_call: {name}({json.dumps(arguments, ensure_ascii=False)[:200]})")
-                    result_str = tool_handler(name, arguments)
-
-                    msgs.append({
-                        "role": "tool",
-                        "tool_call_id": tc.get("id", ""),
-                        "content": result_str,
+                    print(f"\n[LLM] tool_call round {round_idx + 1}: model={model}")
+                    report(f"第 {round_idx + 1} 轮：等待模型响应...")
+
+                    round_result = self._stream_tool_round(client, endpoint, headers, payload, cancel)
+                    if round_result is None:
+                        return None
+                    message, finish_reason, reported_usage = round_result
+                    _add_usage(usage, reported_usage or {
+                        "prompt_tokens": estimate_tokens(json.dumps(msgs, ensure_ascii=False)),
+                        "completion_tokens": estimate_tokens(json.dumps(message, ensure_ascii=False)),
                     })
 
-                # 如果 finish_reason 不是 tool_calls，也退出
-                if finish_reason != "tool_calls" and finish_reason != "stop":
-                    return message.get("content") or None
+                    # 如果没有 tool_calls → 返回纯文本
+                    tool_calls = message.get("tool_calls")
+                    if not tool_calls:
+                        return message.get("content") or None
 
-            except Exception as e:
-                print(f"[LLM] tool_call 异常: {type(e).__name__}: {e}")
-                return None
+                    # 把 assistant 的 tool_calls 消息和工具结果（按 tool_calls 原顺序）加入历史
+                    results = self._run_tool_calls(tool_calls, tool_handler, max_parallel_tools, report, cancel)
+                    if results is None:
+                        print("[LLM] tool_call 已取消")
+                        return None
+                    context.add_round(message, list(zip(tool_calls, results)))
+
+                    # 如果 finish_reason 不是 tool_calls，也退出
+                    if finish_reason != "tool_calls" and finish_reason != "stop":
+                        return message.get("content") or None
+
+        except Exception as e:
+            print(f"[LLM] tool_call 异常: {type(e).__name__}: {e}")
+            return None
 
         print(f"[LLM] tool_call 达到最大轮数 {max_rounds}")
         return None
 
-    def complete(self, messages: list, model: str = None, temperature: float = None, max_tokens: int = None, api_key: str = None) -> Optional[str]:
+    def _stream_tool_round(
+        self, client: httpx.Client, endpoint: str, headers: dict, payload: dict, cancel: threading.Event | None
+    ) -> tuple[dict, str, dict | None] | None:
+        """
+        流式请求一轮，拼出完整的 assistant 消息（content + tool_calls 的增量按 index 合并）。
+        返回 (message, finish_reason, usage)；HTTP 错误或被取消时返回 None。
+        服务端忽略 stream 直接返回 JSON 时按非流式解析；以 400/422 拒绝 stream_options 时去掉后重试。
+        """
+        with client.stream("POST", endpoint, headers=headers, json=payload) as response:
+            if response.status_code != 200:
+                error_text = response.read().decode(errors="replace")
+                print(f"[LLM] tool_call 错误: HTTP {response.status_code} - {error_text[:500]}")
+                if response.status_code in (400, 422) and "stream_options" in payload:
+                    print("[LLM] 服务端可能不支持 stream_options，去掉后重试")
+                    self._no_stream_options.add(endpoint)
+                    retry = {k: v for k, v in payload.items() if k != "stream_options"}
+                    return self._stream_tool_round(client, endpoint, headers, retry, cancel)
+                return None
+
+            if "application/json" in response.headers.get("content-type", ""):
+                data = json.loads(response.read())
+                choice = (data.get("choices") or [{}])[0]
+                return choice.get("message", {}), choice.get("finish_reason", ""), data.get("usage")
+
+            content: list[str] = []
+            calls: dict[int, dict] = {}
+            finish_reason = ""
+            reported_usage = None
+            for line in response.iter_lines():
+                if cancel is not None and cancel.is_set():
+                    return None
+                if not line or not line.startswith("data: "):
+                    continue
+                data_str = line[6:]
+                if data_str == "[DONE]":
+                    break
+                try:
+                    data = json.loads(data_str)
+                except json.JSONDecodeError:
+                    continue
+                if data.get("usage"):
+                    reported_usage = data["usage"]
+                for choice in data.get("choices") or []:
+                    delta = choice.get("delta") or {}
+                    if delta.get("content"):
+                        content.append(delta["content"])
+                    for part in delta.get("tool_calls") or []:
+                        call = calls.setdefault(part.get("index", len(calls)), {
+                            "id": "", "type": "function", "function": {"name": "", "arguments": ""},
+                        })
+                        if part.get("id"):
+                            call["id"] = part["id"]
+                        fn = part.get("function") or {}
+                        call["function"]["name"] += fn.get("name") or ""
+                        call["function"]["arguments"] += fn.get("arguments") or ""
+                    if choice.get("finish_reason"):
+                        finish_reason = choice["finish_reason"]
+
+        message = {"role": "assistant", "content": "".join(content) or None}
+        if calls:
+            message["tool_calls"] = [calls[i] for i in sorted(calls)]
+        return message, finish_reason, reported_usage
+
+    @staticmethod
+    def _run_tool_calls(
+        tool_calls: list[dict],
+        tool_handler: callable,
+        max_parallel: int,
+        report: Callable[[str], None],
+        cancel: threading.Event | None,
+    ) -> list[str] | None:
+        """
+        执行一轮的全部 tool_call，按原顺序返回结果。
+        参数 path 相同的调用（如先 read 再 edit 同一文件）在同一组里按顺序执行，不同组并发；
+        不带 path 的调用（如 list_files）会看到所有文件，作为屏障单独执行：
+        先等前面的组全部完成，执行完它再开始后面的调用。
+        """
+        parsed = []
+        for tc in tool_calls:
+            fn = tc.get("function", {})
+            try:
+                arguments = json.loads(fn.get("arguments") or "{}")
+            except json.JSONDecodeError:
+                arguments = {}
+            parsed.append((fn.get("name", ""), arguments if isinstance(arguments, dict) else {}))
+
+        results: list[str] = [""] * len(parsed)
+
+        def run_group(indices: list[int]) -> None:
+            for i in indices:
+                if cancel is not None and cancel.is_set():
+                    return
+                name, arguments = parsed[i]
+                print(f"[LLM] tool_call: {name}({json.dumps(arguments, ensure_ascii=False)[:200]})")
+                report(f"{name} {arguments.get('path', '')}".strip())
+                try:
+                    results[i] = tool_handler(name, arguments)
+                except Exception as e:
+                    results[i] = f"错误: 工具 {name} 执行失败: {e}"
+
+        def run_groups(groups: list[list[int]]) -> None:
+            if len(groups) <= 1 or max_parallel <= 1:
+                for indices in groups:
+                    run_group(indices)
+            else:
+                with ThreadPoolExecutor(max_workers=min(max_parallel, len(groups))) as pool:
+                    list(pool.map(run_group, groups))
+
+        groups: dict[str, list[int]] = {}
+        for i, (_, arguments) in enumerate(parsed):
+            path = arguments.get("path")
+            if path:
+                groups.setdefault(path, []).append(i)
+                continue
+            run_groups(list(groups.values()))
+            groups = {}
+            run_group([i])
+        run_groups(list(groups.values()))
+
+        if cancel is not None and cancel.is_set():
+            return None
+        return results
+
+    def complete(self, messages: list, model: str = None, temperature: float = None, max_tokens: int = None, api_key: str = None, usage: dict = None, response_format: dict = None) -> Optional[str]:
         """
         非流式语义的 API 调用（内部用 stream 接收，避免长文本超时）。
-        api_key 可覆盖默认 key。
+        api_key 可覆盖默认 key；传入 usage dict 时写入本次调用的 token 用量。
+        response_format 原样透传（JSON mode / JSON schema）；服务端以 400/422 拒绝时去掉该字段重试一次。
+        stream_options（流式返回 usage）同样在被拒绝时去掉重试；两者都会记住该端点，之后不再发送。
         """
         model = model or self.model_primary
         
@@ -320,11 +488,16 @@ class LLMService:
             "max_tokens": max_tokens or self.max_tokens,
             "stream": True,
         }
+        if endpoint not in self._no_stream_options:
+            payload["stream_options"] = {"include_usage": True}
+        if response_format and endpoint not in self._no_response_format:
+            payload["response_format"] = response_format
         
         print(f"\n[LLM] complete(stream): model={model}, key=...{api_key[-6:] if api_key else 'None'}")
         
         try:
             chunks: list[str] = []
+            reported_usage = None
             with httpx.Client(timeout=httpx.Timeout(connect=30.0, read=600.0, write=30.0, pool=30.0)) as client:
                 with client.stream(
                     "POST",
@@ -335,6 +508,14 @@ class LLMService:
                     if response.status_code != 200:
                         error_text = response.read().decode()
                         print(f"[LLM] 错误: HTTP {response.status_code} - {error_text[:500]}")
+                        if response.status_code in (400, 422) and "response_format" in payload:
+                            print("[LLM] 服务端可能不支持 response_format，去掉后重试")
+                            self._no_response_format.add(endpoint)
+                            return self.complete(messages, model, temperature, max_tokens, api_key, usage)
+                        if response.status_code in (400, 422) and "stream_options" in payload:
+                            print("[LLM] 服务端可能不支持 stream_options，去掉后重试")
+                            self._no_stream_options.add(endpoint)
+                            return self.complete(messages, model, temperature, max_tokens, api_key, usage)
                         return None
                     
                     for line in response.iter_lines():
@@ -345,14 +526,22 @@ class LLMService:
                             break
                         try:
                             data = json.loads(data_str)
-                            delta = data.get("choices", [{}])[0].get("delta", {})
-                            content = delta.get("content", "")
+                            if data.get("usage"):
+                                reported_usage = data["usage"]
+                            choices = data.get("choices") or [{}]
+                            content = choices[0].get("delta", {}).get("content", "")
                             if content:
                                 chunks.append(content)
                         except json.JSONDecodeError:
                             continue
             
             result = "".join(chunks)
+            if usage is not None:
+                # 服务端没返回 usage 时按字符数估算
+                _add_usage(usage, reported_usage or {
+                    "prompt_tokens": estimate_tokens("".join(str(m.get("content") or "") for m in messages)),
+                    "completion_tokens": estimate_tokens(result),
+                })
             print(f"[LLM] 成功: {len(result)} 字符")
             return result if result else None
         except Exception as e:
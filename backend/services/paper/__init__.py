@@ -4,21 +4,52 @@ Paper 模块 — AI 自动生成学术论文
 
 from .vfs import VirtualFileSystem
 from .session import PaperStatus, PaperSession, SessionManager
-from .latex import CompileResult, LocalCompiler, RemoteCompiler, get_compiler, extract_errors
+from .session_store import SessionStore, MemorySessionStore, SQLiteSessionStore, get_session_store
+from .latex import (
+    CompileResult, ErrorLocation, LocalCompiler, RemoteCompiler, get_compiler, extract_errors, locate_errors,
+)
+from .lint import CompileStats, LintIssue, LintReport, compile_stats, lint_vfs
+from .research_cache import ResearchCache
 from .service import PaperService
 from .persist import persist_session, restore_session
+from .checkpoint import checkpoint_key, delete_checkpoint, has_checkpoint, load_checkpoint, save_checkpoint
+from .jobs import JobConflictError, JobRunner
+from .tracing import PaperTrace, TimingStats, span, timing_stats
 
 __all__ = [
     "VirtualFileSystem",
     "PaperStatus",
     "PaperSession",
     "SessionManager",
+    "SessionStore",
+    "MemorySessionStore",
+    "SQLiteSessionStore",
+    "get_session_store",
     "CompileResult",
     "LocalCompiler",
     "RemoteCompiler",
     "get_compiler",
     "extract_errors",
+    "locate_errors",
+    "ErrorLocation",
+    "LintIssue",
+    "LintReport",
+    "lint_vfs",
+    "CompileStats",
+    "compile_stats",
+    "ResearchCache",
     "PaperService",
     "persist_session",
     "restore_session",
+    "checkpoint_key",
+    "save_checkpoint",
+    "load_checkpoint",
+    "has_checkpoint",
+    "delete_checkpoint",
+    "JobRunner",
+    "JobConflictError",
+    "PaperTrace",
+    "TimingStats",
+    "span",
+    "timing_stats",
 ]
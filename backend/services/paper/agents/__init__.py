@@ -4,13 +4,14 @@ Paper Agents 包
 
 from .base import BaseAgent
 from .formatter import FormatterAgent
-from .planner import PlannerAgent
+from .planner import PlanError, PlannerAgent
 from .researcher import ResearcherAgent
 from .writer import WriterAgent
 
 __all__ = [
     "BaseAgent",
     "FormatterAgent",
+    "PlanError",
     "PlannerAgent",
     "ResearcherAgent",
     "WriterAgent",
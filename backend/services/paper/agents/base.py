@@ -5,7 +5,9 @@ BaseAgent — 所有 Agent 的抽象基类
 from abc import ABC, abstractmethod
 from typing import Generator
 
+from ..jobs import current_cancel
 from ..session import PaperSession
+from ..tracing import record_llm_call
 
 
 class BaseAgent(ABC):
@@ -17,26 +19,38 @@ class BaseAgent(ABC):
         self.api_key = api_key
 
     def _complete(self, messages: list, **kwargs) -> str | None:
-        """调用 LLM，自动注入 model 和 api_key"""
-        return self.llm.complete(
+        """调用 LLM，自动注入 model 和 api_key；调用次数和 token 用量记到当前 span"""
+        usage: dict = {}
+        result = self.llm.complete(
             messages,
             model=kwargs.pop("model", self.model),
             api_key=self.api_key,
+            usage=usage,
             **kwargs,
         )
+        record_llm_call(usage)
+        return result
 
     def _complete_with_tools(
         self, messages: list, tools: list[dict], tool_handler: callable, **kwargs
     ) -> str | None:
-        """带 function calling 的 LLM 调用，自动注入 model 和 api_key"""
-        return self.llm.complete_with_tools(
+        """
+        带 function calling 的 LLM 调用，自动注入 model 和 api_key；每轮请求都记到当前 span。
+        在后台任务里运行时带上任务的取消信号（JobRunner.cancel 后在下一轮之前停下）。
+        """
+        usage: dict = {}
+        result = self.llm.complete_with_tools(
             messages,
             tools=tools,
             tool_handler=tool_handler,
             model=kwargs.pop("model", self.model),
             api_key=self.api_key,
+            usage=usage,
+            cancel=kwargs.pop("cancel", current_cancel()),
             **kwargs,
         )
+        record_llm_call(usage)
+        return result
 
     @abstractmethod
     def run(self, session: PaperSession) -> Generator[dict, None, None]:
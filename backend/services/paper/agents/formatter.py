@@ -4,44 +4,141 @@ FormatterAgent — 排版师 Agent
 绝对不使用 itemize/enumerate/item 结构
 """
 
-from typing import Generator
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Generator, Iterable
 
 from .base import BaseAgent
-from ..session import PaperSession
+from ..converter import convert_plaintext, fill_placeholders
+from ..edits import EDIT_TOOLS, make_tool_handler
+from ..latex import ErrorLocation
+from ..session import PaperSession, SessionManager
+from ..tracing import span
+
+_PARAGRAPH_MARK_RE = re.compile(r"<<<P(\d+)>>>")
+_PATCH_RE = re.compile(r"<<<PATCH\s+(\S+)\s+(\d+)(?:\s*-\s*(\d+))?\s*>>>\n?(.*?)\n?<<<END>>>", re.DOTALL)
+_NUMBERED_LINE_RE = re.compile(r"^\s*\d+\s*\|\s?")
 
 
 class FormatterAgent(BaseAgent):
     """排版师 Agent：将纯文本转为 LaTeX，写入 VFS"""
 
+    def __init__(
+        self,
+        llm_service,
+        model: str | None = None,
+        api_key: str | None = None,
+        max_workers: int = 4,
+        fast_path: bool = False,
+    ):
+        super().__init__(llm_service, model=model, api_key=api_key)
+        self.max_workers = max(1, max_workers)
+        # 本地规则转换，只把数学 / 列表等难段落交给 LLM
+        self.fast_path = fast_path
+
     def run(self, session: PaperSession) -> Generator[dict, None, None]:
         yield {"type": "progress", "stage": "formatting", "detail": "正在生成 LaTeX 文件..."}
 
-        vfs = session.vfs
-        plan = session.file_plan
-
         # 1. 生成 main.tex
         yield {"type": "progress", "stage": "formatting", "detail": "生成 main.tex..."}
-        vfs.write("main.tex", self._generate_main(plan))
+        session.vfs.write("main.tex", self._generate_main(session.file_plan))
 
-        # 2. 逐章转换 LaTeX
-        outline = plan.get("outline", {})
-        chapter_files = sorted(k for k in outline if k.startswith("chapters/"))
+        # 2. 各章并发转换 LaTeX（正文已全部写好，一次性提交）
+        outline = session.file_plan.get("outline", {})
+        chapters = (
+            {"type": "chapter_done", "file": file_path, "content": session.content.get(file_path, "")}
+            for file_path in sorted(k for k in outline if k.startswith("chapters/"))
+        )
+        yield from self._format_chapters(session, chapters)
 
-        for file_path in chapter_files:
-            chapter_plan = outline[file_path]
-            content = session.content.get(file_path, "")
-            title = chapter_plan.get("title", "")
+        # 3. 生成 refs.bib
+        yield from self._finish(session)
 
-            yield {"type": "progress", "stage": "formatting", "detail": f"格式化 {file_path}..."}
+    def run_streaming(self, session: PaperSession, upstream: Iterable[dict]) -> Generator[dict, None, None]:
+        """
+        流水线模式：消费上游 WriterAgent 的事件流，收到 chapter_done 立即提交该章的
+        LaTeX 转换，其他上游事件原样转发。上游结束后等剩余章节转换完，再生成 refs.bib。
+        """
+        session.vfs.write("main.tex", self._generate_main(session.file_plan))
+        yield from self._format_chapters(session, upstream)
+        yield from self._finish(session)
 
-            latex_content = self._to_latex(title, content, chapter_plan.get("sections", []))
-            vfs.write(file_path, latex_content)
+    def _format_chapters(self, session: PaperSession, upstream: Iterable[dict]) -> Generator[dict, None, None]:
+        """
+        各章转换互不依赖，放进线程池并发执行；每章转换完成时发进度事件。
+        VFS 按章节顺序写入，保证文件顺序（及序列化结果）与完成先后无关。
+        """
+        outline = session.file_plan.get("outline", {})
+        chapter_files = sorted(k for k in outline if k.startswith("chapters/"))
+        total = len(chapter_files)
+        started = time.monotonic()
+
+        converted: dict[str, str] = {}
+        next_write = 0
+        done = 0
+        # local = 完全本地转换；mixed = 本地 + 难段落交给 LLM；llm = 整章交给 LLM；
+        # resumed = 断点恢复时直接复用
+        session.format_stats = {"local": 0, "mixed": 0, "llm": 0, "resumed": 0}
+
+        def convert(file_path: str, title: str, content: str, sections: list) -> tuple[str, str]:
+            with span("format", trace=session.trace, file=file_path) as current:
+                latex, mode = self._convert_chapter(title, content, sections)
+                if current:
+                    current.attrs["mode"] = mode
+                return latex, mode
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures: dict = {}
+
+            def collect(finished) -> Generator[dict, None, None]:
+                nonlocal next_write, done
+                for future in finished:
+                    file_path = futures.pop(future)
+                    converted[file_path], mode = future.result()
+                    session.format_stats[mode] += 1
+                    session.chapter_status[file_path] = "formatted"
+                    done += 1
+                    yield {
+                        "type": "progress",
+                        "stage": "formatting",
+                        "detail": f"格式化 {file_path}（{done}/{total}）...",
+                    }
+                    while next_write < total and chapter_files[next_write] in converted:
+                        session.vfs.write(chapter_files[next_write], converted.pop(chapter_files[next_write]))
+                        next_write += 1
+
+            for event in upstream:
+                if event.get("type") == "chapter_done":
+                    file_path = event["file"]
+                    plan = outline.get(file_path, {})
+                    if session.chapter_status.get(file_path) == "formatted" and session.vfs.exists(file_path):
+                        # 断点恢复：该章的 LaTeX 已在 VFS 中，直接复用
+                        future = pool.submit(lambda latex=session.vfs.read(file_path): (latex, "resumed"))
+                    else:
+                        session.chapter_status[file_path] = "formatting"
+                        future = pool.submit(
+                            convert, file_path, plan.get("title", ""), event.get("content", ""), plan.get("sections", []),
+                        )
+                    futures[future] = file_path
+                else:
+                    yield event
+                yield from collect([f for f in list(futures) if f.done()])
+
+            yield from collect(as_completed(list(futures)))
+
+        if total:
+            stats = session.format_stats
+            print(
+                f"[Formatter] {total} 章 LaTeX 转换完成（并发 {self.max_workers}），"
+                f"本地 {stats['local']} / 混合 {stats['mixed']} / LLM {stats['llm']} / 复用 {stats['resumed']}，"
+                f"耗时 {time.monotonic() - started:.1f}s"
+            )
 
-        # 3. 生成 refs.bib
+    def _finish(self, session: PaperSession) -> Generator[dict, None, None]:
         yield {"type": "progress", "stage": "formatting", "detail": "生成 refs.bib..."}
-        vfs.write("refs.bib", self._generate_bib(session.literature))
-
-        yield {"type": "result", "data": vfs.list_files()}
+        session.vfs.write("refs.bib", self._generate_bib(session.literature))
+        yield {"type": "result", "data": session.vfs.list_files()}
 
     def _generate_main(self, plan: dict) -> str:
         """生成 main.tex 入口文件（纯字符串拼接，无 LLM 调用）"""
@@ -80,6 +177,47 @@ class FormatterAgent(BaseAgent):
             "\\end{document}\n"
         )
 
+    def _convert_chapter(self, title: str, content: str, sections: list) -> tuple[str, str]:
+        """
+        转换一章，返回 (latex, 方式)。
+        fast_path 开启时先本地转换：全部段落都能机械转换则不调用 LLM；
+        只有难段落时一次调用只转换这些段落；结构无法确定或难段落转换失败时整章交给 LLM。
+        """
+        if not self.fast_path:
+            return self._to_latex(title, content, sections), "llm"
+
+        local = convert_plaintext(title, content, sections)
+        if local.complete:
+            return local.latex, "local"
+        if not local.ambiguous:
+            paragraphs = self._paragraphs_to_latex(title, local.hard_paragraphs)
+            if paragraphs is not None:
+                return fill_placeholders(local.latex, paragraphs), "mixed"
+        return self._to_latex(title, content, sections), "llm"
+
+    def _paragraphs_to_latex(self, title: str, paragraphs: list[str]) -> list[str] | None:
+        """一次 LLM 调用转换多个难段落；返回段数对不上时视为失败，返回 None"""
+        numbered = "\n\n".join(f"<<<P{i}>>>\n{p}" for i, p in enumerate(paragraphs))
+        prompt = f"""将以下论文段落（来自章节「{title}」）逐段转换为 LaTeX 正文：
+
+{numbered}
+
+要求：
+1. 保留每段前的 <<<PN>>> 标记行，按原顺序逐段输出
+2. 引用标记 [refN] 转为 \\cite{{refN}}
+3. 数学内容用 $...$ 或 \\[...\\]
+4. 列表/表格内容改写为连贯的段落，绝对不使用 itemize/enumerate/item
+5. 不要输出 \\section 等标题命令，只输出段落正文"""
+
+        response = self._complete([{"role": "user", "content": prompt}]) or ""
+        parts = _PARAGRAPH_MARK_RE.split(response)
+        # split 结果: [前导文本, 编号0, 段落0, 编号1, 段落1, ...]
+        indices = [int(n) for n in parts[1::2]]
+        if indices != list(range(len(paragraphs))):
+            print(f"[Formatter] 段落转换结果无法对齐（期望 {len(paragraphs)} 段），整章回退 LLM")
+            return None
+        return [p.strip() for p in parts[2::2]]
+
     def _to_latex(self, title: str, content: str, sections: list) -> str:
         """用 LLM 将纯文本转换为 LaTeX 格式"""
         prompt = f"""将以下纯文本转换为 LaTeX 格式：
@@ -100,69 +238,52 @@ class FormatterAgent(BaseAgent):
 
         return self._complete([{"role": "user", "content": prompt}]) or ""
 
-    # ---- repair 用的 tool 定义 (OpenAI function calling 格式) ----
+    # ---- repair / revise 用的 tool 定义 (OpenAI function calling 格式) ----
 
-    REPAIR_TOOLS = [
-        {
-            "type": "function",
-            "function": {
-                "name": "list_files",
-                "description": "列出 VFS 中所有文件路径",
-                "parameters": {"type": "object", "properties": {}, "required": []},
-            },
-        },
-        {
-            "type": "function",
-            "function": {
-                "name": "read_file",
-                "description": "读取 VFS 中指定文件的完整内容",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "path": {
-                            "type": "string",
-                            "description": "文件路径，如 main.tex 或 chapters/01_intro.tex",
-                        }
-                    },
-                    "required": ["path"],
-                },
-            },
-        },
-        {
-            "type": "function",
-            "function": {
-                "name": "write_file",
-                "description": "将修复后的内容写入 VFS 中的指定文件（覆盖）",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "path": {
-                            "type": "string",
-                            "description": "文件路径",
-                        },
-                        "content": {
-                            "type": "string",
-                            "description": "修复后的完整文件内容",
-                        },
-                    },
-                    "required": ["path", "content"],
-                },
-            },
-        },
-    ]
+    REPAIR_TOOLS = EDIT_TOOLS
+
+    # 错误位置前后各取几行源码作为修复上下文
+    SNIPPET_RADIUS = 8
 
-    def repair(self, session: PaperSession, error_log: str) -> Generator[dict, None, None]:
+    def repair(
+        self, session: PaperSession, error_log: str, locations: list[ErrorLocation] | None = None
+    ) -> Generator[dict, None, None]:
         """
-        根据编译错误日志，用 function calling 让 LLM 自主定位并修复出错文件。
+        根据编译错误修复 VFS 中的文件。
+
+        编译器能把错误定位到文件和行号时（locations），只把出错位置附近的源码片段交给 LLM，
+        一次调用返回按行号替换的补丁，校验通过后整体写回，不再走多轮工具调用。
+        没有定位信息或补丁无效时，退回 function calling：
 
         LLM 可调用:
           - list_files()        → 查看 VFS 文件列表
+          - read_range(path, start, end) → 读取出错位置附近的行
           - read_file(path)     → 读取单个文件内容
-          - write_file(path, content) → 写回修复后的内容
+          - edit_file(path, edits | diff) → 局部修改（search/replace 或 unified diff）
+          - write_file(path, content) → 写回完整内容（只在需要整体重写时）
 
-        这样上下文里只有错误日志 + 按需读取的单个文件，不会溢出。
+        这样上下文里只有错误日志 + 按需读取的片段，输出也只有改动的几行。
         """
         vfs = session.vfs
+        located = [loc for loc in (locations or []) if vfs.exists(loc.path)]
+
+        if located:
+            yield {
+                "type": "progress",
+                "stage": "compiling",
+                "detail": f"定位到 {len(located)} 处编译错误，正在修复...",
+            }
+            with span("repair_snippet", locations=len(located)):
+                patched = self._repair_snippets(session, error_log, located)
+            if patched:
+                for path, (first, last) in patched.items():
+                    yield {
+                        "type": "progress",
+                        "stage": "compiling",
+                        "detail": f"已修复 {path}（第 {first}-{last} 行）",
+                    }
+                return
+            print("[Formatter] 片段补丁无效，退回工具调用修复")
 
         yield {
             "type": "progress",
@@ -173,26 +294,7 @@ class FormatterAgent(BaseAgent):
         # 记录被修改的文件，用于 yield progress
         modified_files: list[str] = []
 
-        def tool_handler(name: str, arguments: dict) -> str:
-            if name == "list_files":
-                files = vfs.list_files()
-                return "\n".join(files) if files else "(空)"
-
-            if name == "read_file":
-                path = arguments.get("path", "")
-                content = vfs.read(path)
-                if content is None:
-                    return f"错误: 文件 {path} 不存在"
-                return content
-
-            if name == "write_file":
-                path = arguments.get("path", "")
-                content = arguments.get("content", "")
-                vfs.write(path, content)
-                modified_files.append(path)
-                return f"已写入 {path}（{len(content)} 字符）"
-
-            return f"未知工具: {name}"
+        tool_handler = make_tool_handler(vfs, modified_files)
 
         messages = [
             {
@@ -201,17 +303,21 @@ class FormatterAgent(BaseAgent):
                     "你是 LaTeX 编译错误修复专家。用户会给你一段 xelatex 编译错误日志，"
                     "你需要通过工具定位出错文件、读取内容、修复后写回。\n\n"
                     "规则：\n"
-                    "1. 先用 list_files 查看有哪些文件\n"
-                    "2. 根据错误日志中的文件名和行号，用 read_file 读取出错文件\n"
-                    "3. 只修复导致编译失败的语法错误，不要改变内容语义\n"
-                    "4. 绝对不使用 itemize/enumerate/item 结构\n"
-                    "5. 用 write_file 写回修复后的完整文件内容\n"
-                    "6. 修复完成后，回复一句简短总结说明改了什么"
+                    "1. 根据错误日志中的文件名和行号，用 read_range 读取出错位置附近的行；"
+                    "不确定文件名时先用 list_files\n"
+                    "2. 只修复导致编译失败的语法错误，不要改变内容语义\n"
+                    "3. 绝对不使用 itemize/enumerate/item 结构\n"
+                    "4. 用 edit_file 做局部修改（search 须与原文完全一致，不带行号前缀），"
+                    "不要用 write_file 重写整个文件\n"
+                    "5. 修复完成后，回复一句简短总结说明改了什么"
                 ),
             },
             {
                 "role": "user",
-                "content": f"以下是 xelatex 编译错误摘要，请定位并修复问题：\n\n```\n{error_log}\n```",
+                "content": (
+                    f"以下是 xelatex 编译错误摘要，请定位并修复问题：\n\n```\n{error_log}\n```"
+                    + ("\n\n已定位的错误位置：\n" + "\n".join(str(loc) for loc in located) if located else "")
+                ),
             },
         ]
 
@@ -220,15 +326,129 @@ class FormatterAgent(BaseAgent):
             tools=self.REPAIR_TOOLS,
             tool_handler=tool_handler,
             max_rounds=10,
+            on_progress=lambda detail: SessionManager.update_progress(session.id, f"正在修复：{detail}"),
         )
 
-        for f in modified_files:
+        for f in dict.fromkeys(modified_files):
             yield {
                 "type": "progress",
                 "stage": "compiling",
                 "detail": f"已修复 {f}",
             }
 
+    def _repair_snippets(
+        self, session: PaperSession, error_log: str, locations: list[ErrorLocation]
+    ) -> dict[str, tuple[int, int]]:
+        """
+        一次 LLM 调用修复已定位的错误：prompt 只含出错位置附近的带行号源码，
+        LLM 返回 <<<PATCH 路径 起-止>>> 格式的行替换补丁。
+        补丁必须落在给出的片段范围内且互不重叠；全部校验通过才写回 VFS。
+        返回 {文件: (首行, 末行)}，没有可用补丁时返回空 dict。
+        """
+        vfs = session.vfs
+        windows = self._snippet_windows(vfs, locations)
+        if not windows:
+            return {}
+
+        errors = "\n".join(
+            f"{i + 1}. {loc.path}" + (f" 第 {loc.line} 行" if loc.line else "") + f": {loc.message}"
+            for i, loc in enumerate(locations)
+        )
+        snippets = []
+        for path, ranges in windows.items():
+            lines = vfs.read(path).split("\n")
+            for first, last in ranges:
+                numbered = "\n".join(f"{n}| {lines[n - 1]}" for n in range(first, last + 1))
+                snippets.append(f"=== {path}（第 {first}-{last} 行）===\n{numbered}")
+        snippet_text = "\n\n".join(snippets)
+
+        prompt = f"""以下 LaTeX 编译错误已定位到具体文件和行号，附上出错位置附近的源码（行首为行号）。
+
+错误：
+{errors}
+
+编译错误摘要：
+```
+{error_log[:2000]}
+```
+
+源码片段：
+{snippet_text}
+
+请只修改导致编译失败的行，按如下格式输出补丁（可以有多个）：
+<<<PATCH 文件路径 起始行-结束行>>>
+替换这些行的新内容（不带行号，可以比原来多行或少行，删除则留空）
+<<<END>>>
+
+要求：
+1. 行号范围必须在上面给出的片段内
+2. 只修复语法错误，不要改变内容语义
+3. 绝对不使用 itemize/enumerate/item 结构
+4. 只输出补丁，不要解释"""
+
+        response = self._complete([{"role": "user", "content": prompt}]) or ""
+        return self._apply_line_patches(vfs, response, windows)
+
+    def _snippet_windows(self, vfs, locations: list[ErrorLocation]) -> dict[str, list[tuple[int, int]]]:
+        """每个错误位置前后 SNIPPET_RADIUS 行，同一文件里重叠的窗口合并；行号未知时取整个文件开头"""
+        windows: dict[str, list[tuple[int, int]]] = {}
+        for loc in locations:
+            total = len(vfs.read(loc.path).split("\n"))
+            if loc.line:
+                center = min(loc.line, total)
+                first, last = max(1, center - self.SNIPPET_RADIUS), min(total, center + self.SNIPPET_RADIUS)
+            else:
+                first, last = 1, min(total, 4 * self.SNIPPET_RADIUS)
+            windows.setdefault(loc.path, []).append((first, last))
+
+        for path, ranges in windows.items():
+            merged: list[tuple[int, int]] = []
+            for first, last in sorted(ranges):
+                if merged and first <= merged[-1][1] + 1:
+                    merged[-1] = (merged[-1][0], max(merged[-1][1], last))
+                else:
+                    merged.append((first, last))
+            windows[path] = merged
+        return windows
+
+    @staticmethod
+    def _apply_line_patches(vfs, response: str, windows: dict[str, list[tuple[int, int]]]) -> dict[str, tuple[int, int]]:
+        """解析并校验行替换补丁，全部有效时按文件从后往前应用并写回"""
+        patches: dict[str, list[tuple[int, int, list[str]]]] = {}
+        for match in _PATCH_RE.finditer(response):
+            path, first = match.group(1), int(match.group(2))
+            last = int(match.group(3) or first)
+            if path not in windows or first > last:
+                return {}
+            if not any(lo <= first and last <= hi for lo, hi in windows[path]):
+                return {}
+            replacement = match.group(4)
+            lines = replacement.split("\n") if replacement else []
+            # LLM 照抄了 "行号| " 前缀时去掉
+            if lines and all(_NUMBERED_LINE_RE.match(line) for line in lines if line.strip()):
+                lines = [_NUMBERED_LINE_RE.sub("", line, count=1) for line in lines]
+            patches.setdefault(path, []).append((first, last, lines))
+
+        if not patches:
+            return {}
+
+        updated: dict[str, str] = {}
+        touched: dict[str, tuple[int, int]] = {}
+        for path, file_patches in patches.items():
+            lines = vfs.read(path).split("\n")
+            file_patches.sort(key=lambda p: p[0], reverse=True)
+            for (first, last, _), (next_first, _, _) in zip(file_patches[1:], file_patches):
+                if last >= next_first:
+                    return {}
+            for first, last, replacement in file_patches:
+                lines[first - 1:last] = replacement
+            updated[path] = "\n".join(lines)
+            touched[path] = (file_patches[-1][0], file_patches[0][1])
+
+        for path, content in updated.items():
+            vfs.write(path, content)
+        return touched
+
     def _generate_bib(self, literature: list) -> str:
         """生成 refs.bib 文件（纯字符串拼接，无 LLM 调用）"""
         entries = []
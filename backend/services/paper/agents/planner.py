@@ -3,12 +3,33 @@ PlannerAgent — 规划师 Agent（核心）
 决定论文文件结构、章节规划、引用分配
 """
 
-import json
+import os
 from typing import Generator
 
 from .base import BaseAgent
+from ..plan_schema import PLAN_SCHEMA, parse_json_object, validate_plan
 from ..session import PaperSession
 
+# 修正调用里回传的上次输出最多保留的字符数
+FIXUP_RESPONSE_CHARS = 12000
+
+
+class PlanError(ValueError):
+    """规划结果经一次修正调用后仍不合法"""
+
+
+def _response_format() -> dict | None:
+    """
+    PAPER_PLANNER_JSON_MODE：json_object（默认）/ json_schema / off。
+    服务端不支持 response_format 时 LLMService 会去掉该字段重试。
+    """
+    mode = os.environ.get("PAPER_PLANNER_JSON_MODE", "json_object").lower()
+    if mode == "json_schema":
+        return {"type": "json_schema", "json_schema": {"name": "paper_plan", "schema": PLAN_SCHEMA}}
+    if mode == "json_object":
+        return {"type": "json_object"}
+    return None
+
 
 class PlannerAgent(BaseAgent):
     """规划师 Agent：生成完整的论文文件规划 JSON"""
@@ -46,7 +67,8 @@ class PlannerAgent(BaseAgent):
       "sections": ["子节1", "子节2"],
       "key_points": ["要点1", "要点2"],
       "citations": ["ref1", "ref2"],
-      "target_words": 800
+      "target_words": 800,
+      "depends_on": []
     }}
   }}
 }}
@@ -56,24 +78,48 @@ class PlannerAgent(BaseAgent):
 2. 包含标准学术结构：引言、相关工作/文献综述、方法、实验/结果、讨论、结论
 3. 每章 2-4 个子节
 4. 合理分配引用到各章节
-5. 总字数 5000-8000 字"""
+5. 总字数 5000-8000 字
+6. depends_on 列出撰写本章前必须先读到的章节文件（如结论依赖前面各章），能独立撰写的章节留空"""
 
-        response = self._complete([{"role": "user", "content": prompt}])
-        session.file_plan = self._parse_plan(response)
+        messages = [{"role": "user", "content": prompt}]
+        response_format = _response_format()
+        response = self._complete(messages, response_format=response_format)
+        plan = self._parse_plan(response)
+        errors = validate_plan(plan)
+
+        if errors:
+            # 一次针对性修正：带上上次的输出和具体问题，而不是带着空规划继续往下走
+            print(f"[Planner] 规划校验失败（{len(errors)} 处），发起修正调用: {'；'.join(errors[:3])}")
+            yield {"type": "progress", "stage": "planning", "detail": "规划格式有误，正在修正..."}
+            response = self._complete(self._fixup_messages(messages, response, errors), response_format=response_format)
+            plan = self._parse_plan(response)
+            errors = validate_plan(plan)
+            if errors:
+                raise PlanError(f"规划结果无效: {'；'.join(errors[:5])}")
+
+        session.file_plan = plan
 
         file_count = len(session.file_plan.get("files", {}))
         yield {"type": "progress", "stage": "planning", "detail": f"规划完成：{file_count} 个文件"}
         yield {"type": "result", "data": session.file_plan}
 
-    def _parse_plan(self, response: str | None) -> dict:
-        """从 LLM 响应中提取 JSON 对象，容错处理"""
+    @staticmethod
+    def _fixup_messages(messages: list, response: str | None, errors: list[str]) -> list:
+        """构造修正调用：原始请求 + 上次输出 + 问题列表；上次没有输出则原样重试"""
         if not response:
-            return {}
-        start = response.find("{")
-        end = response.rfind("}")
-        if start < 0 or end <= start:
-            return {}
-        try:
-            return json.loads(response[start : end + 1])
-        except (json.JSONDecodeError, ValueError):
-            return {}
+            return messages
+        problems = "\n".join(f"- {e}" for e in errors)
+        return messages + [
+            {"role": "assistant", "content": response[:FIXUP_RESPONSE_CHARS]},
+            {
+                "role": "user",
+                "content": (
+                    f"上面的规划 JSON 有以下问题：\n{problems}\n\n"
+                    "请只修正这些问题，保持其余内容不变，输出完整的 JSON 对象（不要有其他文字）。"
+                ),
+            },
+        ]
+
+    def _parse_plan(self, response: str | None) -> dict:
+        """从 LLM 响应中提取 JSON 对象（容错：代码块、尾随逗号、截断），失败返回 {}"""
+        return parse_json_object(response) or {}
@@ -8,15 +8,29 @@ import json
 from typing import Generator
 
 from .base import BaseAgent
+from ..research_cache import ResearchCache
 from ..session import PaperSession
 
 
 class ResearcherAgent(BaseAgent):
-    """研究员 Agent：用 LLM 生成模拟文献列表 + 综合摘要"""
+    """研究员 Agent：用 LLM 生成模拟文献列表 + 综合摘要；传入 cache 时同主题直接复用"""
+
+    def __init__(self, llm_service, model: str | None = None, api_key: str | None = None,
+                 cache: ResearchCache | None = None):
+        super().__init__(llm_service, model=model, api_key=api_key)
+        self.cache = cache
 
     def run(self, session: PaperSession) -> Generator[dict, None, None]:
         yield {"type": "progress", "stage": "researching", "detail": "正在检索相关文献..."}
 
+        cached = self.cache.get(session.topic) if self.cache else None
+        if cached:
+            session.literature, session.literature_summary = cached
+            print(f"[Researcher] 命中文献缓存: {session.topic}")
+            yield {"type": "progress", "stage": "researching", "detail": "已复用相同主题的文献检索结果"}
+            yield {"type": "result", "data": session.literature}
+            return
+
         # MVP: 用 LLM 生成模拟文献
         prompt = (
             f"为研究主题「{session.topic}」生成 8-10 篇模拟参考文献。\n"
@@ -36,6 +50,8 @@ class ResearcherAgent(BaseAgent):
         )
         summary = self._complete([{"role": "user", "content": summary_prompt}])
         session.literature_summary = summary or ""
+        if self.cache:
+            self.cache.put(session.topic, session.literature, session.literature_summary)
 
         yield {"type": "result", "data": session.literature}
 
@@ -123,8 +123,10 @@ def test_run_progress_messages():
 
     assert "正在生成 LaTeX 文件" in progress_events[0]["detail"]
     assert "main.tex" in progress_events[1]["detail"]
-    assert "chapters/01_intro.tex" in progress_events[2]["detail"]
-    assert "chapters/02_related.tex" in progress_events[3]["detail"]
+    # 章节进度按完成先后发出
+    chapter_details = " ".join(e["detail"] for e in progress_events[2:4])
+    assert "chapters/01_intro.tex" in chapter_details
+    assert "chapters/02_related.tex" in chapter_details
     assert "refs.bib" in progress_events[4]["detail"]
 
 
@@ -425,24 +427,224 @@ def test_run_with_missing_content():
     assert session.vfs.exists("chapters/02_related.tex")
 
 
-def test_run_chapters_processed_in_sorted_order():
-    """Chapters should be formatted in sorted order by file path"""
-    call_order = []
+def test_run_chapters_written_in_sorted_order():
+    """VFS 写入顺序与章节顺序一致，不受转换完成先后影响"""
+    import time
+
     llm = MagicMock()
 
-    def track_calls(msgs, **kwargs):
+    def slow_first(msgs, **kwargs):
         content = msgs[0]["content"]
-        if "章节标题:" in content:
-            for line in content.split("\n"):
-                if line.startswith("章节标题:"):
-                    call_order.append(line.split(":")[1].strip())
-                    break
+        if "章节标题: 引言" in content:
+            time.sleep(0.05)
         return "\\section{test}"
 
-    llm.complete = MagicMock(side_effect=track_calls)
+    llm.complete = MagicMock(side_effect=slow_first)
     agent = FormatterAgent(llm)
     session = _make_session()
 
+    events = list(agent.run(session))
+
+    details = [e["detail"] for e in events if e["type"] == "progress"]
+    assert "chapters/02_related.tex" in details[2]
+    assert "chapters/01_intro.tex" in details[3]
+    assert session.vfs.list_files() == [
+        "main.tex", "chapters/01_intro.tex", "chapters/02_related.tex", "refs.bib",
+    ]
+
+
+def test_run_converts_chapters_concurrently():
+    import threading
+    import time
+
+    active = 0
+    peak = 0
+    lock = threading.Lock()
+
+    def slow_complete(msgs, **kwargs):
+        nonlocal active, peak
+        with lock:
+            active += 1
+            peak = max(peak, active)
+        time.sleep(0.1)
+        with lock:
+            active -= 1
+        return "\\section{test}"
+
+    llm = MagicMock()
+    llm.complete = MagicMock(side_effect=slow_complete)
+    session = _make_session()
+    outline = {f"chapters/{i:02d}_c.tex": {"title": f"第{i}章"} for i in range(1, 7)}
+    session.file_plan = {"title": "测试论文", "outline": outline}
+
+    started = time.monotonic()
+    list(FormatterAgent(llm, max_workers=3).run(session))
+    elapsed = time.monotonic() - started
+
+    assert peak == 3
+    assert elapsed < 0.5  # 串行需要 0.6s
+    assert all(session.vfs.exists(f) for f in outline)
+
+
+def test_run_streaming_formats_chapters_as_they_arrive():
+    agent = _make_agent()
+    session = _make_session()
+    upstream = [
+        {"type": "progress", "stage": "writing", "detail": "撰写第 1/2 章: 引言"},
+        {"type": "chapter_done", "file": "chapters/01_intro.tex", "content": "正文一"},
+        {"type": "progress", "stage": "writing", "detail": "撰写第 2/2 章: 相关工作"},
+        {"type": "chapter_done", "file": "chapters/02_related.tex", "content": "正文二"},
+    ]
+
+    events = list(agent.run_streaming(session, iter(upstream)))
+
+    details = [e["detail"] for e in events if e["type"] == "progress"]
+    # 上游进度原样转发，chapter_done 被消费
+    assert details[0] == "撰写第 1/2 章: 引言"
+    assert not [e for e in events if e["type"] == "chapter_done"]
+    prompts = [c.args[0][0]["content"] for c in agent.llm.complete.call_args_list]
+    assert any("正文一" in p for p in prompts) and any("正文二" in p for p in prompts)
+    assert session.vfs.list_files() == [
+        "main.tex", "chapters/01_intro.tex", "chapters/02_related.tex", "refs.bib",
+    ]
+    assert session.chapter_status == {
+        "chapters/01_intro.tex": "formatted", "chapters/02_related.tex": "formatted",
+    }
+
+
+# --- 本地快速转换 ---
+
+
+def test_fast_path_converts_plain_chapter_without_llm():
+    llm = MagicMock()
+    agent = FormatterAgent(llm, fast_path=True)
+    session = _make_session()
+    session.file_plan = {"title": "t", "outline": {"chapters/01_intro.tex": {"title": "引言", "sections": []}}}
+    session.content = {"chapters/01_intro.tex": "Transformer 取得进展[ref1]。"}
+
     list(agent.run(session))
 
-    assert call_order == ["引言", "相关工作"]
+    llm.complete.assert_not_called()
+    assert session.vfs.read("chapters/01_intro.tex") == "\\section{引言}\n\nTransformer 取得进展\\cite{ref1}。\n"
+    assert session.format_stats == {"local": 1, "mixed": 0, "llm": 0, "resumed": 0}
+
+
+def test_fast_path_sends_only_hard_paragraphs_to_llm():
+    llm = MagicMock()
+    llm.complete = MagicMock(return_value="<<<P0>>>\n损失为 $L = a + b$。")
+    agent = FormatterAgent(llm, fast_path=True)
+
+    latex, mode = agent._convert_chapter("方法", "模型很简单。\n\n损失为 L = a + b。", [])
+
+    assert mode == "mixed"
+    prompt = llm.complete.call_args[0][0][0]["content"]
+    assert "损失为 L = a + b。" in prompt
+    assert "模型很简单" not in prompt
+    assert latex == "\\section{方法}\n\n模型很简单。\n\n损失为 $L = a + b$。\n"
+
+
+def test_fast_path_falls_back_to_full_llm_on_misaligned_output():
+    llm = MagicMock()
+    llm.complete = MagicMock(side_effect=["没有标记的输出", "\\section{方法}\n整章"])
+    agent = FormatterAgent(llm, fast_path=True)
+
+    latex, mode = agent._convert_chapter("方法", "损失为 L = a + b。", [])
+
+    assert mode == "llm"
+    assert latex == "\\section{方法}\n整章"
+    assert llm.complete.call_count == 2
+
+
+def test_fast_path_ambiguous_chapter_uses_full_llm():
+    agent = _make_agent()
+    agent.fast_path = True
+
+    latex, mode = agent._convert_chapter("方法", "第一段。\n\n第二段。", ["模型", "训练"])
+
+    assert mode == "llm"
+    agent.llm.complete.assert_called_once()
+
+
+# --- repair() 片段补丁 ---
+
+
+def _repair_session() -> PaperSession:
+    session = _make_session()
+    lines = [f"第 {n} 行正文。" for n in range(1, 41)]
+    lines[19] = "这里有一个 \\badcommand 错误。"
+    session.vfs.write("chapters/01_intro.tex", "\n".join(lines))
+    session.vfs.write("main.tex", "\\documentclass{article}")
+    return session
+
+
+def test_repair_with_location_sends_snippet_and_applies_patch():
+    from ..latex import ErrorLocation
+
+    session = _repair_session()
+    agent = _make_agent("<<<PATCH chapters/01_intro.tex 20-20>>>\n这里有一个错误。\n<<<END>>>")
+    agent.llm.complete_with_tools = MagicMock()
+
+    events = list(agent.repair(
+        session, "! Undefined control sequence.",
+        locations=[ErrorLocation("chapters/01_intro.tex", 20, "Undefined control sequence.")],
+    ))
+
+    prompt = agent.llm.complete.call_args[0][0][0]["content"]
+    assert "20| 这里有一个 \\badcommand 错误。" in prompt
+    assert "12| 第 12 行正文。" in prompt
+    assert "第 11 行正文" not in prompt and "第 29 行正文" not in prompt
+    lines = session.vfs.read("chapters/01_intro.tex").split("\n")
+    assert lines[19] == "这里有一个错误。"
+    assert len(lines) == 40
+    agent.llm.complete_with_tools.assert_not_called()
+    assert events[-1]["detail"] == "已修复 chapters/01_intro.tex（第 20-20 行）"
+
+
+def test_repair_rejects_patch_outside_snippet_and_falls_back_to_tools():
+    from ..latex import ErrorLocation
+
+    session = _repair_session()
+    original = session.vfs.read("chapters/01_intro.tex")
+    agent = _make_agent(
+        "<<<PATCH chapters/01_intro.tex 20-20>>>\n修好了\n<<<END>>>\n"
+        "<<<PATCH chapters/01_intro.tex 2-3>>>\n越界\n<<<END>>>"
+    )
+    agent.llm.complete_with_tools = MagicMock(return_value="done")
+
+    list(agent.repair(
+        session, "! Undefined control sequence.",
+        locations=[ErrorLocation("chapters/01_intro.tex", 20, "Undefined control sequence.")],
+    ))
+
+    # 有一个补丁无效 → 全部不应用
+    assert session.vfs.read("chapters/01_intro.tex") == original
+    agent.llm.complete_with_tools.assert_called_once()
+    user_message = agent.llm.complete_with_tools.call_args[0][0][1]["content"]
+    assert "chapters/01_intro.tex:20: Undefined control sequence." in user_message
+
+
+def test_repair_without_location_uses_tool_loop():
+    session = _repair_session()
+    agent = _make_agent()
+    agent.llm.complete_with_tools = MagicMock(return_value="done")
+
+    list(agent.repair(session, "! Emergency stop."))
+
+    agent.llm.complete.assert_not_called()
+    agent.llm.complete_with_tools.assert_called_once()
+
+
+def test_apply_line_patches_strips_copied_line_numbers_and_handles_multiple_patches():
+    from ..vfs import VirtualFileSystem
+
+    vfs = VirtualFileSystem()
+    vfs.write("a.tex", "l1\nl2\nl3\nl4\nl5")
+    response = (
+        "<<<PATCH a.tex 4-5>>>\n4| L4\n<<<END>>>\n"
+        "<<<PATCH a.tex 1-2>>>\n<<<END>>>"
+    )
+
+    touched = FormatterAgent._apply_line_patches(vfs, response, {"a.tex": [(1, 5)]})
+
+    assert vfs.read("a.tex") == "l3\nL4"
+    assert touched == {"a.tex": (1, 5)}
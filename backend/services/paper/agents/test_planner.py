@@ -5,7 +5,9 @@ PlannerAgent 单元测试
 import json
 from unittest.mock import MagicMock
 
-from .planner import PlannerAgent
+import pytest
+
+from .planner import PlanError, PlannerAgent
 from ..session import PaperSession
 
 
@@ -173,11 +175,72 @@ def test_run_handles_llm_returning_none():
     agent = _make_agent(None)
     session = _make_session()
 
-    events = list(agent.run(session))
+    with pytest.raises(PlanError):
+        list(agent.run(session))
 
+    # 没有输出时原样重试一次，之后报错而不是带着空规划继续
+    assert agent.llm.complete.call_count == 2
     assert session.file_plan == {}
-    assert events[1]["detail"] == "规划完成：0 个文件"
-    assert events[2]["data"] == {}
+
+
+# --- JSON mode 与修正调用 ---
+
+
+def test_run_requests_json_mode(monkeypatch):
+    monkeypatch.delenv("PAPER_PLANNER_JSON_MODE", raising=False)
+    agent = _make_agent()
+
+    list(agent.run(_make_session()))
+
+    assert agent.llm.complete.call_args.kwargs["response_format"] == {"type": "json_object"}
+
+
+def test_run_json_schema_mode(monkeypatch):
+    monkeypatch.setenv("PAPER_PLANNER_JSON_MODE", "json_schema")
+    agent = _make_agent()
+
+    list(agent.run(_make_session()))
+
+    response_format = agent.llm.complete.call_args.kwargs["response_format"]
+    assert response_format["type"] == "json_schema"
+    assert "outline" in response_format["json_schema"]["schema"]["properties"]
+
+
+def test_run_fixes_invalid_plan_with_one_targeted_call():
+    broken = json.dumps({"title": "t", "files": {}, "outline": {"chapters/01_intro.tex": {"title": "引言"}}})
+    agent = _make_agent()
+    agent.llm.complete = MagicMock(side_effect=[broken, MOCK_PLAN_JSON])
+    session = _make_session()
+
+    events = list(agent.run(session))
+
+    assert agent.llm.complete.call_count == 2
+    fixup = agent.llm.complete.call_args_list[1][0][0]
+    assert fixup[1] == {"role": "assistant", "content": broken}
+    assert "sections" in fixup[2]["content"]
+    assert any(e.get("detail") == "规划格式有误，正在修正..." for e in events)
+    assert session.file_plan["title"] == "基于Transformer的图像分类方法综述"
+
+
+def test_run_raises_when_fixup_still_invalid():
+    agent = _make_agent("这里没有JSON数据")
+    session = _make_session()
+
+    with pytest.raises(PlanError, match="规划结果无效"):
+        list(agent.run(session))
+    assert agent.llm.complete.call_count == 2
+
+
+def test_run_accepts_truncated_output():
+    # 输出在最后一章中途被截断：丢掉不完整的字段，前面的内容保留
+    truncated = MOCK_PLAN_JSON[: MOCK_PLAN_JSON.index('"target_words": 1200')]
+    agent = _make_agent(truncated)
+    session = _make_session()
+
+    list(agent.run(session))
+
+    assert agent.llm.complete.call_count == 1
+    assert session.file_plan["outline"]["chapters/02_related.tex"]["citations"] == ["ref3", "ref4"]
 
 
 # --- 空文献列表 ---
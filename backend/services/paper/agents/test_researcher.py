@@ -6,6 +6,7 @@ import json
 from unittest.mock import MagicMock
 
 from .researcher import ResearcherAgent
+from ..research_cache import ResearchCache
 from ..session import PaperSession, PaperStatus
 
 
@@ -143,3 +144,33 @@ def test_run_handles_llm_returning_none_for_summary():
 
     assert len(session.literature) == 2
     assert session.literature_summary == ""
+
+
+# --- 主题缓存 ---
+
+
+def test_cache_hit_skips_llm_calls():
+    cache = ResearchCache()
+    first = _make_agent(MOCK_LITERATURE_JSON, MOCK_SUMMARY)
+    first.cache = cache
+    list(first.run(_make_session("深度学习 在自然语言处理中的应用")))
+
+    second = _make_agent()
+    second.cache = cache
+    session = _make_session("深度学习在自然语言处理中的应用。")
+    events = list(second.run(session))
+
+    second.llm.complete.assert_not_called()
+    assert session.literature == json.loads(MOCK_LITERATURE_JSON)
+    assert session.literature_summary == MOCK_SUMMARY
+    assert events[-1] == {"type": "result", "data": session.literature}
+
+
+def test_failed_research_is_not_cached():
+    cache = ResearchCache()
+    agent = _make_agent(MOCK_LITERATURE_JSON, None)
+    agent.cache = cache
+
+    list(agent.run(_make_session()))
+
+    assert cache.get(_make_session().topic) is None
@@ -4,7 +4,7 @@ WriterAgent 单元测试
 
 from unittest.mock import MagicMock, call
 
-from .writer import WriterAgent
+from .writer import WriterAgent, extract_summary, split_summary
 from ..session import PaperSession
 
 
@@ -201,38 +201,72 @@ def test_write_chapter_returns_empty_string_on_none():
     assert result == ""
 
 
-# --- _summarize_chapter() ---
+# --- 摘要 ---
 
 
-def test_summarize_chapter_calls_llm():
-    agent = _make_agent()
+def test_split_summary_extracts_delimited_block():
+    content, summary = split_summary("正文第一段。\n\n<<<SUMMARY>>>\n本章介绍了背景。\n<<<END>>>")
 
-    result = agent._summarize_chapter("引言", "这是一段很长的章节内容...")
+    assert content == "正文第一段。"
+    assert summary == "本章介绍了背景。"
 
-    agent.llm.complete.assert_called_once()
-    content = agent.llm.complete.call_args[0][0][0]["content"]
-    assert "概括" in content
 
+def test_split_summary_without_block():
+    assert split_summary("只有正文。") == ("只有正文。", None)
+    assert split_summary("正文。\n<<<SUMMARY>>>\n<<<END>>>") == ("正文。", None)
+
+
+def test_extract_summary_prefers_key_point_sentences():
+    content = "本章讨论图像分类。天气很好。卷积网络从AlexNet发展到ResNet。今天是周一。"
+
+    summary = extract_summary(content, ["AlexNet到ResNet"], max_sentences=2)
+
+    assert summary == "本章讨论图像分类。卷积网络从AlexNet发展到ResNet。"
 
-def test_summarize_chapter_truncates_long_content():
+
+def test_write_chapter_requests_summary_block_only_when_needed():
     agent = _make_agent()
-    long_content = "A" * 3000
+    session = _make_session()
+    plan = MOCK_OUTLINE["chapters/01_intro.tex"]
 
-    agent._summarize_chapter("引言", long_content)
+    agent._write_chapter(session, "chapters/01_intro.tex", plan, [], with_summary=True)
+    agent._write_chapter(session, "chapters/01_intro.tex", plan, [])
 
-    content = agent.llm.complete.call_args[0][0][0]["content"]
-    # Content should be truncated to 1500 chars
-    assert len(content) < 3000
+    with_block, without_block = [c[0][0][0]["content"] for c in agent.llm.complete.call_args_list]
+    assert "<<<SUMMARY>>>" in with_block
+    assert "<<<SUMMARY>>>" not in without_block
 
 
-def test_summarize_chapter_returns_empty_on_none():
+def test_serial_uses_one_llm_call_per_chapter():
     llm = MagicMock()
-    llm.complete = MagicMock(return_value=None)
-    agent = WriterAgent(llm)
+    prompts = []
+
+    def complete(msgs, **kwargs):
+        content = msgs[0]["content"]
+        prompts.append(content)
+        title = _title_of(content)
+        return f"{title}正文。\n<<<SUMMARY>>>\n{title}摘要\n<<<END>>>"
 
-    result = agent._summarize_chapter("引言", "内容")
+    llm.complete = MagicMock(side_effect=complete)
+    session = _make_session()
 
-    assert result == ""
+    list(WriterAgent(llm).run(session))
+
+    assert llm.complete.call_count == 3
+    assert session.content["chapters/01_intro.tex"] == "引言正文。"
+    assert "【引言】引言摘要" in prompts[1]
+    assert "【相关工作】相关工作摘要" in prompts[2]
+
+
+def test_serial_falls_back_to_extractive_summary():
+    agent = _make_agent(chapter_text="Transformer兴起于自然语言处理领域。后来扩展到视觉任务。")
+    session = _make_session()
+
+    list(agent.run(session))
+
+    second_prompt = agent.llm.complete.call_args_list[1][0][0][0]["content"]
+    assert "【引言】Transformer兴起于自然语言处理领域。" in second_prompt
+    assert agent.llm.complete.call_count == 3
 
 
 # --- 边界情况 ---
@@ -283,3 +317,187 @@ def test_run_chapters_sorted_by_filename():
     list(agent.run(session))
 
     assert call_order == ["引言", "相关工作", "结论"]
+
+
+# --- parallel 模式 ---
+
+
+def _title_of(prompt: str) -> str:
+    for line in prompt.split("\n"):
+        if line.startswith("章节标题:"):
+            return line.split(":", 1)[1].strip()
+    return ""
+
+
+def test_parallel_writes_all_chapters_with_ordered_progress():
+    llm = MagicMock()
+    llm.complete = MagicMock(side_effect=lambda msgs, **kwargs: (
+        f"{_title_of(msgs[0]['content'])}内容" if "撰写学术论文章节" in msgs[0]["content"] else "摘要"
+    ))
+    agent = WriterAgent(llm, mode="parallel", max_workers=3)
+    session = _make_session()
+
+    events = list(agent.run(session))
+
+    details = [e["detail"] for e in events if e["type"] == "progress"][1:]
+    assert details == ["撰写第 1/3 章: 引言", "撰写第 2/3 章: 相关工作", "撰写第 3/3 章: 结论"]
+    assert list(session.content) == sorted(MOCK_OUTLINE)
+    assert session.content["chapters/02_related.tex"] == "相关工作内容"
+
+
+def test_parallel_conclusion_waits_for_summaries_by_default():
+    llm = MagicMock()
+    prompts = {}
+
+    def complete(msgs, **kwargs):
+        content = msgs[0]["content"]
+        title = _title_of(content)
+        prompts[title] = content
+        return f"内容\n<<<SUMMARY>>>\n{title}摘要\n<<<END>>>"
+
+    llm.complete = MagicMock(side_effect=complete)
+    agent = WriterAgent(llm, mode="parallel")
+
+    list(agent.run(_make_session()))
+
+    # 引言、相关工作 只拿到全文结构；结论拿到前面两章的摘要
+    assert "全文结构" in prompts["引言"]
+    assert "【引言】" not in prompts["相关工作"]
+    assert "【引言】引言摘要" in prompts["结论"]
+    assert "【相关工作】相关工作摘要" in prompts["结论"]
+    # 摘要只向被依赖的两章索取，且与正文同一次调用
+    assert "<<<SUMMARY>>>" in prompts["引言"]
+    assert "<<<SUMMARY>>>" not in prompts["结论"]
+    assert llm.complete.call_count == 3
+
+
+def test_parallel_respects_planner_depends_on():
+    session = _make_session()
+    outline = {k: dict(v) for k, v in MOCK_OUTLINE.items()}
+    outline["chapters/02_related.tex"]["depends_on"] = ["chapters/01_intro.tex"]
+    outline["chapters/03_conclusion.tex"]["depends_on"] = ["chapters/99_missing.tex"]
+    session.file_plan = {"title": "测试论文", "outline": outline}
+    prompts = {}
+
+    def complete(msgs, **kwargs):
+        content = msgs[0]["content"]
+        if "撰写学术论文章节" in content:
+            prompts[_title_of(content)] = content
+            return "内容"
+        return "摘要"
+
+    llm = MagicMock()
+    llm.complete = MagicMock(side_effect=complete)
+
+    list(WriterAgent(llm, mode="parallel").run(session))
+
+    # mock 没按格式返回摘要块 → 本地抽取式摘要
+    assert "【引言】内容" in prompts["相关工作"]
+    assert "【" not in prompts["结论"].split("前序章节摘要:")[1]
+    assert len(session.content) == 3
+
+
+def test_empty_depends_on_lists_fall_back_to_conclusion_convention():
+    outline = {k: {**v, "depends_on": []} for k, v in MOCK_OUTLINE.items()}
+    chapter_files = sorted(outline)
+
+    deps = WriterAgent._resolve_dependencies(outline, chapter_files)
+
+    assert deps["chapters/03_conclusion.tex"] == {"chapters/01_intro.tex", "chapters/02_related.tex"}
+    assert deps["chapters/02_related.tex"] == set()
+
+
+def test_parallel_is_faster_than_serial():
+    import threading
+    import time
+
+    active = 0
+    peak = 0
+    lock = threading.Lock()
+
+    def slow_complete(msgs, **kwargs):
+        nonlocal active, peak
+        with lock:
+            active += 1
+            peak = max(peak, active)
+        time.sleep(0.1)
+        with lock:
+            active -= 1
+        return "内容"
+
+    outline = {f"chapters/{i:02d}_c.tex": {"title": f"第{i}章"} for i in range(1, 7)}
+
+    def fresh_session():
+        session = _make_session()
+        session.file_plan = {"title": "测试论文", "outline": outline}
+        return session
+
+    llm = MagicMock()
+    llm.complete = MagicMock(side_effect=slow_complete)
+
+    started = time.monotonic()
+    list(WriterAgent(llm, mode="serial").run(fresh_session()))
+    serial_elapsed = time.monotonic() - started
+
+    started = time.monotonic()
+    list(WriterAgent(llm, mode="parallel", max_workers=3).run(fresh_session()))
+    parallel_elapsed = time.monotonic() - started
+
+    # serial: 6 章逐一撰写；parallel: 无依赖，3 路并发
+    assert peak == 3
+    assert parallel_elapsed < serial_elapsed / 2
+
+
+def test_run_emits_chapter_done_with_content():
+    agent = _make_agent(chapter_text="正文")
+    session = _make_session()
+
+    events = list(agent.run(session))
+
+    done = [e for e in events if e["type"] == "chapter_done"]
+    assert [e["file"] for e in done] == sorted(MOCK_OUTLINE)
+    assert all(e["content"] == "正文" for e in done)
+    assert set(session.chapter_status.values()) == {"written"}
+
+
+def test_parallel_emits_chapter_done_for_every_chapter():
+    agent = WriterAgent(_make_agent().llm, mode="parallel")
+    session = _make_session()
+
+    events = list(agent.run(session))
+
+    assert sorted(e["file"] for e in events if e["type"] == "chapter_done") == sorted(MOCK_OUTLINE)
+
+
+# --- 断点恢复 ---
+
+
+def test_serial_skips_chapters_already_written():
+    agent = _make_agent(chapter_text="新内容")
+    session = _make_session()
+    session.content = {"chapters/01_intro.tex": "已有的引言。引言介绍了背景。"}
+    session.chapter_status = {"chapters/01_intro.tex": "formatted"}
+
+    events = list(agent.run(session))
+
+    assert agent.llm.complete.call_count == 2
+    assert session.content["chapters/01_intro.tex"] == "已有的引言。引言介绍了背景。"
+    assert session.chapter_status["chapters/01_intro.tex"] == "formatted"
+    assert [e["file"] for e in events if e["type"] == "chapter_done"] == sorted(MOCK_OUTLINE)
+    # 跳过的章节用本地摘要作为后续章节的上下文
+    second_prompt = agent.llm.complete.call_args_list[0][0][0][0]["content"]
+    assert "【引言】已有的引言。" in second_prompt
+
+
+def test_parallel_skips_chapters_already_written():
+    agent = WriterAgent(_make_agent(chapter_text="新内容").llm, mode="parallel")
+    session = _make_session()
+    session.content = {"chapters/02_related.tex": "已有的相关工作。"}
+
+    events = list(agent.run(session))
+
+    assert agent.llm.complete.call_count == 2
+    assert list(session.content) == sorted(MOCK_OUTLINE)
+    assert session.content["chapters/02_related.tex"] == "已有的相关工作。"
+    details = [e["detail"] for e in events if e["type"] == "progress"][1:]
+    assert details == ["撰写第 1/3 章: 引言", "撰写第 2/3 章: 相关工作", "撰写第 3/3 章: 结论"]
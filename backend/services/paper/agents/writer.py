@@ -1,55 +1,304 @@
 """
 WriterAgent — 写手 Agent
-按文件粒度工作，每次只写一个章节文件
-渐进式披露：每章写完生成摘要，传给下一章
+按文件粒度工作，每次只写一个章节文件，每章只调用一次 LLM：
+需要摘要时让 LLM 在正文后附带分隔的摘要块，缺失时本地抽取摘要
+- serial 模式：渐进式披露，每章附带摘要，传给下一章
+- parallel 模式：各章以规划大纲为上下文并发撰写，只有规划中 depends_on
+  标注的章节（如结论）才等待前序章节摘要
 """
 
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from typing import Generator
 
 from .base import BaseAgent
 from ..session import PaperSession
+from ..tracing import span
+
+CONCLUSION_MARKERS = ("结论", "总结", "conclusion")
+
+SUMMARY_START = "<<<SUMMARY>>>"
+SUMMARY_END = "<<<END>>>"
+_SENTENCE_RE = re.compile(r"[^。！？!?\n]+[。！？!?]?")
+
+
+def split_summary(response: str) -> tuple[str, str | None]:
+    """拆分 LLM 输出的正文和摘要块；没有摘要块（或为空）时摘要为 None"""
+    head, marker, tail = response.rpartition(SUMMARY_START)
+    if not marker:
+        return response.strip(), None
+    summary = tail.split(SUMMARY_END, 1)[0].strip()
+    return head.strip(), summary or None
+
+
+def extract_summary(content: str, key_points: list | None = None, max_sentences: int = 3) -> str:
+    """
+    本地抽取式摘要：按与章节要点的字重合度给句子打分（首句加权），
+    取得分最高的几句按原文顺序拼接。LLM 未按格式返回摘要时兜底。
+    """
+    sentences = [s.strip() for s in _SENTENCE_RE.findall(content) if len(s.strip()) > 5]
+    if not sentences:
+        return content.strip()[:200]
+
+    terms = {
+        point[i:i + 2]
+        for point in (key_points or [])
+        for i in range(len(point) - 1)
+    }
+
+    def score(item: tuple[int, str]) -> float:
+        index, sentence = item
+        overlap = sum(1 for term in terms if term in sentence)
+        return overlap + (1.5 if index == 0 else 0) - index * 0.01
+
+    chosen = sorted(sorted(enumerate(sentences), key=score, reverse=True)[:max_sentences])
+    return "".join(sentence for _, sentence in chosen)[:300]
 
 
 class WriterAgent(BaseAgent):
     """写手 Agent：逐章撰写纯文本内容"""
 
+    def __init__(
+        self,
+        llm_service,
+        model: str | None = None,
+        api_key: str | None = None,
+        mode: str = "serial",
+        max_workers: int = 4,
+    ):
+        super().__init__(llm_service, model=model, api_key=api_key)
+        self.mode = mode
+        self.max_workers = max(1, max_workers)
+
     def run(self, session: PaperSession) -> Generator[dict, None, None]:
+        """
+        session.content 里已有的章节（断点恢复）不再调用 LLM，直接复用，
+        需要摘要时用本地抽取式摘要。
+        """
+        if self.mode == "parallel":
+            yield from self._run_parallel(session)
+            return
+
         yield {"type": "progress", "stage": "writing", "detail": "开始撰写论文..."}
 
+        started = time.monotonic()
         outline = session.file_plan.get("outline", {})
         chapter_files = sorted(k for k in outline if k.startswith("chapters/"))
         total = len(chapter_files)
         previous_summaries: list[str] = []
+        self._mark_pending(session, chapter_files)
 
         for i, file_path in enumerate(chapter_files):
             plan = outline[file_path]
             title = plan.get("title", file_path)
+            # 渐进式披露：最后一章之外都让 LLM 在同一次调用里附带摘要，供后续章节参考
+            with_summary = i < total - 1
 
-            yield {
-                "type": "progress",
-                "stage": "writing",
-                "detail": f"撰写第 {i + 1}/{total} 章: {title}",
-            }
+            if file_path in session.content:
+                content = session.content[file_path]
+                summary = extract_summary(content, plan.get("key_points")) if with_summary else None
+                detail = f"撰写第 {i + 1}/{total} 章: {title}（已完成，跳过）"
+            else:
+                session.chapter_status[file_path] = "writing"
+                yield {
+                    "type": "progress",
+                    "stage": "writing",
+                    "detail": f"撰写第 {i + 1}/{total} 章: {title}",
+                }
+                content, summary = self._write_with_summary(
+                    session, file_path, plan, previous_summaries, "", with_summary,
+                )
+                session.content[file_path] = content
+                session.chapter_status[file_path] = "written"
+                detail = None
 
-            content = self._write_chapter(session, file_path, plan, previous_summaries)
-            session.content[file_path] = content
+            if detail:
+                yield {"type": "progress", "stage": "writing", "detail": detail}
+            yield {"type": "chapter_done", "file": file_path, "content": content}
 
-            # 渐进式披露：生成当前章节摘要，供后续章节参考
-            summary = self._summarize_chapter(title, content)
-            previous_summaries.append(f"【{title}】{summary}")
+            if summary is not None:
+                previous_summaries.append(f"【{title}】{summary}")
 
+        print(f"[Writer] serial 模式完成 {total} 章，耗时 {time.monotonic() - started:.1f}s")
         yield {"type": "result", "data": list(session.content.keys())}
 
+    def _run_parallel(self, session: PaperSession) -> Generator[dict, None, None]:
+        """
+        并发撰写：无依赖的章节同时开写，有依赖的章节在依赖章节摘要就绪后开写。
+        chapter_done 事件在章节写完时立即发出；进度事件按章节顺序发出
+        （前面的章节没写完时，后面已完成的章节先等待），结束时 session.content 按章节排序。
+        """
+        outline = session.file_plan.get("outline", {})
+        chapter_files = sorted(k for k in outline if k.startswith("chapters/"))
+        total = len(chapter_files)
+
+        yield {
+            "type": "progress",
+            "stage": "writing",
+            "detail": f"开始撰写论文（{min(self.max_workers, total or 1)} 路并行）...",
+        }
+
+        started = time.monotonic()
+        deps = self._resolve_dependencies(outline, chapter_files)
+        # 只有被依赖的章节才需要附带摘要
+        needs_summary = set().union(*deps.values()) if deps else set()
+        overview = self._paper_overview(session.file_plan, chapter_files)
+
+        pending = dict(deps)
+        self._mark_pending(session, chapter_files)
+        summaries: dict[str, str] = {}
+        next_emit = 0
+
+        def emit_in_order() -> Generator[dict, None, None]:
+            nonlocal next_emit
+            while next_emit < total and chapter_files[next_emit] in session.content:
+                file_path = chapter_files[next_emit]
+                next_emit += 1
+                yield {
+                    "type": "progress",
+                    "stage": "writing",
+                    "detail": f"撰写第 {next_emit}/{total} 章: {outline[file_path].get('title', file_path)}",
+                }
+
+        # 断点恢复：已写完的章节直接复用
+        for file_path in chapter_files:
+            if file_path in session.content:
+                pending.pop(file_path)
+                content = session.content[file_path]
+                if file_path in needs_summary:
+                    summaries[file_path] = extract_summary(content, outline[file_path].get("key_points"))
+                yield {"type": "chapter_done", "file": file_path, "content": content}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {}
+
+            def submit_ready() -> None:
+                for file_path in [f for f in chapter_files if f in pending]:
+                    if not pending[file_path] <= summaries.keys():
+                        continue
+                    prev = [
+                        f"【{outline[d].get('title', d)}】{summaries[d]}"
+                        for d in sorted(pending.pop(file_path))
+                    ]
+                    future = pool.submit(
+                        self._write_with_summary,
+                        session, file_path, outline[file_path], prev, overview,
+                        file_path in needs_summary,
+                    )
+                    futures[future] = file_path
+                    session.chapter_status[file_path] = "writing"
+
+            submit_ready()
+            yield from emit_in_order()
+            while futures:
+                finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+                completed = []
+                for future in finished:
+                    file_path = futures.pop(future)
+                    content, summary = future.result()
+                    session.content[file_path] = content
+                    session.chapter_status[file_path] = "written"
+                    completed.append(file_path)
+                    if summary is not None:
+                        summaries[file_path] = summary
+                submit_ready()
+
+                # 写完即交给下游（流水线里的排版），不等前面的章节
+                for file_path in sorted(completed):
+                    yield {"type": "chapter_done", "file": file_path, "content": session.content[file_path]}
+                yield from emit_in_order()
+
+        if pending:
+            raise ValueError(f"章节依赖无法满足（存在循环依赖）: {sorted(pending)}")
+
+        ordered = {f: session.content[f] for f in chapter_files if f in session.content}
+        session.content.clear()
+        session.content.update(ordered)
+
+        print(
+            f"[Writer] parallel 模式完成 {total} 章（并发 {self.max_workers}），"
+            f"耗时 {time.monotonic() - started:.1f}s"
+        )
+        yield {"type": "result", "data": list(session.content.keys())}
+
+    @staticmethod
+    def _mark_pending(session: PaperSession, chapter_files: list[str]) -> None:
+        """未写的章节标记为 pending；已写的章节（断点恢复）保留原状态"""
+        for file_path in chapter_files:
+            if file_path not in session.content:
+                session.chapter_status[file_path] = "pending"
+
+    def _write_with_summary(
+        self,
+        session: PaperSession,
+        file_path: str,
+        plan: dict,
+        prev_summaries: list[str],
+        overview: str,
+        summarize: bool,
+    ) -> tuple[str, str | None]:
+        """
+        写一章并按需拿到摘要：摘要和正文在同一次 LLM 调用中产出，
+        LLM 没按格式给出摘要时用本地抽取式摘要兜底
+        """
+        # 并行模式下在线程池里执行，显式挂到 session.trace 上
+        with span("write", trace=session.trace, file=file_path):
+            response = self._write_chapter(session, file_path, plan, prev_summaries, overview, with_summary=summarize)
+        content, summary = split_summary(response)
+        if not summarize:
+            return content, None
+        if summary is None:
+            summary = extract_summary(content, plan.get("key_points"))
+        return content, summary
+
+    @staticmethod
+    def _resolve_dependencies(outline: dict, chapter_files: list[str]) -> dict[str, set[str]]:
+        """
+        读取规划中每章的 depends_on（只保留存在的、排在本章之前的章节）。
+        规划完全没有标注依赖时（没有 depends_on，或全是空列表——json_schema 模式下模型常这样填），
+        按惯例让结论章依赖前面所有章节。
+        """
+        deps: dict[str, set[str]] = {}
+        marked = any(outline[f].get("depends_on") for f in chapter_files)
+        for i, file_path in enumerate(chapter_files):
+            earlier = set(chapter_files[:i])
+            if marked:
+                deps[file_path] = set(outline[file_path].get("depends_on") or []) & earlier
+            else:
+                title = str(outline[file_path].get("title", "")).lower()
+                is_conclusion = i == len(chapter_files) - 1 and any(m in title for m in CONCLUSION_MARKERS)
+                deps[file_path] = earlier if is_conclusion else set()
+        return deps
+
+    @staticmethod
+    def _paper_overview(file_plan: dict, chapter_files: list[str]) -> str:
+        """全文结构概览（各章标题 + 要点），并行撰写时替代前序章节摘要"""
+        outline = file_plan.get("outline", {})
+        lines = [f"论文标题: {file_plan.get('title', '')}"]
+        for i, file_path in enumerate(chapter_files):
+            plan = outline[file_path]
+            points = "；".join(plan.get("key_points", []))
+            lines.append(f"{i + 1}. {plan.get('title', file_path)}：{points}")
+        return "\n".join(lines)
+
     def _write_chapter(
         self,
         session: PaperSession,
         file_path: str,
         plan: dict,
         prev_summaries: list[str],
+        overview: str = "",
+        with_summary: bool = False,
     ) -> str:
-        """撰写单个章节的纯文本内容"""
+        """撰写单个章节的纯文本内容（with_summary 时正文后附带分隔的摘要块）"""
         # 只传最近 3 章摘要，控制上下文长度
-        context = "\n".join(prev_summaries[-3:]) if prev_summaries else "（这是第一章）"
+        if prev_summaries:
+            context = "\n".join(prev_summaries[-3:])
+        elif overview:
+            context = "（无，请参考全文结构把握本章定位，避免与其他章节重复）"
+        else:
+            context = "（这是第一章）"
 
         # 构建该章节的引用信息
         citations_info = ""
@@ -59,6 +308,13 @@ class WriterAgent(BaseAgent):
                 lit = session.literature[idx]
                 citations_info += f"- [{ref_id}] {lit.get('title', '')} ({lit.get('year', '')})\n"
 
+        overview_block = f"\n全文结构:\n{overview}\n" if overview else ""
+        summary_rule = (
+            f"\n6. 正文结束后另起一行输出 {SUMMARY_START}，接着用2-3句话概括本章核心内容，"
+            f"最后一行输出 {SUMMARY_END}"
+            if with_summary else ""
+        )
+
         prompt = f"""撰写学术论文章节（纯文本，不要 LaTeX 标记）：
 
 论文主题: {session.topic}
@@ -66,7 +322,7 @@ class WriterAgent(BaseAgent):
 子节: {', '.join(plan.get('sections', []))}
 要点: {', '.join(plan.get('key_points', []))}
 目标字数: {plan.get('target_words', 800)}
-
+{overview_block}
 可引用文献:
 {citations_info}
 
@@ -78,11 +334,6 @@ class WriterAgent(BaseAgent):
 2. 引用格式用 [refN]，如 [ref1]、[ref3]
 3. 逻辑清晰，段落分明
 4. 不要使用列表/枚举结构，用段落自然组织
-5. 与前序章节保持连贯，不重复已述内容"""
-
-        return self._complete([{"role": "user", "content": prompt}]) or ""
+5. 与前序章节保持连贯，不重复已述内容{summary_rule}"""
 
-    def _summarize_chapter(self, title: str, content: str) -> str:
-        """生成章节摘要（2-3句话），供后续章节参考"""
-        prompt = f"用2-3句话概括以下章节的核心内容：\n\n{content[:1500]}"
         return self._complete([{"role": "user", "content": prompt}]) or ""
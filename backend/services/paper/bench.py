@@ -0,0 +1,363 @@
+"""
+论文 pipeline 端到端压测 — StubLLMServer + run_benchmark
+在本机起一个 OpenAI 兼容的桩 LLM 服务（可配置首 token 延迟、每 token 延迟，按 prompt 返回预置内容），
+让真实的 LLMService（HTTP + 流式解析）和 4 个 Agent 跑起来，
+并发执行 N 条 PaperService.generate，用 LocalCompiler 真实编译，
+输出墙钟时间、各阶段耗时分布、峰值 RSS 和每小时产出篇数，作为每次 pipeline 改动的基线。
+
+用法（在 backend 目录下）：
+    python -m services.paper.bench --papers 8 --concurrency 4 --ttft 0.5 --token-latency 0.01
+    python -m services.paper.bench --no-latex   # 没有 TeX 环境时跳过编译
+"""
+
+import argparse
+import json
+import os
+import re
+import resource
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .lint import compile_stats
+from .tracing import TimingStats
+
+CHUNK_CHARS = 8
+
+_SECTION_TITLES = ["研究背景", "问题定义", "主要方法", "实验设置", "结果分析", "未来方向"]
+_CHAPTER_TITLES = ["引言", "相关工作", "方法", "实验", "讨论", "结论"]
+_SENTENCES = [
+    "近年来该领域的研究持续升温，大量工作围绕模型结构与训练策略展开[ref1]。",
+    "已有方法在公开数据集上取得了显著进展，但在泛化能力方面仍存在不足[ref2]。",
+    "本节从问题定义出发，梳理主流技术路线之间的联系与差异。",
+    "实验结果表明，合理的数据增强与正则化能够有效缓解过拟合问题[ref3]。",
+    "此外，计算开销与部署成本也是实际应用中不可忽视的因素。",
+]
+_MATH_PARAGRAPH = "训练目标定义为 L = sum_i l(x_i, y_i) + lambda R(w)，其中 R 为正则项。"
+
+
+# ---------------------------------------------------------------------------
+# 预置输出：按 prompt 特征返回与各 Agent 解析逻辑匹配的内容
+# ---------------------------------------------------------------------------
+
+
+def _literature() -> str:
+    return json.dumps([
+        {"title": f"Benchmark Paper {i}", "authors": f"Author {i} et al.", "year": str(2015 + i),
+         "abstract": "一篇用于压测的模拟文献。"}
+        for i in range(1, 9)
+    ], ensure_ascii=False)
+
+
+def _plan(chapters: int, words: int) -> str:
+    outline = {}
+    files = {"main.tex": "入口文件", "refs.bib": "参考文献"}
+    for i in range(chapters):
+        path = f"chapters/{i + 1:02d}_part{i + 1}.tex"
+        title = _CHAPTER_TITLES[i % len(_CHAPTER_TITLES)] if i < chapters - 1 else "结论"
+        files[path] = title
+        outline[path] = {
+            "title": title,
+            "sections": _SECTION_TITLES[(i * 2) % 6:(i * 2) % 6 + 2],
+            "key_points": [f"{title}要点一", f"{title}要点二"],
+            "citations": ["ref1", "ref2", "ref3"],
+            "target_words": words,
+            "depends_on": [p for p in outline] if i == chapters - 1 else [],
+        }
+    return json.dumps({"title": "压测论文", "files": files, "outline": outline}, ensure_ascii=False)
+
+
+def _field(prompt: str, name: str) -> str:
+    match = re.search(rf"^{name}:\s*(.*)$", prompt, re.MULTILINE)
+    return match.group(1).strip() if match else ""
+
+
+def _chapter(prompt: str) -> str:
+    """按目标字数生成正文：每个子节一个标题行 + 若干段落，第一节带一段数学内容（走 mixed 转换）"""
+    sections = [s.strip() for s in _field(prompt, "子节").split(",") if s.strip()] or ["概述"]
+    try:
+        target = int(_field(prompt, "目标字数") or 800)
+    except ValueError:
+        target = 800
+
+    per_section = max(1, target // len(sections))
+    parts = []
+    for n, section in enumerate(sections):
+        parts.append(section)
+        text, i, written = [], 0, 0
+        while written < per_section:
+            sentence = _SENTENCES[i % len(_SENTENCES)]
+            text.append(sentence)
+            written += len(sentence)
+            i += 1
+            if i % 3 == 0:
+                parts.append("".join(text))
+                text = []
+        if text:
+            parts.append("".join(text))
+        if n == 0:
+            parts.append(_MATH_PARAGRAPH)
+    body = "\n\n".join(parts)
+
+    if "<<<SUMMARY>>>" in prompt:
+        body += "\n<<<SUMMARY>>>\n本章概述了研究背景与主要方法。\n<<<END>>>"
+    return body
+
+
+def canned_response(prompt: str, chapters: int = 6, words: int = 800) -> str:
+    if "论文文件结构" in prompt:
+        return _plan(chapters, words)
+    if "模拟参考文献" in prompt:
+        return _literature()
+    if "文献综述摘要" in prompt:
+        return "该领域近年来发展迅速，研究趋势集中在模型结构、训练方法与应用落地三个方向。" * 6
+    if "撰写学术论文章节" in prompt:
+        return _chapter(prompt)
+    if "逐段转换为 LaTeX 正文" in prompt:
+        markers = re.findall(r"<<<P\d+>>>", prompt)
+        return "\n".join(f"{m}\n训练目标定义为 $L = \\sum_i \\ell(x_i, y_i) + \\lambda R(w)$。" for m in markers)
+    if "转换为 LaTeX 格式" in prompt:
+        title = _field(prompt, "章节标题") or "章节"
+        return f"\\section{{{title}}}\n\n" + "\n\n".join(_SENTENCES).replace("[ref", "\\cite{ref").replace("]", "}")
+    return "已完成。"
+
+
+# ---------------------------------------------------------------------------
+# 桩 LLM 服务
+# ---------------------------------------------------------------------------
+
+
+class StubLLMServer:
+    """
+    OpenAI 兼容的桩服务：POST /v1/chat/completions（及 /chat/completions）。
+    stream=true 时先等 ttft 秒，再按每 token token_latency 秒分块推送；
+    非流式（function calling）请求等待同样的总时长后一次返回。
+    """
+
+    def __init__(self, ttft: float = 0.0, token_latency: float = 0.0, chapters: int = 6, words: int = 800):
+        self.ttft = ttft
+        self.token_latency = token_latency
+        self.chapters = chapters
+        self.words = words
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "StubLLMServer":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                from ..llm import estimate_tokens
+
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                with stub._lock:
+                    stub.requests += 1
+                messages = payload.get("messages", [])
+                prompt = "\n".join(str(m.get("content") or "") for m in messages)
+                output = canned_response(prompt, stub.chapters, stub.words)
+                usage = {"prompt_tokens": estimate_tokens(prompt), "completion_tokens": estimate_tokens(output)}
+
+                if not payload.get("stream"):
+                    time.sleep(stub.ttft + stub.token_latency * usage["completion_tokens"])
+                    self._send_json({
+                        "choices": [{"message": {"role": "assistant", "content": output}, "finish_reason": "stop"}],
+                        "usage": usage,
+                    })
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.end_headers()
+                time.sleep(stub.ttft)
+                debt = 0.0
+                for i in range(0, len(output), CHUNK_CHARS):
+                    chunk = output[i:i + CHUNK_CHARS]
+                    debt += stub.token_latency * estimate_tokens(chunk)
+                    if debt >= 0.001:
+                        time.sleep(debt)
+                        debt = 0.0
+                    self._send_event({"choices": [{"delta": {"content": chunk}}]})
+                self._send_event({"choices": [], "usage": usage})
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+
+            def _send_json(self, data: dict) -> None:
+                body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _send_event(self, data: dict) -> None:
+                self.wfile.write(f"data: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+
+        return Handler
+
+
+# ---------------------------------------------------------------------------
+# 压测
+# ---------------------------------------------------------------------------
+
+
+class _NullCompiler:
+    """--no-latex：不调用 xelatex，直接返回一个极小的 PDF"""
+
+    def compile(self, files, entry="main.tex", build_key=None):
+        from .latex import CompileResult
+
+        return CompileResult(success=True, pdf_data=b"%PDF-1.4\n%%EOF\n")
+
+
+def _peak_rss_mb(who: int) -> float:
+    rss = resource.getrusage(who).ru_maxrss
+    # Linux 单位是 KB，macOS 是字节
+    return rss / 1024 / 1024 if sys.platform == "darwin" else rss / 1024
+
+
+def run_benchmark(
+    stub: StubLLMServer,
+    papers: int = 4,
+    concurrency: int = 2,
+    use_latex: bool = True,
+    writer_mode: str | None = None,
+) -> dict:
+    """并发跑 papers 篇论文，返回报告 dict"""
+    from flask import Flask
+
+    from models import db
+    from ..llm import LLMService
+    from ..storage import StorageService
+    from ..storage_backends import MemoryBackend
+    from .latex import LocalCompiler
+    from .service import PaperService
+
+    workdir = tempfile.mkdtemp(prefix="paper_bench_")
+    app = Flask("paper-bench")
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+
+    llm = LLMService()
+    llm.base_url = llm.qwen_base_url = stub.url
+    llm._api_keys = ["bench"]
+    llm.qwen_api_key = "bench"
+    service = PaperService(llm, StorageService(MemoryBackend()))
+    service.compiler = LocalCompiler() if use_latex else _NullCompiler()
+    if writer_mode:
+        service.writer.mode = writer_mode
+
+    def run_one(i: int) -> dict:
+        with app.app_context():
+            final, timings = None, None
+            for event in service.generate(f"bench-user-{i}", f"压测主题 {i}"):
+                if event["type"] in ("completed", "error"):
+                    final = event
+                elif event["type"] == "timings":
+                    timings = event
+            db.session.remove()
+        return {"ok": bool(final) and final["type"] == "completed", "error": (final or {}).get("message"),
+                "timings": timings}
+
+    print(f"[Bench] {papers} 篇 / 并发 {concurrency}，LLM 桩 {stub.url}（TTFT {stub.ttft}s，"
+          f"每 token {stub.token_latency * 1000:.1f}ms），编译器 {type(service.compiler).__name__}")
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(run_one, range(papers)))
+    wall = time.monotonic() - started
+
+    stats = TimingStats(window=max(papers, 1))
+    completed = [r for r in results if r["ok"]]
+    for r in completed:
+        stats.record(r["timings"])
+    llm_calls = [r["timings"]["llm_calls"] for r in completed]
+
+    return {
+        "papers": papers,
+        "concurrency": concurrency,
+        "completed": len(completed),
+        "failed": len(results) - len(completed),
+        "errors": sorted({r["error"] for r in results if not r["ok"] and r["error"]}),
+        "wall_time": round(wall, 3),
+        "papers_per_hour": round(len(completed) / wall * 3600, 1) if wall > 0 else 0.0,
+        "peak_rss_mb": round(_peak_rss_mb(resource.RUSAGE_SELF), 1),
+        "peak_child_rss_mb": round(_peak_rss_mb(resource.RUSAGE_CHILDREN), 1),
+        "llm_requests": stub.requests,
+        "llm_calls_per_paper": round(sum(llm_calls) / len(llm_calls), 1) if llm_calls else 0,
+        "compile": compile_stats.stats(),
+        "stages": stats.percentiles(),
+    }
+
+
+def format_report(report: dict) -> str:
+    lines = [
+        f"完成 {report['completed']}/{report['papers']} 篇（失败 {report['failed']}），并发 {report['concurrency']}",
+        f"墙钟时间 {report['wall_time']:.1f}s，吞吐 {report['papers_per_hour']:.1f} 篇/小时",
+        f"峰值 RSS {report['peak_rss_mb']:.1f}MB（编译子进程 {report['peak_child_rss_mb']:.1f}MB）",
+        f"LLM 请求 {report['llm_requests']} 次，每篇 {report['llm_calls_per_paper']} 次",
+        f"首次编译成功率 {report['compile']['first_success_rate']}，lint 自动修复 {report['compile']['lint_fixed']} 处",
+        "",
+        f"{'阶段':<14}{'次数':>6}{'mean':>9}{'p50':>9}{'p90':>9}{'max':>9}",
+    ]
+    for stage, p in report["stages"].items():
+        lines.append(f"{stage:<16}{p['count']:>6}{p['mean']:>9.2f}{p['p50']:>9.2f}{p['p90']:>9.2f}{p['max']:>9.2f}")
+    for error in report["errors"]:
+        lines.append(f"错误: {error}")
+    return "\n".join(lines)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="论文 pipeline 端到端压测（桩 LLM + LocalCompiler）")
+    parser.add_argument("--papers", type=int, default=4, help="总篇数")
+    parser.add_argument("--concurrency", type=int, default=2, help="同时运行的 pipeline 数")
+    parser.add_argument("--ttft", type=float, default=0.5, help="首 token 延迟（秒）")
+    parser.add_argument("--token-latency", type=float, default=0.01, help="每 token 延迟（秒）")
+    parser.add_argument("--chapters", type=int, default=6, help="每篇章节数")
+    parser.add_argument("--words", type=int, default=800, help="每章目标字数")
+    parser.add_argument("--writer-mode", choices=["serial", "parallel"], help="覆盖 PAPER_WRITER_MODE")
+    parser.add_argument("--no-latex", action="store_true", help="不调用 xelatex（没有 TeX 环境时）")
+    parser.add_argument("--json", action="store_true", help="输出 JSON 报告")
+    args = parser.parse_args(argv)
+
+    with StubLLMServer(args.ttft, args.token_latency, args.chapters, args.words) as stub:
+        report = run_benchmark(
+            stub, args.papers, args.concurrency, use_latex=not args.no_latex, writer_mode=args.writer_mode,
+        )
+    print(json.dumps(report, ensure_ascii=False, indent=2) if args.json else format_report(report))
+    return 0 if report["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+"""
+断点续写 — save_checkpoint + load_checkpoint
+每个阶段 / 每章完成后把 PaperSession 的中间产物（文献、综述、规划、正文、VFS）
+gzip JSON 写入对象存储（S3 或本地文件系统后端，取决于 STORAGE_BACKEND），
+worker 重启或生成失败后可从最近的检查点继续，已花费的 LLM 调用不再重复。
+"""
+
+import gzip
+import json
+from datetime import datetime
+
+from .session import PaperSession, PaperStatus
+from .vfs import VirtualFileSystem
+
+CHECKPOINT_VERSION = 1
+
+# 已完成的阶段，按先后顺序；撰写中的逐章检查点仍记为 planned（正文部分完成）
+STAGES = ("researched", "planned", "formatted")
+
+
+def checkpoint_key(paper_id: str) -> str:
+    """检查点只依赖 paper_id，恢复时不需要知道 user_id"""
+    return f"papers/checkpoints/{paper_id}.json.gz"
+
+
+def save_checkpoint(session: PaperSession, storage, stage: str) -> bool:
+    """保存检查点，失败只打印日志，不影响生成流程"""
+    if stage not in STAGES:
+        raise ValueError(f"未知检查点阶段: {stage}")
+
+    payload = {
+        "version": CHECKPOINT_VERSION,
+        "stage": stage,
+        "saved_at": datetime.utcnow().isoformat(),
+        "id": session.id,
+        "user_id": session.user_id,
+        "topic": session.topic,
+        "created_at": session.created_at.isoformat(),
+        "literature": session.literature,
+        "literature_summary": session.literature_summary,
+        "file_plan": session.file_plan,
+        "content": session.content,
+        "chapter_status": session.chapter_status,
+        "vfs": session.vfs.get_all(),
+    }
+    try:
+        data = gzip.compress(json.dumps(payload, ensure_ascii=False).encode("utf-8"))
+        result = storage.upload_bytes(data, checkpoint_key(session.id), "application/gzip")
+    except Exception as e:
+        print(f"[Checkpoint] 保存失败 {session.id} ({stage}): {e}")
+        return False
+    if not result:
+        return False
+    session.checkpoint_stage = stage
+    return True
+
+
+def load_checkpoint(paper_id: str, storage) -> PaperSession | None:
+    """读取检查点并重建 PaperSession；不存在或已损坏时返回 None"""
+    try:
+        data = storage.download_bytes(checkpoint_key(paper_id))
+        if not data:
+            return None
+        payload = json.loads(gzip.decompress(data).decode("utf-8"))
+    except Exception as e:
+        print(f"[Checkpoint] 读取失败 {paper_id}: {e}")
+        return None
+
+    if payload.get("version") != CHECKPOINT_VERSION or payload.get("stage") not in STAGES:
+        print(f"[Checkpoint] 忽略不兼容的检查点 {paper_id}")
+        return None
+
+    vfs = VirtualFileSystem()
+    for path, content in payload.get("vfs", {}).items():
+        vfs.write(path, content)
+
+    return PaperSession(
+        id=payload["id"],
+        user_id=payload["user_id"],
+        topic=payload["topic"],
+        status=PaperStatus.PENDING,
+        vfs=vfs,
+        created_at=datetime.fromisoformat(payload["created_at"]),
+        literature=payload.get("literature", []),
+        literature_summary=payload.get("literature_summary", ""),
+        file_plan=payload.get("file_plan", {}),
+        content=payload.get("content", {}),
+        chapter_status=payload.get("chapter_status", {}),
+        checkpoint_stage=payload["stage"],
+    )
+
+
+def has_checkpoint(paper_id: str, storage) -> bool:
+    try:
+        return storage.head_object(checkpoint_key(paper_id)) is not None
+    except Exception:
+        return False
+
+
+def delete_checkpoint(paper_id: str, storage) -> None:
+    """论文生成完成后清理检查点"""
+    try:
+        storage.delete_object(checkpoint_key(paper_id))
+    except Exception as e:
+        print(f"[Checkpoint] 删除失败 {paper_id}: {e}")
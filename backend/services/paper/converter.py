@@ -0,0 +1,222 @@
+"""
+纯文本 → LaTeX 本地转换器
+WriterAgent 产出的是纯文本，转换大部分是机械工作：转义特殊字符、[refN] → \\cite{refN}、
+识别子节标题、按段落组织。这里用确定性规则在本地完成，
+只把数学密集段落、列表/表格等难以机械转换的段落交给 LLM；
+整章结构无法确定时（如规划了子节却找不到标题）标记为 ambiguous，整章交给 LLM。
+"""
+
+import re
+from dataclasses import dataclass, field
+
+# 交给 LLM 的段落在本地结果里用占位符占位，LLM 转换完再填回
+PLACEHOLDER = "%%LLM_PARAGRAPH_{}%%"
+
+LATEX_SPECIALS = {
+    "\\": r"\textbackslash{}",
+    "&": r"\&",
+    "%": r"\%",
+    "$": r"\$",
+    "#": r"\#",
+    "_": r"\_",
+    "{": r"\{",
+    "}": r"\}",
+    "~": r"\textasciitilde{}",
+    "^": r"\textasciicircum{}",
+}
+_SPECIALS_RE = re.compile(r"[\\&%$#_{}~^]")
+
+# [ref1] / [ref1, ref3] / [ref1][ref2] → \cite{ref1,ref3}
+_CITE_GROUP_RE = re.compile(r"(?:\[\s*ref\d+(?:\s*[,，、;；]\s*ref\d+)*\s*\])+")
+_REF_ID_RE = re.compile(r"ref\d+")
+_BOLD_RE = re.compile(r"\*\*(.+?)\*\*")
+
+_MATH_SYMBOLS = set("∑∫∏√∞≈≠≤≥±×÷∂∇∈∉⊂⊆⊃∪∩∀∃→←↔⇒⇔αβγδεζηθκλμνξπρστφχψωΓΔΘΛΞΠΣΦΨΩ")
+_MATH_PATTERNS = [
+    re.compile(r"\$|\\[(\[]|\\[A-Za-z]+"),             # 已经是 LaTeX 数学 / 命令
+    re.compile(r"[A-Za-z0-9)]\s*[_^]\s*[{(A-Za-z0-9]"),  # x_i, x^2, O(n^2)
+    re.compile(r"(?<![A-Za-z])[A-Za-z]\s*=\s*[-A-Za-z0-9(]"),  # y = ax + b
+]
+
+_TERMINAL_PUNCT = tuple("。！？；!?;:：.」”\"）)")
+_MD_HEADING_RE = re.compile(r"^(#{1,6})\s+(.+?)\s*#*$")
+_BOLD_LINE_RE = re.compile(r"^\*\*(.+?)\*\*[:：]?$")
+_NUMBERED_HEADING_RE = re.compile(
+    r"^(?:(\d+(?:\.\d+)+)\.?|\d+[.、]|[一二三四五六七八九十]+、|[（(][一二三四五六七八九十\d]+[)）]|第[一二三四五六七八九十\d]+节)\s*(.+)$"
+)
+_LIST_ITEM_RE = re.compile(r"^(?:[-*•·]\s+|\d+[)）]\s*|[（(]\d+[)）]\s*|\d+\.\s+)")
+_HEADING_MAX_LEN = 30
+
+
+@dataclass
+class LocalConversion:
+    """本地转换结果"""
+
+    latex: str = ""
+    # 需要交给 LLM 的段落原文，顺序与 latex 中占位符编号一致
+    hard_paragraphs: list[str] = field(default_factory=list)
+    # 结构无法确定，整章都应交给 LLM
+    ambiguous: bool = False
+
+    @property
+    def complete(self) -> bool:
+        """是否完全在本地转换完成（无需任何 LLM 调用）"""
+        return not self.ambiguous and not self.hard_paragraphs
+
+
+def escape_latex(text: str) -> str:
+    """转义 LaTeX 特殊字符"""
+    return _SPECIALS_RE.sub(lambda m: LATEX_SPECIALS[m.group()], text)
+
+
+def convert_inline(text: str) -> str:
+    """
+    转换一段正文的行内内容：引用标记转 \\cite，**加粗** 转 \\textbf，其余文本转义。
+    相邻 / 逗号分隔的多个引用合并成一个 \\cite。
+    """
+    parts = []
+    pos = 0
+    for match in _CITE_GROUP_RE.finditer(text):
+        parts.append(_convert_plain(text[pos:match.start()]))
+        parts.append(f"\\cite{{{','.join(_REF_ID_RE.findall(match.group()))}}}")
+        pos = match.end()
+    parts.append(_convert_plain(text[pos:]))
+    return "".join(parts)
+
+
+def _convert_plain(text: str) -> str:
+    out = []
+    pos = 0
+    for match in _BOLD_RE.finditer(text):
+        out.append(escape_latex(text[pos:match.start()]))
+        out.append(f"\\textbf{{{escape_latex(match.group(1))}}}")
+        pos = match.end()
+    out.append(escape_latex(text[pos:]))
+    return "".join(out)
+
+
+def is_hard_paragraph(paragraph: str) -> bool:
+    """
+    判断段落是否需要交给 LLM：
+    数学内容（符号 / 下标上标 / 等式 / 已有 LaTeX 命令）、列表项、表格、代码块、
+    以及无法识别的引用写法（如 [ref1-ref3]）。
+    """
+    if any(ch in _MATH_SYMBOLS for ch in paragraph):
+        return True
+    if any(p.search(paragraph) for p in _MATH_PATTERNS):
+        return True
+    if "```" in paragraph or paragraph.lstrip().startswith("|"):
+        return True
+    if _LIST_ITEM_RE.match(paragraph.lstrip()):
+        return True
+    remaining = _CITE_GROUP_RE.sub("", paragraph)
+    return "[ref" in remaining
+
+
+def _normalize_title(text: str) -> str:
+    return re.sub(r"[\s:：*#]", "", text).lower()
+
+
+def _parse_heading(line: str, known_titles: set[str]) -> tuple[int, str] | None:
+    """
+    识别子节标题行，返回 (层级, 标题)；层级 1 = subsection，2 = subsubsection。
+    """
+    match = _MD_HEADING_RE.match(line)
+    if match:
+        return (2 if len(match.group(1)) >= 3 else 1), match.group(2).strip("* ")
+
+    match = _BOLD_LINE_RE.match(line)
+    if match:
+        return 1, match.group(1).strip()
+
+    if _normalize_title(line) in known_titles:
+        return 1, line.strip("*# ").rstrip(":：")
+
+    if len(line) > _HEADING_MAX_LEN or line.endswith(_TERMINAL_PUNCT):
+        return None
+    match = _NUMBERED_HEADING_RE.match(line)
+    if match:
+        dotted = match.group(1)
+        level = 2 if dotted and dotted.count(".") >= 2 else 1
+        return level, match.group(2).strip()
+    return None
+
+
+def _split_blocks(content: str, chapter_title: str, known_titles: set[str]) -> list[tuple[str, object]]:
+    """
+    把正文切成 ("heading", (level, title)) / ("paragraph", text) 块。
+    空行分段；非空行若上一行以句末标点结尾也视为新段落（LLM 常用一行一段），
+    否则视为同一段落的折行。列表项每项单独成块。
+    """
+    chapter_key = _normalize_title(chapter_title)
+    blocks: list[tuple[str, object]] = []
+    current: list[str] = []
+
+    def flush() -> None:
+        if current:
+            blocks.append(("paragraph", "".join(current) if _is_cjk_join(current) else " ".join(current)))
+            current.clear()
+
+    for raw in content.replace("\r\n", "\n").split("\n"):
+        line = raw.strip()
+        if not line:
+            flush()
+            continue
+        # 正文开头重复了章节标题：已由 \section 输出，跳过
+        if not blocks and not current and _normalize_title(line) == chapter_key:
+            continue
+        heading = _parse_heading(line, known_titles)
+        if heading:
+            flush()
+            if not blocks and _normalize_title(heading[1]) == chapter_key:
+                continue
+            blocks.append(("heading", heading))
+            continue
+        if current and (current[-1].endswith(_TERMINAL_PUNCT) or _LIST_ITEM_RE.match(line)):
+            flush()
+        current.append(line)
+    flush()
+    return blocks
+
+
+def _is_cjk_join(lines: list[str]) -> bool:
+    """中文折行直接拼接，英文折行用空格拼接"""
+    return any("一" <= ch <= "鿿" for ch in lines[0][-1:])
+
+
+def convert_plaintext(title: str, content: str, sections: list | None = None) -> LocalConversion:
+    """
+    本地转换一章纯文本。返回的 latex 以 \\section{title} 开头，
+    难段落处为 PLACEHOLDER 占位符，对应原文在 hard_paragraphs 里。
+    """
+    sections = [s for s in (sections or []) if s]
+    known_titles = {_normalize_title(s) for s in sections}
+    blocks = _split_blocks(content or "", title, known_titles)
+
+    result = LocalConversion()
+    # 规划了多个子节，正文里却一个标题都识别不出：不知道子节从哪里开始，交给 LLM
+    if len(sections) > 1 and blocks and not any(kind == "heading" for kind, _ in blocks):
+        result.ambiguous = True
+        return result
+
+    out = [f"\\section{{{convert_inline(title)}}}"]
+    for kind, value in blocks:
+        if kind == "heading":
+            level, heading = value
+            command = "subsubsection" if level == 2 else "subsection"
+            out.append(f"\\{command}{{{convert_inline(heading)}}}")
+        elif is_hard_paragraph(value):
+            out.append(PLACEHOLDER.format(len(result.hard_paragraphs)))
+            result.hard_paragraphs.append(value)
+        else:
+            out.append(convert_inline(value))
+
+    result.latex = "\n\n".join(out) + "\n"
+    return result
+
+
+def fill_placeholders(latex: str, converted: list[str]) -> str:
+    """把 LLM 转换好的难段落按编号填回占位符"""
+    for i, paragraph in enumerate(converted):
+        latex = latex.replace(PLACEHOLDER.format(i), paragraph.strip(), 1)
+    return latex
@@ -0,0 +1,253 @@
+"""
+VFS 局部编辑工具 — repair / revise 工具循环共用
+write_file 要求 LLM 把整个文件重新输出一遍，改一个词也要几千个输出 token。
+这里提供 read_range（按行号读取片段）和 edit_file（search/replace 或 unified diff），
+补丁先在内存里全部校验、应用成功后才写回 VFS，任何一处不匹配则整个调用不生效。
+"""
+
+import re
+
+# 单次 read_range 最多返回的行数
+MAX_RANGE_LINES = 200
+
+_HUNK_RE = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+
+class EditError(ValueError):
+    """补丁无法应用（search 文本找不到 / 不唯一、diff 上下文不匹配等）"""
+
+
+def read_range(content: str, start: int, end: int | None = None) -> str:
+    """返回第 start-end 行（从 1 开始，含 end），每行前带 "行号| " 前缀"""
+    lines = content.split("\n")
+    start = max(1, start)
+    end = min(len(lines), end or start + MAX_RANGE_LINES - 1, start + MAX_RANGE_LINES - 1)
+    if start > len(lines):
+        raise EditError(f"起始行 {start} 超出文件范围（共 {len(lines)} 行）")
+    body = "\n".join(f"{n}| {lines[n - 1]}" for n in range(start, end + 1))
+    return f"（第 {start}-{end} 行，共 {len(lines)} 行）\n{body}"
+
+
+def apply_replacements(content: str, edits: list[dict]) -> str:
+    """
+    按顺序应用 search/replace：每个 search 必须在（前面的替换完成后的）内容中恰好出现一次。
+    """
+    if not edits:
+        raise EditError("edits 为空")
+    for i, edit in enumerate(edits, 1):
+        search = edit.get("search") or ""
+        replace = edit.get("replace") or ""
+        if not search:
+            raise EditError(f"第 {i} 处修改的 search 为空")
+        count = content.count(search)
+        if count == 0:
+            raise EditError(f"第 {i} 处修改的 search 文本在文件中不存在（注意不要带 read_range 的行号前缀）")
+        if count > 1:
+            raise EditError(f"第 {i} 处修改的 search 文本出现了 {count} 次，请包含更多上下文使其唯一")
+        content = content.replace(search, replace, 1)
+    return content
+
+
+def _parse_hunks(diff: str) -> list[tuple[int, list[str], list[str]]]:
+    """解析 unified diff，返回 [(原起始行, 原行列表, 新行列表)]"""
+    hunks: list[tuple[int, list[str], list[str]]] = []
+    current = None
+    for line in diff.replace("\r\n", "\n").split("\n"):
+        match = _HUNK_RE.match(line)
+        if match:
+            current = (int(match.group(1)), [], [])
+            hunks.append(current)
+            continue
+        if current is None or line.startswith(("--- ", "+++ ", "\\")):
+            continue
+        tag, text = (line[0], line[1:]) if line else (" ", "")
+        if tag == " ":
+            current[1].append(text)
+            current[2].append(text)
+        elif tag == "-":
+            current[1].append(text)
+        elif tag == "+":
+            current[2].append(text)
+        else:
+            raise EditError(f"无法解析的 diff 行: {line[:40]}")
+    # diff 末尾的空行会被当成一行空上下文，去掉
+    for _, old, new in hunks:
+        while old and new and old[-1] == "" and new[-1] == "":
+            old.pop()
+            new.pop()
+    if not hunks:
+        raise EditError("diff 中没有 @@ hunk")
+    return hunks
+
+
+def _find_block(lines: list[str], block: list[str], expected: int, lower: int) -> int:
+    """在 lines[lower:] 中找 block，优先 expected 位置，否则取离 expected 最近的匹配；找不到返回 -1"""
+    if lines[expected:expected + len(block)] == block and expected >= lower:
+        return expected
+    candidates = [
+        i for i in range(lower, len(lines) - len(block) + 1)
+        if lines[i:i + len(block)] == block
+    ]
+    return min(candidates, key=lambda i: abs(i - expected)) if candidates else -1
+
+
+def apply_unified_diff(content: str, diff: str) -> str:
+    """应用 unified diff；hunk 行号有偏差时按上下文就近匹配，上下文对不上则报错"""
+    lines = content.split("\n")
+    offset, lower = 0, 0
+    for i, (start, old, new) in enumerate(_parse_hunks(diff), 1):
+        expected = max(0, start - 1 + offset)
+        if old:
+            pos = _find_block(lines, old, expected, lower)
+            if pos < 0:
+                raise EditError(f"第 {i} 个 hunk（原第 {start} 行）的上下文与文件内容不匹配")
+        else:
+            # 纯插入：@@ -N,0 表示插在第 N 行之后
+            pos = min(len(lines), start + offset)
+        lines[pos:pos + len(old)] = new
+        offset += len(new) - len(old)
+        lower = pos + len(new)
+    return "\n".join(lines)
+
+
+EDIT_TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "list_files",
+            "description": "列出 VFS 中所有文件路径",
+            "parameters": {"type": "object", "properties": {}, "required": []},
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "read_range",
+            "description": f"读取文件的指定行（每行带 \"行号| \" 前缀，单次最多 {MAX_RANGE_LINES} 行），优先于 read_file",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "path": {"type": "string", "description": "文件路径，如 chapters/01_intro.tex"},
+                    "start": {"type": "integer", "description": "起始行号（从 1 开始）"},
+                    "end": {"type": "integer", "description": "结束行号（含）"},
+                },
+                "required": ["path", "start"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "read_file",
+            "description": "读取 VFS 中指定文件的完整内容",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "path": {
+                        "type": "string",
+                        "description": "文件路径，如 main.tex 或 chapters/01_intro.tex",
+                    }
+                },
+                "required": ["path"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "edit_file",
+            "description": (
+                "局部修改文件（推荐）：edits 为 search/replace 列表，search 须与原文完全一致且唯一；"
+                "或用 diff 传 unified diff。所有修改校验通过才一起生效，否则文件不变"
+            ),
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "path": {"type": "string", "description": "文件路径"},
+                    "edits": {
+                        "type": "array",
+                        "description": "按顺序应用的替换",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "search": {"type": "string", "description": "要替换的原文（不带行号前缀）"},
+                                "replace": {"type": "string", "description": "替换后的文本"},
+                            },
+                            "required": ["search", "replace"],
+                        },
+                    },
+                    "diff": {"type": "string", "description": "unified diff（与 edits 二选一）"},
+                },
+                "required": ["path"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "write_file",
+            "description": "将完整内容写入 VFS 中的指定文件（覆盖）；只在需要重写整个文件时使用",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "path": {
+                        "type": "string",
+                        "description": "文件路径",
+                    },
+                    "content": {
+                        "type": "string",
+                        "description": "完整文件内容",
+                    },
+                },
+                "required": ["path", "content"],
+            },
+        },
+    },
+]
+
+
+def make_tool_handler(vfs, modified_files: list[str]):
+    """EDIT_TOOLS 的 tool_handler；写入过的文件路径追加到 modified_files"""
+
+    def tool_handler(name: str, arguments: dict) -> str:
+        if name == "list_files":
+            files = vfs.list_files()
+            return "\n".join(files) if files else "(空)"
+
+        path = arguments.get("path", "")
+        content = vfs.read(path)
+
+        if name in ("read_file", "read_range", "edit_file") and content is None:
+            return f"错误: 文件 {path} 不存在"
+
+        if name == "read_file":
+            return content
+
+        if name == "read_range":
+            try:
+                end = arguments.get("end")
+                return read_range(content, int(arguments.get("start", 1)), int(end) if end else None)
+            except (EditError, TypeError, ValueError) as e:
+                return f"错误: {e}"
+
+        if name == "edit_file":
+            try:
+                if arguments.get("diff"):
+                    updated = apply_unified_diff(content, arguments["diff"])
+                else:
+                    updated = apply_replacements(content, arguments.get("edits") or [])
+            except EditError as e:
+                return f"错误: {e}（文件未修改）"
+            vfs.write(path, updated)
+            modified_files.append(path)
+            return f"已修改 {path}（{len(content)} → {len(updated)} 字符）"
+
+        if name == "write_file":
+            new_content = arguments.get("content", "")
+            vfs.write(path, new_content)
+            modified_files.append(path)
+            return f"已写入 {path}（{len(new_content)} 字符）"
+
+        return f"未知工具: {name}"
+
+    return tool_handler
@@ -13,6 +13,7 @@ Response: {"success": true, "pdf_base64": "...", "log": "..."}
 
 import base64
 import json
+import os
 import re
 import shutil
 import subprocess
@@ -32,7 +33,8 @@ def extract_errors(log: str) -> str:
     while i < len(lines):
         line = lines[i]
 
-        if line.startswith("!"):
+        # "! ..." 或 -file-line-error 格式的 "./file.tex:42: ..."
+        if line.startswith("!") or re.match(r"^\./.*\.tex:\d+:", line):
             block = [line]
             for j in range(1, 6):
                 if i + j < len(lines):
@@ -67,6 +69,10 @@ def extract_errors(log: str) -> str:
     return "\n\n".join(extracted)
 
 
+# max_print_line 调大避免日志按 79 列折行截断文件路径（错误定位依赖完整路径）
+_TEX_ENV = {**os.environ, "max_print_line": "10000"}
+
+
 def compile_latex(files: dict, entry: str = "main.tex") -> dict:
     """编译 LaTeX 文件，返回结果 dict"""
     tmp_dir = tempfile.mkdtemp(prefix="fc_latex_")
@@ -84,8 +90,8 @@ def compile_latex(files: dict, entry: str = "main.tex") -> dict:
     # 编译顺序: xelatex → bibtex → xelatex → xelatex
     # 1) 第一遍 xelatex — 生成 .aux
     result = subprocess.run(
-        ["xelatex", "-interaction=nonstopmode", "-halt-on-error", entry],
-        cwd=tmp_dir, capture_output=True, text=True, timeout=120,
+        ["xelatex", "-interaction=nonstopmode", "-halt-on-error", "-file-line-error", entry],
+        cwd=tmp_dir, capture_output=True, text=True, timeout=120, env=_TEX_ENV,
     )
     log_output += f"\n=== xelatex pass 1 ===\n{result.stdout}"
     if result.stderr:
@@ -102,7 +108,7 @@ def compile_latex(files: dict, entry: str = "main.tex") -> dict:
     # 2) bibtex — 处理参考文献
     result = subprocess.run(
         ["bibtex", aux_name],
-        cwd=tmp_dir, capture_output=True, text=True, timeout=60,
+        cwd=tmp_dir, capture_output=True, text=True, timeout=60, env=_TEX_ENV,
     )
     log_output += f"\n=== bibtex ===\n{result.stdout}"
     if result.stderr:
@@ -119,8 +125,8 @@ def compile_latex(files: dict, entry: str = "main.tex") -> dict:
     # 3) 第二遍 + 第三遍 xelatex — 解析引用和交叉引用
     for pass_num in (2, 3):
         result = subprocess.run(
-            ["xelatex", "-interaction=nonstopmode", "-halt-on-error", entry],
-            cwd=tmp_dir, capture_output=True, text=True, timeout=120,
+            ["xelatex", "-interaction=nonstopmode", "-halt-on-error", "-file-line-error", entry],
+            cwd=tmp_dir, capture_output=True, text=True, timeout=120, env=_TEX_ENV,
         )
         log_output += f"\n=== xelatex pass {pass_num} ===\n{result.stdout}"
         if result.stderr:
@@ -0,0 +1,409 @@
+"""
+JobRunner — 论文后台任务执行器
+pipeline 在独立线程池里运行，不再依附于 SSE 响应 generator：
+客户端断开不会让生成停下，也不会长时间占住 web 协程。
+每个事件按 seq 写入 paper_job_events，SSE 端点可以随时 attach（先回放历史事件，
+再跟随实时事件）、随时 detach；其他 worker 进程的任务通过轮询事件表跟随。
+cancel() 主动取消任务：任务线程里的 LLM 工具调用循环通过 current_cancel() 拿到取消信号，
+在下一个数据块 / 下一轮之前停下，pipeline generator 在下一个事件处被关闭。
+"""
+
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Iterator
+
+TERMINAL_STATUSES = ("completed", "failed", "interrupted", "cancelled")
+# cancelling：其他进程请求取消，等所属进程的心跳线程转交给任务线程
+ACTIVE_STATUSES = ("queued", "running", "cancelling")
+
+# 当前任务线程的取消信号（pipeline generator 在任务线程里被消费，Agent 调用 LLM 时读取）
+_current_cancel: ContextVar[threading.Event | None] = ContextVar("paper_job_cancel", default=None)
+
+
+def current_cancel() -> threading.Event | None:
+    """当前线程所执行任务的取消信号；不在后台任务里时返回 None"""
+    return _current_cancel.get()
+
+
+class JobConflictError(RuntimeError):
+    """同一篇论文（或同一用户的同一生成请求）已有排队中 / 运行中的任务"""
+
+    def __init__(self, job_id: str | None):
+        super().__init__(f"论文已有进行中的任务 {job_id}")
+        self.job_id = job_id
+
+
+@dataclass
+class _LiveJob:
+    """本进程内运行中的任务：事件副本 + 条件变量，供本地 attach 实时唤醒"""
+
+    events: list = field(default_factory=list)
+    done: bool = False
+    cond: threading.Condition = field(default_factory=threading.Condition)
+    cancel: threading.Event = field(default_factory=threading.Event)
+
+
+class JobRunner:
+    """论文后台任务执行器（线程池 + 持久化任务表 / 事件日志）"""
+
+    def __init__(
+        self,
+        app,
+        max_workers: int = 2,
+        heartbeat_interval: float = 15.0,
+        stale_after: float = 60.0,
+        poll_interval: float = 0.5,
+        retention: float = 7 * 86400,
+        prune_interval: float = 3600.0,
+    ):
+        self.app = app
+        self.heartbeat_interval = heartbeat_interval
+        self.stale_after = stale_after
+        self.poll_interval = poll_interval
+        # 结束超过 retention 秒的任务及其事件日志由心跳线程定期清理
+        self.retention = retention
+        self.prune_interval = prune_interval
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="paper-job")
+        self._live: dict[str, _LiveJob] = {}
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._heartbeat = threading.Thread(target=self._heartbeat_loop, daemon=True)
+        self._heartbeat.start()
+
+    # ---- 提交 ----
+
+    def submit(
+        self,
+        kind: str,
+        events: Iterator[dict],
+        user_id: str | None = None,
+        paper_id: str | None = None,
+        dedupe_key: str | None = None,
+    ) -> str:
+        """
+        提交任务并立即返回 job_id。events 是 PaperService.generate/resume/revise 返回的
+        事件 generator，在后台线程里消费。
+        同一 paper_id（没有 paper_id 时为同一 kind + dedupe_key）已有排队中 / 运行中（且心跳未过期）
+        的任务时抛出 JobConflictError，不再提交。去重由 paper_jobs.active_key 的唯一约束保证，
+        多个 worker 进程同时提交也只有一个能写入。
+        """
+        from sqlalchemy.exc import IntegrityError
+        from models import db, PaperJob
+
+        job_id = uuid.uuid4().hex
+        active_key = f"paper:{paper_id}" if paper_id else (f"{kind}:{dedupe_key}" if dedupe_key else None)
+        with self._lock:
+            if active_key:
+                active = self._active_job(active_key)
+                if active:
+                    raise JobConflictError(active)
+            db.session.add(PaperJob(
+                id=job_id, kind=kind, user_id=user_id, paper_id=paper_id, status="queued", active_key=active_key,
+            ))
+            try:
+                db.session.commit()
+            except IntegrityError:
+                # 其他进程抢先提交了同一篇论文的任务
+                db.session.rollback()
+                holder = PaperJob.query.with_entities(PaperJob.id).filter_by(active_key=active_key).first()
+                raise JobConflictError(holder[0] if holder else None)
+            self._live[job_id] = _LiveJob()
+        self._pool.submit(self._execute, job_id, events)
+        print(f"[Jobs] 已提交 {kind} 任务 {job_id}")
+        return job_id
+
+    def _execute(self, job_id: str, events: Iterator[dict]) -> None:
+        from models import db, PaperJob
+
+        live = self._live[job_id]
+        token = _current_cancel.set(live.cancel)
+        # 以最后一个 completed / error 事件决定结果（其后可能还有 timings 等收尾事件）
+        status, error, final_type = "failed", None, None
+        with self.app.app_context():
+            job = PaperJob.query.get(job_id)
+            if job.status == "cancelling":
+                live.cancel.set()
+            job.status = "running"
+            job.heartbeat_at = datetime.utcnow()
+            db.session.commit()
+
+            seq = 0
+            try:
+                for event in events:
+                    seq += 1
+                    if event.get("type") in ("completed", "error"):
+                        final_type = event["type"]
+                    self._record(job_id, seq, event)
+                    with live.cond:
+                        live.events.append({**event, "seq": seq})
+                        live.cond.notify_all()
+                    if live.cancel.is_set():
+                        break
+                if live.cancel.is_set() and final_type != "completed":
+                    # 关闭 generator：pipeline 在当前 yield 处收到 GeneratorExit
+                    events.close()
+                    status, error = "cancelled", "任务已取消"
+                    seq += 1
+                    event = {"type": "error", "message": error}
+                    self._record(job_id, seq, event)
+                    with live.cond:
+                        live.events.append({**event, "seq": seq})
+                else:
+                    status = "completed" if final_type == "completed" else "failed"
+            except Exception as e:
+                error = f"任务异常: {e}"
+                seq += 1
+                event = {"type": "error", "message": error}
+                try:
+                    db.session.rollback()
+                    self._record(job_id, seq, event)
+                except Exception as record_error:
+                    print(f"[Jobs] 记录异常事件失败 {job_id}: {record_error}")
+                with live.cond:
+                    live.events.append({**event, "seq": seq})
+                print(f"[Jobs] 任务 {job_id} 异常: {e}")
+            finally:
+                try:
+                    job = PaperJob.query.get(job_id)
+                    job.status = status
+                    job.active_key = None
+                    job.error = error or job.error
+                    job.finished_at = datetime.utcnow()
+                    db.session.commit()
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"[Jobs] 更新任务状态失败 {job_id}: {e}")
+                db.session.remove()
+                _current_cancel.reset(token)
+
+        with live.cond:
+            live.done = True
+            live.cond.notify_all()
+        with self._lock:
+            self._live.pop(job_id, None)
+            self._idle.notify_all()
+        print(f"[Jobs] 任务 {job_id} 结束: {status}")
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        取消排队中 / 运行中的任务，返回是否发出了取消请求（任务不存在或已结束时为 False）。
+        本进程的任务直接置位取消信号；其他进程的任务标记为 cancelling，由所属进程的心跳线程转交。
+        """
+        from models import db, PaperJob
+
+        with self._lock:
+            live = self._live.get(job_id)
+        if live is not None:
+            live.cancel.set()
+            print(f"[Jobs] 已请求取消任务 {job_id}")
+            return True
+
+        job = PaperJob.query.get(job_id)
+        if job is None or job.status not in ACTIVE_STATUSES or self._is_stale(job):
+            return False
+        job.status = "cancelling"
+        db.session.commit()
+        print(f"[Jobs] 已请求取消任务 {job_id}（由所属进程执行）")
+        return True
+
+    def _active_job(self, active_key: str) -> str | None:
+        """占用 active_key 的排队中 / 运行中任务 id；心跳已过期的顺带标记为 interrupted 并释放（调用方持有 _lock）"""
+        from models import PaperJob
+
+        job = PaperJob.query.filter_by(active_key=active_key).first()
+        if job is None:
+            return None
+        if job.id in self._live or not self._is_stale(job):
+            return job.id
+        self._mark_interrupted(job)
+        return None
+
+    def _is_stale(self, job) -> bool:
+        """排队中 / 运行中的任务超过 stale_after 没有心跳：所属进程已经不在（重启 / 崩溃）"""
+        last_seen = job.heartbeat_at or job.created_at
+        return datetime.utcnow() - last_seen > timedelta(seconds=self.stale_after)
+
+    @staticmethod
+    def _mark_interrupted(job) -> None:
+        from models import db
+
+        job.status = "interrupted"
+        job.active_key = None
+        job.error = "任务已中断（服务重启），可继续生成"
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+
+    def _record(self, job_id: str, seq: int, event: dict) -> None:
+        """事件写入日志表，同时推进 last_seq / paper_id / 心跳"""
+        from models import db, PaperJob, PaperJobEvent
+
+        db.session.add(PaperJobEvent(
+            job_id=job_id,
+            seq=seq,
+            type=event.get("type", "progress"),
+            data=json.dumps(event, ensure_ascii=False),
+        ))
+        job = PaperJob.query.get(job_id)
+        job.last_seq = seq
+        job.heartbeat_at = datetime.utcnow()
+        if event.get("type") == "session_created" and event.get("session_id"):
+            job.paper_id = event["session_id"]
+        if event.get("type") == "error":
+            job.error = event.get("message")
+        db.session.commit()
+
+    # ---- 查询 / attach ----
+
+    def get(self, job_id: str) -> dict | None:
+        from models import PaperJob
+
+        job = PaperJob.query.get(job_id)
+        return job.to_dict() if job else None
+
+    def attach(self, job_id: str, after: int = 0, keepalive: float = 15.0) -> Iterator[dict | None]:
+        """
+        跟随任务事件流：先回放 seq > after 的历史事件，再实时推送，任务结束后返回。
+        每个事件带 seq（用于 SSE id / Last-Event-ID 续传）；空闲超过 keepalive 秒时
+        yield None，调用方据此发送 SSE 注释保活。调用方随时停止迭代即 detach，不影响任务。
+        """
+        with self._lock:
+            live = self._live.get(job_id)
+        if live is not None:
+            yield from self._attach_live(live, after, keepalive)
+        else:
+            yield from self._attach_polling(job_id, after, keepalive)
+
+    def _attach_live(self, live: _LiveJob, after: int, keepalive: float) -> Iterator[dict | None]:
+        while True:
+            with live.cond:
+                pending = [e for e in live.events if e["seq"] > after]
+                if not pending and not live.done:
+                    live.cond.wait(timeout=keepalive)
+                    pending = [e for e in live.events if e["seq"] > after]
+                done = live.done
+            if not pending and not done:
+                yield None
+            for event in pending:
+                after = event["seq"]
+                yield dict(event)  # 副本：多个 attach 共享 live.events，调用方可能修改事件
+            if done and not [e for e in live.events if e["seq"] > after]:
+                return
+
+    def _attach_polling(self, job_id: str, after: int, keepalive: float) -> Iterator[dict | None]:
+        """任务在其他进程（或已结束）：轮询事件表"""
+        from models import db, PaperJob, PaperJobEvent
+
+        idle_since = time.monotonic()
+        while True:
+            rows = (
+                PaperJobEvent.query.filter(PaperJobEvent.job_id == job_id, PaperJobEvent.seq > after)
+                .order_by(PaperJobEvent.seq)
+                .all()
+            )
+            for row in rows:
+                after = row.seq
+                yield {**json.loads(row.data), "seq": row.seq}
+            if rows:
+                idle_since = time.monotonic()
+
+            job = PaperJob.query.get(job_id)
+            db.session.commit()  # 结束只读事务，下一轮能看到其他进程的新写入
+            if job is None or job.status in TERMINAL_STATUSES:
+                if job is None or not rows:
+                    return
+                continue
+            if job.status in ACTIVE_STATUSES and self._is_stale(job):
+                # 所属进程已经不在（重启 / 崩溃），任务不会再有新事件
+                self._mark_interrupted(job)
+                yield {"type": "error", "message": job.error, "session_id": job.paper_id, "seq": after + 1}
+                return
+
+            if time.monotonic() - idle_since >= keepalive:
+                idle_since = time.monotonic()
+                yield None
+            time.sleep(self.poll_interval)
+
+    # ---- 心跳 / 工具 ----
+
+    def _heartbeat_loop(self) -> None:
+        """
+        定期为本进程排队中 / 运行中的任务刷新心跳（线程池排队或长时间没有事件的任务不会被判定为中断），
+        并每 prune_interval 秒清理一次过期任务。
+        """
+        from models import db, PaperJob
+
+        last_prune = time.monotonic()
+        while True:
+            time.sleep(self.heartbeat_interval)
+            if time.monotonic() - last_prune >= self.prune_interval:
+                last_prune = time.monotonic()
+                try:
+                    with self.app.app_context():
+                        self.prune()
+                        db.session.remove()
+                except Exception as e:
+                    print(f"[Jobs] 清理过期任务失败: {e}")
+            with self._lock:
+                job_ids = list(self._live)
+            if not job_ids:
+                continue
+            try:
+                with self.app.app_context():
+                    PaperJob.query.filter(PaperJob.id.in_(job_ids), PaperJob.status.in_(ACTIVE_STATUSES)).update(
+                        {"heartbeat_at": datetime.utcnow()}, synchronize_session=False,
+                    )
+                    cancelled = PaperJob.query.with_entities(PaperJob.id).filter(
+                        PaperJob.id.in_(job_ids), PaperJob.status == "cancelling",
+                    ).all()
+                    db.session.commit()
+                    db.session.remove()
+                with self._lock:
+                    for (job_id,) in cancelled:
+                        if job_id in self._live:
+                            self._live[job_id].cancel.set()
+            except Exception as e:
+                print(f"[Jobs] 心跳更新失败: {e}")
+
+    def prune(self, batch: int = 500) -> int:
+        """
+        删除结束超过 retention 秒的任务及其事件日志；
+        心跳停在 retention 之前、从未被标记结束的任务（进程崩溃且无人 attach）一并删除。
+        """
+        from models import db, PaperJob, PaperJobEvent
+
+        cutoff = datetime.utcnow() - timedelta(seconds=self.retention)
+        removed = 0
+        while True:
+            rows = PaperJob.query.with_entities(PaperJob.id).filter(
+                db.or_(
+                    db.and_(PaperJob.status.in_(TERMINAL_STATUSES), PaperJob.finished_at < cutoff),
+                    db.and_(PaperJob.status.in_(ACTIVE_STATUSES), PaperJob.heartbeat_at < cutoff),
+                )
+            ).limit(batch).all()
+            job_ids = [row[0] for row in rows]
+            if not job_ids:
+                break
+            PaperJobEvent.query.filter(PaperJobEvent.job_id.in_(job_ids)).delete(synchronize_session=False)
+            PaperJob.query.filter(PaperJob.id.in_(job_ids)).delete(synchronize_session=False)
+            db.session.commit()
+            removed += len(job_ids)
+        if removed:
+            print(f"[Jobs] 已清理 {removed} 个过期任务")
+        return removed
+
+    def join(self, timeout: float | None = None) -> bool:
+        """等待本进程所有任务结束（测试 / 优雅退出用）"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._idle:
+            while self._live:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._idle.wait(timeout=remaining)
+        return True
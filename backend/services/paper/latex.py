@@ -3,15 +3,22 @@ LaTeX 编译器 — 可插拔架构，开发用 LocalCompiler，生产用 Remote
 始终使用 xelatex 以支持中文字符。
 """
 
+import fcntl
+import hashlib
+import json
 import os
 import re
+import shutil
 import subprocess
 import tempfile
+import time
 from dataclasses import dataclass, field
 from pathlib import Path
 
 import requests
 
+from .tracing import span
+
 
 def extract_errors(log: str) -> str:
     """
@@ -35,8 +42,8 @@ def extract_errors(log: str) -> str:
     while i < len(lines):
         line = lines[i]
 
-        # xelatex 错误: "! " 开头
-        if line.startswith("!"):
+        # xelatex 错误: "! " 开头，或 -file-line-error 格式的 "./file.tex:42: ..."
+        if line.startswith("!") or re.match(r"^\./.*\.tex:\d+:", line):
             # 收集错误块：错误行 + 后续最多 5 行上下文
             block = [line]
             for j in range(1, 6):
@@ -77,6 +84,137 @@ def extract_errors(log: str) -> str:
     return "\n\n".join(extracted)
 
 
+@dataclass
+class ErrorLocation:
+    """编译错误在 VFS 中的位置；line 为 None 表示只能定位到文件"""
+
+    path: str
+    line: int | None
+    message: str
+
+    def __str__(self) -> str:
+        where = f"{self.path}:{self.line}" if self.line else self.path
+        return f"{where}: {self.message}"
+
+
+# -file-line-error 格式："./chapters/01_intro.tex:42: Undefined control sequence."
+_FILE_LINE_ERROR_RE = re.compile(r"^(?:\./)?([^\s:()]+\.(?:tex|bib|bbl)):(\d+): (.+)$")
+_LINE_MARKER_RE = re.compile(r"^l\.(\d+)")
+# bibtex："I was expecting a `,' or a `}'---line 5 of file refs.bib"
+_BIBTEX_ERROR_RE = re.compile(r"^(.*?)---line (\d+) of file (\S+)")
+# xelatex 打开文件时输出 "(./chapters/01_intro.tex"，文件读完输出 ")"
+_FILE_OPEN_RE = re.compile(r"\(((?:\./|/)[^\s()]+|[^\s()]+\.(?:tex|sty|cls|clo|cfg|def|fd|bbl|aux|out|toc))")
+_MAX_LOCATIONS = 5
+
+
+def locate_errors(log: str, files: dict | None = None) -> list[ErrorLocation]:
+    """
+    把 xelatex / bibtex 日志中的错误映射回 VFS 文件和行号（最多 _MAX_LOCATIONS 个）。
+
+    定位规则：
+    1. -file-line-error 格式的错误行直接给出文件和行号
+    2. "! ..." 格式的错误：用日志里的文件栈（"(文件" 入栈、")" 出栈）确定当前文件，
+       随后的 "l.NNN" 为行号；当前文件不在 VFS 中（如宏包内部报错）时，
+       退回到栈里最内层的 VFS 文件（即 \\input 它的章节 / main.tex），行号未知
+    3. bibtex 的 "---line N of file refs.bib"
+
+    files 为 VFS 文件 dict，用于过滤掉宏包等非 VFS 文件；为 None 时保留全部相对路径。
+    """
+    if not log:
+        return []
+
+    def to_vfs(name: str) -> str | None:
+        path = name[2:] if name.startswith("./") else name
+        if files is None:
+            return None if path.startswith("/") else path
+        for candidate in (path, f"{path}.tex"):
+            if candidate in files:
+                return candidate
+        return None
+
+    locations: list[ErrorLocation] = []
+    seen: set[tuple] = set()
+
+    def add(path: str, line: int | None, message: str) -> None:
+        key = (path, line, message)
+        if key not in seen and len(locations) < _MAX_LOCATIONS:
+            seen.add(key)
+            locations.append(ErrorLocation(path, line, message))
+
+    # 栈元素：(文件名, 是否文件)；普通括号也入栈，保证 ")" 配对正确
+    stack: list[tuple[str, bool]] = []
+    pending: tuple[str, str | None, bool] | None = None  # (错误信息, 所在 VFS 文件, 行号是否属于该文件)
+
+    def current_file() -> tuple[str | None, bool]:
+        files_on_stack = [name for name, is_file in stack if is_file]
+        for depth, name in enumerate(reversed(files_on_stack)):
+            path = to_vfs(name)
+            if path:
+                return path, depth == 0
+        return None, False
+
+    for line in log.splitlines():
+        # 每遍编译的日志之间由编译器插入 "=== xelatex pass N ===" 分隔
+        if line.startswith("=== "):
+            stack.clear()
+            pending = None
+            continue
+
+        match = _FILE_LINE_ERROR_RE.match(line)
+        if match:
+            path = to_vfs(match.group(1))
+            if path:
+                add(path, int(match.group(2)), match.group(3).strip())
+            pending = ("", None, False)  # 跳过随后的 l.NNN 行
+            continue
+
+        if line.startswith("! "):
+            message = line[2:].strip()
+            if pending and pending[1]:
+                add(pending[1], None, pending[0])
+            if any(kw in message for kw in ("Emergency stop", "Fatal error")):
+                pending = None
+                continue
+            path, owns_line = current_file()
+            pending = (message, path, owns_line)
+            continue
+
+        if pending:
+            marker = _LINE_MARKER_RE.match(line)
+            if marker:
+                message, path, owns_line = pending
+                if path:
+                    add(path, int(marker.group(1)) if owns_line else None, message)
+                pending = None
+            # 错误上下文里是源码片段，括号不参与文件栈
+            continue
+
+        match = _BIBTEX_ERROR_RE.match(line)
+        if match:
+            path = to_vfs(match.group(3))
+            if path:
+                add(path, int(match.group(2)), match.group(1).strip() or "bibtex error")
+            continue
+
+        pos = 0
+        while pos < len(line):
+            ch = line[pos]
+            if ch == "(":
+                opened = _FILE_OPEN_RE.match(line, pos)
+                if opened:
+                    stack.append((opened.group(1), True))
+                    pos = opened.end()
+                    continue
+                stack.append(("", False))
+            elif ch == ")" and stack:
+                stack.pop()
+            pos += 1
+
+    if pending and pending[1]:
+        add(pending[1], None, pending[0])
+    return locations
+
+
 @dataclass
 class CompileResult:
     success: bool
@@ -84,96 +222,201 @@ class CompileResult:
     error: str | None = None
     log: str = ""
     errors: str = ""  # 从 log 中提取的精简错误摘要
+    # 错误在 VFS 中的位置（文件 + 行号），修复时只把附近几行交给 LLM
+    locations: list[ErrorLocation] = field(default_factory=list)
+
+
+# 这些辅助文件的内容在两遍 xelatex 之间发生变化，说明交叉引用 / 目录还没稳定，需要再跑一遍
+_AUX_SUFFIXES = (".aux", ".toc", ".lof", ".lot", ".out")
+_RERUN_RE = re.compile(
+    r"Rerun to get|Label\(s\) may have changed|Please rerun LaTeX|Rerun LaTeX|Table widths have changed"
+)
+# 每次编译最多跑几遍 xelatex（latexmk 默认 5）
+MAX_XELATEX_PASSES = 4
+_STATE_FILE = ".paper_build.json"
+_LOCK_FILE = ".paper_build.lock"
+
+
+def _sha256(data: str | bytes) -> str:
+    return hashlib.sha256(data.encode("utf-8") if isinstance(data, str) else data).hexdigest()
+
+
+def _hash_aux(workdir: Path) -> str:
+    digest = hashlib.sha256()
+    for path in sorted(p for p in workdir.rglob("*") if p.suffix in _AUX_SUFFIXES and p.is_file()):
+        digest.update(str(path.relative_to(workdir)).encode("utf-8"))
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+def _hash_file(path: Path) -> str | None:
+    return _sha256(path.read_bytes()) if path.exists() else None
 
 
 class LocalCompiler:
-    """本地 xelatex 编译器（开发环境）"""
+    """
+    本地 xelatex 编译器（开发环境）。
+    xelatex 遍数按需决定（类似 latexmk）：第一遍后 .aux 里没有 \\bibdata 则不跑 bibtex，
+    引用列表和 .bib 内容的 hash 与上次相同且 .bbl 还在则跳过 bibtex；
+    之后只在 .bbl / .aux / .toc 等发生变化或日志出现 rerun 提示时再跑一遍。
+    配置了 build_root 且调用方传入 build_key（论文 id）时，在 build_root/<build_key>
+    下持久保留构建目录，修复轮次 / 修订之间复用 .aux / .bbl，只重写有变化的文件；
+    否则每次用临时目录，编译完删除。
+    """
 
-    def compile(self, files: dict[str, str], entry: str = "main.tex") -> CompileResult:
-        import shutil
+    def __init__(self, build_root: str | None = None, build_ttl: float = 86400):
+        self.build_root = Path(build_root) if build_root else None
+        # 超过该秒数未使用的构建目录在下次编译时清理
+        self.build_ttl = build_ttl
+
+    @staticmethod
+    def _run(args: list[str], cwd: str, timeout: int, **span_attrs) -> subprocess.CompletedProcess:
+        """
+        执行一遍 xelatex / bibtex，每遍记一个 span。
+        max_print_line 调大避免日志按 79 列折行，否则文件路径被截断，错误无法定位到 VFS 文件。
+        """
+        env = {**os.environ, "max_print_line": "10000"}
+        with span(args[0], **span_attrs):
+            return subprocess.run(args, cwd=cwd, capture_output=True, text=True, timeout=timeout, env=env)
+
+    def compile(self, files: dict[str, str], entry: str = "main.tex", build_key: str | None = None) -> CompileResult:
+        if self.build_root and build_key:
+            workdir = self._build_dir(build_key)
+            # 同一 build_key 的编译（如修订与续写并发）共用一个目录，必须串行；
+            # flock 按打开的文件计，同进程的不同线程和不同 worker 进程之间都互斥
+            with open(workdir / _LOCK_FILE, "w") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                return self._compile_in(workdir, files, entry)
 
         tmp_dir = tempfile.mkdtemp(prefix="paper_")
-        tmp_path = Path(tmp_dir)
+        try:
+            return self._compile_in(Path(tmp_dir), files, entry)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
 
-        # Write all files from VFS dict to temp dir
+    def _build_dir(self, build_key: str) -> Path:
+        """返回（必要时创建）build_key 的持久构建目录，顺带清理过期目录"""
+        self.build_root.mkdir(parents=True, exist_ok=True)
+        now = time.time()
+        for stale in self.build_root.iterdir():
+            try:
+                if stale.is_dir() and now - stale.stat().st_mtime > self.build_ttl:
+                    shutil.rmtree(stale, ignore_errors=True)
+            except OSError:
+                continue
+        workdir = self.build_root / re.sub(r"[^\w.-]", "_", build_key)
+        workdir.mkdir(exist_ok=True)
+        os.utime(workdir)
+        return workdir
+
+    @staticmethod
+    def _load_state(workdir: Path) -> dict:
+        try:
+            return json.loads((workdir / _STATE_FILE).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def _sync_files(workdir: Path, files: dict[str, str], previous: dict[str, str]) -> dict[str, str]:
+        """只写入内容有变化的文件，删除 VFS 中已不存在的文件；返回 {路径: hash}"""
+        hashes = {}
         for file_path, content in files.items():
-            full_path = tmp_path / file_path
+            hashes[file_path] = _sha256(content)
+            full_path = workdir / file_path
+            if previous.get(file_path) == hashes[file_path] and full_path.exists():
+                continue
             full_path.parent.mkdir(parents=True, exist_ok=True)
             full_path.write_text(content, encoding="utf-8")
-
-        log_output = ""
+        for file_path in previous:
+            if file_path not in files:
+                (workdir / file_path).unlink(missing_ok=True)
+        return hashes
+
+    @staticmethod
+    def _bib_signature(workdir: Path, aux_name: str, files: dict[str, str]) -> str | None:
+        """.aux 中的 \\citation / \\bibdata / \\bibstyle 行 + 所有 .bib / .bst 内容的 hash；没有 \\bibdata 返回 None"""
+        aux_path = workdir / f"{aux_name}.aux"
+        aux = aux_path.read_text(encoding="utf-8", errors="replace") if aux_path.exists() else ""
+        lines = [line for line in aux.splitlines() if line.startswith(("\\citation{", "\\bibdata{", "\\bibstyle{"))]
+        if not any(line.startswith("\\bibdata{") for line in lines):
+            return None
+        sources = [f"{path}\n{files[path]}" for path in sorted(files) if path.endswith((".bib", ".bst"))]
+        return _sha256("\n".join(lines + sources))
+
+    def _compile_in(self, workdir: Path, files: dict[str, str], entry: str) -> CompileResult:
+        state = self._load_state(workdir)
         aux_name = entry.replace(".tex", "")
+        pdf_path = workdir / f"{aux_name}.pdf"
+        bbl_path = workdir / f"{aux_name}.bbl"
 
-        # 编译顺序: xelatex → bibtex → xelatex → xelatex
-        # 1) 第一遍 xelatex — 生成 .aux 文件
-        result = subprocess.run(
-            ["xelatex", "-interaction=nonstopmode", "-halt-on-error", entry],
-            cwd=tmp_dir, capture_output=True, text=True, timeout=120,
-        )
-        log_output += "\n=== xelatex pass 1 ===\n" + result.stdout
-        if result.stderr:
-            log_output += "\n--- stderr ---\n" + result.stderr
-        if result.returncode != 0:
-            shutil.rmtree(tmp_dir, ignore_errors=True)
-            return CompileResult(
-                success=False,
-                error=f"xelatex pass 1 failed (exit code {result.returncode})",
-                log=log_output,
-                errors=extract_errors(log_output),
-            )
+        inputs = _sha256(json.dumps([entry, sorted(files.items())], ensure_ascii=False))
+        if state.get("success") and state.get("inputs") == inputs and pdf_path.exists():
+            return CompileResult(success=True, pdf_data=pdf_path.read_bytes(), log="=== 输入未变化，复用上次的 PDF ===\n")
 
-        # 2) bibtex — 处理参考文献，生成 .bbl
-        result = subprocess.run(
-            ["bibtex", aux_name],
-            cwd=tmp_dir, capture_output=True, text=True, timeout=60,
-        )
-        log_output += "\n=== bibtex ===\n" + result.stdout
-        if result.stderr:
-            log_output += "\n--- stderr ---\n" + result.stderr
-        # bibtex 警告不算致命错误，只在 returncode > 1 时报错
-        if result.returncode > 1:
-            shutil.rmtree(tmp_dir, ignore_errors=True)
-            return CompileResult(
+        state = {"files": self._sync_files(workdir, files, state.get("files") or {}), "bib": state.get("bib")}
+        # 上一次构建留下的 PDF 必须先删掉，否则 xelatex 没有输出新 PDF 时会把旧的当作结果
+        pdf_path.unlink(missing_ok=True)
+        log_output = ""
+
+        def finish(result: CompileResult) -> CompileResult:
+            if not result.success:
+                # -halt-on-error 中断时 .aux 可能只写了一半，留着会让下一次第一遍就报错
+                for path in workdir.rglob("*"):
+                    if path.suffix in _AUX_SUFFIXES and path.is_file():
+                        path.unlink(missing_ok=True)
+            state["success"] = result.success
+            state["inputs"] = inputs if result.success else None
+            (workdir / _STATE_FILE).write_text(json.dumps(state), encoding="utf-8")
+            return result
+
+        def failed(error: str) -> CompileResult:
+            return finish(CompileResult(
                 success=False,
-                error=f"bibtex failed (exit code {result.returncode})",
+                error=error,
                 log=log_output,
                 errors=extract_errors(log_output),
-            )
-
-        # 3) 第二遍 + 第三遍 xelatex — 解析引用和交叉引用
-        for pass_num in (2, 3):
-            result = subprocess.run(
-                ["xelatex", "-interaction=nonstopmode", "-halt-on-error", entry],
-                cwd=tmp_dir, capture_output=True, text=True, timeout=120,
+                locations=locate_errors(log_output, files),
+            ))
+
+        for pass_num in range(1, MAX_XELATEX_PASSES + 1):
+            aux_before = _hash_aux(workdir)
+            result = self._run(
+                ["xelatex", "-interaction=nonstopmode", "-halt-on-error", "-file-line-error", entry],
+                str(workdir), 120, pass_num=pass_num,
             )
             log_output += f"\n=== xelatex pass {pass_num} ===\n" + result.stdout
             if result.stderr:
                 log_output += "\n--- stderr ---\n" + result.stderr
             if result.returncode != 0:
-                shutil.rmtree(tmp_dir, ignore_errors=True)
-                return CompileResult(
-                    success=False,
-                    error=f"xelatex pass {pass_num} failed (exit code {result.returncode})",
-                    log=log_output,
-                    errors=extract_errors(log_output),
-                )
-
-        # Read PDF output
-        pdf_path = tmp_path / entry.replace(".tex", ".pdf")
-        pdf_data = None
-        if pdf_path.exists():
-            pdf_data = pdf_path.read_bytes()
-
-        shutil.rmtree(tmp_dir, ignore_errors=True)
-
-        if pdf_data is None:
-            return CompileResult(
-                success=False,
-                error="PDF file not generated",
-                log=log_output,
-            )
-
-        return CompileResult(success=True, pdf_data=pdf_data, log=log_output)
+                return failed(f"xelatex pass {pass_num} failed (exit code {result.returncode})")
+            rerun = _hash_aux(workdir) != aux_before or bool(_RERUN_RE.search(result.stdout))
+
+            # bibtex 只在第一遍之后考虑：此时 .aux 里已有完整的引用列表
+            if pass_num == 1:
+                signature = self._bib_signature(workdir, aux_name, files)
+                if signature is None:
+                    log_output += "\n=== bibtex 跳过（没有 \\bibdata）===\n"
+                elif signature == state["bib"] and bbl_path.exists():
+                    log_output += "\n=== bibtex 跳过（引用与 .bib 未变化）===\n"
+                else:
+                    bbl_before = _hash_file(bbl_path)
+                    result = self._run(["bibtex", aux_name], str(workdir), 60)
+                    log_output += "\n=== bibtex ===\n" + result.stdout
+                    if result.stderr:
+                        log_output += "\n--- stderr ---\n" + result.stderr
+                    # bibtex 警告不算致命错误，只在 returncode > 1 时报错
+                    if result.returncode > 1:
+                        state["bib"] = None
+                        return failed(f"bibtex failed (exit code {result.returncode})")
+                    state["bib"] = signature
+                    rerun = rerun or _hash_file(bbl_path) != bbl_before
+
+            if not rerun:
+                break
+
+        if not pdf_path.exists():
+            return failed("PDF file not generated")
+        return finish(CompileResult(success=True, pdf_data=pdf_path.read_bytes(), log=log_output))
 
 
 class RemoteCompiler:
@@ -183,16 +426,18 @@ class RemoteCompiler:
         self.endpoint = endpoint
         self.api_key = api_key
 
-    def compile(self, files: dict[str, str], entry: str = "main.tex") -> CompileResult:
-        response = requests.post(
-            self.endpoint,
-            json={"files": files, "entry": entry},
-            headers={
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {self.api_key}",
-            },
-            timeout=300,
-        )
+    def compile(self, files: dict[str, str], entry: str = "main.tex", build_key: str | None = None) -> CompileResult:
+        """远程编译无状态，build_key 忽略"""
+        with span("remote_compile"):
+            response = requests.post(
+                self.endpoint,
+                json={"files": files, "entry": entry},
+                headers={
+                    "Content-Type": "application/json",
+                    "Authorization": f"Bearer {self.api_key}",
+                },
+                timeout=300,
+            )
 
         if response.status_code != 200:
             return CompileResult(
@@ -208,12 +453,14 @@ class RemoteCompiler:
         if data.get("pdf_base64"):
             pdf_data = base64.b64decode(data["pdf_base64"])
 
+        success = data.get("success", False)
         return CompileResult(
-            success=data.get("success", False),
+            success=success,
             pdf_data=pdf_data,
             error=data.get("error"),
             log=data.get("log", ""),
             errors=data.get("errors", ""),
+            locations=[] if success else locate_errors(data.get("log", ""), files),
         )
 
 
@@ -226,4 +473,8 @@ def get_compiler() -> LocalCompiler | RemoteCompiler:
         api_key = os.environ["LATEX_FC_API_KEY"]
         return RemoteCompiler(endpoint=endpoint, api_key=api_key)
 
-    return LocalCompiler()
+    # 增量编译：每篇论文一个持久构建目录，修复轮次 / 修订之间复用 .aux / .bbl
+    build_root = None
+    if os.environ.get("PAPER_LATEX_INCREMENTAL", "1") == "1":
+        build_root = os.environ.get("PAPER_LATEX_BUILD_DIR") or os.path.join(tempfile.gettempdir(), "paper_builds")
+    return LocalCompiler(build_root=build_root, build_ttl=float(os.environ.get("PAPER_LATEX_BUILD_TTL", "86400")))
@@ -0,0 +1,374 @@
+"""
+编译前 LaTeX 检查与自动修复 — lint_vfs + compile_stats
+大多数编译失败来自 LLM 输出里的机械错误：未转义的 % & _ #、括号 / 环境不配对、
+残留的 itemize、Markdown 标记、章节文件里混进导言区命令等。
+每次失败都要付出一次完整的 4 遍编译 + 多轮 FormatterAgent.repair 工具调用。
+这里在 compiler.compile 之前用确定性规则扫一遍 VFS：能修的直接修好写回，修不了的报告出来。
+compile_stats 统计首次编译成功率，观察修复规则的效果。
+"""
+
+import re
+import threading
+from collections import Counter
+from dataclasses import dataclass, field
+
+# 数学 / 表格 / 原样输出区域（含 \verb|...| 与 \ensuremath{...}）：其中的 & _ # 等字符是合法语法，不做转义。
+# 用前缀匹配覆盖同族环境：align* / alignat / aligned、tabularx / tabulary、pmatrix / bmatrix、dcases 等
+_VERBATIM_ENVS = (
+    r"equation|align\w*|flalign|gather\w*|multline|eqnarray|math|displaymath|split|\w*cases|\w*matrix"
+    r"|subequations|tabular\w*|longtable|array|verbatim|lstlisting|minted"
+)
+_PROTECTED_RE = re.compile(
+    rf"\\begin\{{({_VERBATIM_ENVS})(\*?)\}}.*?\\end\{{\1\2\}}"
+    r"|\\verb\*?(?P<delim>[^\sA-Za-z*])[^\n]*?(?P=delim)"
+    r"|\\ensuremath\{(?:[^{}]|\{[^{}]*\})*\}"
+    r"|(?<!\\)\$\$.+?(?<!\\)\$\$"
+    r"|\\\[.+?\\\]"
+    r"|\\\(.+?\\\)"
+    r"|(?<!\\)\$(?:\\.|(?!\n\s*\n)[^$\\])+?\$",
+    re.DOTALL,
+)
+# 参数是标识符 / 路径的命令：参数里的 _ 等原样保留；
+# 任何命令的 [...] 可选参数（\hyperref[sec_a]、\begin{figure}[h!]）也原样保留
+_COMMAND_ARG_RE = re.compile(
+    r"\\(?:cite[pt]?|ref|eqref|autoref|pageref|nameref|cref|Cref|label|input|include|url|href|hyperlink"
+    r"|hypertarget|bibliography"
+    r"|bibliographystyle|usepackage|documentclass|includegraphics|begin|end)\*?(?:\[[^\]]*\])?\{[^{}]*\}"
+    r"(?:\[[^\]\n]*\])?"
+    r"|\\[A-Za-z]+\*?\[[^\]\n]*\]"
+)
+_UNESCAPED_RE = re.compile(r"(?<!\\)[&#_]")
+_PERCENT_AFTER_NUMBER_RE = re.compile(r"(\d\s?)%")
+_COMMENT_RE = re.compile(r"(?<!\\)%")
+
+_MD_FENCE_RE = re.compile(r"^[ \t]*```[^\n]*\n?", re.MULTILINE)
+_MD_HEADING_RE = re.compile(r"^[ \t]*(#{1,6})[ \t]+(.+?)[ \t]*#*[ \t]*$", re.MULTILINE)
+_MD_BOLD_RE = re.compile(r"\*\*([^*\n]+?)\*\*")
+
+_LIST_ENV_RE = re.compile(r"\\(?:begin|end)\{(?:itemize|enumerate|description)\}(?:\[[^\]]*\])?")
+_LABELED_ITEM_RE = re.compile(r"\\item\s*\[([^\]]*)\]\s*")
+_ITEM_RE = re.compile(r"\\item\b\s*")
+
+# 章节文件通过 \input 引入，这些命令只能出现在入口文件里
+_PREAMBLE_LINE_RE = re.compile(
+    r"^[ \t]*(?:\\(?:documentclass|usepackage|geometry|title|author|date|maketitle|bibliographystyle|bibliography)\b"
+    r"|\\(?:begin|end)\{document\}).*\n?",
+    re.MULTILINE,
+)
+_ENV_RE = re.compile(r"\\(begin|end)\{([^}]+)\}")
+# 环境配对时跳过的区域：注释、原样输出环境和 \verb（其中的 \begin / \end 只是文字）
+_ENV_SKIP_RE = re.compile(
+    r"\\begin\{(verbatim|lstlisting|minted)(\*?)\}.*?\\end\{\1\2\}"
+    r"|\\verb\*?(?P<delim>[^\sA-Za-z*])[^\n]*?(?P=delim)"
+    r"|(?<!\\)%[^\n]*",
+    re.DOTALL,
+)
+_BIB_FIELD_RE = re.compile(r"^(\s*(\w+)\s*=\s*\{)(.*)(\}\s*,?\s*)$")
+
+
+@dataclass
+class LintIssue:
+    path: str
+    line: int
+    rule: str
+    message: str
+    fixed: bool = True
+
+    def __str__(self) -> str:
+        return f"{self.path}:{self.line}: [{self.rule}] {self.message}"
+
+
+@dataclass
+class LintReport:
+    issues: list[LintIssue] = field(default_factory=list)
+    # 被改写的文件
+    changed: list[str] = field(default_factory=list)
+
+    @property
+    def fixed(self) -> list[LintIssue]:
+        return [i for i in self.issues if i.fixed]
+
+    @property
+    def remaining(self) -> list[LintIssue]:
+        return [i for i in self.issues if not i.fixed]
+
+    def rule_counts(self) -> dict[str, int]:
+        return dict(Counter(i.rule for i in self.fixed))
+
+    def summary(self) -> str:
+        """修不了的问题列表，编译失败时附在错误日志前交给修复 Agent"""
+        return "\n".join(str(i) for i in self.remaining)
+
+
+def _line_of(text: str, pos: int) -> int:
+    return text.count("\n", 0, pos) + 1
+
+
+class _FileLinter:
+    """单个文件的检查与修复，issues 按规则顺序追加"""
+
+    def __init__(self, path: str, content: str, is_entry: bool):
+        self.path = path
+        self.content = content
+        self.is_entry = is_entry
+        self.issues: list[LintIssue] = []
+
+    def _issue(self, pos: int, rule: str, message: str, fixed: bool = True) -> None:
+        self.issues.append(LintIssue(self.path, _line_of(self.content, pos), rule, message, fixed))
+
+    def run(self) -> str:
+        if not self.is_entry:
+            self._strip_preamble()
+        self._map_text(self._fix_markdown)
+        self._flatten_lists()
+        self._map_text(self._escape_specials)
+        if not self.is_entry:
+            self._check_braces()
+        self._balance_environments()
+        return self.content
+
+    # --- 非数学区域 ---
+
+    def _map_text(self, fix) -> None:
+        """只对数学 / 表格 / verbatim 之外的文本应用 fix(text, offset)"""
+        out, pos = [], 0
+        for match in _PROTECTED_RE.finditer(self.content):
+            out.append(fix(self.content[pos:match.start()], pos))
+            out.append(match.group())
+            pos = match.end()
+        out.append(fix(self.content[pos:], pos))
+        self.content = "".join(out)
+
+    def _fix_markdown(self, text: str, offset: int) -> str:
+        for match in _MD_FENCE_RE.finditer(text):
+            self._issue(offset + match.start(), "markdown", "删除 Markdown 代码块标记 ```")
+        text = _MD_FENCE_RE.sub("", text)
+
+        def heading(match: re.Match) -> str:
+            self._issue(offset + match.start(), "markdown", f"Markdown 标题 → \\subsection: {match.group(2)[:20]}")
+            command = "subsubsection" if len(match.group(1)) >= 3 else "subsection"
+            return f"\\{command}{{{match.group(2).strip('* ')}}}"
+
+        def bold(match: re.Match) -> str:
+            self._issue(offset + match.start(), "markdown", "Markdown **加粗** → \\textbf")
+            return f"\\textbf{{{match.group(1)}}}"
+
+        text = _MD_HEADING_RE.sub(heading, text)
+        return _MD_BOLD_RE.sub(bold, text)
+
+    def _escape_specials(self, text: str, offset: int) -> str:
+        lines = text.split("\n")
+        line_offset = offset
+        for n, line in enumerate(lines):
+            if not re.search(r"\\(?:newcommand|renewcommand|def)\b", line):
+                lines[n] = self._escape_line(line, line_offset)
+            line_offset += len(line) + 1
+        return "\n".join(lines)
+
+    def _escape_line(self, line: str, offset: int) -> str:
+        # 数字后的 % 是百分号而不是注释（"提升 15%"），否则整行后半截会被吞掉
+        def percent(match: re.Match) -> str:
+            self._issue(offset + match.start(), "unescaped", "未转义的 %（百分号）")
+            return match.group(1) + r"\%"
+
+        line = _PERCENT_AFTER_NUMBER_RE.sub(percent, line)
+        comment = _COMMENT_RE.search(line)
+        code, rest = (line[:comment.start()], line[comment.start():]) if comment else (line, "")
+
+        out, pos = [], 0
+        for match in _COMMAND_ARG_RE.finditer(code):
+            out.append(self._escape_chunk(code[pos:match.start()], offset + pos))
+            out.append(match.group())
+            pos = match.end()
+        out.append(self._escape_chunk(code[pos:], offset + pos))
+        return "".join(out) + rest
+
+    def _escape_chunk(self, chunk: str, offset: int) -> str:
+        def escape(match: re.Match) -> str:
+            self._issue(offset + match.start(), "unescaped", f"未转义的 {match.group()}")
+            return "\\" + match.group()
+
+        return _UNESCAPED_RE.sub(escape, chunk)
+
+    # --- 结构 ---
+
+    def _strip_preamble(self) -> None:
+        for match in _PREAMBLE_LINE_RE.finditer(self.content):
+            self._issue(match.start(), "preamble", f"章节文件中的导言区命令已删除: {match.group().strip()[:40]}")
+        self.content = _PREAMBLE_LINE_RE.sub("", self.content)
+
+    def _flatten_lists(self) -> None:
+        """列表结构改写为段落（论文正文不使用 itemize/enumerate），\\item[术语] → \\textbf{术语}："""
+        for match in _LIST_ENV_RE.finditer(self.content):
+            self._issue(match.start(), "list", f"列表环境已改写为段落: {match.group()}")
+        for match in _ITEM_RE.finditer(self.content):
+            self._issue(match.start(), "list", "\\item 已改写为段落")
+        if not any(i.rule == "list" for i in self.issues):
+            return
+        content = _LIST_ENV_RE.sub("\n\n", self.content)
+        content = _LABELED_ITEM_RE.sub(lambda m: f"\n\n\\textbf{{{m.group(1)}}}：", content)
+        content = _ITEM_RE.sub("\n\n", content)
+        self.content = re.sub(r"\n[ \t]*(?:\n[ \t]*)+\n", "\n\n", content)
+
+    def _check_braces(self) -> None:
+        """
+        按段落检查花括号，只报告不修改：\footnote{...} 等参数可以合法地跨越空行，
+        按段落"修复"会在一段补 }、又在下一段删掉真正的 }。
+        """
+        pos = 0
+        for paragraph in re.split(r"(\n[ \t]*\n)", self.content):
+            self._check_paragraph(paragraph, pos)
+            pos += len(paragraph)
+
+    def _check_paragraph(self, paragraph: str, offset: int) -> None:
+        depth, i = 0, 0
+        while i < len(paragraph):
+            ch = paragraph[i]
+            if ch == "\\":
+                i += 2
+                continue
+            if ch == "%":
+                end = paragraph.find("\n", i)
+                i = len(paragraph) if end < 0 else end
+                continue
+            if ch == "{":
+                depth += 1
+            elif ch == "}":
+                if depth == 0:
+                    self._issue(offset + i, "braces", "段落内多出的 }", fixed=False)
+                else:
+                    depth -= 1
+            i += 1
+        if depth > 0:
+            self._issue(offset + len(paragraph.rstrip()), "braces", f"段落内有 {depth} 个 {{ 未闭合", fixed=False)
+
+    def _balance_environments(self) -> None:
+        """
+        \\begin / \\end 配对：多余的 \\end 删除，提前结束的外层环境先关闭内层，文件末尾关闭未结束的环境。
+        注释和原样输出区域里的 \\begin / \\end 不参与配对。
+        """
+        skipped = [m.span() for m in _ENV_SKIP_RE.finditer(self.content)]
+        stack: list[str] = []
+        out, pos = [], 0
+        for match in _ENV_RE.finditer(self.content):
+            if any(start <= match.start() < end for start, end in skipped):
+                continue
+            kind, name = match.groups()
+            out.append(self.content[pos:match.start()])
+            pos = match.end()
+            if kind == "begin":
+                stack.append(name)
+                out.append(match.group())
+            elif stack and stack[-1] == name:
+                stack.pop()
+                out.append(match.group())
+            elif name in stack:
+                while stack[-1] != name:
+                    inner = stack.pop()
+                    self._issue(match.start(), "environment", f"补上 \\end{{{inner}}}")
+                    out.append(f"\\end{{{inner}}}\n")
+                stack.pop()
+                out.append(match.group())
+            else:
+                self._issue(match.start(), "environment", f"多余的 \\end{{{name}}} 已删除")
+        out.append(self.content[pos:])
+        content = "".join(out)
+        for name in reversed(stack):
+            self._issue(len(self.content), "environment", f"文件末尾补上 \\end{{{name}}}")
+            content = content.rstrip("\n") + f"\n\\end{{{name}}}\n"
+        self.content = content
+        self._check_dollars()
+
+    def _check_dollars(self) -> None:
+        """段落内 $ 个数为奇数：不知道哪一个是多余的，只报告"""
+        pos = 0
+        for paragraph in re.split(r"(\n[ \t]*\n)", self.content):
+            stripped = re.sub(r"\\\$|(?<!\\)%.*", "", paragraph)
+            if stripped.count("$") % 2:
+                self._issue(pos + paragraph.find("$"), "math", "段落内 $ 不配对", fixed=False)
+            pos += len(paragraph)
+
+
+def lint_tex(path: str, content: str, is_entry: bool = False) -> tuple[str, list[LintIssue]]:
+    """检查并修复一个 .tex 文件，返回 (修复后内容, 问题列表)"""
+    linter = _FileLinter(path, content, is_entry)
+    return linter.run(), linter.issues
+
+
+def lint_bib(path: str, content: str) -> tuple[str, list[LintIssue]]:
+    """refs.bib：字段值里未转义的 & % # _ 会在排版参考文献时报错（url / doi 除外）"""
+    issues: list[LintIssue] = []
+    lines = content.split("\n")
+    for n, line in enumerate(lines):
+        match = _BIB_FIELD_RE.match(line)
+        if not match or match.group(2).lower() in ("url", "doi"):
+            continue
+        value = re.sub(r"(?<!\\)[&%#_]", lambda m: "\\" + m.group(), match.group(3))
+        if value != match.group(3):
+            issues.append(LintIssue(path, n + 1, "bib", f"{match.group(2)} 字段中的特殊字符已转义"))
+            lines[n] = match.group(1) + value + match.group(4)
+    return "\n".join(lines), issues
+
+
+def lint_vfs(vfs, entry: str = "main.tex", fix: bool = True) -> LintReport:
+    """检查 VFS 中全部 .tex / .bib 文件；fix=True 时把修复结果写回 VFS"""
+    report = LintReport()
+    for path in sorted(vfs.list_files()):
+        content = vfs.read(path) or ""
+        if path.endswith(".tex"):
+            fixed, issues = lint_tex(path, content, is_entry=path == entry)
+        elif path.endswith(".bib"):
+            fixed, issues = lint_bib(path, content)
+        else:
+            continue
+        if not fix:
+            for issue in issues:
+                issue.fixed = False
+        report.issues.extend(issues)
+        if fix and fixed != content:
+            vfs.write(path, fixed)
+            report.changed.append(path)
+    return report
+
+
+class CompileStats:
+    """进程内编译统计：首次编译成功率、修复后编译成功率、lint 自动修复次数（按规则）"""
+
+    def __init__(self):
+        self._counts: Counter = Counter()
+        self._rules: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def record_lint(self, report: LintReport) -> None:
+        with self._lock:
+            self._counts["lint_runs"] += 1
+            self._counts["lint_fixed"] += len(report.fixed)
+            self._counts["lint_remaining"] += len(report.remaining)
+            self._rules.update(report.rule_counts())
+
+    def record_compile(self, attempt: int, success: bool) -> None:
+        """attempt 从 0 开始，0 为首次编译，之后为修复后的重试"""
+        key = "first" if attempt == 0 else "retry"
+        with self._lock:
+            self._counts[f"{key}_attempts"] += 1
+            self._counts[f"{key}_success"] += int(success)
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = dict(self._counts)
+            rules = dict(self._rules)
+        first = counts.get("first_attempts", 0)
+        return {
+            "first_attempts": first,
+            "first_success": counts.get("first_success", 0),
+            "first_success_rate": round(counts.get("first_success", 0) / first, 3) if first else None,
+            "retry_attempts": counts.get("retry_attempts", 0),
+            "retry_success": counts.get("retry_success", 0),
+            "lint_runs": counts.get("lint_runs", 0),
+            "lint_fixed": counts.get("lint_fixed", 0),
+            "lint_remaining": counts.get("lint_remaining", 0),
+            "lint_rules": rules,
+        }
+
+
+compile_stats = CompileStats()
@@ -0,0 +1,176 @@
+"""
+论文规划 JSON 的容错解析与结构校验 — PlannerAgent 使用
+LLM 返回的规划常见问题：外面包了 markdown 代码块 / 说明文字、尾随逗号、
+输出被 max_tokens 截断导致括号不闭合。parse_json_object 尽量把这些修好；
+validate_plan 按 files / outline 结构校验并就地规范化，返回具体的问题列表，
+供一次针对性的修正调用使用。
+"""
+
+import json
+import re
+
+# 截断修复时最多尝试回退的逗号位置数
+_MAX_CUTS = 20
+
+_TRAILING_COMMA_RE = re.compile(r",\s*$")
+
+# json_schema 模式下随请求发送；outline 的键是文件路径，只能用 additionalProperties 描述
+PLAN_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "title": {"type": "string"},
+        "files": {"type": "object", "additionalProperties": {"type": "string"}},
+        "outline": {
+            "type": "object",
+            "additionalProperties": {
+                "type": "object",
+                "properties": {
+                    "title": {"type": "string"},
+                    "sections": {"type": "array", "items": {"type": "string"}},
+                    "key_points": {"type": "array", "items": {"type": "string"}},
+                    "citations": {"type": "array", "items": {"type": "string"}},
+                    "target_words": {"type": "integer"},
+                    "depends_on": {"type": "array", "items": {"type": "string"}},
+                },
+                "required": ["title", "sections"],
+            },
+        },
+    },
+    "required": ["title", "files", "outline"],
+}
+
+
+def _closers(stack: list[str]) -> str:
+    return "".join("}" if c == "{" else "]" for c in reversed(stack))
+
+
+def parse_json_object(text: str | None) -> dict | None:
+    """
+    从 LLM 输出中提取第一个 JSON 对象，解析失败返回 None。
+    先按标准 JSON 解析（忽略前后的说明文字和代码块标记）；失败时逐字符扫描修复：
+    去掉 } / ] 前的尾随逗号，截断的输出补全未闭合的字符串和括号，
+    补全后仍不合法（如停在 "key": 处）则回退到最近的逗号处再补全。
+    """
+    if not text:
+        return None
+    start = text.find("{")
+    if start < 0:
+        return None
+
+    decoder = json.JSONDecoder(strict=False)
+    try:
+        value, _ = decoder.raw_decode(text, start)
+        return value if isinstance(value, dict) else None
+    except ValueError:
+        pass
+
+    out: list[str] = []
+    stack: list[str] = []
+    # (out 中逗号的位置, 当时的括号栈)：截断时的回退点
+    cuts: list[tuple[int, list[str]]] = []
+    in_string = escape = False
+    for ch in text[start:]:
+        if in_string:
+            out.append(ch)
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch in "}]":
+            while out and out[-1].isspace():
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+            if not stack:
+                break
+            out.append("}" if stack.pop() == "{" else "]")
+            if not stack:
+                break
+            continue
+        if ch == ",":
+            cuts.append((len(out), list(stack)))
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append(ch)
+        out.append(ch)
+
+    body = "".join(out)
+    if stack:
+        tail = '"' if in_string else ""
+        candidates = [_TRAILING_COMMA_RE.sub("", body + tail) + _closers(stack)]
+        candidates += [body[:pos] + _closers(snapshot) for pos, snapshot in reversed(cuts[-_MAX_CUTS:])]
+    else:
+        candidates = [body]
+
+    for candidate in candidates:
+        try:
+            value = json.loads(candidate, strict=False)
+        except ValueError:
+            continue
+        if isinstance(value, dict):
+            return value
+    return None
+
+
+def _is_str_list(value) -> bool:
+    return isinstance(value, list) and all(isinstance(v, str) for v in value)
+
+
+def validate_plan(plan) -> list[str]:
+    """
+    校验规划结构，返回问题列表（空列表表示合法）。
+    可无歧义修正的小问题就地规范化而不报错：target_words 为数字字符串时转 int、
+    outline 中的章节文件补进 files、depends_on 里不存在的章节去掉。
+    """
+    if not isinstance(plan, dict) or not plan:
+        return ["规划不是一个非空的 JSON 对象"]
+
+    errors: list[str] = []
+    if not isinstance(plan.get("title"), str) or not plan["title"].strip():
+        errors.append("缺少论文标题 title（非空字符串）")
+
+    files = plan.get("files")
+    if not isinstance(files, dict):
+        errors.append("files 必须是 {文件路径: 描述} 对象")
+        files = None
+
+    outline = plan.get("outline")
+    if not isinstance(outline, dict):
+        errors.append("outline 必须是 {章节文件路径: 章节规划} 对象")
+        return errors
+
+    chapter_files = sorted(k for k in outline if k.startswith("chapters/"))
+    if not chapter_files:
+        errors.append("outline 中没有章节文件（键应形如 chapters/01_intro.tex）")
+
+    for path in outline:
+        if not path.startswith("chapters/") or not path.endswith(".tex"):
+            errors.append(f"outline 键 {path} 不是章节文件路径（应形如 chapters/01_intro.tex）")
+            continue
+        entry = outline[path]
+        if not isinstance(entry, dict):
+            errors.append(f"outline[{path}] 必须是对象")
+            continue
+        if not isinstance(entry.get("title"), str) or not entry["title"].strip():
+            errors.append(f"outline[{path}] 缺少章节标题 title")
+        if not _is_str_list(entry.get("sections")):
+            errors.append(f"outline[{path}].sections 必须是字符串列表")
+        for key in ("key_points", "citations", "depends_on"):
+            if key in entry and not _is_str_list(entry[key]):
+                errors.append(f"outline[{path}].{key} 必须是字符串列表")
+        if "target_words" in entry:
+            words = entry["target_words"]
+            if isinstance(words, str) and words.strip().isdigit():
+                entry["target_words"] = int(words)
+            elif not isinstance(words, int) or isinstance(words, bool) or words <= 0:
+                errors.append(f"outline[{path}].target_words 必须是正整数")
+        if _is_str_list(entry.get("depends_on")):
+            entry["depends_on"] = [d for d in entry["depends_on"] if d in outline and d != path]
+        if files is not None and path not in files:
+            files[path] = entry.get("title") if isinstance(entry.get("title"), str) else ""
+
+    return errors
@@ -0,0 +1,100 @@
+"""
+研究阶段结果缓存 — 按主题缓存 literature + literature_summary
+同一门课的学生经常生成相同或几乎相同主题的论文，researching 阶段的两次 LLM 调用
+（文献列表、综述摘要）结果可以直接复用。
+键为规范化后的主题（NFKC、小写、去掉空白和标点）；可选按字符 bigram 的 Dice 相似度
+做模糊匹配（默认关闭：「基于深度学习的图像分类方法研究」与「……图像分割方法研究」是不同的题目，
+相似度约 0.86，只比措辞差异「……方法的研究」的约 0.90 低一点，阈值很难把两者分开）。
+"""
+
+import copy
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+_STRIP_RE = re.compile(r"[\W_]+", re.UNICODE)
+
+
+def normalize_topic(topic: str) -> str:
+    """全角转半角、小写、去掉空白和标点"""
+    return _STRIP_RE.sub("", unicodedata.normalize("NFKC", topic or "").lower())
+
+
+def _bigrams(text: str) -> set[str]:
+    return {text[i:i + 2] for i in range(len(text) - 1)} or {text}
+
+
+def similarity(a: str, b: str) -> float:
+    """两个规范化主题的字符 bigram Dice 系数（0-1）"""
+    if a == b:
+        return 1.0
+    grams_a, grams_b = _bigrams(a), _bigrams(b)
+    return 2 * len(grams_a & grams_b) / (len(grams_a) + len(grams_b))
+
+
+class ResearchCache:
+    """
+    进程内 LRU + TTL 缓存。get / put 都做深拷贝，命中的文献列表不会被多个 session 共享修改。
+    fuzzy_threshold 为 0 时只做精确匹配；否则相似度不低于该值的最相似条目视为命中。
+    """
+
+    def __init__(self, ttl: float = 86400, max_entries: int = 256, fuzzy_threshold: float = 0.0):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.fuzzy_threshold = fuzzy_threshold
+        # 规范化主题 → (写入时间, literature, literature_summary)
+        self._entries: OrderedDict[str, tuple[float, list, str]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.fuzzy_hits = 0
+        self.misses = 0
+
+    def get(self, topic: str) -> tuple[list, str] | None:
+        """返回 (literature, literature_summary)；未命中或已过期返回 None"""
+        key = normalize_topic(topic)
+        if not key:
+            return None
+        now = time.time()
+        with self._lock:
+            for stale in [k for k, (at, _, _) in self._entries.items() if now - at > self.ttl]:
+                del self._entries[stale]
+
+            match = key if key in self._entries else None
+            if match is None and self.fuzzy_threshold > 0:
+                scored = [(similarity(key, k), k) for k in self._entries]
+                best = max(scored, default=(0.0, None))
+                if best[0] >= self.fuzzy_threshold:
+                    match = best[1]
+                    self.fuzzy_hits += 1
+
+            if match is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(match)
+            _, literature, summary = self._entries[match]
+            return copy.deepcopy(literature), summary
+
+    def put(self, topic: str, literature: list, summary: str) -> None:
+        """只缓存完整结果（文献列表和摘要都非空），失败的调用不应被复用"""
+        key = normalize_topic(topic)
+        if not key or not literature or not summary:
+            return
+        with self._lock:
+            self._entries[key] = (time.time(), copy.deepcopy(literature), summary)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "fuzzy_hits": self.fuzzy_hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            }
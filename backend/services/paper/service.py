@@ -8,8 +8,13 @@ import json
 from typing import Generator
 
 from .agents import ResearcherAgent, PlannerAgent, WriterAgent, FormatterAgent
-from .latex import get_compiler
+from .checkpoint import STAGES, delete_checkpoint, load_checkpoint, save_checkpoint
+from .edits import make_tool_handler
+from .latex import ErrorLocation, get_compiler
+from .lint import compile_stats, lint_vfs
+from .research_cache import ResearchCache
 from .session import PaperSession, PaperStatus, SessionManager
+from .tracing import PaperTrace, span, timing_stats
 
 
 class PaperService:
@@ -18,13 +23,24 @@ class PaperService:
     def __init__(self, llm_service, storage_service):
         self.storage = storage_service
         self.compiler = get_compiler()
+        # 每个阶段 / 每章完成后保存检查点，支持崩溃后续写
+        self.checkpoints = os.environ.get("PAPER_CHECKPOINTS", "1") == "1"
+        # 编译前用确定性规则修复常见 LaTeX 错误（未转义字符、括号、列表、Markdown 残留）
+        self.lint = os.environ.get("PAPER_LATEX_LINT", "1") == "1"
         # Paper 专用 API Key，留空则走 LLMService 默认 key 池
         paper_key = os.environ.get("API_KEY_PAPER") or None
+        # 同主题的文献列表 + 综述摘要缓存（TTL 为 0 时关闭）
+        cache_ttl = float(os.environ.get("PAPER_RESEARCH_CACHE_TTL", "86400"))
+        self.research_cache = ResearchCache(
+            ttl=cache_ttl,
+            fuzzy_threshold=float(os.environ.get("PAPER_RESEARCH_CACHE_FUZZY", "0")),
+        ) if cache_ttl > 0 else None
         # 每个 Agent 独立配置模型，留空则 fallback 到 MODEL_PRIMARY
         self.researcher = ResearcherAgent(
             llm_service,
             model=os.environ.get("MODEL_PAPER_RESEARCHER") or None,
             api_key=paper_key,
+            cache=self.research_cache,
         )
         self.planner = PlannerAgent(
             llm_service,
@@ -35,11 +51,15 @@ class PaperService:
             llm_service,
             model=os.environ.get("MODEL_PAPER_WRITER") or None,
             api_key=paper_key,
+            mode=os.environ.get("PAPER_WRITER_MODE", "serial"),
+            max_workers=int(os.environ.get("PAPER_WRITER_CONCURRENCY", "4")),
         )
         self.formatter = FormatterAgent(
             llm_service,
             model=os.environ.get("MODEL_PAPER_FORMATTER") or None,
             api_key=paper_key,
+            max_workers=int(os.environ.get("PAPER_FORMATTER_CONCURRENCY", "4")),
+            fast_path=os.environ.get("PAPER_LATEX_FAST_PATH", "1") == "1",
         )
 
     def _sync_tracking_record(self, session: PaperSession, create_if_missing: bool = False) -> None:
@@ -86,9 +106,62 @@ class PaperService:
 
     @staticmethod
     def _set_progress_detail(session: PaperSession, detail: str) -> None:
-        """将最近一条进度详情写入 session，供 /status 轮询读取。"""
+        """将最近一条进度详情写入 session 并同步到会话存储，供 /status 轮询读取（可能在其他 worker）。"""
         if detail:
             session.progress_detail = detail
+            SessionManager.update_progress(session.id, detail)
+
+    def _checkpoint(self, session: PaperSession, stage: str) -> None:
+        if self.checkpoints:
+            save_checkpoint(session, self.storage, stage)
+
+    def _compile(self, session: PaperSession, attempt: int):
+        """
+        编译一次（每次编译记一个 compile span，编译器内部各遍再记子 span）。
+        编译前先跑 lint 自动修复；编译失败时把 lint 修不了的问题附在错误摘要前，交给修复 Agent。
+        """
+        with span("compile", trace=session.trace, stage=True, attempt=attempt + 1) as s:
+            report = None
+            if self.lint:
+                with span("lint"):
+                    report = lint_vfs(session.vfs, "main.tex")
+                compile_stats.record_lint(report)
+                if report.issues:
+                    rules = "，".join(f"{rule} {n}" for rule, n in report.rule_counts().items())
+                    print(f"[Lint] {session.id} 自动修复 {len(report.fixed)} 处（{rules or '无'}），"
+                          f"未修复 {len(report.remaining)} 处")
+
+            result = self.compiler.compile(session.vfs.get_all(), "main.tex", build_key=session.id)
+            compile_stats.record_compile(attempt, result.success)
+            if s:
+                s.attrs["success"] = result.success
+                if report:
+                    s.attrs["lint_fixed"] = len(report.fixed)
+            if not result.success and report and report.remaining:
+                result.errors = f"编译前检查发现的问题：\n{report.summary()}\n\n{result.errors or result.log}"
+                located = {(loc.path, loc.line) for loc in result.locations}
+                result.locations = result.locations + [
+                    ErrorLocation(issue.path, issue.line, issue.message)
+                    for issue in report.remaining if (issue.path, issue.line) not in located
+                ]
+            return result
+
+    def _write_and_format(self, session: PaperSession) -> Generator[dict, None, None]:
+        """
+        撰写 + 排版流水线：WriterAgent 每写完一章（chapter_done），
+        FormatterAgent 立即在线程池里转换该章，后续章节继续撰写。
+        写手全部完成后会话状态切到 formatting，只剩排版收尾。
+        每写完一章保存一次检查点。
+        """
+        def writer_events() -> Generator[dict, None, None]:
+            for event in self.writer.run(session):
+                yield event
+                if event["type"] == "chapter_done":
+                    self._checkpoint(session, "planned")
+            SessionManager.update_status(session.id, PaperStatus.FORMATTING)
+            self._sync_tracking_record(session, create_if_missing=False)
+
+        yield from self.formatter.run_streaming(session, writer_events())
 
     def generate(self, user_id: str, topic: str) -> Generator[dict, None, None]:
         """
@@ -101,32 +174,91 @@ class PaperService:
         - error: 出错
         """
         session = SessionManager.create(user_id, topic)
+        session.trace = PaperTrace(session.id)
         yield {"type": "session_created", "session_id": session.id}
+        yield from self._with_timings(session.trace, self._run_pipeline(session))
+
+    def resume(self, paper_id: str) -> Generator[dict, None, None]:
+        """
+        从最近的检查点继续生成（worker 重启后或用户手动重试）。
+        已完成的阶段和已写完的章节直接复用，不再调用 LLM。
 
-        # 4 Agent pipeline
+        事件类型同 generate()，session_created 额外带 resumed_from（检查点阶段）。
+        """
+        if SessionManager.is_active(paper_id):
+            yield {"type": "error", "message": "论文正在生成中", "session_id": paper_id}
+            return
+
+        session = load_checkpoint(paper_id, self.storage)
+        if not session:
+            yield {"type": "error", "message": "没有可恢复的生成进度，请重新生成", "session_id": paper_id}
+            return
+
+        session.trace = PaperTrace(session.id)
+        SessionManager.add(session)
+        print(f"[Paper] 从检查点恢复 {paper_id}（{session.checkpoint_stage}，已写 {len(session.content)} 章）")
+        yield {"type": "session_created", "session_id": session.id, "resumed_from": session.checkpoint_stage}
+        yield from self._with_timings(session.trace, self._run_pipeline(session))
+
+    @staticmethod
+    def _with_timings(trace: PaperTrace, events: Generator[dict, None, None]) -> Generator[dict, None, None]:
+        """
+        透传 pipeline 事件，结束后追加一条 timings 事件（各阶段耗时 / LLM 调用 / token）。
+        任务被取消（generator 被提前关闭）时把会话标记为失败，之后可以从检查点继续生成。
+        """
+        completed = False
+        try:
+            for event in events:
+                completed = event.get("type") == "completed"
+                yield event
+        except GeneratorExit:
+            session = SessionManager.get(trace.paper_id)
+            if session and SessionManager.is_active(session.id):
+                session.error = "生成已取消"
+                SessionManager.update_status(session.id, PaperStatus.FAILED)
+            print(f"[Paper] {trace.paper_id} 已取消")
+            raise
+
+        trace.finish()
+        summary = trace.summary()
+        if completed:
+            timing_stats.record(summary)
+        stages = "，".join(f"{name} {entry['duration']:.1f}s" for name, entry in summary["stages"].items())
+        print(f"[Paper] {trace.paper_id} 耗时 {summary['total']:.1f}s（{stages}），LLM 调用 {summary['llm_calls']} 次")
+        session = SessionManager.get(trace.paper_id)
+        if session:
+            SessionManager.publish(session)
+        yield {"type": "timings", "session_id": trace.paper_id, **summary}
+
+    def _run_pipeline(self, session: PaperSession) -> Generator[dict, None, None]:
+        """执行 pipeline；session.checkpoint_stage 之前（含）的阶段视为已完成并跳过"""
+        completed = STAGES.index(session.checkpoint_stage) + 1 if session.checkpoint_stage in STAGES else 0
+
+        # 4 Agent pipeline：撰写与排版流水线重叠，章节写完立即进入 LaTeX 转换
         agents_pipeline = [
-            (PaperStatus.RESEARCHING, self.researcher),
-            (PaperStatus.PLANNING, self.planner),
-            (PaperStatus.WRITING, self.writer),
-            (PaperStatus.FORMATTING, self.formatter),
+            (PaperStatus.RESEARCHING, self.researcher.run, "researched", "research"),
+            (PaperStatus.PLANNING, self.planner.run, "planned", "plan"),
+            (PaperStatus.WRITING, self._write_and_format, "formatted", "write_format"),
         ]
 
-        for status, agent in agents_pipeline:
+        for status, run_stage, checkpoint, span_name in agents_pipeline[completed:]:
             SessionManager.update_status(session.id, status)
             # planning 完成后才创建持久化记录；后续阶段更新同一条记录。
             self._sync_tracking_record(session, create_if_missing=False)
             try:
-                for event in agent.run(session):
-                    if event["type"] == "progress":
-                        self._set_progress_detail(session, event.get("detail", ""))
-                        yield event
+                with span(span_name, trace=session.trace, stage=True):
+                    for event in run_stage(session):
+                        if event["type"] == "progress":
+                            self._set_progress_detail(session, event.get("detail", ""))
+                            yield event
             except Exception as e:
-                session.error = f"{status.value} 阶段失败: {e}"
+                session.error = f"{session.status.value} 阶段失败: {e}"
                 SessionManager.update_status(session.id, PaperStatus.FAILED)
                 self._sync_tracking_record(session, create_if_missing=False)
                 yield {"type": "error", "message": session.error, "session_id": session.id}
                 return
 
+            self._checkpoint(session, checkpoint)
             if status == PaperStatus.PLANNING:
                 self._sync_tracking_record(session, create_if_missing=True)
 
@@ -141,7 +273,7 @@ class PaperService:
         result = None
         for attempt in range(1 + MAX_REPAIR_ROUNDS):
             try:
-                result = self.compiler.compile(session.vfs.get_all(), "main.tex")
+                result = self._compile(session, attempt)
             except Exception as e:
                 session.error = f"编译异常: {e}"
                 SessionManager.update_status(session.id, PaperStatus.FAILED)
@@ -160,10 +292,13 @@ class PaperService:
             detail = f"编译失败，正在自动修复（第 {attempt}/{MAX_REPAIR_ROUNDS} 轮）..."
             self._set_progress_detail(session, detail)
             yield {"type": "progress", "stage": "compiling", "detail": detail}
-            for repair_event in self.formatter.repair(session, result.errors or result.log):
-                if repair_event.get("type") == "progress":
-                    self._set_progress_detail(session, repair_event.get("detail", ""))
-                yield repair_event
+            with span("repair", trace=session.trace, stage=True, round=attempt + 1):
+                for repair_event in self.formatter.repair(
+                    session, result.errors or result.log, locations=result.locations,
+                ):
+                    if repair_event.get("type") == "progress":
+                        self._set_progress_detail(session, repair_event.get("detail", ""))
+                    yield repair_event
 
             detail = "重新编译中..."
             self._set_progress_detail(session, detail)
@@ -185,7 +320,11 @@ class PaperService:
 
         from .persist import persist_session
         from models import db
-        persist_session(session, self.storage, db, upsert=True)
+        with span("persist", trace=session.trace, stage=True):
+            persist_session(session, self.storage, db, upsert=True)
+        SessionManager.publish(session)  # 带上 pdf_url
+        if self.checkpoints:
+            delete_checkpoint(session.id, self.storage)
         yield {"type": "completed", "pdf_url": session.pdf_url, "session_id": session.id}
 
     def revise(self, paper_id: str, instruction: str) -> Generator[dict, None, None]:
@@ -194,19 +333,25 @@ class PaperService:
 
         事件类型同 generate()。
         """
+        trace = PaperTrace(paper_id)
+        yield from self._with_timings(trace, self._revise(paper_id, instruction, trace))
+
+    def _revise(self, paper_id: str, instruction: str, trace: PaperTrace) -> Generator[dict, None, None]:
         from .persist import restore_session, persist_session
         from models import db, PaperRecord
 
         detail = "正在恢复论文数据..."
         yield {"type": "progress", "stage": "revising", "detail": detail}
 
-        session = restore_session(paper_id, self.storage, db)
+        with span("restore", trace=trace, stage=True):
+            session = restore_session(paper_id, self.storage, db)
         if not session:
             yield {"type": "error", "message": "论文不存在或数据已丢失", "session_id": paper_id}
             return
 
         # 放入内存管理
-        SessionManager._sessions[session.id] = session
+        session.trace = trace
+        SessionManager.add(session)
         SessionManager.update_status(session.id, PaperStatus.FORMATTING)
 
         detail = "正在按要求修改..."
@@ -217,23 +362,7 @@ class PaperService:
         vfs = session.vfs
         modified_files: list[str] = []
 
-        def tool_handler(name: str, arguments: dict) -> str:
-            if name == "list_files":
-                files = vfs.list_files()
-                return "\n".join(files) if files else "(空)"
-            if name == "read_file":
-                path = arguments.get("path", "")
-                content = vfs.read(path)
-                if content is None:
-                    return f"错误: 文件 {path} 不存在"
-                return content
-            if name == "write_file":
-                path = arguments.get("path", "")
-                content = arguments.get("content", "")
-                vfs.write(path, content)
-                modified_files.append(path)
-                return f"已写入 {path}（{len(content)} 字符）"
-            return f"未知工具: {name}"
+        tool_handler = make_tool_handler(vfs, modified_files)
 
         messages = [
             {
@@ -243,10 +372,11 @@ class PaperService:
                     "你需要通过工具读取相关文件、按指令修改、写回。\n\n"
                     "规则：\n"
                     "1. 先用 list_files 查看论文文件结构\n"
-                    "2. 用 read_file 读取需要修改的文件\n"
+                    "2. 用 read_file 或 read_range 读取需要修改的部分\n"
                     "3. 按用户指令修改内容，保持 LaTeX 语法正确\n"
                     "4. 绝对不使用 itemize/enumerate/item 结构\n"
-                    "5. 用 write_file 写回修改后的完整文件内容\n"
+                    "5. 局部修改用 edit_file（search/replace 或 unified diff），"
+                    "只有大范围重写时才用 write_file 写回完整文件\n"
                     "6. 修改完成后，回复一句简短总结"
                 ),
             },
@@ -256,14 +386,16 @@ class PaperService:
             },
         ]
 
-        self.formatter._complete_with_tools(
-            messages,
-            tools=self.formatter.REPAIR_TOOLS,
-            tool_handler=tool_handler,
-            max_rounds=15,
-        )
+        with span("revise", trace=session.trace, stage=True):
+            self.formatter._complete_with_tools(
+                messages,
+                tools=self.formatter.REPAIR_TOOLS,
+                tool_handler=tool_handler,
+                max_rounds=15,
+                on_progress=lambda detail: self._set_progress_detail(session, f"正在修改：{detail}"),
+            )
 
-        for f in modified_files:
+        for f in dict.fromkeys(modified_files):
             detail = f"已修改 {f}"
             self._set_progress_detail(session, detail)
             yield {"type": "progress", "stage": "revising", "detail": detail}
@@ -282,7 +414,7 @@ class PaperService:
         result = None
         for attempt in range(1 + MAX_REPAIR_ROUNDS):
             try:
-                result = self.compiler.compile(session.vfs.get_all(), "main.tex")
+                result = self._compile(session, attempt)
             except Exception as e:
                 session.error = f"编译异常: {e}"
                 SessionManager.update_status(session.id, PaperStatus.FAILED)
@@ -299,10 +431,13 @@ class PaperService:
             detail = f"编译失败，正在自动修复（第 {attempt}/{MAX_REPAIR_ROUNDS} 轮）..."
             self._set_progress_detail(session, detail)
             yield {"type": "progress", "stage": "compiling", "detail": detail}
-            for repair_event in self.formatter.repair(session, result.errors or result.log):
-                if repair_event.get("type") == "progress":
-                    self._set_progress_detail(session, repair_event.get("detail", ""))
-                yield repair_event
+            with span("repair", trace=session.trace, stage=True, round=attempt + 1):
+                for repair_event in self.formatter.repair(
+                    session, result.errors or result.log, locations=result.locations,
+                ):
+                    if repair_event.get("type") == "progress":
+                        self._set_progress_detail(session, repair_event.get("detail", ""))
+                    yield repair_event
             detail = "重新编译中..."
             self._set_progress_detail(session, detail)
             yield {"type": "progress", "stage": "compiling", "detail": detail}
@@ -321,27 +456,29 @@ class PaperService:
         SessionManager.update_status(session.id, PaperStatus.COMPLETED)
 
         # 更新已有记录而非新建
-        record = PaperRecord.query.get(session.id)
-        if record:
-            pdf_key = record.pdf_s3_key or f"users/{session.user_id}/papers/{session.id}/paper.pdf"
-            upload_result = self.storage.upload_pdf(session.pdf_data, pdf_key)
-            session.pdf_url = upload_result["url"] if upload_result else record.pdf_url
-
-            vfs_json = session.vfs.serialize().encode("utf-8")
-            import gzip
-            vfs_gz = gzip.compress(vfs_json)
-            vfs_key = record.vfs_s3_key or f"users/{session.user_id}/papers/{session.id}/vfs.json.gz"
-            self.storage.upload_bytes(vfs_gz, vfs_key, "application/gzip")
-
-            record.status = PaperStatus.COMPLETED.value
-            record.pdf_url = session.pdf_url
-            import json
-            from datetime import datetime
-            record.outline_json = json.dumps(session.file_plan, ensure_ascii=False)
-            record.completed_at = datetime.utcnow()
-            record.error = None
-            db.session.commit()
-        else:
-            persist_session(session, self.storage, db)
+        with span("persist", trace=session.trace, stage=True):
+            record = PaperRecord.query.get(session.id)
+            if record:
+                pdf_key = record.pdf_s3_key or f"users/{session.user_id}/papers/{session.id}/paper.pdf"
+                upload_result = self.storage.upload_pdf(session.pdf_data, pdf_key)
+                session.pdf_url = upload_result["url"] if upload_result else record.pdf_url
+
+                vfs_json = session.vfs.serialize().encode("utf-8")
+                import gzip
+                vfs_gz = gzip.compress(vfs_json)
+                vfs_key = record.vfs_s3_key or f"users/{session.user_id}/papers/{session.id}/vfs.json.gz"
+                self.storage.upload_bytes(vfs_gz, vfs_key, "application/gzip")
+
+                record.status = PaperStatus.COMPLETED.value
+                record.pdf_url = session.pdf_url
+                import json
+                from datetime import datetime
+                record.outline_json = json.dumps(session.file_plan, ensure_ascii=False)
+                record.completed_at = datetime.utcnow()
+                record.error = None
+                db.session.commit()
+            else:
+                persist_session(session, self.storage, db)
+        SessionManager.publish(session)
 
         yield {"type": "completed", "pdf_url": session.pdf_url, "session_id": session.id}
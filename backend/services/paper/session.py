@@ -2,12 +2,19 @@
 Session 管理 — PaperStatus, PaperSession, SessionManager
 """
 
+import os
+import sys
+import threading
+import time
 import uuid
+from collections import OrderedDict
 from dataclasses import dataclass, field
 from datetime import datetime
 from enum import Enum
 from typing import Optional
 
+from .session_store import MemorySessionStore, SessionStore
+from .tracing import PaperTrace
 from .vfs import VirtualFileSystem
 
 
@@ -29,46 +36,301 @@ class PaperSession:
     topic: str
     status: PaperStatus = PaperStatus.PENDING
     progress_detail: str = ""
+    # 各章节进度：file_path → pending / writing / written / formatting / formatted
+    chapter_status: dict = field(default_factory=dict)
     vfs: VirtualFileSystem = field(default_factory=VirtualFileSystem)
     pdf_url: Optional[str] = None
     pdf_s3_key: Optional[str] = None
     vfs_s3_key: Optional[str] = None
     error: Optional[str] = None
     created_at: datetime = field(default_factory=datetime.utcnow)
+    # 最近一次保存的检查点阶段（见 checkpoint.STAGES），空表示还没有检查点
+    checkpoint_stage: str = ""
 
     # Agent 中间产物
     literature: list = field(default_factory=list)
     literature_summary: str = ""
     file_plan: dict = field(default_factory=dict)
     content: dict = field(default_factory=dict)
+    # LaTeX 转换方式统计：{"local": n, "mixed": n, "llm": n}
+    format_stats: dict = field(default_factory=dict)
+    # 本次 generate / resume / revise 的耗时 span
+    trace: Optional[PaperTrace] = field(default=None, repr=False)
+
+
+TERMINAL_STATUSES = (PaperStatus.COMPLETED, PaperStatus.FAILED)
+
+
+def _deep_size(obj) -> int:
+    """粗略估算对象占用的内存字节数（递归 dict / list / str / bytes）"""
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(_deep_size(k) + _deep_size(v) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return sys.getsizeof(obj) + sum(_deep_size(v) for v in obj)
+    if isinstance(obj, (str, bytes, bytearray)):
+        return sys.getsizeof(obj)
+    return 0
+
+
+def estimate_session_size(session: PaperSession) -> int:
+    """估算会话常驻内存：VFS、正文、文献、规划以及编译产物 pdf_data"""
+    return (
+        _deep_size(session.vfs._files)
+        + _deep_size(session.content)
+        + _deep_size(session.literature)
+        + _deep_size(session.literature_summary)
+        + _deep_size(session.file_plan)
+        + _deep_size(getattr(session, "pdf_data", None))
+    )
 
 
 class SessionManager:
-    """内存中的 Session 存储"""
+    """
+    Session 管理：完整的 PaperSession 留在本进程内存，
+    状态快照（status / progress_detail / 章节进度 / 心跳）同步到 SessionStore，
+    多 worker 部署时其他进程通过 get_status() 读取。
+
+    内存有上限：已完成 / 已失败的会话按 TTL、LRU（会话数上限）和总字节预算淘汰，
+    进行中的会话永不淘汰。被淘汰的会话仍可通过 PaperRecord / 对象存储恢复。
+    """
+
+    # 按访问顺序排列（最近访问的在末尾），用于 LRU 淘汰
+    _sessions: dict[str, PaperSession] = OrderedDict()
+    _lock = threading.RLock()
+    # 结束时间与结束时估算的大小（结束后内容不再变化，只算一次）
+    _finished_at: dict[str, float] = {}
+    _sizes: dict[str, int] = {}
+    _evictions: dict[str, int] = {"ttl": 0, "lru": 0, "bytes": 0}
+    session_ttl: float = float(os.environ.get("PAPER_SESSION_TTL", 1800))
+    max_sessions: int = int(os.environ.get("PAPER_SESSION_MAX", 100))
+    max_bytes: int = int(os.environ.get("PAPER_SESSION_MAX_BYTES", 128 * 1024 * 1024))
+    _store: SessionStore = MemorySessionStore()
+    # 共享存储里快照超过这么久没有心跳，视为所属进程已不在
+    stale_after: float = float(os.environ.get("PAPER_SESSION_STALE", 60))
+    heartbeat_interval: float = float(os.environ.get("PAPER_SESSION_HEARTBEAT", 15))
+    # 共享存储里过期快照的清理间隔（秒）
+    expire_interval: float = 60
+    _last_expire: float = 0
+    _heartbeat_thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def configure(cls, store: SessionStore) -> None:
+        """切换会话存储（app 启动时根据环境变量调用）；共享存储会启动心跳线程"""
+        cls._store = store
+        if store.shared and cls._heartbeat_thread is None:
+            cls._heartbeat_thread = threading.Thread(target=cls._heartbeat_loop, daemon=True)
+            cls._heartbeat_thread.start()
+        print(f"[Session] 会话存储: {store.name}")
 
-    _sessions: dict[str, PaperSession] = {}
+    @staticmethod
+    def snapshot(session: PaperSession) -> dict:
+        """可跨进程共享的会话快照（不含 VFS / 正文等大对象）"""
+        return {
+            "id": session.id,
+            "user_id": session.user_id,
+            "topic": session.topic,
+            "status": session.status.value,
+            "progress_detail": session.progress_detail,
+            "chapters": dict(session.chapter_status),
+            "format_stats": dict(session.format_stats),
+            "pdf_url": session.pdf_url,
+            "error": session.error,
+            "owner_pid": os.getpid(),
+            "timings": session.trace.summary() if session.trace and session.status in TERMINAL_STATUSES else None,
+        }
+
+    @classmethod
+    def publish(cls, session: PaperSession) -> None:
+        """把本进程会话的最新状态同步到共享存储，失败只打印日志"""
+        try:
+            cls._store.put(cls.snapshot(session))
+        except Exception as e:
+            print(f"[Session] 同步会话状态失败 {session.id}: {e}")
 
     @classmethod
     def create(cls, user_id: str, topic: str) -> PaperSession:
         session_id = uuid.uuid4().hex
         session = PaperSession(id=session_id, user_id=user_id, topic=topic)
-        cls._sessions[session_id] = session
+        return cls.add(session)
+
+    @classmethod
+    def add(cls, session: PaperSession) -> PaperSession:
+        """放入会话（新建，或从持久化 / 检查点恢复时使用）"""
+        with cls._lock:
+            cls._sessions[session.id] = session
+            cls._sessions.move_to_end(session.id)
+            cls._finished_at.pop(session.id, None)
+            cls._sizes.pop(session.id, None)
+            if session.status in TERMINAL_STATUSES:
+                cls._finished_at[session.id] = time.time()
+        cls.publish(session)
+        cls.evict()
         return session
 
     @classmethod
     def get(cls, session_id: str) -> Optional[PaperSession]:
-        return cls._sessions.get(session_id)
+        """本进程内的完整会话"""
+        with cls._lock:
+            session = cls._sessions.get(session_id)
+            if session:
+                cls._sessions.move_to_end(session_id)
+            return session
+
+    @classmethod
+    def get_status(cls, session_id: str) -> Optional[dict]:
+        """
+        会话状态快照：优先本进程，其次共享存储。
+        共享存储里的进行中会话若心跳已过期（所属 worker 重启 / 崩溃），返回 None。
+        """
+        session = cls._sessions.get(session_id)
+        if session:
+            return cls.snapshot(session)
+        try:
+            snapshot = cls._store.get(session_id)
+        except Exception as e:
+            print(f"[Session] 读取会话状态失败 {session_id}: {e}")
+            return None
+        if not snapshot:
+            return None
+        terminal = (PaperStatus.COMPLETED.value, PaperStatus.FAILED.value)
+        if snapshot["status"] not in terminal and time.time() - snapshot.get("heartbeat_at", 0) > cls.stale_after:
+            return None
+        return snapshot
+
+    @classmethod
+    def is_active(cls, session_id: str) -> bool:
+        """会话是否正在某个 worker 里生成"""
+        snapshot = cls.get_status(session_id)
+        return bool(snapshot) and snapshot["status"] not in (PaperStatus.COMPLETED.value, PaperStatus.FAILED.value)
 
     @classmethod
     def update_status(
         cls, session_id: str, status: PaperStatus, detail: str = ""
     ) -> None:
         session = cls._sessions.get(session_id)
-        if session:
-            session.status = status
-            if detail:
-                session.progress_detail = detail
+        if not session:
+            return
+        session.status = status
+        if detail:
+            session.progress_detail = detail
+        with cls._lock:
+            cls._sizes.pop(session_id, None)
+            if status in TERMINAL_STATUSES:
+                cls._finished_at[session_id] = time.time()
+            else:
+                cls._finished_at.pop(session_id, None)
+        cls.publish(session)
+        if status in TERMINAL_STATUSES:
+            cls.evict()
+
+    @classmethod
+    def update_progress(cls, session_id: str, detail: str) -> None:
+        """更新进度详情（章节进度随快照一起同步）"""
+        session = cls._sessions.get(session_id)
+        if session and detail:
+            session.progress_detail = detail
+            cls.publish(session)
 
     @classmethod
     def delete(cls, session_id: str) -> bool:
-        return cls._sessions.pop(session_id, None) is not None
+        try:
+            cls._store.delete(session_id)
+        except Exception as e:
+            print(f"[Session] 删除会话状态失败 {session_id}: {e}")
+        with cls._lock:
+            cls._finished_at.pop(session_id, None)
+            cls._sizes.pop(session_id, None)
+            return cls._sessions.pop(session_id, None) is not None
+
+    # ---- 内存淘汰 ----
+
+    @classmethod
+    def _size_of(cls, session: PaperSession) -> int:
+        if session.status not in TERMINAL_STATUSES:
+            return estimate_session_size(session)
+        if session.id not in cls._sizes:
+            cls._sizes[session.id] = estimate_session_size(session)
+        return cls._sizes[session.id]
+
+    @classmethod
+    def _evict_one(cls, session_id: str, reason: str) -> None:
+        cls._sessions.pop(session_id, None)
+        cls._finished_at.pop(session_id, None)
+        cls._sizes.pop(session_id, None)
+        cls._evictions[reason] += 1
+
+    @classmethod
+    def evict(cls, now: Optional[float] = None) -> int:
+        """
+        淘汰已结束的会话，返回淘汰数量：
+        1. 结束超过 session_ttl 秒的（同时删除共享存储里的快照，状态改由 PaperRecord 提供）
+        2. 会话总数超过 max_sessions 时，按 LRU 淘汰
+        3. 估算总字节数超过 max_bytes 时，按 LRU 淘汰
+        LRU / 字节淘汰只释放本进程内存，快照保留，/status 仍能查到结束状态；
+        这些快照（以及崩溃进程留下的快照）由共享存储按 updated_at / 心跳在 session_ttl 后统一清理。
+        """
+        now = time.time() if now is None else now
+        expired = []
+        evicted = 0
+        with cls._lock:
+            for session_id, finished_at in list(cls._finished_at.items()):
+                if now - finished_at > cls.session_ttl:
+                    cls._evict_one(session_id, "ttl")
+                    expired.append(session_id)
+
+            # 按 LRU 顺序排列的可淘汰会话（最久未访问的在前）
+            candidates = [sid for sid, s in cls._sessions.items() if s.status in TERMINAL_STATUSES]
+            while len(cls._sessions) > cls.max_sessions and candidates:
+                cls._evict_one(candidates.pop(0), "lru")
+                evicted += 1
+
+            resident = sum(cls._size_of(s) for s in cls._sessions.values())
+            while resident > cls.max_bytes and candidates:
+                session_id = candidates.pop(0)
+                resident -= cls._size_of(cls._sessions[session_id])
+                cls._evict_one(session_id, "bytes")
+                evicted += 1
+
+        for session_id in expired:
+            try:
+                cls._store.delete(session_id)
+            except Exception as e:
+                print(f"[Session] 删除过期会话状态失败 {session_id}: {e}")
+        if now - cls._last_expire > cls.expire_interval:
+            cls._last_expire = now
+            try:
+                cls._store.expire(now - cls.session_ttl)
+            except Exception as e:
+                print(f"[Session] 清理过期会话快照失败: {e}")
+        evicted += len(expired)
+        if evicted:
+            print(f"[Session] 淘汰 {evicted} 个已结束会话，常驻约 {resident / 1024 / 1024:.1f}MB")
+        return evicted
+
+    @classmethod
+    def stats(cls) -> dict:
+        """内存占用与淘汰统计（/health 暴露）"""
+        cls.evict()
+        with cls._lock:
+            sessions = list(cls._sessions.values())
+            return {
+                "sessions": len(sessions),
+                "active": sum(1 for s in sessions if s.status not in TERMINAL_STATUSES),
+                "resident_bytes": sum(cls._size_of(s) for s in sessions),
+                "max_bytes": cls.max_bytes,
+                "max_sessions": cls.max_sessions,
+                "evictions": dict(cls._evictions),
+            }
+
+    @classmethod
+    def _heartbeat_loop(cls) -> None:
+        """定期为本进程进行中的会话刷新心跳"""
+        while True:
+            time.sleep(cls.heartbeat_interval)
+            active = [sid for sid, s in list(cls._sessions.items()) if s.status not in TERMINAL_STATUSES]
+            if not active:
+                continue
+            try:
+                cls._store.heartbeat(active)
+            except Exception as e:
+                print(f"[Session] 心跳更新失败: {e}")
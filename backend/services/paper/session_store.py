@@ -0,0 +1,169 @@
+"""
+会话状态共享存储 — SessionManager 的跨进程后端
+完整的 PaperSession（VFS、正文、PDF 字节）只留在运行它的 worker 进程内；
+这里只共享轻量快照（状态、进度详情、章节进度、心跳），
+使任意 gunicorn worker 都能回答 /api/paper/<id>/status，
+并能区分"别的 worker 正在生成"和"所属进程已经不在（任务中断）"。
+- MemorySessionStore: 进程内字典（单 worker / 测试，默认）
+- SQLiteSessionStore: 本机共享 SQLite 文件（WAL 模式，多 worker）
+Redis 等其他共享存储实现 SessionStore 的 put / get / delete / heartbeat / expire 即可接入。
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+
+
+class SessionStore(ABC):
+    """会话快照存储抽象基类，快照是可 JSON 序列化的 dict，必须包含 id"""
+
+    name = "base"
+    # 是否跨进程共享；共享存储才需要心跳
+    shared = False
+
+    @abstractmethod
+    def put(self, snapshot: dict) -> None:
+        """写入 / 覆盖快照，同时刷新心跳"""
+
+    @abstractmethod
+    def get(self, session_id: str) -> dict | None:
+        """读取快照（含 heartbeat_at，unix 时间戳）"""
+
+    @abstractmethod
+    def delete(self, session_id: str) -> None:
+        """删除快照"""
+
+    @abstractmethod
+    def heartbeat(self, session_ids: list[str]) -> None:
+        """批量刷新心跳（只更新 heartbeat_at，不改快照内容）"""
+
+    @abstractmethod
+    def expire(self, before: float) -> int:
+        """删除 before 之前就不再更新、也没有心跳的快照，返回删除数量"""
+
+
+class MemorySessionStore(SessionStore):
+    """进程内存储：单 worker 部署时与原来的行为一致"""
+
+    name = "memory"
+
+    def __init__(self):
+        self._snapshots: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def put(self, snapshot):
+        with self._lock:
+            now = time.time()
+            self._snapshots[snapshot["id"]] = {**snapshot, "heartbeat_at": now, "updated_at": now}
+
+    def get(self, session_id):
+        with self._lock:
+            snapshot = self._snapshots.get(session_id)
+            return dict(snapshot) if snapshot else None
+
+    def delete(self, session_id):
+        with self._lock:
+            self._snapshots.pop(session_id, None)
+
+    def heartbeat(self, session_ids):
+        now = time.time()
+        with self._lock:
+            for session_id in session_ids:
+                if session_id in self._snapshots:
+                    self._snapshots[session_id]["heartbeat_at"] = now
+
+    def expire(self, before):
+        with self._lock:
+            stale = [
+                sid for sid, s in self._snapshots.items()
+                if s["updated_at"] < before and s["heartbeat_at"] < before
+            ]
+            for session_id in stale:
+                del self._snapshots[session_id]
+            return len(stale)
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    SQLite 共享存储：同一台机器上的多个 worker 共用一个数据库文件。
+    WAL 模式下跨进程读写互不阻塞；进程内只开一条连接、用锁串行访问
+    （gevent 下每个请求都是新 greenlet，按线程开连接会无限增长且永不关闭）。
+    """
+
+    name = "sqlite"
+    shared = True
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=5.0, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS paper_sessions ("
+            " id TEXT PRIMARY KEY,"
+            " data TEXT NOT NULL,"
+            " heartbeat_at REAL NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def put(self, snapshot):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO paper_sessions (id, data, heartbeat_at, updated_at) VALUES (?, ?, ?, ?)",
+                (snapshot["id"], json.dumps(snapshot, ensure_ascii=False), now, now),
+            )
+
+    def get(self, session_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data, heartbeat_at FROM paper_sessions WHERE id = ?", (session_id,)
+            ).fetchone()
+        if not row:
+            return None
+        return {**json.loads(row[0]), "heartbeat_at": row[1]}
+
+    def delete(self, session_id):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM paper_sessions WHERE id = ?", (session_id,))
+
+    def heartbeat(self, session_ids):
+        if not session_ids:
+            return
+        placeholders = ",".join("?" * len(session_ids))
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"UPDATE paper_sessions SET heartbeat_at = ? WHERE id IN ({placeholders})",
+                (time.time(), *session_ids),
+            )
+
+    def expire(self, before):
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "DELETE FROM paper_sessions WHERE updated_at < ? AND heartbeat_at < ?", (before, before),
+            )
+        return cursor.rowcount
+
+    def close(self) -> None:
+        """关闭进程内的连接（测试 / 优雅退出用）"""
+        with self._lock:
+            self._conn.close()
+
+
+def get_session_store() -> SessionStore:
+    """工厂函数：根据 PAPER_SESSION_STORE 环境变量选择会话存储（默认 memory）"""
+    store_type = os.environ.get("PAPER_SESSION_STORE", "memory")
+
+    if store_type == "sqlite":
+        return SQLiteSessionStore(os.environ.get("PAPER_SESSION_DB") or "instance/paper_sessions.db")
+
+    if store_type != "memory":
+        print(f"[Session] 未知的 PAPER_SESSION_STORE={store_type}，使用 memory")
+    return MemorySessionStore()
@@ -0,0 +1,45 @@
+"""
+论文 pipeline 压测工具单元测试（零延迟桩服务，不调用 xelatex）
+"""
+
+import json
+
+import httpx
+
+from .bench import StubLLMServer, canned_response, format_report, run_benchmark
+
+
+def test_canned_chapter_follows_sections_and_target_words():
+    prompt = "撰写学术论文章节\n章节标题: 方法\n子节: 问题定义, 主要方法\n目标字数: 600\n<<<SUMMARY>>>"
+
+    text = canned_response(prompt)
+
+    assert text.startswith("问题定义")
+    assert "\n主要方法\n" in text
+    assert len(text) >= 600
+    assert text.rstrip().endswith("<<<END>>>")
+
+
+def test_stub_streams_chunks_with_usage():
+    with StubLLMServer() as stub:
+        payload = {"messages": [{"role": "user", "content": "请生成模拟参考文献"}], "stream": True}
+        with httpx.stream("POST", f"{stub.url}/v1/chat/completions", json=payload) as response:
+            lines = [line[6:] for line in response.iter_lines() if line.startswith("data: ")]
+
+    assert lines[-1] == "[DONE]"
+    events = [json.loads(line) for line in lines[:-1]]
+    content = "".join(e["choices"][0]["delta"]["content"] for e in events if e["choices"])
+    assert len(json.loads(content)) == 8
+    assert events[-1]["usage"]["completion_tokens"] > 0
+
+
+def test_run_benchmark_reports_stages():
+    with StubLLMServer(chapters=2, words=200) as stub:
+        report = run_benchmark(stub, papers=2, concurrency=2, use_latex=False)
+
+    assert report["completed"] == 2
+    assert report["failed"] == 0
+    assert report["papers_per_hour"] > 0
+    assert report["llm_requests"] == 2 * report["llm_calls_per_paper"]
+    assert {"total", "research", "plan", "write_format", "compile", "persist"} <= set(report["stages"])
+    assert "完成 2/2 篇" in format_report(report)
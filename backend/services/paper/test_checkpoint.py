@@ -0,0 +1,73 @@
+"""
+检查点（断点续写）单元测试
+"""
+
+from ..storage import StorageService
+from ..storage_backends import MemoryBackend
+from .checkpoint import checkpoint_key, delete_checkpoint, has_checkpoint, load_checkpoint, save_checkpoint
+from .session import PaperSession
+
+
+def _storage() -> StorageService:
+    return StorageService(MemoryBackend())
+
+
+def _session() -> PaperSession:
+    session = PaperSession(id="p1", user_id="u1", topic="图神经网络综述")
+    session.literature = [{"title": "GCN", "year": 2017}]
+    session.literature_summary = "综述"
+    session.file_plan = {"title": "GNN", "outline": {"chapters/01_intro.tex": {"title": "引言"}}}
+    session.content = {"chapters/01_intro.tex": "引言正文"}
+    session.chapter_status = {"chapters/01_intro.tex": "formatted"}
+    session.vfs.write("main.tex", "\\documentclass{article}")
+    session.vfs.write("chapters/01_intro.tex", "\\section{引言}")
+    return session
+
+
+def test_round_trip_restores_intermediate_state():
+    storage = _storage()
+    original = _session()
+
+    assert save_checkpoint(original, storage, "planned")
+    assert original.checkpoint_stage == "planned"
+
+    restored = load_checkpoint("p1", storage)
+
+    assert restored.user_id == "u1"
+    assert restored.topic == "图神经网络综述"
+    assert restored.literature == original.literature
+    assert restored.literature_summary == "综述"
+    assert restored.file_plan == original.file_plan
+    assert restored.content == original.content
+    assert restored.chapter_status == original.chapter_status
+    assert restored.vfs.get_all() == original.vfs.get_all()
+    assert restored.checkpoint_stage == "planned"
+    assert restored.created_at == original.created_at
+
+
+def test_load_missing_or_corrupt_checkpoint_returns_none():
+    storage = _storage()
+    assert load_checkpoint("missing", storage) is None
+
+    storage.upload_bytes(b"not gzip", checkpoint_key("bad"))
+    assert load_checkpoint("bad", storage) is None
+
+
+def test_save_failure_does_not_raise():
+    class BrokenStorage:
+        def upload_bytes(self, *args, **kwargs):
+            raise RuntimeError("s3 down")
+
+    session = _session()
+
+    assert save_checkpoint(session, BrokenStorage(), "researched") is False
+    assert session.checkpoint_stage == ""
+
+
+def test_has_and_delete_checkpoint():
+    storage = _storage()
+    save_checkpoint(_session(), storage, "formatted")
+
+    assert has_checkpoint("p1", storage)
+    delete_checkpoint("p1", storage)
+    assert not has_checkpoint("p1", storage)
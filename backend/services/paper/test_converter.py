@@ -0,0 +1,122 @@
+"""
+纯文本 → LaTeX 本地转换器单元测试
+"""
+
+from .converter import (
+    PLACEHOLDER,
+    convert_inline,
+    convert_plaintext,
+    escape_latex,
+    fill_placeholders,
+    is_hard_paragraph,
+)
+
+
+# --- escape / inline ---
+
+
+def test_escape_latex_special_characters():
+    assert escape_latex("50% & #1 a_b {x} ~ ^ $") == (
+        r"50\% \& \#1 a\_b \{x\} \textasciitilde{} \textasciicircum{} \$"
+    )
+
+
+def test_escape_latex_backslash():
+    assert escape_latex("a\\b") == r"a\textbackslash{}b"
+
+
+def test_convert_inline_cites():
+    assert convert_inline("已有研究[ref1]。") == r"已有研究\cite{ref1}。"
+
+
+def test_convert_inline_merges_adjacent_and_listed_cites():
+    assert convert_inline("见[ref1][ref2]与[ref3, ref4]") == r"见\cite{ref1,ref2}与\cite{ref3,ref4}"
+    assert convert_inline("[ref5，ref6]") == r"\cite{ref5,ref6}"
+
+
+def test_convert_inline_bold():
+    assert convert_inline("**重点**_内容") == r"\textbf{重点}\_内容"
+
+
+# --- 难段落识别 ---
+
+
+def test_plain_paragraph_is_easy():
+    assert not is_hard_paragraph("Transformer 在 2017 年提出[ref1]，随后被广泛应用。")
+
+
+def test_math_paragraphs_are_hard():
+    assert is_hard_paragraph("损失函数为 L = -log p(y|x)。")
+    assert is_hard_paragraph("复杂度为 O(n^2)。")
+    assert is_hard_paragraph("其中 x_i 表示第 i 个样本。")
+    assert is_hard_paragraph("注意力权重满足 ∑ a = 1。")
+    assert is_hard_paragraph("已有公式 $a+b$。")
+
+
+def test_lists_tables_and_odd_cites_are_hard():
+    assert is_hard_paragraph("- 第一点")
+    assert is_hard_paragraph("(1) 数据预处理")
+    assert is_hard_paragraph("| 模型 | 准确率 |")
+    assert is_hard_paragraph("见 [ref1-ref3]。")
+
+
+# --- 整章转换 ---
+
+
+def test_convert_plaintext_fully_local():
+    content = (
+        "引言\n\n"
+        "研究背景\n"
+        "深度学习发展迅速[ref1]。\n"
+        "研究者提出了多种方法。\n\n"
+        "## 问题定义\n"
+        "本文关注图像分类问题。"
+    )
+
+    result = convert_plaintext("引言", content, ["研究背景", "问题定义"])
+
+    assert result.complete
+    assert result.latex == (
+        "\\section{引言}\n\n"
+        "\\subsection{研究背景}\n\n"
+        "深度学习发展迅速\\cite{ref1}。\n\n"
+        "研究者提出了多种方法。\n\n"
+        "\\subsection{问题定义}\n\n"
+        "本文关注图像分类问题。\n"
+    )
+
+
+def test_convert_plaintext_joins_wrapped_lines():
+    result = convert_plaintext("引言", "这是一个被折行的\n句子。", [])
+
+    assert "这是一个被折行的句子。" in result.latex
+
+
+def test_convert_plaintext_numbered_headings():
+    result = convert_plaintext("方法", "1.1 模型结构\n正文。\n\n1.1.1 编码器\n正文。", ["模型结构"])
+
+    assert "\\subsection{模型结构}" in result.latex
+    assert "\\subsubsection{编码器}" in result.latex
+
+
+def test_convert_plaintext_marks_hard_paragraphs():
+    content = "**方法概述**\n模型很简单。\n\n损失为 L = a + b。"
+
+    result = convert_plaintext("方法", content, ["方法概述"])
+
+    assert not result.complete
+    assert result.hard_paragraphs == ["损失为 L = a + b。"]
+    assert PLACEHOLDER.format(0) in result.latex
+
+
+def test_convert_plaintext_ambiguous_without_headings():
+    result = convert_plaintext("方法", "第一段。\n\n第二段。", ["模型", "训练"])
+
+    assert result.ambiguous
+    assert not result.complete
+
+
+def test_fill_placeholders():
+    latex = f"\\section{{x}}\n\n{PLACEHOLDER.format(0)}\n\n{PLACEHOLDER.format(1)}\n"
+
+    assert fill_placeholders(latex, ["$a$ ", "$b$"]) == "\\section{x}\n\n$a$\n\n$b$\n"
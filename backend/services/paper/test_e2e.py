@@ -58,7 +58,7 @@ def _make_smart_llm():
     """Create an LLM mock that returns context-appropriate responses."""
     llm = MagicMock()
 
-    def smart_complete(messages, model=None):
+    def smart_complete(messages, model=None, **kwargs):
         prompt = messages[0]["content"] if messages else ""
 
         # Planner: file plan (check BEFORE researcher summary — planner prompt also contains 文献综述摘要)
@@ -129,7 +129,9 @@ class TestCompleteFlow:
 
     def test_completed_last(self):
         events, _ = self._run()
-        assert events[-1]["type"] == "completed"
+        # completed 之后只跟一条 timings 收尾事件
+        assert events[-2]["type"] == "completed"
+        assert events[-1]["type"] == "timings"
 
     def test_progress_events_emitted(self):
         events, _ = self._run()
@@ -0,0 +1,88 @@
+"""
+VFS 局部编辑工具（read_range / edit_file）单元测试
+"""
+
+import pytest
+
+from .edits import EditError, apply_replacements, apply_unified_diff, make_tool_handler, read_range
+from .vfs import VirtualFileSystem
+
+CONTENT = "\n".join(f"line {n}" for n in range(1, 11))
+
+
+def test_read_range_numbers_lines_and_clamps_end():
+    text = read_range(CONTENT, 9, 20)
+
+    assert text == "（第 9-10 行，共 10 行）\n9| line 9\n10| line 10"
+    with pytest.raises(EditError):
+        read_range(CONTENT, 11)
+
+
+def test_replacements_apply_in_order():
+    result = apply_replacements(CONTENT, [
+        {"search": "line 2\n", "replace": "LINE 2\n"},
+        {"search": "LINE 2\nline 3", "replace": "merged"},
+    ])
+
+    assert result.split("\n")[:3] == ["line 1", "merged", "line 4"]
+
+
+def test_replacements_reject_missing_or_ambiguous_search():
+    with pytest.raises(EditError, match="不存在"):
+        apply_replacements(CONTENT, [{"search": "nope", "replace": "x"}])
+    with pytest.raises(EditError, match="出现了"):
+        apply_replacements(CONTENT, [{"search": "line 1", "replace": "x"}])  # line 1 / line 10
+
+
+def test_unified_diff_with_shifted_line_numbers():
+    diff = (
+        "--- a/chapters/01.tex\n"
+        "+++ b/chapters/01.tex\n"
+        "@@ -3,3 +3,3 @@\n"  # 实际在第 5 行，按上下文就近匹配
+        " line 4\n"
+        "-line 5\n"
+        "+LINE 5\n"
+        " line 6\n"
+        "@@ -9,0 +9,1 @@\n"
+        "+inserted\n"
+    )
+
+    lines = apply_unified_diff(CONTENT, diff).split("\n")
+
+    assert lines[4] == "LINE 5"
+    assert lines[9] == "inserted"
+    assert len(lines) == 11
+
+
+def test_unified_diff_context_mismatch_raises():
+    with pytest.raises(EditError, match="不匹配"):
+        apply_unified_diff(CONTENT, "@@ -1,2 +1,2 @@\n-line 1\n-line X\n+a\n+b\n")
+
+
+def test_edit_file_is_atomic():
+    vfs = VirtualFileSystem()
+    vfs.write("a.tex", CONTENT)
+    modified: list[str] = []
+    handler = make_tool_handler(vfs, modified)
+
+    result = handler("edit_file", {"path": "a.tex", "edits": [
+        {"search": "line 2", "replace": "ok"},
+        {"search": "missing", "replace": "x"},
+    ]})
+
+    assert result.startswith("错误")
+    assert vfs.read("a.tex") == CONTENT
+    assert modified == []
+
+    handler("edit_file", {"path": "a.tex", "edits": [{"search": "line 2\n", "replace": "ok\n"}]})
+    assert vfs.read("a.tex").startswith("line 1\nok\nline 3")
+    assert modified == ["a.tex"]
+
+
+def test_tool_handler_read_range_and_missing_file():
+    vfs = VirtualFileSystem()
+    vfs.write("a.tex", CONTENT)
+    handler = make_tool_handler(vfs, [])
+
+    assert handler("read_range", {"path": "a.tex", "start": 2, "end": "3"}).endswith("2| line 2\n3| line 3")
+    assert handler("edit_file", {"path": "b.tex", "edits": []}) == "错误: 文件 b.tex 不存在"
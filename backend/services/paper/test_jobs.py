@@ -0,0 +1,257 @@
+"""
+JobRunner（论文后台任务）单元测试
+"""
+
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from app import app
+from models import db, PaperJob, PaperJobEvent
+from .jobs import JobConflictError, JobRunner, current_cancel
+
+
+@pytest.fixture
+def runner():
+    app.config["TESTING"] = True
+    with app.app_context():
+        db.create_all()
+        job_runner = JobRunner(app, max_workers=2, poll_interval=0.01)
+        yield job_runner
+        job_runner.join(timeout=5)
+        db.session.remove()
+        PaperJobEvent.query.delete()
+        PaperJob.query.delete()
+        db.session.commit()
+
+
+def _events(*types):
+    for i, event_type in enumerate(types):
+        yield {"type": event_type, "session_id": "p1", "n": i}
+
+
+def test_job_runs_in_background_and_records_events(runner):
+    job_id = runner.submit("generate", _events("session_created", "progress", "completed"), user_id="u1")
+
+    events = [e for e in runner.attach(job_id) if e is not None]
+    assert runner.join(timeout=5)
+
+    assert [e["type"] for e in events] == ["session_created", "progress", "completed"]
+    assert [e["seq"] for e in events] == [1, 2, 3]
+    job = runner.get(job_id)
+    assert job["status"] == "completed"
+    assert job["paper_id"] == "p1"
+    assert job["last_seq"] == 3
+    assert PaperJobEvent.query.filter_by(job_id=job_id).count() == 3
+
+
+def test_attach_after_replays_only_newer_events_from_log(runner):
+    job_id = runner.submit("generate", _events("session_created", "progress", "progress", "completed"))
+    runner.join(timeout=5)
+
+    # 任务已结束：从事件表回放
+    events = list(runner.attach(job_id, after=2))
+
+    assert [e["seq"] for e in events] == [3, 4]
+    assert events[-1]["type"] == "completed"
+
+
+def test_detach_does_not_stop_job(runner):
+    gate = threading.Event()
+
+    def slow_events():
+        yield {"type": "session_created", "session_id": "p1"}
+        gate.wait(timeout=5)
+        yield {"type": "completed", "session_id": "p1"}
+
+    job_id = runner.submit("generate", slow_events())
+    stream = runner.attach(job_id)
+    assert next(stream)["type"] == "session_created"
+    stream.close()  # 客户端断开
+
+    gate.set()
+    assert runner.join(timeout=5)
+    assert runner.get(job_id)["status"] == "completed"
+
+
+def test_failed_pipeline_marks_job_failed(runner):
+    def broken():
+        yield {"type": "session_created", "session_id": "p1"}
+        raise RuntimeError("boom")
+
+    job_id = runner.submit("generate", broken())
+    events = [e for e in runner.attach(job_id) if e is not None]
+    runner.join(timeout=5)
+
+    assert events[-1]["type"] == "error"
+    assert "boom" in events[-1]["message"]
+    job = runner.get(job_id)
+    assert job["status"] == "failed"
+    assert "boom" in job["error"]
+
+
+def test_error_event_without_exception_marks_job_failed(runner):
+    job_id = runner.submit("generate", _events("session_created", "error"))
+    runner.join(timeout=5)
+
+    assert runner.get(job_id)["status"] == "failed"
+
+
+def test_stale_job_from_dead_worker_is_marked_interrupted(runner):
+    db.session.add(PaperJob(
+        id="stale-job", kind="generate", paper_id="p9", status="running",
+        heartbeat_at=datetime.utcnow() - timedelta(minutes=10),
+    ))
+    db.session.commit()
+
+    events = list(runner.attach("stale-job"))
+
+    assert events[-1]["type"] == "error"
+    assert events[-1]["session_id"] == "p9"
+    assert runner.get("stale-job")["status"] == "interrupted"
+
+
+def test_trailing_timings_event_does_not_change_result(runner):
+    job_id = runner.submit("generate", _events("session_created", "completed", "timings"))
+    runner.join(timeout=5)
+
+    assert runner.get(job_id)["status"] == "completed"
+
+
+def test_stale_queued_job_is_marked_interrupted(runner):
+    db.session.add(PaperJob(
+        id="queued-job", kind="resume", paper_id="p9", status="queued",
+        created_at=datetime.utcnow() - timedelta(minutes=10),
+        heartbeat_at=datetime.utcnow() - timedelta(minutes=10),
+    ))
+    db.session.commit()
+
+    events = list(runner.attach("queued-job"))
+
+    assert events[-1]["type"] == "error"
+    assert runner.get("queued-job")["status"] == "interrupted"
+
+
+def test_submit_rejects_second_job_for_same_paper(runner):
+    gate = threading.Event()
+
+    def slow_events():
+        gate.wait(timeout=5)
+        yield {"type": "completed", "session_id": "p1"}
+
+    first = runner.submit("resume", slow_events(), paper_id="p1")
+    with pytest.raises(JobConflictError) as excinfo:
+        runner.submit("revise", _events("completed"), paper_id="p1")
+    assert excinfo.value.job_id == first
+
+    gate.set()
+    assert runner.join(timeout=5)
+    # 前一个任务结束后可以再提交
+    runner.submit("revise", _events("completed"), paper_id="p1")
+    assert runner.join(timeout=5)
+
+
+def test_stale_job_does_not_block_submit(runner):
+    db.session.add(PaperJob(
+        id="dead-job", kind="resume", paper_id="p1", status="running", active_key="paper:p1",
+        heartbeat_at=datetime.utcnow() - timedelta(minutes=10),
+    ))
+    db.session.commit()
+
+    runner.submit("revise", _events("completed"), paper_id="p1")
+    runner.join(timeout=5)
+
+    assert runner.get("dead-job")["status"] == "interrupted"
+
+
+def test_active_key_is_unique_across_processes(runner):
+    # 另一个 worker 进程刚写入、心跳正常的同一篇论文任务（本进程 _live 里没有）
+    db.session.add(PaperJob(id="other-worker", kind="resume", paper_id="p1", status="running", active_key="paper:p1"))
+    db.session.commit()
+
+    with pytest.raises(JobConflictError) as excinfo:
+        runner.submit("revise", _events("completed"), paper_id="p1")
+    assert excinfo.value.job_id == "other-worker"
+
+    # 数据库层面同样拒绝第二个占用同一 active_key 的任务
+    db.session.add(PaperJob(id="dup", kind="revise", paper_id="p1", status="queued", active_key="paper:p1"))
+    with pytest.raises(IntegrityError):
+        db.session.commit()
+    db.session.rollback()
+
+
+def test_generate_dedupes_on_key_and_releases_it_when_done(runner):
+    gate = threading.Event()
+
+    def slow_events():
+        gate.wait(timeout=5)
+        yield {"type": "completed", "session_id": "p1"}
+
+    first = runner.submit("generate", slow_events(), user_id="u1", dedupe_key="u1:topic")
+    with pytest.raises(JobConflictError) as excinfo:
+        runner.submit("generate", _events("completed"), user_id="u1", dedupe_key="u1:topic")
+    assert excinfo.value.job_id == first
+    # 不同主题不受影响
+    runner.submit("generate", _events("completed"), user_id="u1", dedupe_key="u1:other")
+
+    gate.set()
+    assert runner.join(timeout=5)
+    assert PaperJob.query.get(first).active_key is None
+    runner.submit("generate", _events("completed"), user_id="u1", dedupe_key="u1:topic")
+    assert runner.join(timeout=5)
+
+
+def test_prune_removes_old_jobs_and_their_events(runner):
+    old = datetime.utcnow() - timedelta(days=30)
+    db.session.add(PaperJob(id="old-done", kind="generate", status="completed", finished_at=old))
+    db.session.add(PaperJob(id="old-dead", kind="generate", status="running", heartbeat_at=old))
+    db.session.add(PaperJobEvent(job_id="old-done", seq=1, type="completed", data="{}"))
+    db.session.commit()
+    recent = runner.submit("generate", _events("session_created", "completed"))
+    runner.join(timeout=5)
+
+    assert runner.prune() == 2
+
+    assert runner.get("old-done") is None and runner.get("old-dead") is None
+    assert PaperJobEvent.query.filter_by(job_id="old-done").count() == 0
+    assert runner.get(recent)["status"] == "completed"
+
+
+def test_cancel_stops_job_and_exposes_signal_to_pipeline(runner):
+    started, seen = threading.Event(), {}
+
+    def slow_events():
+        seen["cancel"] = current_cancel()
+        yield {"type": "session_created", "session_id": "p1"}
+        started.set()
+        seen["cancel"].wait(timeout=5)
+        try:
+            yield {"type": "progress", "session_id": "p1"}
+            yield {"type": "completed", "session_id": "p1"}
+        except GeneratorExit:
+            seen["closed"] = True
+            raise
+
+    job_id = runner.submit("generate", slow_events())
+    assert started.wait(timeout=5)
+    assert runner.cancel(job_id)
+    events = [e for e in runner.attach(job_id) if e is not None]
+    assert runner.join(timeout=5)
+
+    assert seen["closed"]
+    assert [e["type"] for e in events] == ["session_created", "progress", "error"]
+    assert runner.get(job_id)["status"] == "cancelled"
+    assert current_cancel() is None
+    # 已结束的任务不能再取消
+    assert not runner.cancel(job_id)
+
+
+def test_cancel_job_of_other_process_is_handed_over_by_heartbeat(runner):
+    db.session.add(PaperJob(id="remote-job", kind="generate", paper_id="p9", status="running"))
+    db.session.commit()
+
+    assert runner.cancel("remote-job")
+    assert runner.get("remote-job")["status"] == "cancelling"
+    assert not runner.cancel("missing-job")
@@ -0,0 +1,237 @@
+"""
+编译错误定位与 LocalCompiler 增量编译单元测试（不调用 xelatex）
+"""
+
+import os
+import re
+import subprocess
+from pathlib import Path
+
+import pytest
+
+from .latex import LocalCompiler, extract_errors, locate_errors
+
+FILES = {"main.tex": "", "chapters/01_intro.tex": "", "chapters/02_method.tex": "", "refs.bib": ""}
+
+
+def test_file_stack_maps_error_to_innermost_vfs_file():
+    log = (
+        "=== xelatex pass 1 ===\n"
+        "(./main.tex\n"
+        "(/usr/share/texlive/texmf-dist/tex/latex/base/article.cls\n"
+        "Document Class: article 2022/07/02 v1.4n Standard LaTeX document class\n"
+        "(/usr/share/texlive/texmf-dist/tex/latex/base/size12.clo))\n"
+        "(./main.aux) (./chapters/01_intro.tex) (./chapters/02_method.tex\n"
+        "! Undefined control sequence.\n"
+        "l.17 这里有一个 \\badcommand\n"
+        "                          (见表 1\n"
+        "! Emergency stop.\n"
+    )
+
+    locations = locate_errors(log, FILES)
+
+    assert [(loc.path, loc.line, loc.message) for loc in locations] == [
+        ("chapters/02_method.tex", 17, "Undefined control sequence."),
+    ]
+
+
+def test_file_line_error_format():
+    log = (
+        "(./main.tex (./chapters/01_intro.tex\n"
+        "./chapters/01_intro.tex:42: Missing $ inserted.\n"
+        "<inserted text>\n"
+        "l.42 a_b\n"
+    )
+
+    assert [str(loc) for loc in locate_errors(log, FILES)] == ["chapters/01_intro.tex:42: Missing $ inserted."]
+    assert "l.42 a_b" in extract_errors(log)
+
+
+def test_error_inside_package_falls_back_to_including_file_without_line():
+    log = (
+        "(./main.tex (./chapters/01_intro.tex) (/usr/share/texlive/hyperref.sty\n"
+        "! Package hyperref Error: Wrong DVI mode driver option.\n"
+        "l.4200 \\foo\n"
+    )
+
+    locations = locate_errors(log, FILES)
+
+    assert [(loc.path, loc.line) for loc in locations] == [("main.tex", None)]
+
+
+def test_bibtex_error_line():
+    log = "=== bibtex ===\nI was expecting a `,' or a `}'---line 5 of file refs.bib\n"
+
+    locations = locate_errors(log, FILES)
+
+    assert [(loc.path, loc.line) for loc in locations] == [("refs.bib", 5)]
+
+
+def test_unknown_files_and_empty_log():
+    assert locate_errors("", FILES) == []
+    assert locate_errors("(./other.tex\n! Undefined control sequence.\nl.3 x\n", FILES) == []
+
+
+# --- LocalCompiler 增量编译（用假的 xelatex / bibtex 代替真实命令）---
+
+
+@pytest.fixture
+def fake_tex(monkeypatch):
+    """
+    假 xelatex：按所有 .tex 中的 \\cite 写 .aux（.bbl 存在时附带 \\bibcite，模拟引用被解析）并输出 PDF，
+    源码中含 \\bad 时失败；假 bibtex：按 .aux 的引用写 .bbl。返回调用的命令名列表。
+    """
+    calls: list[str] = []
+
+    def run(args, cwd, timeout, **span_attrs):
+        workdir = Path(cwd)
+        calls.append(args[0])
+        if args[0] == "bibtex":
+            aux = (workdir / "main.aux").read_text()
+            cites = re.findall(r"\\citation\{(.*?)\}", aux)
+            (workdir / "main.bbl").write_text("".join(f"\\bibitem{{{c}}}\n" for c in cites))
+            return subprocess.CompletedProcess(args, 0, stdout="bibtex ok", stderr="")
+
+        source = "".join(p.read_text() for p in sorted(workdir.rglob("*.tex")))
+        if "\\bad" in source:
+            (workdir / "main.aux").write_text("\\relax\n\\citation{ha")
+            return subprocess.CompletedProcess(args, 1, stdout="./main.tex:3: Undefined control sequence.", stderr="")
+        cites = sorted(set(re.findall(r"\\cite\{(.*?)\}", source)))
+        lines = ["\\relax"] + [f"\\citation{{{c}}}" for c in cites]
+        if "\\bibliography{" in source:
+            lines += ["\\bibstyle{plain}", "\\bibdata{refs}"]
+        bbl = workdir / "main.bbl"
+        if bbl.exists():
+            lines += [f"\\bibcite{{{c}}}{{1}}" for c in cites if c in bbl.read_text()]
+        (workdir / "main.aux").write_text("\n".join(lines))
+        (workdir / "main.pdf").write_bytes(b"%PDF-" + source.encode())
+        return subprocess.CompletedProcess(args, 0, stdout="Output written on main.pdf", stderr="")
+
+    monkeypatch.setattr(LocalCompiler, "_run", staticmethod(run))
+    return calls
+
+
+def _paper(chapter: str = "正文 \\cite{ref1}") -> dict:
+    return {
+        "main.tex": "\\begin{document}\n\\input{chapters/01}\n\\bibliography{refs}\n\\end{document}",
+        "chapters/01.tex": chapter,
+        "refs.bib": "@article{ref1, title={A}}",
+    }
+
+
+def test_fresh_build_stops_when_aux_is_stable(fake_tex):
+    result = LocalCompiler().compile(_paper())
+
+    assert result.success and result.pdf_data.startswith(b"%PDF-")
+    # 第一遍 → bibtex → 第二遍解析引用（.aux 变化）→ 第三遍确认稳定
+    assert fake_tex == ["xelatex", "bibtex", "xelatex", "xelatex"]
+
+
+def test_no_bibdata_skips_bibtex(fake_tex):
+    files = {"main.tex": "\\begin{document}正文\\end{document}"}
+
+    result = LocalCompiler().compile(files)
+
+    assert result.success
+    assert fake_tex == ["xelatex", "xelatex"]
+    assert "bibtex 跳过" in result.log
+
+
+def test_persistent_build_reuses_aux_and_bbl(fake_tex, tmp_path):
+    compiler = LocalCompiler(build_root=str(tmp_path))
+    compiler.compile(_paper(), build_key="paper-1")
+    fake_tex.clear()
+
+    # 只改正文、引用不变：一遍 xelatex，bibtex 跳过
+    result = compiler.compile(_paper("改过的正文 \\cite{ref1}"), build_key="paper-1")
+    assert result.success and "改过的正文".encode() in result.pdf_data
+    assert fake_tex == ["xelatex"]
+    assert "引用与 .bib 未变化" in result.log
+
+    # 输入完全不变：直接复用上次的 PDF
+    fake_tex.clear()
+    assert compiler.compile(_paper("改过的正文 \\cite{ref1}"), build_key="paper-1").success
+    assert fake_tex == []
+
+    # 新增引用：重新跑 bibtex
+    fake_tex.clear()
+    compiler.compile(_paper("正文 \\cite{ref1} \\cite{ref2}"), build_key="paper-1")
+    assert fake_tex[:2] == ["xelatex", "bibtex"]
+
+
+def test_failed_build_discards_partial_aux(fake_tex, tmp_path):
+    compiler = LocalCompiler(build_root=str(tmp_path))
+
+    result = compiler.compile(_paper("\\bad"), build_key="paper-1")
+
+    assert not result.success
+    assert result.locations[0].path == "main.tex"
+    assert not (tmp_path / "paper-1" / "main.aux").exists()
+
+    fake_tex.clear()
+    assert compiler.compile(_paper(), build_key="paper-1").success
+    assert fake_tex[:2] == ["xelatex", "bibtex"]
+
+
+def test_removed_vfs_files_are_deleted_and_stale_dirs_pruned(fake_tex, tmp_path):
+    compiler = LocalCompiler(build_root=str(tmp_path), build_ttl=60)
+    files = {**_paper(), "chapters/02.tex": "旧章节"}
+    compiler.compile(files, build_key="paper-1")
+    compiler.compile(_paper(), build_key="paper-1")
+    assert not (tmp_path / "paper-1" / "chapters" / "02.tex").exists()
+
+    os.utime(tmp_path / "paper-1", (0, 0))
+    compiler.compile(_paper(), build_key="paper-2")
+    assert not (tmp_path / "paper-1").exists()
+
+
+def test_stale_pdf_is_not_returned_when_xelatex_writes_none(fake_tex, tmp_path, monkeypatch):
+    compiler = LocalCompiler(build_root=str(tmp_path))
+    assert compiler.compile(_paper(), build_key="paper-1").success
+
+    # xelatex 正常退出但没有写出 PDF：不能把上一次的 PDF 当作结果
+    real_run = LocalCompiler._run
+
+    def no_pdf(args, cwd, timeout, **attrs):
+        result = real_run(args, cwd, timeout, **attrs)
+        (Path(cwd) / "main.pdf").unlink(missing_ok=True)
+        return result
+
+    monkeypatch.setattr(LocalCompiler, "_run", staticmethod(no_pdf))
+    result = compiler.compile(_paper("新正文"), build_key="paper-1")
+
+    assert not result.success
+    assert result.error == "PDF file not generated"
+
+
+def test_same_build_key_compiles_serially(fake_tex, tmp_path, monkeypatch):
+    import threading
+    import time
+
+    compiler = LocalCompiler(build_root=str(tmp_path))
+    real_run = LocalCompiler._run
+    active, peak = [0], [0]
+    lock = threading.Lock()
+
+    def slow(args, cwd, timeout, **attrs):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.02)
+        try:
+            return real_run(args, cwd, timeout, **attrs)
+        finally:
+            with lock:
+                active[0] -= 1
+
+    monkeypatch.setattr(LocalCompiler, "_run", staticmethod(slow))
+    threads = [
+        threading.Thread(target=compiler.compile, args=(_paper(f"正文 {i} \\cite{{ref1}}"),), kwargs={"build_key": "p"})
+        for i in range(3)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert peak[0] == 1
@@ -0,0 +1,161 @@
+"""
+编译前 LaTeX 检查与自动修复单元测试
+"""
+
+from .lint import CompileStats, lint_bib, lint_tex, lint_vfs
+from .vfs import VirtualFileSystem
+
+
+def _fix(content: str, is_entry: bool = False) -> tuple[str, list[str]]:
+    fixed, issues = lint_tex("chapters/01.tex", content, is_entry=is_entry)
+    return fixed, [i.rule for i in issues]
+
+
+def test_escapes_specials_outside_math_and_identifiers():
+    fixed, rules = _fix("提升 15% 以上，R&D 投入 #1，a_b 见\\cite{ref_1}，公式 $x_i & y$。\n")
+
+    assert fixed == "提升 15\\% 以上，R\\&D 投入 \\#1，a\\_b 见\\cite{ref_1}，公式 $x_i & y$。\n"
+    assert rules == ["unescaped"] * 4
+
+
+def test_comments_and_math_environments_are_untouched():
+    content = "% 注释 a_b & c\n\\begin{align}\na_1 &= b_2\n\\end{align}\n"
+
+    fixed, rules = _fix(content)
+
+    assert fixed == content
+    assert rules == []
+
+
+def test_markdown_leftovers_are_converted():
+    fixed, rules = _fix("## 研究背景\n\n```\n**重点**内容。\n```\n")
+
+    assert fixed == "\\subsection{研究背景}\n\n\\textbf{重点}内容。\n"
+    assert set(rules) == {"markdown"}
+
+
+def test_lists_are_flattened_into_paragraphs():
+    fixed, _ = _fix("前文。\n\\begin{itemize}\n\\item 第一点\n\\item[术语] 解释\n\\end{itemize}\n后文。\n")
+
+    assert "itemize" not in fixed and "\\item" not in fixed
+    assert "第一点\n\n\\textbf{术语}：解释" in fixed
+
+
+def test_unbalanced_braces_are_reported_not_fixed():
+    content = "\\textbf{未闭合的加粗\n\n多余的括号}。\n"
+
+    fixed, issues = lint_tex("chapters/01.tex", content)
+
+    assert fixed == content
+    assert [(i.rule, i.fixed, i.line) for i in issues] == [("braces", False, 1), ("braces", False, 3)]
+
+
+def test_footnote_spanning_blank_line_is_untouched():
+    content = "正文\\footnote{第一段说明。\n\n第二段说明。}继续。\n"
+
+    fixed, issues = lint_tex("chapters/01.tex", content)
+
+    assert fixed == content
+    assert all(not i.fixed for i in issues)
+
+
+def test_ampersand_environments_are_untouched():
+    for env in ("tabularx", "longtable", "alignat", "flalign", "split", "cases", "pmatrix", "align*"):
+        args = "{\\linewidth}{XX}" if env == "tabularx" else "{2}" if env == "alignat" else ""
+        content = f"\\begin{{{env}}}{args}\na_1 & b_2 \\\\\nc & d\n\\end{{{env}}}\n"
+
+        fixed, rules = _fix(content)
+
+        assert fixed == content, env
+        assert rules == [], env
+
+
+def test_optional_arguments_are_untouched():
+    content = "见\\hyperref[sec_a]{第 1 节}，图\\ref{fig_b}。\n\\begin{figure}[h_t]\n\\end{figure}\n"
+
+    fixed, rules = _fix(content)
+
+    assert fixed == content
+    assert rules == []
+
+
+def test_ensuremath_hyperlink_and_verb_are_untouched():
+    for content in (
+        "值为 \\ensuremath{x_1 + y_{i_j}}。\n",
+        "见\\hyperlink{sec_a}{第一节}，\\hypertarget{sec_a}{引言}。\n",
+        "命令 \\verb|a_b#c| 与 \\verb+x_y+ 原样输出。\n",
+    ):
+        fixed, rules = _fix(content)
+
+        assert fixed == content, content
+        assert rules == [], content
+
+
+def test_commented_out_environment_is_not_balanced():
+    content = "% \\begin{figure} 暂时注释掉\n正文。\n\\begin{verbatim}\n\\end{table}\n\\end{verbatim}\n"
+
+    fixed, rules = _fix(content)
+
+    assert fixed == content
+    assert rules == []
+
+
+def test_environments_are_balanced():
+    fixed, rules = _fix("\\end{center}\n\\begin{quote}\n引用\n")
+
+    assert fixed == "\n\\begin{quote}\n引用\n\\end{quote}\n"
+    assert rules == ["environment", "environment"]
+
+
+def test_preamble_commands_removed_from_chapter_but_kept_in_entry():
+    content = "\\documentclass{article}\n\\begin{document}\n正文。\n\\end{document}\n"
+
+    chapter, rules = _fix(content)
+    entry, entry_rules = _fix(content, is_entry=True)
+
+    assert chapter == "正文。\n"
+    assert rules == ["preamble"] * 3
+    assert entry == content
+    assert entry_rules == []
+
+
+def test_unpaired_dollar_is_reported_not_fixed():
+    _, issues = lint_tex("chapters/01.tex", "价格 $5 元。\n")
+
+    assert [(i.rule, i.fixed, i.line) for i in issues] == [("math", False, 1)]
+
+
+def test_bib_fields_are_escaped_except_urls():
+    content = "@article{ref1,\n  title = {R&D at 50% scale},\n  url = {http://x.org/a_b}\n}"
+
+    fixed, issues = lint_bib("refs.bib", content)
+
+    assert "title = {R\\&D at 50\\% scale}," in fixed
+    assert "url = {http://x.org/a_b}" in fixed
+    assert len(issues) == 1
+
+
+def test_lint_vfs_writes_back_fixes_and_reports_remaining():
+    vfs = VirtualFileSystem()
+    vfs.write("main.tex", "\\documentclass{article}\n\\begin{document}\n\\input{chapters/01_intro}\n\\end{document}\n")
+    vfs.write("chapters/01_intro.tex", "\\section{引言}\n\n增长 30%，成本 $5。\n")
+
+    report = lint_vfs(vfs)
+
+    assert report.changed == ["chapters/01_intro.tex"]
+    assert "增长 30\\%" in vfs.read("chapters/01_intro.tex")
+    assert report.rule_counts() == {"unescaped": 1}
+    assert "chapters/01_intro.tex:3: [math]" in report.summary()
+
+
+def test_compile_stats_first_success_rate():
+    stats = CompileStats()
+    stats.record_compile(0, True)
+    stats.record_compile(0, False)
+    stats.record_compile(1, True)
+
+    result = stats.stats()
+
+    assert result["first_attempts"] == 2
+    assert result["first_success_rate"] == 0.5
+    assert result["retry_success"] == 1
@@ -0,0 +1,85 @@
+"""
+规划 JSON 容错解析与结构校验单元测试
+"""
+
+import json
+
+from .plan_schema import parse_json_object, validate_plan
+
+
+def _plan(**overrides) -> dict:
+    plan = {
+        "title": "测试论文",
+        "files": {"main.tex": "入口文件", "chapters/01_intro.tex": "引言"},
+        "outline": {
+            "chapters/01_intro.tex": {"title": "引言", "sections": ["背景"], "target_words": 800},
+            "chapters/02_end.tex": {"title": "结论", "sections": ["总结"], "depends_on": ["chapters/01_intro.tex"]},
+        },
+    }
+    plan.update(overrides)
+    return plan
+
+
+# --- parse_json_object ---
+
+
+def test_parse_plain_and_wrapped():
+    text = json.dumps({"a": 1})
+    assert parse_json_object(text) == {"a": 1}
+    assert parse_json_object(f"```json\n{text}\n```\n说明") == {"a": 1}
+    assert parse_json_object(f"结果如下：{text} 以上") == {"a": 1}
+
+
+def test_parse_trailing_commas():
+    assert parse_json_object('{"a": [1, 2,], "b": {"c": 3,},}') == {"a": [1, 2], "b": {"c": 3}}
+
+
+def test_parse_truncated_inside_string_and_after_key():
+    assert parse_json_object('{"a": 1, "b": "未写完') == {"a": 1, "b": "未写完"}
+    # 停在 "key": 处：回退到上一个逗号
+    assert parse_json_object('{"a": 1, "b": {"c": [1, 2], "d":') == {"a": 1, "b": {"c": [1, 2]}}
+
+
+def test_parse_braces_inside_strings_are_ignored():
+    assert parse_json_object('{"a": "x } y", "b": [') == {"a": "x } y", "b": []}
+
+
+def test_parse_failures_return_none():
+    assert parse_json_object(None) is None
+    assert parse_json_object("没有 JSON") is None
+    assert parse_json_object("{invalid json content}") is None
+
+
+# --- validate_plan ---
+
+
+def test_valid_plan_is_normalized():
+    plan = _plan()
+    plan["outline"]["chapters/01_intro.tex"]["target_words"] = "800"
+    plan["outline"]["chapters/02_end.tex"]["depends_on"].append("chapters/99_missing.tex")
+
+    assert validate_plan(plan) == []
+    assert plan["outline"]["chapters/01_intro.tex"]["target_words"] == 800
+    assert plan["outline"]["chapters/02_end.tex"]["depends_on"] == ["chapters/01_intro.tex"]
+    # outline 中的章节补进 files
+    assert plan["files"]["chapters/02_end.tex"] == "结论"
+
+
+def test_missing_depends_on_is_not_added():
+    plan = _plan()
+    validate_plan(plan)
+    assert "depends_on" not in plan["outline"]["chapters/01_intro.tex"]
+
+
+def test_structural_errors_are_reported():
+    assert validate_plan({}) == ["规划不是一个非空的 JSON 对象"]
+    assert validate_plan([1]) == ["规划不是一个非空的 JSON 对象"]
+
+    errors = validate_plan(_plan(title="", outline={"intro.tex": {"title": "引言"}}))
+    assert any("title" in e for e in errors)
+    assert any("intro.tex" in e for e in errors)
+    assert any("没有章节文件" in e for e in errors)
+
+    errors = validate_plan(_plan(outline={"chapters/01.tex": {"title": "引言", "sections": "背景", "target_words": -1}}))
+    assert any("sections" in e for e in errors)
+    assert any("target_words" in e for e in errors)
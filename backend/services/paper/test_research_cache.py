@@ -0,0 +1,72 @@
+"""
+ResearchCache 单元测试
+"""
+
+from .research_cache import ResearchCache, normalize_topic, similarity
+
+LITERATURE = [{"title": "ViT论文", "year": 2020}]
+
+
+def test_normalize_topic():
+    assert normalize_topic(" Transformer 图像分类！") == "transformer图像分类"
+    assert normalize_topic("ＴＲＡＮＳＦＯＲＭＥＲ，图像分类") == "transformer图像分类"
+
+
+def test_exact_hit_returns_copies():
+    cache = ResearchCache()
+    cache.put("Transformer图像分类", LITERATURE, "摘要")
+
+    literature, summary = cache.get("transformer 图像分类")
+    literature[0]["title"] = "被修改"
+
+    assert summary == "摘要"
+    assert cache.get("Transformer图像分类")[0] == LITERATURE
+    assert cache.stats()["hits"] == 2
+
+
+def test_ttl_expiry(monkeypatch):
+    cache = ResearchCache(ttl=10)
+    now = [1000.0]
+    monkeypatch.setattr("services.paper.research_cache.time.time", lambda: now[0])
+    cache.put("主题", LITERATURE, "摘要")
+
+    now[0] += 11
+
+    assert cache.get("主题") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_fuzzy_matching_is_opt_in():
+    exact = ResearchCache()
+    exact.put("基于深度学习的图像分类方法研究", LITERATURE, "摘要")
+    assert exact.get("基于深度学习的图像分类方法的研究") is None
+
+    fuzzy = ResearchCache(fuzzy_threshold=0.85)
+    fuzzy.put("基于深度学习的图像分类方法研究", LITERATURE, "摘要")
+    assert fuzzy.get("基于深度学习的图像分类方法的研究") is not None
+    assert fuzzy.get("强化学习在机器人控制中的应用") is None
+    assert fuzzy.stats()["fuzzy_hits"] == 1
+
+
+def test_similarity_bounds():
+    assert similarity("abc", "abc") == 1.0
+    assert similarity("abcd", "wxyz") == 0.0
+
+
+def test_lru_eviction():
+    cache = ResearchCache(max_entries=2)
+    cache.put("主题一", LITERATURE, "摘要")
+    cache.put("主题二", LITERATURE, "摘要")
+    cache.get("主题一")
+    cache.put("主题三", LITERATURE, "摘要")
+
+    assert cache.get("主题二") is None
+    assert cache.get("主题一") is not None
+
+
+def test_one_character_topic_change_scores_close_to_rewording():
+    base = normalize_topic("基于深度学习的图像分类方法研究")
+    reworded = similarity(base, normalize_topic("基于深度学习的图像分类方法的研究"))
+    different = similarity(base, normalize_topic("基于深度学习的图像分割方法研究"))
+
+    assert 0.85 < different < reworded < 0.9
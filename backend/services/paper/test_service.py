@@ -2,6 +2,7 @@
 PaperService 单元测试
 """
 
+import json
 from unittest.mock import MagicMock, patch
 
 from .service import PaperService
@@ -12,9 +13,21 @@ from .latex import CompileResult
 # --- Helpers ---
 
 
+MINIMAL_PLAN = json.dumps({
+    "title": "测试论文",
+    "files": {"chapters/01_intro.tex": "引言"},
+    "outline": {"chapters/01_intro.tex": {"title": "引言", "sections": ["背景"]}},
+}, ensure_ascii=False)
+
+
 def _make_llm():
     llm = MagicMock()
-    llm.complete = MagicMock(return_value="mock response")
+
+    def complete(messages, **kwargs):
+        # 规划阶段需要一个能通过校验的规划，其余调用返回固定文本
+        return MINIMAL_PLAN if "论文文件结构" in messages[0]["content"] else "mock response"
+
+    llm.complete = MagicMock(side_effect=complete)
     return llm
 
 
@@ -30,11 +43,21 @@ def _make_compiler(success=True, pdf_data=b"%PDF-mock", error=None):
     return compiler
 
 
+def _as_streaming(agent_run):
+    """把 agent.run 形式的 mock 包装成 FormatterAgent.run_streaming：先转发上游写手事件"""
+    def run_streaming(session, upstream):
+        yield from upstream
+        yield from agent_run(session)
+    return run_streaming
+
+
 @patch("models.db", new_callable=MagicMock, create=True)
 @patch("services.paper.persist.persist_session")
 def _collect_events(service, mock_persist, mock_db, user_id="user-001", topic="测试主题"):
-    """Run generate() and collect all events into a list."""
-    return list(service.generate(user_id, topic))
+    """Run generate() and collect all events before the trailing timings event."""
+    events = list(service.generate(user_id, topic))
+    assert events[-1]["type"] == "timings"
+    return events[:-1]
 
 
 # --- 正常流程 ---
@@ -60,6 +83,26 @@ def test_generate_yields_completed_last_on_success():
     assert "session_id" in events[-1]
 
 
+@patch("models.db", new_callable=MagicMock, create=True)
+@patch("services.paper.persist.persist_session")
+def test_generate_ends_with_timings_event(mock_persist, mock_db):
+    service = PaperService(_make_llm(), _make_storage())
+    service.compiler = _make_compiler()
+
+    events = list(service.generate("user-001", "测试主题"))
+
+    timings = events[-1]
+    assert timings["type"] == "timings"
+    assert timings["session_id"] == events[0]["session_id"]
+    assert list(timings["stages"]) == ["research", "plan", "write_format", "compile", "persist"]
+    # 每次 LLM 调用都记到了所在阶段 / 章节的 span 上
+    assert timings["llm_calls"] == service.researcher.llm.complete.call_count
+    assert timings["llm_calls"] == sum(stage["llm_calls"] for stage in timings["stages"].values())
+    compile_span = next(span for span in timings["spans"] if span["name"] == "compile")
+    assert compile_span["attrs"] == {"attempt": 1, "success": True, "lint_fixed": 0}
+    assert SessionManager.get_status(timings["session_id"])["timings"]["total"] == timings["total"]
+
+
 def test_generate_yields_progress_events():
     service = PaperService(_make_llm(), _make_storage())
     service.compiler = _make_compiler()
@@ -84,7 +127,7 @@ def test_generate_forwards_agent_progress_events():
     service.researcher.run = mock_agent_run
     service.planner.run = mock_agent_run
     service.writer.run = mock_agent_run
-    service.formatter.run = mock_agent_run
+    service.formatter.run_streaming = _as_streaming(mock_agent_run)
 
     events = _collect_events(service)
 
@@ -169,7 +212,7 @@ def test_generate_calls_compiler_with_vfs_files():
     service.researcher.run = noop_agent
     service.planner.run = noop_agent
     service.writer.run = noop_agent
-    service.formatter.run = formatter_writes_vfs
+    service.formatter.run_streaming = _as_streaming(formatter_writes_vfs)
 
     _collect_events(service)
 
@@ -179,6 +222,40 @@ def test_generate_calls_compiler_with_vfs_files():
     assert files_arg["main.tex"] == "\\documentclass{article}"
 
 
+def test_generate_lints_vfs_before_compile_and_passes_remaining_issues_to_repair():
+    service = PaperService(_make_llm(), _make_storage())
+    service.compiler = _make_compiler(success=False, pdf_data=None, error="xelatex failed")
+    service.compiler.compile.return_value.errors = "! Missing $ inserted."
+
+    def formatter_writes_vfs(session):
+        session.vfs.write("chapters/01_intro.tex", "增长 30%，成本 $5。\n")
+        yield {"type": "result", "data": None}
+
+    def noop_agent(session):
+        yield {"type": "result", "data": None}
+
+    repair_logs, repair_locations = [], []
+
+    def repair(session, error_log, locations=None):
+        repair_logs.append(error_log)
+        repair_locations.append(locations)
+        yield {"type": "progress", "stage": "compiling", "detail": "已修复"}
+
+    service.researcher.run = noop_agent
+    service.planner.run = noop_agent
+    service.writer.run = noop_agent
+    service.formatter.run_streaming = _as_streaming(formatter_writes_vfs)
+    service.formatter.repair = repair
+
+    _collect_events(service)
+
+    files_arg = service.compiler.compile.call_args_list[0][0][0]
+    assert files_arg["chapters/01_intro.tex"] == "增长 30\\%，成本 $5。\n"
+    assert "chapters/01_intro.tex:1: [math]" in repair_logs[0]
+    assert "! Missing $ inserted." in repair_logs[0]
+    assert [(loc.path, loc.line) for loc in repair_locations[0]] == [("chapters/01_intro.tex", 1)]
+
+
 def test_generate_stores_pdf_data_on_session():
     service = PaperService(_make_llm(), _make_storage())
     service.compiler = _make_compiler(pdf_data=b"%PDF-test-data")
@@ -338,6 +415,26 @@ def test_generate_sets_failed_status_on_agent_exception():
     assert "planning" in session.error
 
 
+def test_closing_generate_marks_session_failed():
+    """任务被取消时 generator 被提前关闭：会话不再算作生成中，可以从检查点继续"""
+    service = PaperService(_make_llm(), _make_storage())
+
+    def slow_agent(session):
+        yield {"type": "progress", "stage": "researching", "detail": "检索文献..."}
+
+    service.researcher.run = slow_agent
+
+    events = service.generate("user-001", "测试主题")
+    session_id = next(events)["session_id"]
+    assert next(events)["type"] == "progress"
+    events.close()
+
+    session = SessionManager.get(session_id)
+    assert session.status == PaperStatus.FAILED
+    assert session.error == "生成已取消"
+    assert not SessionManager.is_active(session_id)
+
+
 def test_generate_stops_pipeline_on_agent_failure():
     """If an agent fails, subsequent agents should NOT run."""
     service = PaperService(_make_llm(), _make_storage())
@@ -406,8 +503,179 @@ def test_agents_run_in_correct_order():
     service.researcher.run = make_tracking_agent("researcher")
     service.planner.run = make_tracking_agent("planner")
     service.writer.run = make_tracking_agent("writer")
-    service.formatter.run = make_tracking_agent("formatter")
+    service.formatter.run_streaming = _as_streaming(make_tracking_agent("formatter"))
 
     _collect_events(service)
 
     assert call_order == ["researcher", "planner", "writer", "formatter"]
+
+
+# --- 撰写 / 排版流水线 ---
+
+
+PIPELINE_PLAN = {
+    "title": "流水线测试",
+    "outline": {
+        f"chapters/0{i}_c.tex": {"title": f"第{i}章", "sections": []} for i in range(1, 4)
+    },
+}
+
+
+def test_formatting_overlaps_with_writing():
+    """第 1 章写完就开始转换 LaTeX，不等最后一章写完"""
+    import threading
+    import time
+
+    calls = []
+    lock = threading.Lock()
+
+    def complete(messages, **kwargs):
+        prompt = messages[0]["content"]
+        if "撰写学术论文章节" in prompt:
+            with lock:
+                calls.append("write")
+            time.sleep(0.05)
+            return "正文"
+        if "转换为 LaTeX" in prompt:
+            with lock:
+                calls.append("format")
+            return "\\section{x}"
+        return "摘要"
+
+    llm = MagicMock()
+    llm.complete = MagicMock(side_effect=complete)
+    service = PaperService(llm, _make_storage())
+    service.compiler = _make_compiler()
+    service.formatter.fast_path = False  # 每章都走 LLM 转换，便于观察重叠
+
+    def planner_run(session):
+        session.file_plan = PIPELINE_PLAN
+        yield {"type": "result", "data": session.file_plan}
+
+    service.researcher.run = lambda session: iter([{"type": "result", "data": []}])
+    service.planner.run = planner_run
+
+    events = _collect_events(service)
+
+    assert events[-1]["type"] == "completed"
+    assert calls.index("format") < len(calls) - 1 - calls[::-1].index("write")
+    session = SessionManager.get(events[0]["session_id"])
+    assert set(session.chapter_status.values()) == {"formatted"}
+    assert session.vfs.list_files() == [
+        "main.tex", "chapters/01_c.tex", "chapters/02_c.tex", "chapters/03_c.tex", "refs.bib",
+    ]
+
+
+def test_pipeline_switches_to_formatting_after_writer_finishes():
+    statuses = []
+
+    def writer_run(session):
+        statuses.append(session.status)
+        yield {"type": "result", "data": []}
+
+    def formatter_streaming(session, upstream):
+        yield from upstream
+        statuses.append(session.status)
+        yield {"type": "result", "data": []}
+
+    service = PaperService(_make_llm(), _make_storage())
+    service.compiler = _make_compiler()
+    service.writer.run = writer_run
+    service.formatter.run_streaming = formatter_streaming
+
+    _collect_events(service)
+
+    assert statuses == [PaperStatus.WRITING, PaperStatus.FORMATTING]
+
+
+# --- 检查点 / 续写 ---
+
+
+@patch("models.db", new_callable=MagicMock, create=True)
+@patch("services.paper.persist.persist_session")
+def _collect_resume(service, paper_id, mock_persist, mock_db):
+    """续写事件（去掉末尾的 timings；检查点缺失等提前返回的情况没有 timings）"""
+    events = list(service.resume(paper_id))
+    return events[:-1] if events[-1]["type"] == "timings" else events
+
+
+def _checkpointing_service():
+    from ..storage import StorageService
+    from ..storage_backends import MemoryBackend
+
+    service = PaperService(_make_llm(), StorageService(MemoryBackend()))
+    service.compiler = _make_compiler()
+    service.checkpoints = True
+    return service
+
+
+def test_resume_continues_from_last_checkpoint():
+    from .checkpoint import has_checkpoint
+
+    service = _checkpointing_service()
+    calls = []
+
+    def researcher_run(session):
+        calls.append("researcher")
+        session.literature = [{"title": "GCN"}]
+        yield {"type": "result", "data": []}
+
+    def planner_run(session):
+        calls.append("planner")
+        session.file_plan = PIPELINE_PLAN
+        yield {"type": "result", "data": session.file_plan}
+
+    written = []
+
+    def crashing_complete(messages, **kwargs):
+        prompt = messages[0]["content"]
+        if "撰写学术论文章节" in prompt:
+            if len(written) == 2:
+                raise RuntimeError("worker killed")
+            written.append(prompt)
+        return "正文。"
+
+    service.researcher.run = researcher_run
+    service.planner.run = planner_run
+    service.writer.llm.complete = MagicMock(side_effect=crashing_complete)
+
+    events = _collect_events(service)
+    paper_id = events[0]["session_id"]
+    assert events[-1]["type"] == "error"
+    assert has_checkpoint(paper_id, service.storage)
+    SessionManager.delete(paper_id)  # 模拟 worker 重启后内存会话丢失
+
+    service.writer.llm.complete = MagicMock(return_value="正文。")
+    resumed = _collect_resume(service, paper_id)
+
+    assert resumed[0] == {"type": "session_created", "session_id": paper_id, "resumed_from": "planned"}
+    assert resumed[-1]["type"] == "completed"
+    assert calls == ["researcher", "planner"]  # 已完成的阶段不重跑
+    # 前两章已写完，续写只补最后一章
+    chapter_calls = [
+        c for c in service.writer.llm.complete.call_args_list
+        if "撰写学术论文章节" in c[0][0][0]["content"]
+    ]
+    assert len(chapter_calls) == 1
+    session = SessionManager.get(paper_id)
+    assert session.literature == [{"title": "GCN"}]
+    assert not has_checkpoint(paper_id, service.storage)
+
+
+def test_resume_without_checkpoint_errors():
+    service = _checkpointing_service()
+
+    events = _collect_resume(service, "no-such-paper")
+
+    assert events == [{"type": "error", "message": "没有可恢复的生成进度，请重新生成", "session_id": "no-such-paper"}]
+
+
+def test_resume_rejects_active_session():
+    service = _checkpointing_service()
+    session = SessionManager.create("u1", "进行中")
+    SessionManager.update_status(session.id, PaperStatus.WRITING)
+
+    events = _collect_resume(service, session.id)
+
+    assert events[0]["type"] == "error"
+    assert "正在生成中" in events[0]["message"]
@@ -0,0 +1,127 @@
+"""
+SessionManager 内存淘汰单元测试
+"""
+
+import time
+from collections import OrderedDict
+
+import pytest
+
+from .session import PaperStatus, SessionManager, estimate_session_size
+from .session_store import MemorySessionStore
+
+
+@pytest.fixture(autouse=True)
+def isolated_manager(monkeypatch):
+    monkeypatch.setattr(SessionManager, "_sessions", OrderedDict())
+    monkeypatch.setattr(SessionManager, "_finished_at", {})
+    monkeypatch.setattr(SessionManager, "_sizes", {})
+    monkeypatch.setattr(SessionManager, "_evictions", {"ttl": 0, "lru": 0, "bytes": 0})
+    monkeypatch.setattr(SessionManager, "_store", MemorySessionStore())
+    monkeypatch.setattr(SessionManager, "session_ttl", 1800)
+    monkeypatch.setattr(SessionManager, "max_sessions", 100)
+    monkeypatch.setattr(SessionManager, "max_bytes", 1024 * 1024 * 1024)
+    monkeypatch.setattr(SessionManager, "_last_expire", 0)
+
+
+def _finished(topic: str, status=PaperStatus.COMPLETED, pdf_bytes: int = 0):
+    session = SessionManager.create("u1", topic)
+    session.vfs.write("main.tex", "\\documentclass{article}")
+    session.pdf_data = b"x" * pdf_bytes
+    SessionManager.update_status(session.id, status)
+    return session
+
+
+def test_estimate_counts_vfs_content_and_pdf():
+    session = SessionManager.create("u1", "估算")
+    empty = estimate_session_size(session)
+
+    session.vfs.write("chapters/01.tex", "正文" * 1000)
+    session.content["chapters/01.tex"] = "正文" * 1000
+    session.pdf_data = b"x" * 10_000
+
+    assert estimate_session_size(session) > empty + 10_000 + 2 * 2000
+
+
+def test_ttl_evicts_finished_sessions_and_their_snapshots():
+    done = _finished("已完成")
+    active = SessionManager.create("u1", "进行中")
+    SessionManager.update_status(active.id, PaperStatus.WRITING)
+
+    evicted = SessionManager.evict(now=time.time() + 3600)
+
+    assert evicted == 1
+    assert SessionManager.get(done.id) is None
+    assert SessionManager.get_status(done.id) is None
+    assert SessionManager.get(active.id) is active
+    assert SessionManager.stats()["evictions"]["ttl"] == 1
+
+
+def test_lru_keeps_recently_accessed_sessions(monkeypatch):
+    monkeypatch.setattr(SessionManager, "max_sessions", 2)
+    first = _finished("第一篇")
+    second = _finished("第二篇")
+    SessionManager.get(first.id)  # 最近访问过
+
+    third = _finished("第三篇")
+
+    assert SessionManager.get(second.id) is None
+    assert SessionManager.get(first.id) is first
+    assert SessionManager.get(third.id) is third
+    # LRU 淘汰只释放内存，/status 仍能读到结束状态
+    assert SessionManager.get_status(second.id)["status"] == "completed"
+    assert SessionManager.stats()["evictions"]["lru"] == 1
+
+
+def test_lru_evicted_snapshots_expire_after_ttl(monkeypatch):
+    monkeypatch.setattr(SessionManager, "max_sessions", 1)
+    first = _finished("第一篇")
+    second = _finished("第二篇")
+    assert SessionManager.get_status(first.id)["status"] == "completed"
+
+    # 进程里已没有 first，TTL 淘汰看不到它；快照由共享存储按更新时间清理
+    SessionManager.evict(now=time.time() + 3600)
+
+    assert SessionManager.get_status(first.id) is None
+    assert SessionManager.get_status(second.id) is None
+
+
+def test_byte_budget_evicts_oldest_finished_first(monkeypatch):
+    monkeypatch.setattr(SessionManager, "max_bytes", 250_000)
+    old = _finished("旧", pdf_bytes=100_000)
+    newer = _finished("新", status=PaperStatus.FAILED, pdf_bytes=100_000)
+    assert SessionManager.stats()["evictions"]["bytes"] == 0
+
+    latest = _finished("最新", pdf_bytes=100_000)
+
+    assert SessionManager.get(old.id) is None
+    assert SessionManager.get(newer.id) is newer
+    assert SessionManager.get(latest.id) is latest
+    stats = SessionManager.stats()
+    assert stats["evictions"]["bytes"] == 1
+    assert stats["resident_bytes"] <= 250_000
+
+
+def test_active_sessions_are_never_evicted(monkeypatch):
+    monkeypatch.setattr(SessionManager, "max_bytes", 1)
+    monkeypatch.setattr(SessionManager, "max_sessions", 1)
+    a = SessionManager.create("u1", "进行中 A")
+    b = SessionManager.create("u1", "进行中 B")
+    a.pdf_data = b"x" * 10_000
+
+    SessionManager.evict(now=time.time() + 10_000)
+
+    assert SessionManager.get(a.id) is a
+    assert SessionManager.get(b.id) is b
+    stats = SessionManager.stats()
+    assert stats["active"] == 2
+    assert stats["evictions"] == {"ttl": 0, "lru": 0, "bytes": 0}
+
+
+def test_resumed_session_is_no_longer_finished():
+    session = _finished("失败后续写", status=PaperStatus.FAILED)
+    SessionManager.update_status(session.id, PaperStatus.WRITING)
+
+    SessionManager.evict(now=time.time() + 3600)
+
+    assert SessionManager.get(session.id) is session
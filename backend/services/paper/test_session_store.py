@@ -0,0 +1,154 @@
+"""
+会话存储（跨进程 SessionManager 后端）单元测试
+"""
+
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from .session import PaperStatus, SessionManager
+from .session_store import MemorySessionStore, SQLiteSessionStore, get_session_store
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return MemorySessionStore()
+    return SQLiteSessionStore(str(tmp_path / "sessions.db"))
+
+
+def test_put_get_delete_round_trip(store):
+    store.put({"id": "p1", "status": "writing", "chapters": {"a.tex": "written"}})
+
+    snapshot = store.get("p1")
+    assert snapshot["status"] == "writing"
+    assert snapshot["chapters"] == {"a.tex": "written"}
+    assert snapshot["heartbeat_at"] <= time.time()
+
+    store.delete("p1")
+    assert store.get("p1") is None
+
+
+def test_heartbeat_refreshes_timestamp(store):
+    store.put({"id": "p1", "status": "writing"})
+    before = store.get("p1")["heartbeat_at"]
+    time.sleep(0.01)
+
+    store.heartbeat(["p1", "missing"])
+
+    assert store.get("p1")["heartbeat_at"] > before
+
+
+def test_expire_removes_only_stale_snapshots(store):
+    store.put({"id": "old", "status": "completed"})
+    store.put({"id": "running", "status": "writing"})
+    time.sleep(0.01)
+    cutoff = time.time()
+    store.put({"id": "new", "status": "completed"})
+    store.heartbeat(["running"])
+
+    assert store.expire(cutoff) == 1
+
+    assert store.get("old") is None
+    # 之后更新过的、仍有心跳的快照保留
+    assert store.get("new") and store.get("running")
+
+
+def test_sqlite_store_is_shared_between_instances_and_uses_wal(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    worker_a = SQLiteSessionStore(path)
+    worker_b = SQLiteSessionStore(path)
+
+    worker_a.put({"id": "p1", "status": "planning", "progress_detail": "规划中"})
+
+    assert worker_b.get("p1")["progress_detail"] == "规划中"
+    mode = sqlite3.connect(path).execute("PRAGMA journal_mode").fetchone()[0]
+    assert mode == "wal"
+
+
+def test_sqlite_store_shares_one_connection_across_threads(tmp_path):
+    store = SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    errors = []
+
+    def worker(i):
+        try:
+            store.put({"id": f"p{i}", "status": "planning"})
+            store.heartbeat([f"p{i}"])
+            assert store.get(f"p{i}")["status"] == "planning"
+        except Exception as e:  # pragma: no cover - 失败时在主线程断言
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(16)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert not errors
+    assert all(store.get(f"p{i}") for i in range(16))
+    store.close()
+    with pytest.raises(sqlite3.ProgrammingError):
+        store.get("p0")
+
+
+def test_get_session_store_factory(monkeypatch, tmp_path):
+    monkeypatch.setenv("PAPER_SESSION_STORE", "sqlite")
+    monkeypatch.setenv("PAPER_SESSION_DB", str(tmp_path / "s.db"))
+    assert isinstance(get_session_store(), SQLiteSessionStore)
+
+    monkeypatch.setenv("PAPER_SESSION_STORE", "memory")
+    assert isinstance(get_session_store(), MemorySessionStore)
+
+
+# --- SessionManager 跨 worker 行为 ---
+
+
+@pytest.fixture
+def shared_store(monkeypatch, tmp_path):
+    store = SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    monkeypatch.setattr(SessionManager, "_store", store)
+    return store
+
+
+def test_status_visible_from_other_worker(shared_store):
+    session = SessionManager.create("u1", "跨进程")
+    session.chapter_status["chapters/01_intro.tex"] = "written"
+    SessionManager.update_progress(session.id, "撰写第 1/3 章")
+    SessionManager._sessions.pop(session.id)  # 模拟另一个 worker：本进程内存里没有该会话
+
+    snapshot = SessionManager.get_status(session.id)
+
+    assert snapshot["status"] == "pending"
+    assert snapshot["progress_detail"] == "撰写第 1/3 章"
+    assert snapshot["chapters"] == {"chapters/01_intro.tex": "written"}
+    assert SessionManager.is_active(session.id)
+    SessionManager.delete(session.id)
+
+
+def test_stale_heartbeat_means_owner_is_gone(shared_store, monkeypatch):
+    session = SessionManager.create("u1", "中断")
+    SessionManager.update_status(session.id, PaperStatus.WRITING)
+    SessionManager._sessions.pop(session.id)
+
+    monkeypatch.setattr(SessionManager, "stale_after", -1)
+
+    assert SessionManager.get_status(session.id) is None
+    assert not SessionManager.is_active(session.id)
+    SessionManager.delete(session.id)
+
+
+def test_finished_session_stays_visible_without_heartbeat(shared_store, monkeypatch):
+    session = SessionManager.create("u1", "已完成")
+    session.pdf_url = "https://x/p.pdf"
+    SessionManager.update_status(session.id, PaperStatus.COMPLETED)
+    SessionManager._sessions.pop(session.id)
+    monkeypatch.setattr(SessionManager, "stale_after", -1)
+
+    snapshot = SessionManager.get_status(session.id)
+
+    assert snapshot["status"] == "completed"
+    assert snapshot["pdf_url"] == "https://x/p.pdf"
+    assert not SessionManager.is_active(session.id)
+    SessionManager.delete(session.id)
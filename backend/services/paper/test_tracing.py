@@ -0,0 +1,87 @@
+"""
+耗时追踪（PaperTrace / span / TimingStats）单元测试
+"""
+
+import threading
+
+from .tracing import PaperTrace, TimingStats, record_llm_call, span
+
+
+def test_llm_calls_are_attributed_to_innermost_span_and_stage():
+    trace = PaperTrace("p1")
+    with trace.span("write_format", stage=True):
+        record_llm_call({"calls": 1, "prompt_tokens": 10, "completion_tokens": 5})
+        with span("format", file="chapters/01.tex"):
+            record_llm_call({"calls": 2, "prompt_tokens": 100, "completion_tokens": 50})
+    trace.finish()
+
+    summary = trace.summary()
+
+    spans = {s["name"]: s for s in summary["spans"]}
+    assert spans["write_format"]["llm_calls"] == 1
+    assert spans["format"]["llm_calls"] == 2
+    assert spans["format"]["attrs"] == {"file": "chapters/01.tex"}
+    stage = summary["stages"]["write_format"]
+    assert stage["llm_calls"] == 3
+    assert stage["prompt_tokens"] == 110
+    assert summary["completion_tokens"] == 55
+
+
+def test_spans_in_worker_threads_join_current_stage():
+    trace = PaperTrace("p1")
+
+    def write_chapter(i):
+        with span("write", trace=trace, file=f"chapters/0{i}.tex"):
+            record_llm_call()
+
+    with trace.span("write_format", stage=True):
+        threads = [threading.Thread(target=write_chapter, args=(i,)) for i in range(3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    summary = trace.summary()
+    assert summary["stages"]["write_format"]["llm_calls"] == 3
+    assert [s["stage"] for s in summary["spans"] if s["name"] == "write"] == ["write_format"] * 3
+
+
+def test_span_without_trace_is_noop():
+    with span("xelatex") as current:
+        record_llm_call()
+    assert current is None
+
+
+def test_stage_duration_sums_repeated_stage_spans():
+    trace = PaperTrace("p1")
+    for attempt in range(2):
+        with trace.span("compile", stage=True, attempt=attempt + 1):
+            with span("xelatex", pass_num=1):
+                pass
+
+    summary = trace.summary()
+    compile_spans = [s for s in summary["spans"] if s["name"] == "compile"]
+    assert len(compile_spans) == 2
+    assert summary["stages"]["compile"]["duration"] == round(sum(s.duration for s in trace.spans if s.name == "compile"), 3)
+
+
+def test_timing_stats_percentiles():
+    stats = TimingStats(window=100)
+    for i in range(1, 101):
+        stats.record({"total": float(i), "stages": {"plan": {"duration": i / 10}}})
+
+    result = stats.percentiles()
+
+    assert result["total"]["count"] == 100
+    assert result["total"]["p50"] in (50.0, 51.0)
+    assert result["total"]["p90"] in (90.0, 91.0)
+    assert result["total"]["max"] == 100.0
+    assert result["plan"]["p99"] >= 9.9
+
+
+def test_timing_stats_window_keeps_recent_samples():
+    stats = TimingStats(window=3)
+    for total in (100.0, 1.0, 2.0, 3.0):
+        stats.record({"total": total, "stages": {}})
+
+    assert stats.percentiles()["total"]["max"] == 3.0
@@ -0,0 +1,184 @@
+"""
+论文生成耗时追踪 — PaperTrace + span + TimingStats
+每篇论文一个 PaperTrace，pipeline 各阶段、每章撰写 / 排版、每次编译、每轮修复、持久化
+各记一个 span：耗时、LLM 调用次数、token 数。
+当前 span 存在 ContextVar 里（每个线程各自独立），BaseAgent 调用 LLM 后
+通过 record_llm_call 记到当前线程最内层的 span 上；线程池里的章节任务自己开 span。
+生成结束后 summary() 随 SSE timings 事件下发，并汇入 timing_stats 做分位数统计。
+"""
+
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Iterator, Optional
+
+_current_span: ContextVar[Optional["Span"]] = ContextVar("paper_current_span", default=None)
+
+
+@dataclass
+class Span:
+    name: str
+    # 所属顶层阶段（research / plan / write_format / compile / persist ...）
+    stage: str
+    start: float
+    duration: float = 0.0
+    llm_calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    attrs: dict = field(default_factory=dict)
+    trace: Optional["PaperTrace"] = field(default=None, repr=False)
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "stage": self.stage,
+            "start": round(self.start, 3),
+            "duration": round(self.duration, 3),
+            "llm_calls": self.llm_calls,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            **({"attrs": self.attrs} if self.attrs else {}),
+        }
+
+
+class PaperTrace:
+    """一篇论文（一次 generate / resume / revise）的 span 集合，线程安全"""
+
+    def __init__(self, paper_id: str):
+        self.paper_id = paper_id
+        self.spans: list[Span] = []
+        self._origin = time.monotonic()
+        self._finished_at: float | None = None
+        self._stage = ""
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, stage: bool = False, **attrs) -> Iterator[Span]:
+        """
+        记录一个 span。stage=True 表示顶层阶段：之后开启的 span（包括其他线程里的）
+        都归属到这个阶段，直到下一个阶段开始。
+        """
+        if stage:
+            self._stage = name
+        span = Span(name=name, stage=self._stage or name, start=time.monotonic() - self._origin,
+                    attrs=attrs, trace=self)
+        token = _current_span.set(span)
+        began = time.monotonic()
+        try:
+            yield span
+        finally:
+            span.duration = time.monotonic() - began
+            try:
+                _current_span.reset(token)
+            except ValueError:
+                # generator 被其他上下文回收（客户端中途断开）时 token 已不属于当前上下文
+                pass
+            with self._lock:
+                self.spans.append(span)
+
+    def finish(self) -> None:
+        self._finished_at = time.monotonic()
+
+    def summary(self) -> dict:
+        """
+        汇总：total 为整体墙钟时间；stages 每个阶段的耗时（阶段 span 本身）
+        及阶段内所有 span 的 LLM 调用 / token 合计；spans 为全部 span 明细（按开始时间）。
+        """
+        end = self._finished_at or time.monotonic()
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.start)
+
+        stages: dict[str, dict] = {}
+        for span in spans:
+            entry = stages.setdefault(span.stage, {
+                "duration": 0.0, "llm_calls": 0, "prompt_tokens": 0, "completion_tokens": 0,
+            })
+            if span.name == span.stage:
+                entry["duration"] += span.duration
+            entry["llm_calls"] += span.llm_calls
+            entry["prompt_tokens"] += span.prompt_tokens
+            entry["completion_tokens"] += span.completion_tokens
+        for entry in stages.values():
+            entry["duration"] = round(entry["duration"], 3)
+
+        return {
+            "paper_id": self.paper_id,
+            "total": round(end - self._origin, 3),
+            "llm_calls": sum(s.llm_calls for s in spans),
+            "prompt_tokens": sum(s.prompt_tokens for s in spans),
+            "completion_tokens": sum(s.completion_tokens for s in spans),
+            "stages": stages,
+            "spans": [s.to_dict() for s in spans],
+        }
+
+
+@contextmanager
+def span(name: str, trace: PaperTrace | None = None, stage: bool = False, **attrs) -> Iterator[Span | None]:
+    """
+    开启 span：优先用传入的 trace，否则用当前线程所在 span 的 trace；
+    两者都没有（单测 / 非 pipeline 调用）时什么也不记。
+    """
+    if trace is None:
+        current = _current_span.get()
+        trace = current.trace if current else None
+    if trace is None:
+        yield None
+        return
+    with trace.span(name, stage=stage, **attrs) as s:
+        yield s
+
+
+def record_llm_call(usage: dict | None = None) -> None:
+    """把一次（或一组）LLM 调用记到当前线程最内层的 span 上"""
+    current = _current_span.get()
+    if current is None:
+        return
+    usage = usage or {}
+    current.llm_calls += usage.get("calls", 1) or 1
+    current.prompt_tokens += usage.get("prompt_tokens", 0)
+    current.completion_tokens += usage.get("completion_tokens", 0)
+
+
+def _percentile(sorted_values: list[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class TimingStats:
+    """进程内最近 window 篇论文的阶段耗时，用于分位数统计"""
+
+    def __init__(self, window: int = 200):
+        self._samples: dict[str, deque] = defaultdict(lambda: deque(maxlen=window))
+        self._lock = threading.Lock()
+
+    def record(self, summary: dict) -> None:
+        with self._lock:
+            self._samples["total"].append(summary["total"])
+            for stage, entry in summary["stages"].items():
+                self._samples[stage].append(entry["duration"])
+
+    def percentiles(self) -> dict:
+        """{stage: {count, mean, p50, p90, p99, max}}，单位秒"""
+        with self._lock:
+            samples = {stage: sorted(values) for stage, values in self._samples.items()}
+        result = {}
+        for stage, values in samples.items():
+            if not values:
+                continue
+            result[stage] = {
+                "count": len(values),
+                "mean": round(sum(values) / len(values), 3),
+                "p50": _percentile(values, 0.5),
+                "p90": _percentile(values, 0.9),
+                "p99": _percentile(values, 0.99),
+                "max": values[-1],
+            }
+        return result
+
+
+timing_stats = TimingStats()
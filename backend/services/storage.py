@@ -1,45 +1,59 @@
 """
-S3 存储服务
+存储服务 — 对外保持 S3 风格的 key API，实际读写委托给可插拔后端（见 storage_backends）
 """
 
+import hashlib
+import io
 import os
 import uuid
-import boto3
 from datetime import datetime
-from typing import Optional
+from typing import BinaryIO, Generator, Optional
+
+from .disk_cache import DiskCache
+from .storage_backends import (
+    MB,
+    STREAM_CHUNK_SIZE,
+    StorageBackend,
+    _env_int,
+    get_backend,
+)
+
+
+def _build_cache() -> DiskCache | None:
+    """S3_CACHE_DIR 非空时启用本地磁盘缓存"""
+    cache_dir = os.environ.get("S3_CACHE_DIR")
+    if not cache_dir:
+        return None
+    return DiskCache(cache_dir, max_bytes=_env_int("S3_CACHE_MAX_MB", 512) * MB)
 
 
 class StorageService:
-    """S3 兼容存储服务"""
+    """对象存储服务（S3 / 本地文件系统 / 内存）"""
     
-    def __init__(self):
-        self._client = self._init_client()
-        self.bucket = os.environ.get("S3_BUCKET")
-        self.public_url = os.environ.get("S3_PUBLIC_URL", "").rstrip("/")
-    
-    def _init_client(self):
-        """初始化 S3 客户端"""
-        endpoint = os.environ.get("S3_ENDPOINT")
-        access_key = os.environ.get("S3_ACCESS_KEY")
-        secret_key = os.environ.get("S3_SECRET_KEY")
-        
-        if not all([endpoint, access_key, secret_key]):
-            print("[S3] 未配置 S3 存储，图片将无法保存")
-            return None
-        
-        return boto3.client(
-            's3',
-            endpoint_url=endpoint,
-            aws_access_key_id=access_key,
-            aws_secret_access_key=secret_key
-        )
+    def __init__(self, backend: StorageBackend | None = None):
+        self.backend = backend or get_backend()
+        # 本地文件系统后端本身就能 sendfile，不需要再套一层磁盘缓存
+        self.cache = None if self.backend.name == "fs" else _build_cache()
     
+    @property
+    def _client(self):
+        """兼容旧代码：S3 后端的 boto3 client"""
+        return getattr(self.backend, "client", None)
+
+    @property
+    def bucket(self) -> str | None:
+        return getattr(self.backend, "bucket", None)
+
+    @property
+    def public_url(self) -> str:
+        return self.backend.public_url
+
     @property
     def available(self) -> bool:
-        return self._client is not None and self.bucket is not None
+        return self.backend.available
     
     def upload_image(self, image_data: bytes, user_id: str = None, session_id: str = None, content_type: str = "image/png") -> Optional[dict]:
-        """上传图片到 S3，返回 URL 和 key"""
+        """上传图片，返回 URL 和 key"""
         if not self.available:
             return None
         
@@ -54,54 +68,151 @@ class StorageService:
             s3_key = f"ai-images/{date_prefix}/{image_id}.png"
         
         try:
-            self._client.put_object(
-                Bucket=self.bucket,
-                Key=s3_key,
-                Body=image_data,
-                ContentType=content_type,
-                ACL='public-read'
-            )
-            url = f"{self.public_url}/{s3_key}"
-            print(f"[S3] 上传成功: {url}")
+            # 图片链接直接嵌在对话里，需要长期公开可读（本地文件系统后端据此免签名）
+            self.backend.put(s3_key, image_data, content_type, {"acl": "public-read"})
+            url = self.backend.url(s3_key)
+            print(f"[Storage] 上传成功: {url}")
             return {"url": url, "s3_key": s3_key, "id": image_id}
         except Exception as e:
-            print(f"[S3] 上传失败: {e}")
+            print(f"[Storage] 上传失败: {e}")
             return None
     
     def upload_bytes(self, data: bytes, s3_key: str, content_type: str = "application/octet-stream") -> dict | None:
-        """Upload raw bytes to S3"""
+        """Upload raw bytes，内容哈希写入 metadata 作为强 ETag"""
+        if not self.available:
+            return None
+        metadata = {"sha256": hashlib.sha256(data).hexdigest()}
+        self.backend.put(s3_key, data, content_type, metadata)
+        self._invalidate(s3_key)
+        return {"url": self.backend.url(s3_key), "s3_key": s3_key}
+
+    def upload_fileobj(self, fileobj: BinaryIO, s3_key: str, content_type: str = "application/octet-stream", metadata: dict | None = None) -> dict | None:
+        """从文件对象流式上传，大文件自动分片并发上传，不整体读入内存"""
         if not self.available:
             return None
-        self._client.put_object(
-            Bucket=self.bucket,
-            Key=s3_key,
-            Body=data,
-            ContentType=content_type,
-            ACL='public-read'
-        )
-        url = f"{self.public_url}/{s3_key}"
-        return {"url": url, "s3_key": s3_key}
+        self.backend.put_fileobj(s3_key, fileobj, content_type, metadata)
+        self._invalidate(s3_key)
+        return {"url": self.backend.url(s3_key), "s3_key": s3_key}
+
+    def head_object(self, s3_key: str) -> dict | None:
+        """查询对象元信息 {"size", "etag", "content_type"}，不存在时返回 None"""
+        if not self.available:
+            return None
+        return self.backend.head(s3_key)
+
+    def iter_object(
+        self,
+        s3_key: str,
+        start: int | None = None,
+        end: int | None = None,
+        chunk_size: int = STREAM_CHUNK_SIZE,
+    ) -> Generator[bytes, None, None]:
+        """
+        分块流式读取对象，可选字节区间 [start, end]（闭区间，同 HTTP Range）。
+        不整体读入内存，适合代理大文件。
+        """
+        if not self.available:
+            return
+        yield from self.backend.iter_range(s3_key, start, end, chunk_size)
 
     def download_bytes(self, s3_key: str) -> bytes | None:
-        """Download raw bytes from S3"""
+        """Download raw bytes（启用磁盘缓存时走 read-through）"""
+        if not self.available:
+            return None
+        cached = self.fetch_cached(s3_key)
+        if cached:
+            try:
+                with open(cached["path"], "rb") as f:
+                    return f.read()
+            except OSError:
+                pass  # 刚好被淘汰，回退直接下载
+        buf = io.BytesIO()
+        self.download_fileobj(s3_key, buf)
+        return buf.getvalue()
+
+    def download_fileobj(self, s3_key: str, fileobj: BinaryIO) -> bool:
+        """下载到文件对象，大文件自动分段并发下载"""
+        if not self.available:
+            return False
+        self.backend.get_to_fileobj(s3_key, fileobj)
+        return True
+
+    def fetch_cached(self, s3_key: str) -> dict | None:
+        """
+        返回对象在本机磁盘上的 {"path", "size", "etag", "content_type"}：
+        本地文件系统后端直接返回对象文件；其他后端走磁盘缓存，未命中时流式下载到缓存。
+        未启用缓存或对象超出缓存预算时返回 None。
+        """
         if not self.available:
             return None
-        response = self._client.get_object(Bucket=self.bucket, Key=s3_key)
-        return response['Body'].read()
+
+        local = self.backend.local_path(s3_key)
+        if local:
+            meta = self.backend.head(s3_key)
+            return {**meta, "path": local} if meta else None
+
+        if self.cache is None:
+            return None
+        entry = self.cache.get(s3_key)
+        if entry:
+            return entry
+        max_bytes = self.cache.max_bytes
+        return self.cache.put_stream(s3_key, lambda f: self.backend.fetch(s3_key, f, max_bytes=max_bytes))
+
+    def presigned_url(
+        self,
+        s3_key: str,
+        expires_in: int = 300,
+        content_type: str | None = None,
+        disposition: str = "inline",
+    ) -> str | None:
+        """
+        生成短时效的预签名 GET URL，客户端直连存储下载。
+        可覆盖 Content-Type / Content-Disposition，
+        解决 S3 直链默认 attachment 无法 inline 预览的问题。
+        """
+        if not self.available:
+            return None
+        try:
+            return self.backend.presigned_url(s3_key, expires_in, content_type, disposition)
+        except Exception as e:
+            print(f"[Storage] 生成预签名 URL 失败: {e}")
+            return None
+
+    def _invalidate(self, *s3_keys: str) -> None:
+        if self.cache is None:
+            return
+        for key in s3_keys:
+            self.cache.invalidate(key)
 
     def upload_pdf(self, pdf_data: bytes, s3_key: str) -> dict | None:
-        """Upload PDF to S3"""
+        """Upload PDF"""
         return self.upload_bytes(pdf_data, s3_key, "application/pdf")
 
     def delete_object(self, s3_key: str) -> bool:
-        """删除 S3 对象"""
+        """删除对象"""
         if not self.available:
             return False
         
+        self._invalidate(s3_key)
         try:
-            self._client.delete_object(Bucket=self.bucket, Key=s3_key)
-            print(f"[S3] 删除成功: {s3_key}")
+            self.backend.delete(s3_key)
+            print(f"[Storage] 删除成功: {s3_key}")
             return True
         except Exception as e:
-            print(f"[S3] 删除失败: {e}")
+            print(f"[Storage] 删除失败: {e}")
             return False
+
+    def delete_many(self, s3_keys: list[str]) -> dict:
+        """
+        批量删除对象（S3 后端用 delete_objects，每批最多 1000 个）。
+        返回 {"deleted": [...], "failed": [...]}，failed 可交给调用方重试。
+        """
+        keys = list(dict.fromkeys(k for k in s3_keys if k))
+        if not keys or not self.available:
+            return {"deleted": [], "failed": []}
+
+        self._invalidate(*keys)
+        result = self.backend.delete_many(keys)
+        print(f"[Storage] 批量删除: 成功 {len(result['deleted'])}，失败 {len(result['failed'])}")
+        return result
@@ -0,0 +1,559 @@
+"""
+存储后端 — 可插拔架构，StorageService 的实际读写都委托给这里
+- S3Backend: S3 兼容对象存储（生产默认）
+- FilesystemBackend: 本地文件系统（单机部署 / 无 bucket 环境）
+- MemoryBackend: 纯内存（测试 / 压测）
+"""
+
+import hashlib
+import hmac
+import io
+import json
+import os
+import secrets
+import shutil
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import BinaryIO, Generator
+from urllib.parse import urlencode
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+MB = 1024 * 1024
+STREAM_CHUNK_SIZE = 64 * 1024
+DELETE_BATCH_SIZE = 1000  # S3 delete_objects 单次上限
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+class StorageBackend(ABC):
+    """存储后端抽象基类，key 统一用 / 分隔的相对路径"""
+
+    name = "base"
+
+    def __init__(self, public_url: str = ""):
+        self.public_url = public_url.rstrip("/")
+
+    @property
+    def available(self) -> bool:
+        return True
+
+    @abstractmethod
+    def put(self, key: str, data: bytes, content_type: str, metadata: dict | None = None) -> None:
+        """写入字节内容（覆盖）"""
+
+    @abstractmethod
+    def put_fileobj(self, key: str, fileobj: BinaryIO, content_type: str, metadata: dict | None = None) -> None:
+        """从文件对象流式写入（覆盖）"""
+
+    @abstractmethod
+    def get_to_fileobj(self, key: str, fileobj: BinaryIO) -> None:
+        """完整读取到文件对象，不存在时抛异常"""
+
+    @abstractmethod
+    def iter_range(
+        self, key: str, start: int | None = None, end: int | None = None,
+        chunk_size: int = STREAM_CHUNK_SIZE,
+    ) -> Generator[bytes, None, None]:
+        """分块读取字节区间 [start, end]（闭区间，同 HTTP Range），缺省为整个对象"""
+
+    @abstractmethod
+    def head(self, key: str) -> dict | None:
+        """返回 {"size", "etag", "content_type"}，不存在时返回 None"""
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        """删除对象，失败时抛异常（不存在不算失败）"""
+
+    @abstractmethod
+    def delete_many(self, keys: list[str]) -> dict:
+        """批量删除，返回 {"deleted": [...], "failed": [...]}"""
+
+    @abstractmethod
+    def presigned_url(
+        self, key: str, expires_in: int, content_type: str | None, disposition: str
+    ) -> str | None:
+        """生成短时效的 GET URL，可覆盖 Content-Type / Content-Disposition"""
+
+    def url(self, key: str) -> str:
+        """对象的公开访问 URL"""
+        return f"{self.public_url}/{key}"
+
+    def get(self, key: str) -> bytes:
+        buf = io.BytesIO()
+        self.get_to_fileobj(key, buf)
+        return buf.getvalue()
+
+    def fetch(self, key: str, fileobj: BinaryIO, max_bytes: int | None = None) -> dict | None:
+        """
+        读取到文件对象并返回 {"etag", "content_type"}（供磁盘缓存填充）。
+        对象超过 max_bytes 时不读取内容，返回 None。
+        """
+        meta = self.head(key) or {}
+        if max_bytes is not None and meta.get("size", 0) > max_bytes:
+            return None
+        self.get_to_fileobj(key, fileobj)
+        return {"etag": meta.get("etag", ""), "content_type": meta.get("content_type")}
+
+    def local_path(self, key: str) -> str | None:
+        """对象在本机磁盘上的路径（可直接 sendfile），非本地后端返回 None"""
+        return None
+
+
+# ============ S3 ============
+
+# 进程内共享的 S3 client：boto3 client 线程安全，连接池按 client 维度复用，
+# AIService / PaperService 各自 new StorageService() 时不会再各建一套连接池。
+_shared_client = None
+_shared_client_lock = threading.Lock()
+
+
+def _build_client_config() -> Config:
+    """连接池大小 + 重试策略（默认 adaptive，带客户端限流）"""
+    return Config(
+        max_pool_connections=_env_int("S3_MAX_POOL_CONNECTIONS", 50),
+        retries={
+            "mode": os.environ.get("S3_RETRY_MODE", "adaptive"),
+            "max_attempts": _env_int("S3_MAX_ATTEMPTS", 5),
+        },
+        connect_timeout=_env_int("S3_CONNECT_TIMEOUT", 10),
+        read_timeout=_env_int("S3_READ_TIMEOUT", 60),
+        tcp_keepalive=True,
+    )
+
+
+def _build_transfer_config() -> TransferConfig:
+    """大文件（PDF / VFS 快照）走分片并发上传下载"""
+    return TransferConfig(
+        multipart_threshold=_env_int("S3_MULTIPART_THRESHOLD_MB", 8) * MB,
+        multipart_chunksize=_env_int("S3_MULTIPART_CHUNKSIZE_MB", 8) * MB,
+        max_concurrency=_env_int("S3_MAX_CONCURRENCY", 4),
+        use_threads=True,
+    )
+
+
+def _content_etag(response: dict) -> str:
+    """优先取上传时写入的内容哈希，旧对象回退到 S3 自带 ETag"""
+    metadata = response.get("Metadata") or {}
+    return metadata.get("sha256") or response.get("ETag", "").strip('"')
+
+
+def get_shared_client():
+    """获取进程内共享的 S3 client，未配置时返回 None"""
+    global _shared_client
+    if _shared_client is not None:
+        return _shared_client
+
+    endpoint = os.environ.get("S3_ENDPOINT")
+    access_key = os.environ.get("S3_ACCESS_KEY")
+    secret_key = os.environ.get("S3_SECRET_KEY")
+
+    if not all([endpoint, access_key, secret_key]):
+        print("[S3] 未配置 S3 存储，图片将无法保存")
+        return None
+
+    with _shared_client_lock:
+        if _shared_client is None:
+            _shared_client = boto3.client(
+                's3',
+                endpoint_url=endpoint,
+                aws_access_key_id=access_key,
+                aws_secret_access_key=secret_key,
+                config=_build_client_config(),
+            )
+    return _shared_client
+
+
+class S3Backend(StorageBackend):
+    """S3 兼容对象存储"""
+
+    name = "s3"
+
+    def __init__(self, client=None, bucket: str | None = None, public_url: str | None = None):
+        super().__init__(public_url if public_url is not None else os.environ.get("S3_PUBLIC_URL", ""))
+        self.client = client if client is not None else get_shared_client()
+        self.bucket = bucket if bucket is not None else os.environ.get("S3_BUCKET")
+        self.transfer_config = _build_transfer_config()
+
+    @property
+    def available(self) -> bool:
+        return self.client is not None and self.bucket is not None
+
+    def put(self, key: str, data: bytes, content_type: str, metadata: dict | None = None) -> None:
+        # 超过分片阈值时走 multipart
+        if len(data) >= self.transfer_config.multipart_threshold:
+            self.put_fileobj(key, io.BytesIO(data), content_type, metadata)
+            return
+        kwargs = {}
+        if metadata:
+            kwargs["Metadata"] = metadata
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=key,
+            Body=data,
+            ContentType=content_type,
+            ACL='public-read',
+            **kwargs,
+        )
+
+    def put_fileobj(self, key: str, fileobj: BinaryIO, content_type: str, metadata: dict | None = None) -> None:
+        extra_args = {"ContentType": content_type, "ACL": "public-read"}
+        if metadata:
+            extra_args["Metadata"] = metadata
+        self.client.upload_fileobj(
+            fileobj,
+            self.bucket,
+            key,
+            ExtraArgs=extra_args,
+            Config=self.transfer_config,
+        )
+
+    def get_to_fileobj(self, key: str, fileobj: BinaryIO) -> None:
+        # 先按分片阈值发一次 Range get_object：阈值以下的对象一次往返拿完
+        # （s3transfer 会先 head_object 取大小）；超过阈值的才交给分片并发下载
+        threshold = self.transfer_config.multipart_threshold
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=key, Range=f"bytes=0-{threshold - 1}")
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") != "InvalidRange":
+                raise
+            return  # 空对象：任何 Range 都不可满足
+        body = response["Body"]
+        content_range = response.get("ContentRange") or ""
+        total = content_range.rpartition("/")[2]
+        if total.isdigit() and int(total) > threshold:
+            body.close()
+            self.client.download_fileobj(
+                self.bucket, key, fileobj, Config=self.transfer_config
+            )
+            return
+        try:
+            for chunk in body.iter_chunks(STREAM_CHUNK_SIZE):
+                fileobj.write(chunk)
+        finally:
+            body.close()
+
+    def iter_range(self, key, start=None, end=None, chunk_size=STREAM_CHUNK_SIZE):
+        kwargs = {"Bucket": self.bucket, "Key": key}
+        if start is not None:
+            kwargs["Range"] = f"bytes={start}-{'' if end is None else end}"
+        body = self.client.get_object(**kwargs)["Body"]
+        try:
+            yield from body.iter_chunks(chunk_size)
+        finally:
+            body.close()
+
+    def head(self, key: str) -> dict | None:
+        try:
+            response = self.client.head_object(Bucket=self.bucket, Key=key)
+        except Exception as e:
+            print(f"[S3] head 失败: {key}: {e}")
+            return None
+        return {
+            "size": response.get("ContentLength", 0),
+            "etag": _content_etag(response),
+            "content_type": response.get("ContentType"),
+        }
+
+    def fetch(self, key: str, fileobj: BinaryIO, max_bytes: int | None = None) -> dict | None:
+        # 一次 get_object 同时拿到内容和元信息，省掉 head 往返；超出预算时只看 ContentLength，不读 body
+        response = self.client.get_object(Bucket=self.bucket, Key=key)
+        body = response["Body"]
+        if max_bytes is not None and (response.get("ContentLength") or 0) > max_bytes:
+            body.close()
+            return None
+        try:
+            for chunk in body.iter_chunks(STREAM_CHUNK_SIZE):
+                fileobj.write(chunk)
+        finally:
+            body.close()
+        return {"etag": _content_etag(response), "content_type": response.get("ContentType")}
+
+    def delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    def delete_many(self, keys: list[str]) -> dict:
+        deleted: list[str] = []
+        failed: list[str] = []
+        for start in range(0, len(keys), DELETE_BATCH_SIZE):
+            batch = keys[start:start + DELETE_BATCH_SIZE]
+            try:
+                response = self.client.delete_objects(
+                    Bucket=self.bucket,
+                    Delete={"Objects": [{"Key": k} for k in batch], "Quiet": True},
+                )
+            except Exception as e:
+                print(f"[S3] 批量删除失败: {e}")
+                failed.extend(batch)
+                continue
+
+            # Quiet 模式下只返回出错的 key
+            errors = {err.get("Key") for err in response.get("Errors", [])}
+            for k in batch:
+                (failed if k in errors else deleted).append(k)
+        return {"deleted": deleted, "failed": failed}
+
+    def presigned_url(self, key, expires_in, content_type, disposition):
+        params = {
+            "Bucket": self.bucket,
+            "Key": key,
+            "ResponseContentDisposition": disposition,
+        }
+        if content_type:
+            params["ResponseContentType"] = content_type
+        return self.client.generate_presigned_url(
+            "get_object", Params=params, ExpiresIn=expires_in
+        )
+
+
+# ============ 本地文件系统 ============
+
+
+class FilesystemBackend(StorageBackend):
+    """
+    本地文件系统后端。对象存在 <root>/objects/<key>，元信息存在 <root>/meta/<key>.json。
+    写入走临时文件 + os.replace，读取可直接 sendfile；
+    预签名 URL 用 HMAC 签名，由 app.py 的 /storage/<key> 路由校验后提供下载；
+    未签名的请求只能读取标记为公开读的对象。
+    """
+
+    name = "fs"
+
+    def __init__(self, root: str, public_url: str = "/storage", secret: str | None = None):
+        super().__init__(public_url)
+        self.root = Path(root).resolve()
+        self.objects_dir = self.root / "objects"
+        self.meta_dir = self.root / "meta"
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        self.meta_dir.mkdir(parents=True, exist_ok=True)
+        if not secret:
+            print("[Storage] 未配置 STORAGE_URL_SECRET，预签名 URL 仅在当前进程内有效")
+            secret = secrets.token_hex(32)
+        self._secret = secret.encode("utf-8")
+
+    def _object_path(self, key: str) -> Path:
+        path = (self.objects_dir / key).resolve()
+        if not key or self.objects_dir not in path.parents:
+            raise ValueError(f"非法的存储 key: {key!r}")
+        return path
+
+    def _meta_path(self, key: str) -> Path:
+        return self.meta_dir / f"{key}.json"
+
+    def _atomic_write(self, key: str, fileobj: BinaryIO, content_type: str, metadata: dict | None) -> None:
+        path = self._object_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        digest = hashlib.sha256()
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                while True:
+                    chunk = fileobj.read(STREAM_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    f.write(chunk)
+            meta = {
+                "content_type": content_type,
+                "etag": (metadata or {}).get("sha256") or digest.hexdigest(),
+                "metadata": metadata or {},
+            }
+            meta_path = self._meta_path(key)
+            meta_path.parent.mkdir(parents=True, exist_ok=True)
+            meta_tmp = f"{tmp_name}.json"
+            Path(meta_tmp).write_text(json.dumps(meta), encoding="utf-8")
+            os.replace(tmp_name, path)
+            os.replace(meta_tmp, meta_path)
+        except BaseException:
+            for leftover in (tmp_name, f"{tmp_name}.json"):
+                try:
+                    os.unlink(leftover)
+                except OSError:
+                    pass
+            raise
+
+    def put(self, key, data, content_type, metadata=None):
+        self._atomic_write(key, io.BytesIO(data), content_type, metadata)
+
+    def put_fileobj(self, key, fileobj, content_type, metadata=None):
+        self._atomic_write(key, fileobj, content_type, metadata)
+
+    def get_to_fileobj(self, key, fileobj):
+        with open(self._object_path(key), "rb") as f:
+            shutil.copyfileobj(f, fileobj, STREAM_CHUNK_SIZE)
+
+    def iter_range(self, key, start=None, end=None, chunk_size=STREAM_CHUNK_SIZE):
+        with open(self._object_path(key), "rb") as f:
+            if start is not None:
+                f.seek(start)
+            remaining = None if end is None else end - (start or 0) + 1
+            while remaining is None or remaining > 0:
+                chunk = f.read(chunk_size if remaining is None else min(chunk_size, remaining))
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    def head(self, key):
+        try:
+            size = self._object_path(key).stat().st_size
+        except (OSError, ValueError):
+            return None
+        try:
+            meta = json.loads(self._meta_path(key).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            meta = {}
+        return {
+            "size": size,
+            "etag": meta.get("etag", ""),
+            "content_type": meta.get("content_type"),
+        }
+
+    def delete(self, key):
+        for path in (self._object_path(key), self._meta_path(key)):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def delete_many(self, keys):
+        deleted: list[str] = []
+        failed: list[str] = []
+        for key in keys:
+            try:
+                self.delete(key)
+                deleted.append(key)
+            except (OSError, ValueError) as e:
+                print(f"[Storage] 删除失败: {key}: {e}")
+                failed.append(key)
+        return {"deleted": deleted, "failed": failed}
+
+    def local_path(self, key):
+        try:
+            path = self._object_path(key)
+        except ValueError:
+            return None
+        return str(path) if path.is_file() else None
+
+    def _signature(self, key: str, expires: int, content_type: str, disposition: str) -> str:
+        message = "\n".join([key, str(expires), content_type, disposition]).encode("utf-8")
+        return hmac.new(self._secret, message, hashlib.sha256).hexdigest()
+
+    def presigned_url(self, key, expires_in, content_type, disposition):
+        expires = int(time.time()) + expires_in
+        query = {
+            "expires": expires,
+            "content_type": content_type or "",
+            "disposition": disposition,
+            "signature": self._signature(key, expires, content_type or "", disposition),
+        }
+        return f"{self.url(key)}?{urlencode(query)}"
+
+    def is_public(self, key: str) -> bool:
+        """上传时标记为公开读（metadata acl=public-read，如聊天图片）的对象不需要签名即可下载"""
+        try:
+            meta = json.loads(self._meta_path(key).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return False
+        return (meta.get("metadata") or {}).get("acl") == "public-read"
+
+    def verify_signature(self, key: str, params: dict) -> bool:
+        """校验预签名 URL 的查询参数（签名正确且未过期）"""
+        try:
+            expires = int(params.get("expires", ""))
+        except ValueError:
+            return False
+        if expires < time.time():
+            return False
+        expected = self._signature(
+            key, expires, params.get("content_type", ""), params.get("disposition", "")
+        )
+        return hmac.compare_digest(expected, params.get("signature", ""))
+
+
+# ============ 内存 ============
+
+
+class MemoryBackend(StorageBackend):
+    """纯内存后端，进程退出即丢失，用于测试和压测"""
+
+    name = "memory"
+
+    def __init__(self, public_url: str = "memory://objects"):
+        super().__init__(public_url)
+        self._objects: dict[str, tuple[bytes, str, dict]] = {}
+        self._lock = threading.Lock()
+
+    def put(self, key, data, content_type, metadata=None):
+        with self._lock:
+            self._objects[key] = (bytes(data), content_type, dict(metadata or {}))
+
+    def put_fileobj(self, key, fileobj, content_type, metadata=None):
+        self.put(key, fileobj.read(), content_type, metadata)
+
+    def _get(self, key: str) -> tuple[bytes, str, dict]:
+        with self._lock:
+            if key not in self._objects:
+                raise KeyError(key)
+            return self._objects[key]
+
+    def get_to_fileobj(self, key, fileobj):
+        fileobj.write(self._get(key)[0])
+
+    def iter_range(self, key, start=None, end=None, chunk_size=STREAM_CHUNK_SIZE):
+        data = self._get(key)[0]
+        data = data[start or 0:None if end is None else end + 1]
+        for offset in range(0, len(data), chunk_size):
+            yield data[offset:offset + chunk_size]
+
+    def head(self, key):
+        try:
+            data, content_type, metadata = self._get(key)
+        except KeyError:
+            return None
+        return {
+            "size": len(data),
+            "etag": metadata.get("sha256") or hashlib.sha256(data).hexdigest(),
+            "content_type": content_type,
+        }
+
+    def delete(self, key):
+        with self._lock:
+            self._objects.pop(key, None)
+
+    def delete_many(self, keys):
+        for key in keys:
+            self.delete(key)
+        return {"deleted": list(keys), "failed": []}
+
+    def presigned_url(self, key, expires_in, content_type, disposition):
+        return f"{self.url(key)}?{urlencode({'expires': int(time.time()) + expires_in})}"
+
+
+def get_backend() -> StorageBackend:
+    """工厂函数：根据 STORAGE_BACKEND 环境变量选择存储后端（默认 s3）"""
+    backend_type = os.environ.get("STORAGE_BACKEND", "s3")
+
+    if backend_type == "fs":
+        return FilesystemBackend(
+            root=os.environ.get("STORAGE_FS_ROOT") or "storage_data",
+            public_url=os.environ.get("STORAGE_PUBLIC_URL") or "/storage",
+            secret=os.environ.get("STORAGE_URL_SECRET"),
+        )
+
+    if backend_type == "memory":
+        return MemoryBackend()
+
+    return S3Backend()
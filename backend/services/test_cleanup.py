@@ -0,0 +1,78 @@
+"""
+CleanupQueue 单元测试
+"""
+
+import threading
+from unittest.mock import MagicMock
+
+from .cleanup import CleanupQueue
+
+
+def test_enqueue_deletes_in_background():
+    storage = MagicMock()
+    storage.delete_many.return_value = {"deleted": ["a", "b"], "failed": []}
+    cleanup = CleanupQueue(storage)
+
+    queued = cleanup.enqueue(["a", None, "b", "a"])
+    cleanup.join()
+
+    assert queued == ["a", "b"]
+    storage.delete_many.assert_called_once_with(["a", "b"])
+
+
+def test_enqueue_empty_does_nothing():
+    storage = MagicMock()
+    cleanup = CleanupQueue(storage)
+
+    assert cleanup.enqueue([None, ""]) == []
+    storage.delete_many.assert_not_called()
+
+
+def test_failed_keys_are_retried_until_success():
+    storage = MagicMock()
+    storage.delete_many.side_effect = [
+        {"deleted": ["a"], "failed": ["b"]},
+        {"deleted": ["b"], "failed": []},
+    ]
+    cleanup = CleanupQueue(storage, base_delay=0)
+
+    cleanup.enqueue(["a", "b"])
+    cleanup.join()
+
+    assert storage.delete_many.call_args_list[1].args == (["b"],)
+
+
+def test_retries_stop_after_max_attempts():
+    storage = MagicMock()
+    storage.delete_many.return_value = {"deleted": [], "failed": ["a"]}
+    cleanup = CleanupQueue(storage, max_attempts=3, base_delay=0)
+
+    cleanup.enqueue(["a"])
+    cleanup.join()
+
+    assert storage.delete_many.call_count == 3
+
+
+def test_retry_backoff_does_not_block_other_batches():
+    storage = MagicMock()
+    b_done = threading.Event()
+
+    def delete_many(keys):
+        if keys == ["b"]:
+            b_done.set()
+            return {"deleted": ["b"], "failed": []}
+        # a 第一次失败，重试成功
+        failed = ["a"] if storage.delete_many.call_count == 1 else []
+        return {"deleted": [], "failed": failed}
+
+    storage.delete_many.side_effect = delete_many
+    cleanup = CleanupQueue(storage, base_delay=0.5)
+
+    cleanup.enqueue(["a"])
+    cleanup.enqueue(["b"])
+
+    # 退避期间 worker 继续处理后面的批次
+    assert b_done.wait(timeout=0.3)
+    assert [c.args for c in storage.delete_many.call_args_list] == [(["a"],), (["b"],)]
+    cleanup.join()
+    assert storage.delete_many.call_args_list[-1].args == (["a"],)
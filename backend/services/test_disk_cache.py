@@ -0,0 +1,115 @@
+"""
+DiskCache 单元测试
+"""
+
+import os
+import time
+
+from .disk_cache import DiskCache
+
+
+def test_put_and_get_roundtrip(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=1024)
+
+    cache.put_bytes("users/u1/paper.pdf", b"%PDF", etag="e1", content_type="application/pdf")
+    entry = cache.get("users/u1/paper.pdf")
+
+    assert entry["etag"] == "e1"
+    assert entry["size"] == 4
+    assert open(entry["path"], "rb").read() == b"%PDF"
+
+
+def test_miss_returns_none(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=1024)
+
+    assert cache.get("missing") is None
+
+
+def test_lru_eviction_respects_byte_budget(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=10)
+
+    cache.put_bytes("a", b"1234")
+    cache.put_bytes("b", b"1234")
+    cache.get("a")  # a 变为最近访问
+    cache.put_bytes("c", b"1234")
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+    assert cache.total_bytes == 8
+
+
+def test_object_larger_than_budget_is_not_cached(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=4)
+
+    assert cache.put_bytes("big", b"12345") is None
+    assert cache.get("big") is None
+    assert list(tmp_path.rglob("*.tmp*")) == []
+
+
+def test_invalidate_removes_files(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=1024)
+    path = cache.put_bytes("k", b"data")["path"]
+
+    cache.invalidate("k")
+
+    assert cache.get("k") is None
+    assert cache.total_bytes == 0
+    assert not (tmp_path / path).exists()
+
+
+def test_failed_write_leaves_no_partial_file(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=1024)
+
+    def broken_writer(f):
+        f.write(b"half")
+        raise IOError("connection reset")
+
+    try:
+        cache.put_stream("k", broken_writer)
+    except IOError:
+        pass
+
+    assert cache.get("k") is None
+    assert [p for p in tmp_path.rglob("*") if p.is_file()] == []
+
+
+def test_entries_shared_across_instances(tmp_path):
+    """另一个 worker（新实例）能看到已写入的缓存，也能看到失效。"""
+    writer = DiskCache(str(tmp_path), max_bytes=1024)
+    writer.put_bytes("k", b"v1", etag="e1")
+
+    reader = DiskCache(str(tmp_path), max_bytes=1024)
+    assert reader.get("k")["etag"] == "e1"
+    assert reader.total_bytes == 2
+
+    writer.put_bytes("k", b"v2!", etag="e2")
+    assert reader.get("k")["etag"] == "e2"
+
+    writer.invalidate("k")
+    assert reader.get("k") is None
+
+
+def test_budget_covers_files_written_by_other_workers(tmp_path):
+    """预算针对整个目录：另一个 worker 写入时扫描目录，按 mtime 淘汰最久未访问的文件。"""
+    first = DiskCache(str(tmp_path), max_bytes=10, scan_interval=0)
+    second = DiskCache(str(tmp_path), max_bytes=10, scan_interval=0)
+    first.put_bytes("a", b"x" * 6)
+    old = time.time() - 60
+    os.utime(first.get("a")["path"], (old, old))
+
+    second.put_bytes("b", b"y" * 6)
+
+    sizes = [p.stat().st_size for p in tmp_path.rglob("*") if p.is_file() and p.suffix != ".json"]
+    assert sizes == [6]
+    assert first.get("a") is None
+    assert second.get("b") is not None
+
+
+def test_writer_returning_none_is_not_cached(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=1024)
+
+    assert cache.put_stream("k", lambda f: None) is None
+    assert cache.put_bytes("big", b"x" * 2048) is None
+    assert cache.get("k") is None
+    assert [p for p in tmp_path.rglob("*") if p.is_file()] == []
@@ -0,0 +1,269 @@
+"""
+LLMService.complete_with_tools 单元测试（httpx.MockTransport 模拟流式接口）
+"""
+
+import json
+import threading
+import time
+
+import httpx
+import pytest
+
+from . import llm as llm_module
+from .llm import LLMService
+
+
+def _sse(*chunks: dict) -> bytes:
+    body = "".join(f"data: {json.dumps(c, ensure_ascii=False)}\n\n" for c in chunks)
+    return (body + "data: [DONE]\n\n").encode("utf-8")
+
+
+def _tool_call_round(*calls: tuple[str, str, dict]) -> bytes:
+    """一轮 tool_calls 响应：每个调用的 arguments 拆成两个增量块"""
+    chunks = []
+    for index, (call_id, name, arguments) in enumerate(calls):
+        text = json.dumps(arguments, ensure_ascii=False)
+        chunks.append({"choices": [{"delta": {"tool_calls": [
+            {"index": index, "id": call_id, "type": "function", "function": {"name": name, "arguments": text[:5]}},
+        ]}}]})
+        chunks.append({"choices": [{"delta": {"tool_calls": [
+            {"index": index, "function": {"arguments": text[5:]}},
+        ]}}]})
+    chunks.append({"choices": [{"delta": {}, "finish_reason": "tool_calls"}]})
+    chunks.append({"choices": [], "usage": {"prompt_tokens": 10, "completion_tokens": 5}})
+    return _sse(*chunks)
+
+
+def _text_round(text: str) -> bytes:
+    return _sse(
+        {"choices": [{"delta": {"content": text}}]},
+        {"choices": [{"delta": {}, "finish_reason": "stop"}]},
+    )
+
+
+@pytest.fixture
+def mock_api(monkeypatch):
+    """按顺序返回 responses 里的响应体，记录每次请求的 payload 和 Client 创建次数"""
+    state = {"responses": [], "payloads": [], "clients": 0}
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        state["payloads"].append(json.loads(request.content))
+        body = state["responses"].pop(0)
+        return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=body)
+
+    real_client = httpx.Client
+
+    def client_factory(*args, **kwargs):
+        state["clients"] += 1
+        return real_client(*args, transport=httpx.MockTransport(handler), **kwargs)
+
+    monkeypatch.setattr(llm_module.httpx, "Client", client_factory)
+    return state
+
+
+def _service() -> LLMService:
+    service = LLMService()
+    service._api_keys = ["test-key"]
+    return service
+
+
+def test_streamed_tool_calls_are_assembled_and_executed(mock_api):
+    mock_api["responses"] = [
+        _tool_call_round(("c1", "read_file", {"path": "a.tex"}), ("c2", "read_file", {"path": "b.tex"})),
+        _text_round("修复完成"),
+    ]
+    calls = []
+
+    def handler(name, arguments):
+        calls.append((name, arguments["path"]))
+        return f"内容 {arguments['path']}"
+
+    usage: dict = {}
+    result = _service().complete_with_tools(
+        [{"role": "user", "content": "修复"}], tools=[], tool_handler=handler, usage=usage,
+    )
+
+    assert result == "修复完成"
+    assert sorted(calls) == [("read_file", "a.tex"), ("read_file", "b.tex")]
+    # 一个 Client（连接）贯穿所有轮次，请求均为流式
+    assert mock_api["clients"] == 1
+    assert all(p["stream"] for p in mock_api["payloads"])
+    second = mock_api["payloads"][1]["messages"]
+    assert second[1]["tool_calls"][0]["function"]["arguments"] == '{"path": "a.tex"}'
+    assert [m["content"] for m in second[2:]] == ["内容 a.tex", "内容 b.tex"]
+    assert usage["calls"] == 2
+    assert usage["prompt_tokens"] >= 10
+
+
+def test_independent_tool_calls_run_concurrently_same_path_in_order(mock_api):
+    mock_api["responses"] = [
+        _tool_call_round(
+            ("c1", "read_file", {"path": "a.tex"}),
+            ("c2", "read_file", {"path": "b.tex"}),
+            ("c3", "edit_file", {"path": "a.tex"}),
+        ),
+        _text_round("ok"),
+    ]
+    order, active, peak = [], [0], [0]
+    lock = threading.Lock()
+
+    def handler(name, arguments):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.05)
+        with lock:
+            active[0] -= 1
+            order.append((name, arguments["path"]))
+        return "ok"
+
+    _service().complete_with_tools([{"role": "user", "content": "x"}], tools=[], tool_handler=handler)
+
+    assert peak[0] == 2
+    a_calls = [name for name, path in order if path == "a.tex"]
+    assert a_calls == ["read_file", "edit_file"]
+
+
+def test_tool_calls_without_path_run_alone(mock_api):
+    mock_api["responses"] = [
+        _tool_call_round(
+            ("c1", "write_file", {"path": "a.tex", "content": "x"}),
+            ("c2", "write_file", {"path": "b.tex", "content": "y"}),
+            ("c3", "list_files", {}),
+            ("c4", "read_file", {"path": "c.tex"}),
+            ("c5", "read_file", {"path": "d.tex"}),
+        ),
+        _text_round("ok"),
+    ]
+    events, active = [], [0]
+    lock = threading.Lock()
+
+    def handler(name, arguments):
+        with lock:
+            active[0] += 1
+            events.append(("start", name, active[0]))
+        time.sleep(0.05)
+        with lock:
+            active[0] -= 1
+            events.append(("end", name, active[0]))
+        return "ok"
+
+    _service().complete_with_tools([{"role": "user", "content": "x"}], tools=[], tool_handler=handler)
+
+    names = [name for kind, name, _ in events]
+    start, end = names.index("list_files"), len(names) - 1 - names[::-1].index("list_files")
+    # list_files 开始时前面的写入都已结束、后面的读取还没开始，执行期间没有其他调用
+    assert names[:start].count("write_file") == 4
+    assert names[end + 1:].count("read_file") == 4
+    assert events[start][2] == 1 and end == start + 1
+
+
+def test_cancel_stops_before_next_round(mock_api):
+    mock_api["responses"] = [_tool_call_round(("c1", "read_file", {"path": "a.tex"})), _text_round("ok")]
+    cancel = threading.Event()
+
+    def handler(name, arguments):
+        cancel.set()
+        return "ok"
+
+    result = _service().complete_with_tools(
+        [{"role": "user", "content": "x"}], tools=[], tool_handler=handler, cancel=cancel,
+    )
+
+    assert result is None
+    assert len(mock_api["payloads"]) == 1
+
+
+def test_progress_callback_and_tool_errors_are_reported_to_model(mock_api):
+    mock_api["responses"] = [_tool_call_round(("c1", "edit_file", {"path": "a.tex"})), _text_round("ok")]
+    progress = []
+
+    def handler(name, arguments):
+        raise RuntimeError("boom")
+
+    result = _service().complete_with_tools(
+        [{"role": "user", "content": "x"}], tools=[], tool_handler=handler, on_progress=progress.append,
+    )
+
+    assert result == "ok"
+    assert "edit_file a.tex" in progress
+    tool_message = mock_api["payloads"][1]["messages"][-1]
+    assert "boom" in tool_message["content"]
+
+
+def test_response_format_is_dropped_when_rejected(monkeypatch):
+    payloads = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        payload = json.loads(request.content)
+        payloads.append(payload)
+        if "response_format" in payload:
+            return httpx.Response(400, content=b'{"error": "response_format not supported"}')
+        return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=_text_round("{}"))
+
+    real_client = httpx.Client
+    monkeypatch.setattr(
+        llm_module.httpx, "Client", lambda *a, **kw: real_client(*a, transport=httpx.MockTransport(handler), **kw),
+    )
+
+    service = _service()
+    result = service.complete([{"role": "user", "content": "x"}], response_format={"type": "json_object"})
+
+    assert result == "{}"
+    assert payloads[0]["response_format"] == {"type": "json_object"}
+    assert "response_format" not in payloads[1]
+    # 记住该端点不支持：后续请求直接不带，不再先吃一次 400
+    assert service.complete([{"role": "user", "content": "y"}], response_format={"type": "json_object"}) == "{}"
+    assert len(payloads) == 3
+    assert "response_format" not in payloads[2]
+
+
+def test_stream_options_are_dropped_when_rejected(monkeypatch):
+    payloads = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        payload = json.loads(request.content)
+        payloads.append(payload)
+        if "stream_options" in payload:
+            return httpx.Response(422, content=b'{"error": "unknown field stream_options"}')
+        if "tools" in payload:
+            return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=_text_round("done"))
+        return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=_text_round("{}"))
+
+    real_client = httpx.Client
+    monkeypatch.setattr(
+        llm_module.httpx, "Client", lambda *a, **kw: real_client(*a, transport=httpx.MockTransport(handler), **kw),
+    )
+    service = _service()
+
+    usage: dict = {}
+    result = service.complete([{"role": "user", "content": "x"}], usage=usage)
+
+    assert result == "{}"
+    assert ["stream_options" in p for p in payloads] == [True, False]
+    assert usage["calls"] == 1 and usage["completion_tokens"] > 0
+    # 记住该端点不支持：后续请求（包括工具调用）不再携带
+    assert service.complete([{"role": "user", "content": "y"}]) == "{}"
+    assert service.complete_with_tools([{"role": "user", "content": "z"}], tools=[], tool_handler=None) == "done"
+    assert len(payloads) == 4
+
+
+def test_tool_round_drops_rejected_stream_options(monkeypatch):
+    payloads = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        payload = json.loads(request.content)
+        payloads.append(payload)
+        if "stream_options" in payload:
+            return httpx.Response(400, content=b'{"error": "stream_options not supported"}')
+        return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=_text_round("done"))
+
+    real_client = httpx.Client
+    monkeypatch.setattr(
+        llm_module.httpx, "Client", lambda *a, **kw: real_client(*a, transport=httpx.MockTransport(handler), **kw),
+    )
+
+    result = _service().complete_with_tools([{"role": "user", "content": "x"}], tools=[], tool_handler=None)
+
+    assert result == "done"
+    assert ["stream_options" in p for p in payloads] == [True, False]
@@ -0,0 +1,325 @@
+"""
+StorageService 单元测试
+"""
+
+import io
+from unittest.mock import MagicMock, patch
+
+import pytest
+from botocore.exceptions import ClientError
+
+from . import storage_backends as backends_module
+from .storage import StorageService
+
+
+@pytest.fixture(autouse=True)
+def s3_env(monkeypatch):
+    monkeypatch.setenv("S3_ENDPOINT", "https://s3.example.com")
+    monkeypatch.setenv("S3_ACCESS_KEY", "ak")
+    monkeypatch.setenv("S3_SECRET_KEY", "sk")
+    monkeypatch.setenv("S3_BUCKET", "bucket")
+    monkeypatch.setenv("S3_PUBLIC_URL", "https://cdn.example.com/")
+    monkeypatch.delenv("S3_CACHE_DIR", raising=False)
+    monkeypatch.delenv("STORAGE_BACKEND", raising=False)
+    monkeypatch.setattr(backends_module, "_shared_client", None)
+
+
+def _make_service(client=None) -> StorageService:
+    client = client or MagicMock()
+    with patch.object(backends_module.boto3, "client", return_value=client):
+        return StorageService()
+
+
+# --- 共享 client ---
+
+
+def test_services_share_one_client():
+    with patch.object(backends_module.boto3, "client", return_value=MagicMock()) as factory:
+        a = StorageService()
+        b = StorageService()
+
+    assert a._client is b._client
+    factory.assert_called_once()
+
+
+def test_client_config_uses_pool_and_retry_env(monkeypatch):
+    monkeypatch.setenv("S3_MAX_POOL_CONNECTIONS", "64")
+    monkeypatch.setenv("S3_MAX_ATTEMPTS", "7")
+    with patch.object(backends_module.boto3, "client", return_value=MagicMock()) as factory:
+        StorageService()
+
+    config = factory.call_args.kwargs["config"]
+    assert config.max_pool_connections == 64
+    assert config.retries == {"mode": "adaptive", "max_attempts": 7}
+
+
+def test_unavailable_without_env(monkeypatch):
+    monkeypatch.delenv("S3_ENDPOINT")
+    service = StorageService()
+
+    assert not service.available
+    assert service.upload_bytes(b"data", "k") is None
+
+
+# --- 上传 ---
+
+
+def test_small_upload_uses_put_object():
+    client = MagicMock()
+    service = _make_service(client)
+
+    result = service.upload_bytes(b"small", "a/b.bin")
+
+    client.put_object.assert_called_once()
+    client.upload_fileobj.assert_not_called()
+    assert result == {"url": "https://cdn.example.com/a/b.bin", "s3_key": "a/b.bin"}
+
+
+def test_large_upload_uses_multipart_transfer(monkeypatch):
+    monkeypatch.setenv("S3_MULTIPART_THRESHOLD_MB", "1")
+    client = MagicMock()
+    service = _make_service(client)
+
+    service.upload_pdf(b"x" * (backends_module.MB + 1), "p.pdf")
+
+    client.put_object.assert_not_called()
+    args, kwargs = client.upload_fileobj.call_args
+    assert args[1:] == ("bucket", "p.pdf")
+    assert kwargs["ExtraArgs"]["ContentType"] == "application/pdf"
+    assert kwargs["Config"] is service.backend.transfer_config
+
+
+def test_upload_fileobj_streams_file_object():
+    client = MagicMock()
+    service = _make_service(client)
+    fileobj = io.BytesIO(b"stream")
+
+    service.upload_fileobj(fileobj, "s.gz", "application/gzip")
+
+    assert client.upload_fileobj.call_args.args[0] is fileobj
+
+
+# --- 下载 ---
+
+
+def test_small_download_uses_single_get_object():
+    body = MagicMock()
+    body.iter_chunks.return_value = iter([b"pay", b"load"])
+    client = MagicMock()
+    client.get_object.return_value = {"Body": body, "ContentRange": "bytes 0-6/7"}
+    service = _make_service(client)
+
+    assert service.download_bytes("k") == b"payload"
+    threshold = service.backend.transfer_config.multipart_threshold
+    assert client.get_object.call_args.kwargs["Range"] == f"bytes=0-{threshold - 1}"
+    client.head_object.assert_not_called()
+    client.download_fileobj.assert_not_called()
+    body.close.assert_called_once()
+
+
+def test_large_download_uses_transfer_manager():
+    client = MagicMock()
+    client.download_fileobj.side_effect = lambda bucket, key, f, Config: f.write(b"payload")
+    service = _make_service(client)
+    threshold = service.backend.transfer_config.multipart_threshold
+    client.get_object.return_value = {"Body": MagicMock(), "ContentRange": f"bytes 0-{threshold - 1}/{threshold + 1}"}
+
+    assert service.download_bytes("k") == b"payload"
+    client.download_fileobj.assert_called_once()
+
+
+def test_download_empty_object():
+    client = MagicMock()
+    client.get_object.side_effect = ClientError({"Error": {"Code": "InvalidRange"}}, "GetObject")
+    service = _make_service(client)
+
+    assert service.download_bytes("k") == b""
+
+
+# --- 批量删除 ---
+
+
+def test_delete_many_batches_by_1000():
+    client = MagicMock()
+    client.delete_objects.return_value = {}
+    service = _make_service(client)
+    keys = [f"k{i}" for i in range(2500)]
+
+    result = service.delete_many(keys)
+
+    batch_sizes = [
+        len(c.kwargs["Delete"]["Objects"]) for c in client.delete_objects.call_args_list
+    ]
+    assert batch_sizes == [1000, 1000, 500]
+    assert len(result["deleted"]) == 2500
+    assert result["failed"] == []
+
+
+def test_delete_many_reports_per_key_errors():
+    client = MagicMock()
+    client.delete_objects.return_value = {"Errors": [{"Key": "b", "Code": "InternalError"}]}
+    service = _make_service(client)
+
+    result = service.delete_many(["a", "b", None, "a"])
+
+    assert result == {"deleted": ["a"], "failed": ["b"]}
+
+
+def test_delete_many_marks_whole_batch_failed_on_exception():
+    client = MagicMock()
+    client.delete_objects.side_effect = RuntimeError("network")
+    service = _make_service(client)
+
+    result = service.delete_many(["a", "b"])
+
+    assert result == {"deleted": [], "failed": ["a", "b"]}
+
+
+# --- 流式读取 ---
+
+
+def test_upload_bytes_records_content_hash():
+    client = MagicMock()
+    service = _make_service(client)
+
+    service.upload_bytes(b"abc", "k")
+
+    metadata = client.put_object.call_args.kwargs["Metadata"]
+    assert metadata["sha256"] == "ba7816bf8f01cfea414140de5dae2223b00361a396177a9cb410ff61f20015ad"
+
+
+def test_head_object_prefers_content_hash_etag():
+    client = MagicMock()
+    client.head_object.return_value = {
+        "ContentLength": 10, "ETag": '"s3etag"', "Metadata": {"sha256": "hash"},
+    }
+    service = _make_service(client)
+
+    meta = service.head_object("k")
+    assert meta["size"] == 10
+    assert meta["etag"] == "hash"
+
+
+def test_head_object_falls_back_to_s3_etag():
+    client = MagicMock()
+    client.head_object.return_value = {"ContentLength": 10, "ETag": '"s3etag"'}
+    service = _make_service(client)
+
+    assert service.head_object("k")["etag"] == "s3etag"
+
+
+def test_iter_object_passes_range_and_closes_body():
+    body = MagicMock()
+    body.iter_chunks.return_value = iter([b"ab", b"cd"])
+    client = MagicMock()
+    client.get_object.return_value = {"Body": body}
+    service = _make_service(client)
+
+    chunks = list(service.iter_object("k", 10, 19))
+
+    assert chunks == [b"ab", b"cd"]
+    assert client.get_object.call_args.kwargs["Range"] == "bytes=10-19"
+    body.close.assert_called_once()
+
+
+# --- 磁盘缓存 ---
+
+
+def _make_cached_service(monkeypatch, tmp_path, client):
+    monkeypatch.setenv("S3_CACHE_DIR", str(tmp_path))
+    return _make_service(client)
+
+
+def _object_response(data=b"payload", sha="hash"):
+    body = MagicMock()
+    body.iter_chunks.return_value = iter([data])
+    return {"Body": body, "Metadata": {"sha256": sha}, "ContentType": "application/pdf"}
+
+
+def test_download_bytes_reads_through_cache(monkeypatch, tmp_path):
+    client = MagicMock()
+    client.get_object.return_value = _object_response()
+    service = _make_cached_service(monkeypatch, tmp_path, client)
+
+    assert service.download_bytes("k") == b"payload"
+    assert service.download_bytes("k") == b"payload"
+
+    client.get_object.assert_called_once()
+    client.download_fileobj.assert_not_called()
+
+
+def test_fetch_cached_returns_local_path_and_etag(monkeypatch, tmp_path):
+    client = MagicMock()
+    client.get_object.return_value = _object_response()
+    service = _make_cached_service(monkeypatch, tmp_path, client)
+
+    entry = service.fetch_cached("k")
+
+    assert entry["etag"] == "hash"
+    assert entry["content_type"] == "application/pdf"
+    assert open(entry["path"], "rb").read() == b"payload"
+
+
+def test_upload_and_delete_invalidate_cache(monkeypatch, tmp_path):
+    client = MagicMock()
+    client.get_object.side_effect = lambda **kw: _object_response()
+    client.delete_objects.return_value = {}
+    service = _make_cached_service(monkeypatch, tmp_path, client)
+
+    service.fetch_cached("k")
+    service.upload_bytes(b"new", "k")
+    assert service.cache.get("k") is None
+
+    service.fetch_cached("k")
+    service.delete_many(["k"])
+    assert service.cache.get("k") is None
+
+
+def test_fetch_cached_skips_objects_over_budget_without_reading(monkeypatch, tmp_path):
+    response = _object_response()
+    client = MagicMock()
+    client.get_object.return_value = {**response, "ContentLength": 10 * 1024 * 1024 * 1024}
+    service = _make_cached_service(monkeypatch, tmp_path, client)
+
+    assert service.fetch_cached("k") is None
+
+    response["Body"].iter_chunks.assert_not_called()
+    response["Body"].close.assert_called_once()
+    assert [p for p in tmp_path.rglob("*") if p.is_file()] == []
+
+
+def test_fetch_cached_disabled_without_cache_dir():
+    service = _make_service()
+
+    assert service.cache is None
+    assert service.fetch_cached("k") is None
+
+
+# --- 预签名 URL ---
+
+
+def test_presigned_url_overrides_response_headers():
+    client = MagicMock()
+    client.generate_presigned_url.return_value = "https://s3.example.com/signed"
+    service = _make_service(client)
+
+    url = service.presigned_url("p.pdf", expires_in=120, content_type="application/pdf")
+
+    assert url == "https://s3.example.com/signed"
+    args, kwargs = client.generate_presigned_url.call_args
+    assert args == ("get_object",)
+    assert kwargs["ExpiresIn"] == 120
+    assert kwargs["Params"] == {
+        "Bucket": "bucket",
+        "Key": "p.pdf",
+        "ResponseContentDisposition": "inline",
+        "ResponseContentType": "application/pdf",
+    }
+
+
+def test_presigned_url_none_on_error():
+    client = MagicMock()
+    client.generate_presigned_url.side_effect = RuntimeError("bad credentials")
+    service = _make_service(client)
+
+    assert service.presigned_url("p.pdf") is None
@@ -0,0 +1,145 @@
+"""
+存储后端单元测试 — FilesystemBackend / MemoryBackend 共用同一套行为约定
+"""
+
+import io
+import time
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from .storage import StorageService
+from .storage_backends import FilesystemBackend, MemoryBackend, get_backend
+
+
+@pytest.fixture(params=["fs", "memory"])
+def backend(request, tmp_path):
+    if request.param == "fs":
+        return FilesystemBackend(str(tmp_path), public_url="https://api.example.com/storage", secret="s3cret")
+    return MemoryBackend()
+
+
+# --- 通用约定 ---
+
+
+def test_put_get_roundtrip(backend):
+    backend.put("users/u1/a.bin", b"hello", "application/octet-stream")
+
+    assert backend.get("users/u1/a.bin") == b"hello"
+
+
+def test_put_fileobj_streams(backend):
+    backend.put_fileobj("k.pdf", io.BytesIO(b"%PDF-1.7"), "application/pdf")
+
+    meta = backend.head("k.pdf")
+    assert meta["size"] == 8
+    assert meta["content_type"] == "application/pdf"
+    assert meta["etag"]
+
+
+def test_head_uses_content_hash_metadata(backend):
+    backend.put("k", b"data", "text/plain", {"sha256": "given-hash"})
+
+    assert backend.head("k")["etag"] == "given-hash"
+
+
+def test_head_missing_returns_none(backend):
+    assert backend.head("missing") is None
+
+
+def test_iter_range(backend):
+    backend.put("k", bytes(range(100)), "application/octet-stream")
+
+    assert b"".join(backend.iter_range("k", 10, 19, chunk_size=3)) == bytes(range(10, 20))
+    assert b"".join(backend.iter_range("k", 95)) == bytes(range(95, 100))
+    assert b"".join(backend.iter_range("k")) == bytes(range(100))
+
+
+def test_delete_and_delete_many(backend):
+    for key in ("a", "b", "c"):
+        backend.put(key, b"x", "text/plain")
+
+    backend.delete("a")
+    result = backend.delete_many(["b", "c", "never-existed"])
+
+    assert backend.head("a") is None
+    assert backend.head("b") is None
+    assert result["failed"] == []
+
+
+def test_get_missing_raises(backend):
+    with pytest.raises(Exception):
+        backend.get("missing")
+
+
+def test_presigned_url_contains_expiry(backend):
+    url = backend.presigned_url("k.pdf", 60, "application/pdf", "inline")
+
+    assert "k.pdf" in url
+    assert "expires=" in url
+
+
+# --- FilesystemBackend ---
+
+
+def test_fs_local_path_and_atomic_write(tmp_path):
+    backend = FilesystemBackend(str(tmp_path), secret="s")
+    backend.put("users/u1/paper.pdf", b"%PDF", "application/pdf")
+
+    path = backend.local_path("users/u1/paper.pdf")
+    assert open(path, "rb").read() == b"%PDF"
+    assert backend.local_path("missing.pdf") is None
+    assert list(tmp_path.rglob(".tmp-*")) == []
+
+
+def test_fs_rejects_path_traversal(tmp_path):
+    backend = FilesystemBackend(str(tmp_path / "store"), secret="s")
+
+    with pytest.raises(ValueError):
+        backend.put("../escape.txt", b"x", "text/plain")
+    assert backend.local_path("../../etc/passwd") is None
+
+
+def test_fs_presigned_url_signature(tmp_path):
+    backend = FilesystemBackend(str(tmp_path), public_url="/storage", secret="s")
+    url = backend.presigned_url("k.pdf", 60, "application/pdf", "inline")
+    params = {k: v[0] for k, v in parse_qs(urlsplit(url).query, keep_blank_values=True).items()}
+
+    assert urlsplit(url).path == "/storage/k.pdf"
+    assert backend.verify_signature("k.pdf", params)
+    assert not backend.verify_signature("other.pdf", params)
+    assert not backend.verify_signature("k.pdf", {**params, "disposition": "attachment"})
+    assert not backend.verify_signature("k.pdf", {**params, "expires": str(int(time.time()) - 1)})
+
+
+# --- StorageService 组合 ---
+
+
+def test_storage_service_over_memory_backend():
+    service = StorageService(MemoryBackend())
+
+    result = service.upload_pdf(b"%PDF", "users/u1/papers/p1/paper.pdf")
+
+    assert result["url"] == "memory://objects/users/u1/papers/p1/paper.pdf"
+    assert service.download_bytes("users/u1/papers/p1/paper.pdf") == b"%PDF"
+    assert service.delete_many(["users/u1/papers/p1/paper.pdf"])["deleted"] == ["users/u1/papers/p1/paper.pdf"]
+
+
+def test_storage_service_fs_fetch_cached_is_object_file(tmp_path):
+    service = StorageService(FilesystemBackend(str(tmp_path), secret="s"))
+    service.upload_pdf(b"%PDF", "p.pdf")
+
+    entry = service.fetch_cached("p.pdf")
+
+    assert entry["path"] == service.backend.local_path("p.pdf")
+    assert entry["size"] == 4
+    assert service.cache is None
+
+
+def test_get_backend_from_env(monkeypatch, tmp_path):
+    monkeypatch.setenv("STORAGE_BACKEND", "fs")
+    monkeypatch.setenv("STORAGE_FS_ROOT", str(tmp_path))
+    assert isinstance(get_backend(), FilesystemBackend)
+
+    monkeypatch.setenv("STORAGE_BACKEND", "memory")
+    assert isinstance(get_backend(), MemoryBackend)
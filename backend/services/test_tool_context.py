@@ -0,0 +1,91 @@
+"""
+ToolContext（工具调用上下文裁剪）单元测试
+"""
+
+import json
+
+from .tool_context import ToolContext
+
+BIG = "正文内容。" * 200  # 1000 字符
+
+
+def _call(call_id: str, name: str, **arguments) -> dict:
+    return {"id": call_id, "type": "function", "function": {"name": name, "arguments": json.dumps(arguments)}}
+
+
+def _assistant(*calls) -> dict:
+    return {"role": "assistant", "content": None, "tool_calls": list(calls)}
+
+
+def _context() -> ToolContext:
+    return ToolContext([{"role": "system", "content": "sys"}, {"role": "user", "content": "修复"}])
+
+
+def test_latest_round_results_are_kept_and_used_results_stubbed():
+    context = _context()
+    c1 = _call("c1", "read_file", path="a.tex")
+    context.add_round(_assistant(c1), [(c1, BIG)])
+
+    assert context.prune()[-1]["content"] == BIG  # 模型还没看过
+
+    c2 = _call("c2", "list_files")
+    context.add_round(_assistant(c2), [(c2, "a.tex")])
+    messages = context.prune()
+
+    assert messages[3]["content"].startswith("[已省略 read_file a.tex 的结果（1000 字符，已使用）")
+    assert messages[3]["tool_call_id"] == "c1"
+    assert messages[-1]["content"] == "a.tex"
+    assert context.stubbed_chars == 1000
+
+
+def test_only_latest_version_of_a_file_is_kept():
+    context = _context()
+    c1, c2 = _call("c1", "read_file", path="a.tex"), _call("c2", "read_file", path="a.tex")
+    context.add_round(_assistant(c1, c2), [(c1, BIG), (c2, BIG + "v2")])
+
+    messages = context.prune()
+
+    assert "已有更新版本" in messages[3]["content"]
+    assert messages[4]["content"] == BIG + "v2"
+
+
+def test_write_file_arguments_are_stubbed_after_execution():
+    context = _context()
+    c1 = _call("c1", "write_file", path="a.tex", content=BIG)
+    context.add_round(_assistant(c1), [(c1, "已写入 a.tex")])
+    c2 = _call("c2", "list_files")
+    context.add_round(_assistant(c2), [(c2, "a.tex")])
+
+    messages = context.prune()
+
+    arguments = json.loads(messages[2]["tool_calls"][0]["function"]["arguments"])
+    assert arguments == {"path": "a.tex", "content": "[已写入 1000 字符，内容已省略]"}
+
+
+def test_original_messages_are_not_mutated():
+    original = [{"role": "user", "content": "修复"}]
+    context = ToolContext(original)
+    c1 = _call("c1", "read_file", path="a.tex")
+    assistant = _assistant(c1)
+    context.add_round(assistant, [(c1, BIG)])
+    context.add_round(_assistant(_call("c2", "list_files")), [(_call("c2", "list_files"), "x")])
+
+    context.prune()
+
+    assert original == [{"role": "user", "content": "修复"}]
+    assert json.loads(assistant["tool_calls"][0]["function"]["arguments"]) == {"path": "a.tex"}
+
+
+def test_token_budget_drops_oldest_rounds_but_keeps_initial_and_latest():
+    context = ToolContext([{"role": "user", "content": "修复"}], token_budget=300, stub_threshold=10_000)
+    for n in range(4):
+        call = _call(f"c{n}", "read_range", path=f"{n}.tex")
+        context.add_round(_assistant(call), [(call, BIG)])
+
+    messages = context.prune()
+
+    assert messages[0] == {"role": "user", "content": "修复"}
+    assert messages[-1]["tool_call_id"] == "c3"
+    assert context.dropped_rounds == 3
+    # 每条 tool 消息前都是对应的 assistant tool_calls 消息
+    assert [m["role"] for m in messages] == ["user", "assistant", "tool"]
@@ -0,0 +1,145 @@
+"""
+function calling 多轮对话的上下文裁剪 — ToolContext
+complete_with_tools 每轮把完整的工具结果（整章 read_file 内容）追加进 messages，
+之后每一轮都要重新发送，10-15 轮的 repair / revise 下请求体近似平方增长。
+ToolContext 在每轮请求前裁剪：
+1. 同一文件只保留最新版本：之后又被 read_file / write_file / edit_file 过的旧结果换成占位
+2. 已经被模型看过（早于最近一轮）的大段工具结果换成短占位，需要时模型可以重新读取
+3. 已执行的 write_file 参数里的完整文件内容换成占位
+4. 仍超出 token 预算时，从最早的轮次开始整轮丢弃（system / 初始消息和最近一轮始终保留）
+"""
+
+import json
+
+# 这些工具的结果代表文件的一个完整版本，更新的版本出现后旧结果作废
+_VERSION_TOOLS = ("read_file", "write_file", "edit_file")
+
+
+def _estimate_tokens(messages: list[dict]) -> int:
+    from .llm import estimate_tokens
+
+    return estimate_tokens(json.dumps(messages, ensure_ascii=False))
+
+
+class ToolContext:
+    """
+    管理一次 complete_with_tools 的消息历史。
+    用法：每轮请求前 prune()，发送 messages；收到 tool_calls 并执行后 add_round()。
+    """
+
+    def __init__(self, messages: list[dict], token_budget: int | None = None, stub_threshold: int = 400):
+        self.messages: list[dict] = list(messages)
+        self.token_budget = token_budget
+        # 短于该字符数的工具结果不值得占位
+        self.stub_threshold = stub_threshold
+        self._base = len(self.messages)
+        # 每轮：(assistant 消息下标, [(tool 消息下标, 工具名, path)])
+        self._rounds: list[tuple[int, list[tuple[int, str, str]]]] = []
+        self._stubbed: set[int] = set()
+        self.stubbed_chars = 0
+        self.dropped_rounds = 0
+
+    def add_round(self, assistant_message: dict, results: list[tuple[dict, str]]) -> None:
+        """追加一轮：assistant 的 tool_calls 消息 + 每个调用的 (tool_call, 结果)"""
+        self.messages.append(assistant_message)
+        assistant_index = len(self.messages) - 1
+        tools = []
+        for tool_call, result in results:
+            fn = tool_call.get("function", {})
+            try:
+                arguments = json.loads(fn.get("arguments") or "{}")
+            except json.JSONDecodeError:
+                arguments = {}
+            path = arguments.get("path", "") if isinstance(arguments, dict) else ""
+            self.messages.append({
+                "role": "tool",
+                "tool_call_id": tool_call.get("id", ""),
+                "content": result,
+            })
+            tools.append((len(self.messages) - 1, fn.get("name", ""), path))
+        self._rounds.append((assistant_index, tools))
+
+    def tokens(self) -> int:
+        return _estimate_tokens(self.messages)
+
+    def prune(self) -> list[dict]:
+        """按上述规则裁剪，返回本轮要发送的 messages"""
+        if not self._rounds:
+            return self.messages
+
+        latest = len(self._rounds) - 1
+        newer_version: set[str] = set()
+        for round_idx in range(latest, -1, -1):
+            assistant_index, tools = self._rounds[round_idx]
+            for index, name, path in reversed(tools):
+                if path and path in newer_version:
+                    self._stub(index, name, path, "已有更新版本")
+                elif round_idx < latest:
+                    self._stub(index, name, path, "已使用")
+                if path and name in _VERSION_TOOLS:
+                    newer_version.add(path)
+            if round_idx < latest:
+                self._stub_write_arguments(assistant_index)
+
+        if self.token_budget:
+            while self.tokens() > self.token_budget and self._drop_oldest_round():
+                pass
+        return self.messages
+
+    def _stub(self, index: int, name: str, path: str, reason: str) -> None:
+        if index in self._stubbed:
+            return
+        content = self.messages[index].get("content") or ""
+        if len(content) < self.stub_threshold:
+            return
+        target = f"{name} {path}".strip()
+        self.messages[index] = {
+            **self.messages[index],
+            "content": f"[已省略 {target} 的结果（{len(content)} 字符，{reason}），需要时请重新读取]",
+        }
+        self._stubbed.add(index)
+        self.stubbed_chars += len(content)
+
+    def _stub_write_arguments(self, assistant_index: int) -> None:
+        """已执行的 write_file 参数里的完整文件内容换成占位（内容已在 VFS 中）"""
+        if assistant_index in self._stubbed:
+            return
+        self._stubbed.add(assistant_index)
+        message = self.messages[assistant_index]
+        calls = []
+        changed = False
+        for tc in message.get("tool_calls") or []:
+            fn = tc.get("function", {})
+            if fn.get("name") == "write_file":
+                try:
+                    arguments = json.loads(fn.get("arguments") or "{}")
+                except json.JSONDecodeError:
+                    arguments = None
+                content = arguments.get("content") if isinstance(arguments, dict) else None
+                if isinstance(content, str) and len(content) >= self.stub_threshold:
+                    arguments["content"] = f"[已写入 {len(content)} 字符，内容已省略]"
+                    tc = {**tc, "function": {**fn, "arguments": json.dumps(arguments, ensure_ascii=False)}}
+                    self.stubbed_chars += len(content)
+                    changed = True
+            calls.append(tc)
+        if changed:
+            self.messages[assistant_index] = {**message, "tool_calls": calls}
+
+    def _drop_oldest_round(self) -> bool:
+        """丢弃最早的一整轮（assistant + 对应的 tool 消息）；只剩最近一轮时返回 False"""
+        if len(self._rounds) <= 1:
+            return False
+        assistant_index, tools = self._rounds[0]
+        end = (tools[-1][0] if tools else assistant_index) + 1
+        removed = end - assistant_index
+        del self.messages[assistant_index:end]
+
+        def shift(i: int) -> int:
+            return i - removed if i >= end else i
+
+        self._rounds = [
+            (shift(a), [(shift(i), name, path) for i, name, path in t]) for a, t in self._rounds[1:]
+        ]
+        self._stubbed = {shift(i) for i in self._stubbed if not assistant_index <= i < end}
+        self.dropped_rounds += 1
+        return True
@@ -9,8 +9,8 @@ from unittest.mock import MagicMock, patch
 
 import pytest
 
-from app import app
-from models import db, PaperRecord
+from app import app, job_runner
+from models import db, PaperJob, PaperRecord
 
 
 @pytest.fixture
@@ -21,6 +21,7 @@ def client():
     with app.app_context():
         db.create_all()
         yield app.test_client()
+        job_runner.join(timeout=5)
         db.session.remove()
         db.drop_all()
 
@@ -143,19 +144,60 @@ def test_paper_generate_chinese_characters_in_sse(mock_service, client):
     assert "撰写第 1/6 章: 引言" in body
 
 
+@patch("app.paper_service")
+def test_paper_generate_runs_as_replayable_job(mock_service, client):
+    """生成在后台任务里运行，SSE 断开后可按 Last-Event-ID 续上"""
+    mock_service.generate.return_value = iter([
+        {"type": "session_created", "session_id": "abc123"},
+        {"type": "progress", "stage": "researching", "detail": "正在检索..."},
+        {"type": "completed", "pdf_url": "https://example.com/paper.pdf", "session_id": "abc123"},
+    ])
+
+    resp = client.post(
+        "/api/paper/generate",
+        data=json.dumps({"topic": "深度学习综述", "user_id": "user-1"}),
+        content_type="application/json",
+    )
+    job_id = resp.headers["X-Paper-Job-Id"]
+    body = resp.get_data(as_text=True)
+    assert f'"job_id": "{job_id}"' in body
+    assert "id: 3\nevent: completed" in body
+    job_runner.join(timeout=5)
+
+    job = client.get(f"/api/paper/jobs/{job_id}").get_json()
+    assert job["status"] == "completed"
+    assert job["paper_id"] == "abc123"
+
+    replay = client.get(f"/api/paper/jobs/{job_id}/events", headers={"Last-Event-ID": "2"})
+    replay_body = replay.get_data(as_text=True)
+    assert "event: completed" in replay_body
+    assert "event: session_created" not in replay_body
+
+
+def test_paper_job_not_found(client):
+    assert client.get("/api/paper/jobs/missing").status_code == 404
+    assert client.get("/api/paper/jobs/missing/events").status_code == 404
+
+
 # ============ GET /api/paper/<paper_id>/status ============
 
 
 @patch("app.SessionManager")
 def test_paper_status_from_memory(mock_sm, client):
     """When session exists in memory, return its status."""
-    mock_session = MagicMock()
-    mock_session.id = "sess-1"
-    mock_session.topic = "AI综述"
-    mock_session.status.value = "writing"
-    mock_session.progress_detail = "撰写第 2/6 章"
-    mock_session.pdf_url = None
-    mock_sm.get.return_value = mock_session
+    mock_sm.get_status.return_value = {
+        "id": "sess-1",
+        "user_id": "u1",
+        "topic": "AI综述",
+        "status": "writing",
+        "progress_detail": "撰写第 2/6 章",
+        "chapters": {"chapters/01_intro.tex": "formatted", "chapters/02_method.tex": "writing"},
+        "format_stats": {"local": 1, "mixed": 0, "llm": 0},
+        "pdf_url": None,
+        "error": None,
+        "owner_pid": 123,
+        "heartbeat_at": 0,
+    }
 
     resp = client.get("/api/paper/sess-1/status")
     assert resp.status_code == 200
@@ -164,6 +206,9 @@ def test_paper_status_from_memory(mock_sm, client):
     assert data["status"] == "writing"
     assert data["topic"] == "AI综述"
     assert data["progress_detail"] == "撰写第 2/6 章"
+    assert data["chapters"] == {"chapters/01_intro.tex": "formatted", "chapters/02_method.tex": "writing"}
+    assert data["format_stats"] == {"local": 1, "mixed": 0, "llm": 0}
+    assert "owner_pid" not in data
 
 
 def test_paper_status_from_database(client):
@@ -189,7 +234,7 @@ def test_paper_status_from_database(client):
 @patch("app.SessionManager")
 def test_paper_status_marks_orphan_in_progress_as_failed(mock_sm, client):
     """DB in-progress record without in-memory session should be marked as failed."""
-    mock_sm.get.return_value = None
+    mock_sm.get_status.return_value = None
 
     with app.app_context():
         record = PaperRecord(
@@ -212,10 +257,43 @@ def test_paper_status_marks_orphan_in_progress_as_failed(mock_sm, client):
         assert refreshed.status == "failed"
 
 
+@patch("app.has_checkpoint", return_value=True)
+@patch("app.SessionManager")
+def test_paper_status_reports_resumable_checkpoint(mock_sm, mock_has_checkpoint, client):
+    mock_sm.get_status.return_value = None
+
+    with app.app_context():
+        db.session.add(PaperRecord(id="db-paper-stuck-2", user_id="u1", topic="中断任务", status="planning"))
+        db.session.commit()
+
+    data = client.get("/api/paper/db-paper-stuck-2/status").get_json()
+
+    assert data["status"] == "failed"
+    assert data["resumable"] is True
+    assert "可继续生成" in data["error"]
+
+
+@patch("app.paper_service")
+def test_paper_resume_streams_sse(mock_service, client):
+    mock_service.resume.return_value = iter([
+        {"type": "session_created", "session_id": "p1", "resumed_from": "planned"},
+        {"type": "completed", "pdf_url": "https://x/p.pdf", "session_id": "p1"},
+    ])
+
+    resp = client.post("/api/paper/p1/resume")
+
+    assert resp.status_code == 200
+    assert resp.mimetype == "text/event-stream"
+    body = resp.get_data(as_text=True)
+    assert "event: session_created" in body
+    assert '"resumed_from": "planned"' in body
+    mock_service.resume.assert_called_once_with("p1")
+
+
 @patch("app.SessionManager")
 def test_paper_status_not_found(mock_sm, client):
     """Non-existent paper should return 404."""
-    mock_sm.get.return_value = None
+    mock_sm.get_status.return_value = None
 
     resp = client.get("/api/paper/nonexistent/status")
     assert resp.status_code == 404
@@ -341,3 +419,292 @@ def test_list_papers_ordered_by_created_at_desc(client):
     # Newest first: ordered-2, ordered-1, ordered-0
     assert data[0]["id"] == "ordered-2"
     assert data[-1]["id"] == "ordered-0"
+
+
+# ============ DELETE /api/paper/<paper_id> ============
+
+
+@patch("app.cleanup_queue")
+def test_paper_delete_queues_s3_cleanup_after_commit(mock_cleanup, client):
+    """S3 keys are handed to the cleanup queue; the DB record is gone immediately."""
+    mock_cleanup.enqueue.side_effect = lambda keys: [k for k in keys if k]
+
+    with app.app_context():
+        record = PaperRecord(
+            id="del-paper-1",
+            user_id="u1",
+            topic="删除测试",
+            status="completed",
+            pdf_s3_key="users/u1/papers/del-paper-1/paper.pdf",
+            vfs_s3_key="users/u1/papers/del-paper-1/vfs.json.gz",
+        )
+        db.session.add(record)
+        db.session.commit()
+
+    resp = client.delete("/api/paper/del-paper-1")
+    assert resp.status_code == 200
+    data = resp.get_json()
+    assert data["queued_s3_keys"] == [
+        "users/u1/papers/del-paper-1/paper.pdf",
+        "users/u1/papers/del-paper-1/vfs.json.gz",
+        "papers/checkpoints/del-paper-1.json.gz",
+    ]
+    mock_cleanup.enqueue.assert_called_once()
+
+    with app.app_context():
+        assert PaperRecord.query.get("del-paper-1") is None
+
+
+def test_paper_delete_not_found(client):
+    resp = client.delete("/api/paper/nonexistent")
+    assert resp.status_code == 404
+
+
+# ============ GET /api/paper/<paper_id>/pdf ============
+
+PDF_BYTES = b"%PDF-1.7 " + b"x" * 991
+
+
+def _add_pdf_record(paper_id="pdf-paper-1"):
+    with app.app_context():
+        db.session.add(PaperRecord(
+            id=paper_id,
+            user_id="u1",
+            topic="PDF 代理",
+            status="completed",
+            pdf_s3_key=f"users/u1/papers/{paper_id}/paper.pdf",
+        ))
+        db.session.commit()
+
+
+def _mock_pdf_storage(mock_storage, data=PDF_BYTES, etag="abc123"):
+    mock_storage.fetch_cached.return_value = None
+    mock_storage.head_object.return_value = {
+        "size": len(data), "etag": etag, "content_type": "application/pdf",
+    }
+
+    def iter_object(key, start=None, end=None):
+        chunk = data[start or 0:(end + 1) if end is not None else None]
+        yield chunk[:100]
+        yield chunk[100:]
+
+    mock_storage.iter_object.side_effect = iter_object
+
+
+@patch("app.storage_service")
+def test_paper_pdf_streams_full_body_with_etag(mock_storage, client):
+    _add_pdf_record()
+    _mock_pdf_storage(mock_storage)
+
+    resp = client.get("/api/paper/pdf-paper-1/pdf")
+    assert resp.status_code == 200
+    assert resp.data == PDF_BYTES
+    assert resp.headers["ETag"] == '"abc123"'
+    assert resp.headers["Accept-Ranges"] == "bytes"
+    assert resp.headers["Content-Length"] == str(len(PDF_BYTES))
+    mock_storage.download_bytes.assert_not_called()
+
+
+@patch("app.storage_service")
+def test_paper_pdf_if_none_match_returns_304(mock_storage, client):
+    _add_pdf_record()
+    _mock_pdf_storage(mock_storage)
+
+    resp = client.get("/api/paper/pdf-paper-1/pdf", headers={"If-None-Match": '"abc123"'})
+    assert resp.status_code == 304
+    assert resp.data == b""
+    mock_storage.iter_object.assert_not_called()
+
+
+@patch("app.storage_service")
+def test_paper_pdf_range_request_returns_206(mock_storage, client):
+    _add_pdf_record()
+    _mock_pdf_storage(mock_storage)
+
+    resp = client.get("/api/paper/pdf-paper-1/pdf", headers={"Range": "bytes=100-199"})
+    assert resp.status_code == 206
+    assert resp.data == PDF_BYTES[100:200]
+    assert resp.headers["Content-Range"] == f"bytes 100-199/{len(PDF_BYTES)}"
+    mock_storage.iter_object.assert_called_once_with("users/u1/papers/pdf-paper-1/paper.pdf", 100, 199)
+
+
+@patch("app.storage_service")
+def test_paper_pdf_unsatisfiable_range_returns_416(mock_storage, client):
+    _add_pdf_record()
+    _mock_pdf_storage(mock_storage)
+
+    resp = client.get("/api/paper/pdf-paper-1/pdf", headers={"Range": "bytes=5000-"})
+    assert resp.status_code == 416
+    assert resp.headers["Content-Range"] == f"bytes */{len(PDF_BYTES)}"
+
+
+@patch("app.storage_service")
+def test_paper_pdf_multi_range_returns_full_body(mock_storage, client):
+    _add_pdf_record()
+    _mock_pdf_storage(mock_storage)
+
+    resp = client.get("/api/paper/pdf-paper-1/pdf", headers={"Range": "bytes=0-9,100-199"})
+    assert resp.status_code == 200
+    assert resp.data == PDF_BYTES
+    assert "Content-Range" not in resp.headers
+
+
+@patch("app.storage_service")
+def test_paper_pdf_stale_if_range_returns_full_body(mock_storage, client):
+    _add_pdf_record()
+    _mock_pdf_storage(mock_storage)
+
+    resp = client.get(
+        "/api/paper/pdf-paper-1/pdf",
+        headers={"Range": "bytes=0-9", "If-Range": '"old-etag"'},
+    )
+    assert resp.status_code == 200
+    assert resp.data == PDF_BYTES
+
+
+@patch("app.storage_service")
+def test_paper_pdf_missing_object_returns_502(mock_storage, client):
+    _add_pdf_record()
+    mock_storage.fetch_cached.return_value = None
+    mock_storage.head_object.return_value = None
+
+    resp = client.get("/api/paper/pdf-paper-1/pdf")
+    assert resp.status_code == 502
+
+
+@patch("app.storage_service")
+def test_paper_pdf_served_from_disk_cache(mock_storage, client, tmp_path):
+    """Cache hits are served with send_file and still honour Range / ETag."""
+    _add_pdf_record()
+    pdf_path = tmp_path / "paper.pdf"
+    pdf_path.write_bytes(PDF_BYTES)
+    mock_storage.fetch_cached.return_value = {
+        "path": str(pdf_path), "size": len(PDF_BYTES), "etag": "abc123",
+        "content_type": "application/pdf",
+    }
+
+    resp = client.get("/api/paper/pdf-paper-1/pdf", headers={"Range": "bytes=0-9"})
+    assert resp.status_code == 206
+    assert resp.data == PDF_BYTES[:10]
+    assert resp.headers["ETag"] == '"abc123"'
+    assert resp.headers["Content-Disposition"] == "inline"
+    resp.close()
+
+    resp = client.get("/api/paper/pdf-paper-1/pdf", headers={"If-None-Match": '"abc123"'})
+    assert resp.status_code == 304
+    mock_storage.iter_object.assert_not_called()
+    mock_storage.head_object.assert_not_called()
+
+
+@patch("app.storage_service")
+def test_paper_pdf_redirect_mode_returns_presigned_url(mock_storage, client):
+    _add_pdf_record()
+    mock_storage.presigned_url.return_value = "https://s3.example.com/signed?X-Amz-Signature=x"
+    app.config["PAPER_PDF_DELIVERY"] = "redirect"
+    try:
+        resp = client.get("/api/paper/pdf-paper-1/pdf")
+    finally:
+        app.config["PAPER_PDF_DELIVERY"] = "proxy"
+
+    assert resp.status_code == 302
+    assert resp.headers["Location"] == "https://s3.example.com/signed?X-Amz-Signature=x"
+    assert resp.headers["Cache-Control"] == "no-store"
+    kwargs = mock_storage.presigned_url.call_args.kwargs
+    assert kwargs["content_type"] == "application/pdf"
+    assert kwargs["disposition"] == "inline"
+    mock_storage.fetch_cached.assert_not_called()
+
+
+@patch("app.storage_service")
+def test_paper_pdf_redirect_mode_falls_back_to_proxy(mock_storage, client):
+    _add_pdf_record()
+    _mock_pdf_storage(mock_storage)
+    mock_storage.presigned_url.return_value = None
+    app.config["PAPER_PDF_DELIVERY"] = "redirect"
+    try:
+        resp = client.get("/api/paper/pdf-paper-1/pdf")
+    finally:
+        app.config["PAPER_PDF_DELIVERY"] = "proxy"
+
+    assert resp.status_code == 200
+    assert resp.data == PDF_BYTES
+
+
+# ============ GET /storage/<key> (filesystem backend) ============
+
+
+def _fs_storage(tmp_path):
+    from services.storage import StorageService
+    from services.storage_backends import FilesystemBackend
+
+    return StorageService(FilesystemBackend(str(tmp_path), public_url="/storage", secret="s"))
+
+
+def test_storage_route_serves_fs_objects(client, tmp_path):
+    fs_storage = _fs_storage(tmp_path)
+    fs_storage.upload_image(b"\x89PNG", "u1")
+    key = next(p for p in (tmp_path / "objects").rglob("*.png")).relative_to(tmp_path / "objects").as_posix()
+
+    with patch("app.storage_service", fs_storage):
+        resp = client.get(f"/storage/{key}")
+
+    assert resp.status_code == 200
+    assert resp.data == b"\x89PNG"
+    assert resp.mimetype == "image/png"
+    resp.close()
+
+
+def test_storage_route_checks_presigned_signature(client, tmp_path):
+    fs_storage = _fs_storage(tmp_path)
+    fs_storage.upload_pdf(b"%PDF", "users/u1/papers/p1/paper.pdf")
+    url = fs_storage.presigned_url("users/u1/papers/p1/paper.pdf", content_type="application/pdf")
+
+    with patch("app.storage_service", fs_storage):
+        ok = client.get(url)
+        tampered = client.get(url.replace("disposition=inline", "disposition=attachment"))
+
+    assert ok.status_code == 200
+    assert ok.headers["Content-Disposition"] == "inline"
+    ok.close()
+    assert tampered.status_code == 403
+
+
+def test_storage_route_rejects_unsigned_or_expired_private_objects(client, tmp_path):
+    fs_storage = _fs_storage(tmp_path)
+    fs_storage.upload_pdf(b"%PDF", "users/u1/papers/p1/paper.pdf")
+    expired = fs_storage.presigned_url("users/u1/papers/p1/paper.pdf", expires_in=-1)
+
+    with patch("app.storage_service", fs_storage):
+        unsigned = client.get("/storage/users/u1/papers/p1/paper.pdf")
+        unsigned_with_expires = client.get(expired.split("&signature=")[0])
+        expired_resp = client.get(expired)
+
+    assert unsigned.status_code == 403
+    assert unsigned_with_expires.status_code == 403
+    assert expired_resp.status_code == 403
+
+
+def test_paper_download_returns_presigned_url(client, tmp_path):
+    fs_storage = _fs_storage(tmp_path)
+    fs_storage.upload_pdf(b"%PDF", "users/u1/papers/dl-2/paper.pdf")
+    with app.app_context():
+        db.session.add(PaperRecord(
+            id="dl-paper-2", user_id="u1", topic="下载", status="completed",
+            pdf_url="/storage/users/u1/papers/dl-2/paper.pdf",
+            pdf_s3_key="users/u1/papers/dl-2/paper.pdf",
+        ))
+        db.session.commit()
+
+    with patch("app.storage_service", fs_storage):
+        url = client.get("/api/paper/dl-paper-2/download").get_json()["pdf_url"]
+        resp = client.get(url)
+
+    assert "signature=" in url
+    assert resp.status_code == 200
+    assert resp.headers["Content-Disposition"] == "attachment"
+    resp.close()
+
+
+def test_storage_route_disabled_for_s3_backend(client):
+    resp = client.get("/storage/users/u1/images/a.png")
+    assert resp.status_code == 404
@@ -195,7 +195,7 @@ export function PDFPreview({ pdfUrl, proxyUrl, onDownload }: PDFPreviewProps) {
 
   const handleDownload = () => {
     if (onDownload) onDownload();
-    else window.open(pdfUrl, '_blank');
+    else window.open(src, '_blank');
   };
 
   return (
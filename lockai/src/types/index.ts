@@ -94,6 +94,9 @@ export interface PaperRecord {
   status: string;
   pdf_url: string | null;
   progress_detail?: string | null;
+  chapters?: Record<string, "pending" | "writing" | "written" | "formatting" | "formatted">;
+  format_stats?: { local: number; mixed: number; llm: number; resumed: number };
+  resumable?: boolean;
   error?: string | null;
   created_at: string;
   completed_at: string | null;
@@ -110,7 +113,14 @@ export interface PaperFileContent {
   content: string;
 }
 
-export type PaperEventType = 'session_created' | 'progress' | 'completed' | 'error';
+export type PaperEventType = 'session_created' | 'progress' | 'completed' | 'error' | 'timings';
+
+export interface PaperStageTiming {
+  duration: number;
+  llm_calls: number;
+  prompt_tokens: number;
+  completion_tokens: number;
+}
 
 export interface PaperEvent {
   type: PaperEventType;
@@ -119,6 +129,10 @@ export interface PaperEvent {
   detail?: string;
   pdf_url?: string;
   message?: string;
+  // timings 事件
+  total?: number;
+  llm_calls?: number;
+  stages?: Record<string, PaperStageTiming>;
 }
 
 export type PaperEventCallback = (event: PaperEvent) => void;